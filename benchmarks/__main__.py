@@ -0,0 +1,109 @@
+# -*- coding: UTF-8 -*-
+"""
+Run the benchmarks, i.e. ``python -m benchmarks --users 50 --vms 20 --latency-ms 5``
+
+Save the results with ``--save``, then pass them to ``--compare`` on a later run
+to fail (exit 1) when any benchmark got slower than ``--tolerance`` allows.
+"""
+import sys
+import json
+import logging
+import argparse
+
+from benchmarks import api, worker, harness
+from benchmarks.fake_vcenter import World
+
+
+WORKER_BENCHMARKS = ('show', 'create', 'delete', 'update_network')
+API_BENCHMARKS = ('show', 'create', 'delete', 'image', 'task')
+
+
+def parse_args(argv):
+    """Define the CLI
+
+    :Returns: argparse.Namespace
+    """
+    parser = argparse.ArgumentParser(prog='python -m benchmarks', description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=10, help='Users in the fake vCenter')
+    parser.add_argument('--vms', type=int, default=5, help='CentOS VMs in every user folder')
+    parser.add_argument('--latency-ms', type=float, default=0, help='Milliseconds every vCenter call takes')
+    parser.add_argument('--task-ms', type=float, default=0, help='Milliseconds every vCenter task takes')
+    parser.add_argument('--iterations', type=int, default=100, help='Operations per benchmark')
+    parser.add_argument('--concurrency', type=int, default=1, help='Threads running each benchmark')
+    parser.add_argument('--only', default='', help='Comma separated benchmarks to run, i.e. worker.show,api.show')
+    parser.add_argument('--save', help='Write the results to this JSON file')
+    parser.add_argument('--compare', help='Fail if slower than the results in this JSON file')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='How much slower (as a fraction of ops/sec) counts as a regression')
+    return parser.parse_args(argv)
+
+
+def selected(only, prefix, names):
+    """The benchmarks of one kind that were asked for
+
+    :Returns: List
+    """
+    if not only:
+        return list(names)
+    wanted = [x.strip() for x in only.split(',')]
+    return [x for x in names if '{}.{}'.format(prefix, x) in wanted]
+
+
+def regressions(results, baseline, tolerance):
+    """Find the benchmarks that got slower than the baseline allows
+
+    :Returns: List of String
+
+    :param results: This run
+    :type results: List of harness.Result
+
+    :param baseline: The saved results of an earlier run; name -> ops/sec
+    :type baseline: Dictionary
+
+    :param tolerance: The fraction of ops/sec a benchmark may lose
+    :type tolerance: Float
+    """
+    slower = []
+    for result in results:
+        before = baseline.get(result.name, {}).get('ops_per_sec', None)
+        if before and result.ops_per_sec < before * (1 - tolerance):
+            slower.append('{}: {:.1f} ops/sec, was {:.1f}'.format(result.name, result.ops_per_sec, before))
+    return slower
+
+
+def main(argv=None):
+    """Run the benchmarks
+
+    :Returns: Integer, the exit code
+    """
+    args = parse_args(argv)
+    # The access log of every request would drown out the report
+    logging.disable(logging.INFO)
+    results = []
+    worker_benchmarks = selected(args.only, 'worker', WORKER_BENCHMARKS)
+    if worker_benchmarks:
+        world = World(users=args.users,
+                      vms_per_user=args.vms,
+                      latency=args.latency_ms / 1000.0,
+                      task_seconds=args.task_ms / 1000.0)
+        results += worker.run(world, args.iterations, args.concurrency, worker_benchmarks)
+    api_benchmarks = selected(args.only, 'api', API_BENCHMARKS)
+    if api_benchmarks:
+        results += api.run(args.users, args.iterations, args.concurrency, api_benchmarks)
+    harness.report(results, sys.stdout)
+    if args.save:
+        with open(args.save, 'w') as the_file:
+            json.dump({x.name: x._asdict() for x in results}, the_file, indent=2, sort_keys=True)
+    if args.compare:
+        with open(args.compare) as the_file:
+            slower = regressions(results, json.load(the_file), args.tolerance)
+        for line in slower:
+            sys.stdout.write('REGRESSION {}\n'.format(line))
+        if slower:
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
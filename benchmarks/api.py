@@ -0,0 +1,114 @@
+# -*- coding: UTF-8 -*-
+"""
+Benchmarks of the API (``CentOSView``), with Celery sending to an in-memory broker.
+
+What's measured is the work the API does per request: checking the token,
+validating the body, deduplicating, and sending the task. No worker runs the
+tasks; ``benchmarks.load`` covers the whole round trip.
+"""
+import os
+import random
+import tempfile
+import contextlib
+from unittest.mock import patch
+
+from celery import Celery
+from vlab_api_common.http_auth import generate_v2_test_token
+
+from vlab_centos_api.app import app
+from vlab_centos_api.lib import routing, results, dedup, images
+from benchmarks import harness
+
+
+@contextlib.contextmanager
+def installed(broker='memory://', backend='cache+memory://', images_dir=None):
+    """Point the API at an in-memory broker, and a directory of (empty) OVAs
+
+    :Returns: Generator, yielding the Celery app the API sends tasks with
+
+    :param broker: The URL of the message broker
+    :type broker: String
+
+    :param backend: The URL of the result backend
+    :type backend: String
+
+    :param images_dir: Where the OVAs are; defaults to a temporary directory with CentOS 7 in it
+    :type images_dir: String
+    """
+    celery_app = Celery('centos', broker=broker, backend=backend)
+    routing.configure(celery_app)
+    results.configure(celery_app)
+    celery_app.conf.result_backend = backend
+    with contextlib.ExitStack() as stack:
+        if images_dir is None:
+            images_dir = stack.enter_context(tempfile.TemporaryDirectory())
+            for name in ('CentOS-7.ova', 'CentOS-desktop-7.ova'):
+                open(os.path.join(images_dir, name), 'w').close()
+        stack.enter_context(patch.object(app, 'celery_app', celery_app))
+        catalog = images.ImageCatalog(images_dir)
+        # Like the API does when it starts
+        catalog.load()
+        stack.enter_context(patch.object(images, 'CATALOG', catalog))
+        stack.enter_context(patch.object(dedup, 'REQUESTS', dedup.RequestLog()))
+        stack.enter_context(patch.object(dedup, 'SHOWS', dedup.SingleFlight()))
+        stack.enter_context(patch.object(results, 'CACHE', results.ResultCache()))
+        yield celery_app
+
+
+def run(users=10, iterations=1000, concurrency=1, benchmarks=('show', 'create', 'delete', 'image', 'task')):
+    """Benchmark the API end points
+
+    :Returns: List of harness.Result
+
+    :param users: How many different users make requests
+    :type users: Integer
+
+    :param iterations: How many requests each benchmark makes
+    :type iterations: Integer
+
+    :param concurrency: How many threads make requests at once
+    :type concurrency: Integer
+
+    :param benchmarks: The names of the benchmarks to run
+    :type benchmarks: List
+    """
+    tokens = [generate_v2_test_token(username='user{}'.format(x)) for x in range(users)]
+    client = app.test_client()
+    found = []
+
+    def check(resp, *expected):
+        if resp.status_code not in expected:
+            raise RuntimeError('HTTP {}: {}'.format(resp.status_code, resp.data[:200]))
+
+    def show(index):
+        check(client.get('/api/2/inf/centos', headers={'X-Auth': random.choice(tokens)}), 202)
+
+    def create(index):
+        body = {'name': 'bench{}'.format(index), 'image': '7', 'network': 'frontend'}
+        headers = {'X-Auth': tokens[index % users], 'X-REQUEST-ID': 'create-{}'.format(index)}
+        check(client.post('/api/2/inf/centos', json=body, headers=headers), 202)
+
+    def delete(index):
+        body = {'name': 'bench{}'.format(index)}
+        headers = {'X-Auth': tokens[index % users], 'X-REQUEST-ID': 'delete-{}'.format(index)}
+        check(client.delete('/api/2/inf/centos', json=body, headers=headers), 202)
+
+    def image(index):
+        check(client.get('/api/2/inf/centos/image', headers={'X-Auth': random.choice(tokens)}), 200)
+
+    def task(index):
+        task_id = task_ids[index % len(task_ids)]
+        check(client.get('/api/2/inf/centos/task/{}'.format(task_id), headers={'X-Auth': tokens[0]}), 200)
+
+    answer = []
+    with installed() as celery_app:
+        # Finished tasks for the status polls to find
+        task_ids = []
+        for index in range(10):
+            task_id = 'bench-task-{}'.format(index)
+            celery_app.backend.store_result(task_id, {'content': {}, 'error': None, 'params': {}}, 'SUCCESS')
+            task_ids.append(task_id)
+        operations = {'show': show, 'create': create, 'delete': delete, 'image': image, 'task': task}
+        for name in benchmarks:
+            answer.append(harness.measure('api.{}'.format(name), operations[name], iterations, concurrency))
+    return answer
@@ -0,0 +1,514 @@
+# -*- coding: UTF-8 -*-
+"""
+An in-memory stand-in for vCenter, at the pyVmomi stub layer.
+
+Every managed object the worker touches is a real pyVmomi object (i.e.
+``vim.VirtualMachine('vm-12', stub)``), so the PropertyCollector specs,
+``isinstance`` checks, and data objects in ``vlab_centos_api`` all run as they
+would against vCenter. Only the SOAP round trip is replaced: ``FakeStub`` answers
+each method call and property read from the ``World`` model, after sleeping for
+the configured per-call latency.
+
+Methods that return a ``vim.Task`` block for the configured task duration, and
+hand back a task that's already complete; vCenter would return right away and
+make the caller wait on the task instead, but the wall-clock cost is the same.
+"""
+import time
+import datetime
+import threading
+import itertools
+import collections
+import collections.abc
+
+import ujson
+from pyVmomi import vim, vmodl
+
+from vlab_inf_common.vmware.vcenter import vCenter
+
+# vlab-inf-common still uses ``collections.Iterable``, which Python 3.10 removed
+if not hasattr(collections, 'Iterable'):
+    collections.Iterable = collections.abc.Iterable
+
+
+ADAPTER_LABEL = 'Network adapter 1'
+
+
+class FakeFault(Exception):
+    """vCenter refused a call the fake does not know how to answer"""
+
+
+class _Entity(object):
+    """One managed object in the model
+
+    :param ref: The pyVmomi object the worker sees
+    :type ref: pyVmomi.VmomiSupport.ManagedObject
+
+    :param props: Property name -> value, or a function that builds the value
+    :type props: Dictionary
+    """
+    def __init__(self, ref, props=None):
+        self.ref = ref
+        self.props = props or {}
+        self.children = []
+        self.parent = None
+
+    def read(self, name):
+        value = self.props.get(name, None)
+        return value() if callable(value) else value
+
+
+class _VM(object):
+    """The state of a virtual machine, turned into fresh data objects on every read
+
+    Fresh objects matter; callers (like ``change_network``) edit the device they
+    read, and must not be editing the model by accident.
+    """
+    def __init__(self, name, annotation, network, power='poweredOn', ip=None, template=False):
+        self.name = name
+        self.annotation = annotation
+        self.network = network
+        self.power = power
+        self.ip = ip
+        self.template = template
+        self.memory_mb = 4096
+        self.cpus = 4
+        self.change_version = 1
+
+    def runtime(self):
+        return vim.vm.RuntimeInfo(powerState=self.power)
+
+    def guest(self):
+        nics = []
+        if self.power == 'poweredOn' and self.ip:
+            nics.append(vim.vm.GuestInfo.NicInfo(ipAddress=[self.ip, 'fe80::1'], connected=True))
+        return vim.vm.GuestInfo(net=nics)
+
+    def config(self):
+        nic = vim.vm.device.VirtualVmxnet3(key=4000,
+                                           deviceInfo=vim.Description(label=ADAPTER_LABEL, summary='nic'))
+        hardware = vim.vm.VirtualHardware(memoryMB=self.memory_mb, numCPU=self.cpus, device=[nic])
+        return vim.vm.ConfigInfo(name=self.name,
+                                 annotation=self.annotation,
+                                 changeVersion='{}'.format(self.change_version),
+                                 template=self.template,
+                                 hardware=hardware)
+
+
+class World(object):
+    """A whole vCenter: a datacenter, the vLab folders, users' VMs and networks
+
+    :param users: How many users (each with a folder and a network) to create
+    :type users: Integer
+
+    :param vms_per_user: How many CentOS VMs are in every user's folder
+    :type vms_per_user: Integer
+
+    :param latency: Seconds every SOAP call takes
+    :type latency: Float
+
+    :param task_seconds: Seconds a task takes; a number, or a mapping of method -> seconds
+    :type task_seconds: Float or Dictionary
+
+    :param images: The versions of CentOS to make templates for
+    :type images: List
+
+    :param top_dir: The name of the top level vLab folder
+    :type top_dir: String
+
+    :param template_dir: The name of the folder templates live in
+    :type template_dir: String
+
+    :param resource_pool: The name of the resource pool VMs are deployed into
+    :type resource_pool: String
+    """
+    def __init__(self, users=10, vms_per_user=5, latency=0.0, task_seconds=0.0, images=('7',),
+                 top_dir='vlab', template_dir='centos-templates', resource_pool='Resources'):
+        self.latency = latency
+        if isinstance(task_seconds, dict):
+            self.task_seconds = collections.defaultdict(float, task_seconds)
+        else:
+            self.task_seconds = collections.defaultdict(lambda: task_seconds)
+        self.calls = collections.Counter()
+        self.stub = FakeStub(self)
+        self._lock = threading.RLock()
+        self._ids = itertools.count(1)
+        self._entities = {}
+        self._vms = {}
+        self._collectors = {}
+        self.users = ['user{}'.format(x) for x in range(users)]
+        self._build(vms_per_user, images, top_dir, template_dir, resource_pool)
+
+    def connect(self, **kwargs):
+        """Login; the signature matches ``vlab_inf_common.vmware.vCenter``
+
+        :Returns: FakeVCenter
+        """
+        self.calls['login'] += 1
+        # A real login has a stub of its own; the sessions here share one, so
+        # undo whatever the last login wrapped around it (i.e. metrics.instrument)
+        self.stub.__dict__.pop('InvokeMethod', None)
+        return FakeVCenter(self)
+
+    def folder_of(self, username):
+        """The folder of a user's VMs
+
+        :Returns: vim.Folder
+        """
+        return self._user_folders[username]
+
+    def vm_names(self, username):
+        """The names of every VM a user has
+
+        :Returns: List
+        """
+        with self._lock:
+            entity = self._entities[self._user_folders[username]._moId]
+            return [self._vms[x._moId].name for x in entity.children if x._moId in self._vms]
+
+    # -- building the inventory ------------------------------------------------
+
+    def _add(self, vimtype, prefix, parent=None, **props):
+        ref = vimtype('{}-{}'.format(prefix, next(self._ids)), self.stub)
+        entity = _Entity(ref, props)
+        self._entities[ref._moId] = entity
+        if parent is not None:
+            self._attach(entity, parent)
+        return ref
+
+    def _attach(self, entity, parent):
+        entity.parent = parent
+        parent_entity = self._entities[parent._moId]
+        parent_entity.children.append(entity.ref)
+
+    def _children_of(self, ref):
+        entity = self._entities[ref._moId]
+        return lambda: list(entity.children)
+
+    def _build(self, vms_per_user, images, top_dir, template_dir, resource_pool):
+        self.root = self._add(vim.Folder, 'group-d', name='Datacenters')
+        self._entities[self.root._moId].props['childEntity'] = self._children_of(self.root)
+        datacenter = self._add(vim.Datacenter, 'datacenter', parent=self.root, name='Datacenter')
+        vm_folder = self._add(vim.Folder, 'group-v', parent=datacenter, name='vm')
+        network_folder = self._add(vim.Folder, 'group-n', parent=datacenter, name='network')
+        host_folder = self._add(vim.Folder, 'group-h', parent=datacenter, name='host')
+        self._entities[datacenter._moId].props.update(vmFolder=vm_folder, networkFolder=network_folder,
+                                                       hostFolder=host_folder)
+        for folder in (vm_folder, network_folder, host_folder):
+            self._entities[folder._moId].props['childEntity'] = self._children_of(folder)
+        cluster = self._add(vim.ClusterComputeResource, 'domain-c', parent=host_folder, name='cluster')
+        pool = self._add(vim.ResourcePool, 'resgroup', parent=cluster, name=resource_pool)
+        self._entities[cluster._moId].props['resourcePool'] = pool
+        self._add(vim.HostSystem, 'host', parent=cluster, name='esxi1')
+        self.dvs = self._add(vim.DistributedVirtualSwitch, 'dvs', parent=network_folder,
+                             name='dvs', uuid='50 1d 2f 9a')
+        top_folder = self._folder(top_dir, vm_folder)
+        self._user_folders = {}
+        self._networks = {}
+        self._network('centos-warm-pool', network_folder)
+        for username in self.users:
+            self._user_folders[username] = self._folder(username, top_folder)
+            network = self._network('{}_frontend'.format(username), network_folder)
+            for index in range(vms_per_user):
+                meta = {'component': 'CentOS', 'created': time.time(), 'version': images[0],
+                        'configured': False, 'generation': 1}
+                self._vm('vm{}'.format(index), ujson.dumps(meta), self._user_folders[username],
+                         network=network)
+        templates = self._folder(template_dir, top_folder)
+        for image in images:
+            for kind in ('cli', 'gui'):
+                template = self._vm('centos-template-{}-{}'.format(image, kind), None, templates,
+                                    network=None, power='poweredOff', template=True)
+                snapshot = vim.vm.Snapshot('snapshot-{}'.format(next(self._ids)), self.stub)
+                self._entities[template._moId].props['snapshot'] = vim.vm.SnapshotInfo(currentSnapshot=snapshot)
+
+    def _folder(self, name, parent):
+        ref = self._add(vim.Folder, 'group-v', parent=parent, name=name)
+        self._entities[ref._moId].props['childEntity'] = self._children_of(ref)
+        return ref
+
+    def _network(self, name, parent):
+        key = 'dvportgroup-{}'.format(next(self._ids))
+        ref = vim.dvs.DistributedVirtualPortgroup(key, self.stub)
+        entity = _Entity(ref, {'name': name, 'key': key, 'vm': []})
+        entity.props['config'] = vim.dvs.DistributedVirtualPortgroup.ConfigInfo(name=name,
+                                                                                key=key,
+                                                                                distributedVirtualSwitch=self.dvs)
+        self._entities[key] = entity
+        self._attach(entity, parent)
+        self._networks[key] = ref
+        return ref
+
+    def _vm(self, name, annotation, folder, network, power='poweredOn', template=False):
+        ref = vim.VirtualMachine('vm-{}'.format(next(self._ids)), self.stub)
+        index = int(ref._moId.split('-')[1])
+        state = _VM(name, annotation, network=[network] if network else [], power=power,
+                    ip='10.{}.{}.{}'.format(index // 65536 % 256, index // 256 % 256, index % 256),
+                    template=template)
+        entity = _Entity(ref, {'name': lambda: state.name,
+                               'runtime': state.runtime,
+                               'guest': state.guest,
+                               'config': state.config,
+                               'network': lambda: list(state.network)})
+        self._entities[ref._moId] = entity
+        self._vms[ref._moId] = state
+        self._attach(entity, folder)
+        for net in state.network:
+            self._entities[net._moId].props['vm'].append(ref)
+        return ref
+
+    # -- answering calls -------------------------------------------------------
+
+    def read(self, ref, name):
+        """Read one property of a managed object
+
+        :Returns: Object
+        """
+        with self._lock:
+            entity = self._entities.get(ref._moId, None)
+            if entity is None:
+                raise vim.fault.ManagedObjectNotFound(obj=ref)
+            return entity.read(name)
+
+    def read_path(self, ref, path):
+        """Read a property path, like "runtime.powerState"
+
+        :Returns: Object
+        """
+        first, _, rest = path.partition('.')
+        value = self.read(ref, first)
+        for part in [x for x in rest.split('.') if x]:
+            if value is None:
+                break
+            value = getattr(value, part, None)
+        return value
+
+    def _task(self, method, result=None):
+        time.sleep(self.task_seconds[method])
+        ref = vim.Task('task-{}'.format(next(self._ids)), self.stub)
+        info = vim.TaskInfo(key=ref._moId, task=ref, state='success', result=result,
+                            completeTime=datetime.datetime.now(datetime.timezone.utc))
+        with self._lock:
+            self._entities[ref._moId] = _Entity(ref, {'info': info})
+        return ref
+
+    def invoke(self, mo, method, args):
+        """Run a method of a managed object
+
+        :Returns: Object
+        """
+        handler = getattr(self, '_{}'.format(method), None)
+        if handler is None:
+            raise FakeFault('The fake vCenter does not implement {}.{}'.format(type(mo).__name__, method))
+        return handler(mo, *args)
+
+    def _RetrieveServiceContent(self, mo):
+        with self._lock:
+            if not hasattr(self, '_content'):
+                collector = vmodl.query.PropertyCollector('propertyCollector', self.stub)
+                self._entities[collector._moId] = _Entity(collector)
+                setting = self._add(vim.option.OptionManager, 'VpxSettings')
+                self._entities[setting._moId].props['setting'] = [vim.option.OptionValue(key='VirtualCenter.FQDN',
+                                                                                         value='vcenter.fake')]
+                session_manager = self._add(vim.SessionManager, 'SessionManager')
+                self._entities[session_manager._moId].props['currentSession'] = lambda: vim.UserSession(key='fake', userName='bench')
+                self._content = vim.ServiceInstanceContent(rootFolder=self.root,
+                                                           propertyCollector=collector,
+                                                           viewManager=self._add(vim.view.ViewManager, 'ViewManager'),
+                                                           searchIndex=self._add(vim.SearchIndex, 'SearchIndex'),
+                                                           sessionManager=session_manager,
+                                                           setting=setting,
+                                                           about=vim.AboutInfo(instanceUuid='fake-vcenter-uuid'))
+            return self._content
+
+    def _AcquireCloneTicket(self, mo):
+        return 'cst-VCT-{}'.format(next(self._ids))
+
+    def _FindChild(self, mo, entity, name):
+        with self._lock:
+            for child in self._entities[entity._moId].children:
+                if self._entities[child._moId].read('name') == name:
+                    return child
+        return None
+
+    def _CreateContainerView(self, mo, container, types, recursive):
+        with self._lock:
+            found = []
+            pending = list(self._entities[container._moId].children)
+            while pending:
+                ref = pending.pop(0)
+                if any(isinstance(ref, x) for x in types):
+                    found.append(ref)
+                if recursive:
+                    pending.extend(self._entities[ref._moId].children)
+            return self._add(vim.view.ContainerView, 'session[fake]view', view=found)
+
+    def _DestroyView(self, mo):
+        with self._lock:
+            self._entities.pop(mo._moId, None)
+
+    def _RetrieveProperties(self, mo, specs):
+        with self._lock:
+            return [self._object_content(ref, props) for ref, props in self._select(specs)]
+
+    def _object_content(self, ref, props):
+        prop_set = []
+        for path in props:
+            value = _typed(self.read_path(ref, path))
+            if value is not None:
+                prop_set.append(vmodl.DynamicProperty(name=path, val=value))
+        return vmodl.query.PropertyCollector.ObjectContent(obj=ref, propSet=prop_set)
+
+    def _select(self, specs):
+        """Walk the ObjectSpecs & TraversalSpecs of FilterSpecs, like the PropertyCollector does
+
+        :Returns: List of (managed object, property paths)
+        """
+        answer = collections.OrderedDict()
+        for spec in specs:
+            for obj_spec in spec.objectSet:
+                for ref in self._traverse(obj_spec.obj, obj_spec.skip, obj_spec.selectSet or []):
+                    paths = [path for prop in spec.propSet if isinstance(ref, prop.type) for path in prop.pathSet]
+                    if paths:
+                        answer.setdefault(ref, paths)
+        return list(answer.items())
+
+    def _traverse(self, ref, skip, select_set):
+        if ref._moId not in self._entities:
+            return
+        if not skip:
+            yield ref
+        for traversal in select_set:
+            if not isinstance(ref, traversal.type):
+                continue
+            value = self.read(ref, traversal.path) or []
+            for child in (value if isinstance(value, list) else [value]):
+                for found in self._traverse(child, traversal.skip, traversal.selectSet or []):
+                    yield found
+
+    def _CreatePropertyCollector(self, mo):
+        with self._lock:
+            ref = self._add(vmodl.query.PropertyCollector, 'session[fake]collector')
+            self._collectors[ref._moId] = {'specs': [], 'reported': False}
+            return ref
+
+    def _CreateFilter(self, mo, spec, partial_updates):
+        with self._lock:
+            self._collectors[mo._moId]['specs'].append(spec)
+            return self._add(vmodl.query.PropertyCollector.Filter, 'session[fake]filter')
+
+    def _WaitForUpdatesEx(self, mo, version, options):
+        with self._lock:
+            collector = self._collectors[mo._moId]
+            if not collector['reported']:
+                collector['reported'] = True
+                updates = []
+                for ref, props in self._select(collector['specs']):
+                    changes = [vmodl.query.PropertyCollector.Change(name=x, op='assign', val=_typed(self.read_path(ref, x)))
+                               for x in props]
+                    updates.append(vmodl.query.PropertyCollector.ObjectUpdate(kind='enter', obj=ref, changeSet=changes))
+                filter_update = vmodl.query.PropertyCollector.FilterUpdate(objectSet=updates)
+                return vmodl.query.PropertyCollector.UpdateSet(version='1', filterSet=[filter_update])
+        # Nothing in the model changes on its own
+        time.sleep(getattr(options, 'maxWaitSeconds', 0) or 0)
+        return None
+
+    def _DestroyPropertyCollector(self, mo):
+        with self._lock:
+            self._collectors.pop(mo._moId, None)
+            self._entities.pop(mo._moId, None)
+
+    def _PowerOnVM_Task(self, mo, host=None):
+        with self._lock:
+            self._vms[mo._moId].power = 'poweredOn'
+        return self._task('PowerOnVM_Task')
+
+    def _PowerOffVM_Task(self, mo):
+        with self._lock:
+            self._vms[mo._moId].power = 'poweredOff'
+        return self._task('PowerOffVM_Task')
+
+    def _Destroy_Task(self, mo):
+        with self._lock:
+            entity = self._entities.pop(mo._moId)
+            state = self._vms.pop(mo._moId)
+            self._entities[entity.parent._moId].children.remove(mo)
+            for net in state.network:
+                self._entities[net._moId].props['vm'].remove(mo)
+        return self._task('Destroy_Task')
+
+    def _ReconfigVM_Task(self, mo, spec):
+        with self._lock:
+            state = self._vms[mo._moId]
+            if spec.memoryMB:
+                state.memory_mb = spec.memoryMB
+            if spec.numCPUs:
+                state.cpus = spec.numCPUs
+            if spec.annotation is not None:
+                state.annotation = spec.annotation
+            for change in spec.deviceChange or []:
+                port = change.device.backing.port
+                network = self._networks[port.portgroupKey]
+                for old in state.network:
+                    self._entities[old._moId].props['vm'].remove(mo)
+                state.network = [network]
+                self._entities[network._moId].props['vm'].append(mo)
+            state.change_version += 1
+        return self._task('ReconfigVM_Task')
+
+    def _CloneVM_Task(self, mo, folder, name, spec):
+        with self._lock:
+            template = self._vms[mo._moId]
+            the_vm = self._vm(name, template.annotation, folder, network=None, power='poweredOff')
+        return self._task('CloneVM_Task', result=the_vm)
+
+
+def _typed(value):
+    """Convert a list into the typed array pyVmomi deserializes; an empty one is unset
+
+    :Returns: Object
+    """
+    if not isinstance(value, list):
+        return value
+    if not value:
+        return None
+    return type(value[0]).Array(value)
+
+
+class FakeStub(object):
+    """Stands in for pyVmomi's ``SoapStubAdapter``; answers calls from a World
+
+    :param world: The model of vCenter
+    :type world: World
+    """
+    version = 'vim.version.version10'
+
+    def __init__(self, world):
+        self._world = world
+
+    def InvokeMethod(self, mo, info, args, *more):
+        self._world.calls[info.wsdlName] += 1
+        time.sleep(self._world.latency)
+        return self._world.invoke(mo, info.wsdlName, args)
+
+    def InvokeAccessor(self, mo, info):
+        self._world.calls['Fetch'] += 1
+        time.sleep(self._world.latency)
+        return self._world.read(mo, info.name)
+
+
+class FakeVCenter(vCenter):
+    """A ``vlab_inf_common.vmware.vCenter`` logged into a World instead of vCenter
+
+    Everything except login & logout is the real ``vCenter`` code.
+
+    :param world: The model of vCenter
+    :type world: World
+    """
+    def __init__(self, world, base_dir=None):
+        self._world = world
+        self._conn = vim.ServiceInstance('ServiceInstance', world.stub)
+        self._base_dir = base_dir or 'vlab'
+        self._net_cache = None
+
+    def close(self):
+        self._world.calls['logout'] += 1
@@ -0,0 +1,103 @@
+# -*- coding: UTF-8 -*-
+"""
+Run an operation many times, from many threads, and summarize how it went.
+"""
+import time
+import math
+import collections
+from concurrent import futures
+
+
+Result = collections.namedtuple('Result', 'name ops seconds ops_per_sec p50 p99 errors calls_per_op first_error')
+
+
+def percentile(values, pct):
+    """The value below which ``pct`` percent of the values fall (nearest rank)
+
+    :Returns: Float
+
+    :param values: The measurements
+    :type values: List
+
+    :param pct: The percentile, 0 - 100
+    :type pct: Float
+    """
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(int(math.ceil(pct / 100.0 * len(ordered))), 1)
+    return ordered[rank - 1]
+
+
+def measure(name, operation, iterations, concurrency=1, world=None):
+    """Time ``operation(index)`` for every index in ``range(iterations)``
+
+    :Returns: Result
+
+    :param name: What's being measured, for the report
+    :type name: String
+
+    :param operation: The thing to time; called with the iteration number
+    :type operation: Function
+
+    :param iterations: How many times to call the operation
+    :type iterations: Integer
+
+    :param concurrency: How many threads call the operation at once
+    :type concurrency: Integer
+
+    :param world: The fake vCenter, to count the SOAP calls each operation makes
+    :type world: benchmarks.fake_vcenter.World
+    """
+    calls_before = sum(world.calls.values()) if world else 0
+
+    def timed(index):
+        start = time.perf_counter()
+        try:
+            operation(index)
+        except Exception as doh:
+            return time.perf_counter() - start, '{}: {}'.format(type(doh).__name__, doh)
+        return time.perf_counter() - start, None
+
+    started = time.perf_counter()
+    with futures.ThreadPoolExecutor(max_workers=max(concurrency, 1)) as executor:
+        outcomes = list(executor.map(timed, range(iterations)))
+    elapsed = time.perf_counter() - started
+    latencies = [x for x, _ in outcomes]
+    errors = [x for _, x in outcomes if x is not None]
+    calls = (sum(world.calls.values()) - calls_before) if world else 0
+    return Result(name=name,
+                  ops=iterations,
+                  seconds=elapsed,
+                  ops_per_sec=iterations / elapsed if elapsed else 0.0,
+                  p50=percentile(latencies, 50),
+                  p99=percentile(latencies, 99),
+                  errors=len(errors),
+                  calls_per_op=calls / float(iterations) if iterations else 0.0,
+                  first_error=errors[0] if errors else None)
+
+
+def report(results, stream):
+    """Write a table of results
+
+    :Returns: None
+
+    :param results: What ``measure`` returned
+    :type results: List
+
+    :param stream: Where to write the table, like sys.stdout
+    :type stream: File
+    """
+    row = '{:<24} {:>7} {:>10} {:>10} {:>10} {:>7} {:>11}\n'
+    stream.write(row.format('benchmark', 'ops', 'ops/sec', 'p50 ms', 'p99 ms', 'errors', 'calls/op'))
+    for result in results:
+        stream.write(row.format(result.name,
+                                result.ops,
+                                '{:.1f}'.format(result.ops_per_sec),
+                                '{:.2f}'.format(result.p50 * 1000),
+                                '{:.2f}'.format(result.p99 * 1000),
+                                result.errors,
+                                '{:.1f}'.format(result.calls_per_op)))
+    for result in results:
+        if result.first_error:
+            stream.write('{} failed {} times, first with {}\n'.format(result.name, result.errors, result.first_error))
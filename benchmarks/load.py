@@ -0,0 +1,420 @@
+# -*- coding: UTF-8 -*-
+"""
+Replay API traffic end to end: through the Flask app, an in-memory broker, and
+a Celery worker (in a thread) running the tasks against the fake vCenter.
+
+i.e. ``python -m benchmarks.load --clients 1,4,16 --workers 1,4 --requests 500``
+
+A trace is JSONL; one request per line::
+
+    {"at": 0.25, "method": "POST", "path": "/api/2/inf/centos", "user": "user3",
+     "body": {"name": "myBox", "image": "7", "network": "frontend"}}
+
+``at`` is seconds from the start of the replay. Without it, requests are sent
+as fast as the clients can send them. Without ``--trace``, a synthetic mix of
+shows, creates, deletes and image lookups is replayed.
+
+Every pair of ``--clients`` (concurrent API requests; i.e. uWSGI processes)
+and ``--workers`` (Celery concurrency) is a row of the report, so you can see
+where adding more of one stops helping.
+"""
+import sys
+import json
+import time
+import random
+import logging
+import argparse
+import threading
+import contextlib
+import collections
+from concurrent import futures
+
+import ujson
+from celery.signals import task_prerun, task_postrun
+from celery.contrib.testing.worker import start_worker
+from vlab_api_common.http_auth import generate_v2_test_token
+
+from vlab_centos_api.app import app
+from vlab_centos_api.lib.worker import tasks
+from benchmarks import api, worker, harness
+from benchmarks.fake_vcenter import World
+
+
+CENTOS = '/api/2/inf/centos'
+MIX = {'show': 0.6, 'create': 0.15, 'delete': 0.15, 'image': 0.1}
+
+LoadResult = collections.namedtuple('LoadResult', 'clients workers requests seconds api_p50 api_p99 api_errors '
+                                                  'enqueued enqueue_rate completed task_p50 task_p99 queue_p50 '
+                                                  'task_errors unfinished busy')
+
+
+def synthetic(count, users=10, mix=None, vms_per_user=5, rate=0, seed=None):
+    """Make up a trace of API requests
+
+    Deletes go after the VMs a ``World`` starts every user with, and become
+    shows once a user has none left. A delete of something created earlier in
+    the trace could beat its create to the worker, and leave the create waiting
+    on the IP of a VM that's gone.
+
+    :Returns: List of Dictionary
+
+    :param count: How many requests to make
+    :type count: Integer
+
+    :param users: How many different users make the requests
+    :type users: Integer
+
+    :param mix: The relative weights of show, create, delete and image requests
+    :type mix: Dictionary
+
+    :param vms_per_user: How many VMs every user starts with
+    :type vms_per_user: Integer
+
+    :param rate: Requests per second; zero means as fast as they can be sent
+    :type rate: Float
+
+    :param seed: Make the same trace every time
+    :type seed: Integer
+    """
+    rng = random.Random(seed)
+    kinds, weights = zip(*sorted((mix or MIX).items()))
+    remaining = {'user{}'.format(x): ['vm{}'.format(y) for y in range(vms_per_user)] for x in range(users)}
+    trace = []
+    for index in range(count):
+        user = 'user{}'.format(rng.randrange(users))
+        kind = rng.choices(kinds, weights)[0]
+        if kind == 'delete' and not remaining[user]:
+            kind = 'show'
+        if kind == 'show':
+            entry = {'method': 'GET', 'path': CENTOS}
+        elif kind == 'create':
+            body = {'name': 'load{}'.format(index), 'image': '7', 'network': 'frontend'}
+            entry = {'method': 'POST', 'path': CENTOS, 'body': body}
+        elif kind == 'delete':
+            name = remaining[user].pop(rng.randrange(len(remaining[user])))
+            entry = {'method': 'DELETE', 'path': CENTOS, 'body': {'name': name}}
+        elif kind == 'image':
+            entry = {'method': 'GET', 'path': '{}/image'.format(CENTOS)}
+        else:
+            raise ValueError('Unknown kind of request: {}'.format(kind))
+        entry['user'] = user
+        if rate:
+            entry['at'] = index / float(rate)
+        trace.append(entry)
+    return trace
+
+
+def read_trace(path):
+    """Load a trace from a JSONL file
+
+    :Returns: List of Dictionary
+
+    :Raises: ValueError if a request has no method, path or user
+
+    :param path: The location of the trace
+    :type path: String
+    """
+    trace = []
+    with open(path) as the_file:
+        for number, line in enumerate(the_file, 1):
+            line = line.strip()
+            if not line:
+                continue
+            entry = json.loads(line)
+            missing = [x for x in ('method', 'path', 'user') if x not in entry]
+            if missing:
+                raise ValueError('Line {} of {} has no {}'.format(number, path, ', '.join(missing)))
+            trace.append(entry)
+    return sorted(trace, key=lambda x: x.get('at', 0))
+
+
+def write_trace(trace, path):
+    """Save a trace as JSONL, to replay it again later
+
+    :Returns: None
+
+    :param trace: The requests to save
+    :type trace: List of Dictionary
+
+    :param path: Where to save them
+    :type path: String
+    """
+    with open(path, 'w') as the_file:
+        for entry in trace:
+            the_file.write('{}\n'.format(json.dumps(entry, sort_keys=True)))
+
+
+class Tracker(object):
+    """Follows every task the API sent through the worker, via Celery's signals
+
+    Times are from ``time.perf_counter``, so they compare with when each
+    request was sent.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.sent = {}
+        self.started = {}
+        self.finished = {}
+        self.errors = 0
+        self.busy = 0.0
+
+    def accept(self, task_id, sent):
+        """Note a task the API sent, and when the request that sent it was made
+
+        Shows moments apart share a task; the first request counts.
+
+        :Returns: None
+        """
+        with self._lock:
+            self.sent.setdefault(task_id, sent)
+
+    def _prerun(self, task_id=None, **kwargs):
+        with self._lock:
+            self.started[task_id] = time.perf_counter()
+
+    def _postrun(self, task_id=None, state=None, retval=None, **kwargs):
+        now = time.perf_counter()
+        with self._lock:
+            self.busy += now - self.started.get(task_id, now)
+            if state == 'IGNORED':
+                # Waiting on a deploy slot; it'll run again
+                return
+            self.finished[task_id] = now
+            if state != 'SUCCESS' or (isinstance(retval, dict) and retval.get('error')):
+                self.errors += 1
+
+    def unfinished(self):
+        """How many tasks the API sent that the worker hasn't finished
+
+        :Returns: Integer
+        """
+        with self._lock:
+            return len([x for x in self.sent if x not in self.finished])
+
+    def wait(self, timeout):
+        """Block until the worker finishes every task the API sent, or the timeout
+
+        :Returns: Integer, how many tasks are still unfinished
+        """
+        deadline = time.perf_counter() + timeout
+        while self.unfinished() and time.perf_counter() < deadline:
+            time.sleep(0.01)
+        return self.unfinished()
+
+    @contextlib.contextmanager
+    def listening(self):
+        """Follow tasks for the life of a ``with`` statement
+
+        :Returns: Generator
+        """
+        task_prerun.connect(self._prerun, weak=False)
+        task_postrun.connect(self._postrun, weak=False)
+        try:
+            yield self
+        finally:
+            task_prerun.disconnect(self._prerun)
+            task_postrun.disconnect(self._postrun)
+
+
+@contextlib.contextmanager
+def worker_running(concurrency, broker='memory://', backend='cache+memory://'):
+    """Run the Celery worker in a thread, consuming from an in-memory broker
+
+    :Returns: Generator
+
+    :param concurrency: How many tasks the worker runs at once
+    :type concurrency: Integer
+
+    :param broker: The URL of the message broker the API sends to
+    :type broker: String
+
+    :param backend: The URL of the result backend the API reads from
+    :type backend: String
+    """
+    # The in-memory transport polls (once a second by default), and a worker at
+    # its prefetch limit only checks again every couple of seconds; either would
+    # show up as time in the queue that a real broker doesn't have
+    settings = {'broker_url': broker,
+                'result_backend': backend,
+                'broker_transport_options': {'polling_interval': 0.01},
+                'worker_prefetch_multiplier': 0}
+    saved = {x: tasks.app.conf[x] for x in settings}
+    tasks.app.conf.update(settings)
+    try:
+        with start_worker(tasks.app, concurrency=concurrency, pool='threads', perform_ping_check=False,
+                          loglevel='WARNING', shutdown_timeout=60):
+            yield
+    finally:
+        tasks.app.conf.update(saved)
+
+
+def replay(trace, clients, world, workers, drain_timeout=60):
+    """Send every request in a trace to the API, and wait for the worker to finish the tasks
+
+    :Returns: LoadResult
+
+    :param trace: The requests to send
+    :type trace: List of Dictionary
+
+    :param clients: How many requests are sent at once
+    :type clients: Integer
+
+    :param world: The fake vCenter
+    :type world: benchmarks.fake_vcenter.World
+
+    :param workers: How many tasks the Celery worker runs at once
+    :type workers: Integer
+
+    :param drain_timeout: How many seconds to wait for the worker, once every request is sent
+    :type drain_timeout: Float
+    """
+    tokens = {x: generate_v2_test_token(username=x) for x in set(y['user'] for y in trace)}
+    client = app.test_client()
+    tracker = Tracker()
+
+    def send(index):
+        entry = trace[index]
+        if 'at' in entry:
+            delay = start + entry['at'] - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+        headers = {'X-Auth': tokens[entry['user']],
+                   'X-REQUEST-ID': entry.get('txn_id', 'load-{}-{}-{}'.format(clients, workers, index))}
+        sent = time.perf_counter()
+        resp = client.open(entry['path'], method=entry['method'], json=entry.get('body', None), headers=headers)
+        answered = time.perf_counter()
+        if resp.status_code == 202:
+            tracker.accept(ujson.loads(resp.data)['content']['task-id'], sent)
+        return answered - sent, resp.status_code >= 400
+
+    with contextlib.ExitStack() as stack:
+        stack.enter_context(api.installed())
+        stack.enter_context(worker.installed(world, pool_size=workers))
+        stack.enter_context(tracker.listening())
+        stack.enter_context(worker_running(workers))
+        start = time.perf_counter()
+        with futures.ThreadPoolExecutor(max_workers=max(clients, 1)) as executor:
+            outcomes = list(executor.map(send, range(len(trace))))
+        sending = time.perf_counter() - start
+        unfinished = tracker.wait(drain_timeout)
+        elapsed = max(list(tracker.finished.values()) + [start + sending]) - start
+    latencies = [x for x, _ in outcomes]
+    done = [x for x in tracker.sent if x in tracker.finished]
+    task_latencies = [tracker.finished[x] - tracker.sent[x] for x in done]
+    queue_waits = [max(tracker.started[x] - tracker.sent[x], 0) for x in done if x in tracker.started]
+    return LoadResult(clients=clients,
+                      workers=workers,
+                      requests=len(trace),
+                      seconds=elapsed,
+                      api_p50=harness.percentile(latencies, 50),
+                      api_p99=harness.percentile(latencies, 99),
+                      api_errors=sum(1 for _, failed in outcomes if failed),
+                      enqueued=len(tracker.sent),
+                      enqueue_rate=len(tracker.sent) / sending if sending else 0.0,
+                      completed=len(done),
+                      task_p50=harness.percentile(task_latencies, 50),
+                      task_p99=harness.percentile(task_latencies, 99),
+                      queue_p50=harness.percentile(queue_waits, 50),
+                      task_errors=tracker.errors,
+                      unfinished=unfinished,
+                      busy=tracker.busy / (workers * elapsed) if elapsed else 0.0)
+
+
+def report(results, stream):
+    """Write a table of load test results
+
+    :Returns: None
+
+    :param results: What ``replay`` returned
+    :type results: List of LoadResult
+
+    :param stream: Where to write the table, like sys.stdout
+    :type stream: File
+    """
+    row = '{:>7} {:>7} {:>8} {:>8} {:>8} {:>7} {:>10} {:>9} {:>9} {:>9} {:>7} {:>10} {:>6}\n'
+    stream.write(row.format('clients', 'workers', 'api p50', 'api p99', 'api err', 'tasks', 'enqueue/s',
+                            'task p50', 'task p99', 'queue p50', 'failed', 'unfinished', 'busy'))
+    for result in results:
+        stream.write(row.format(result.clients,
+                                result.workers,
+                                '{:.1f}'.format(result.api_p50 * 1000),
+                                '{:.1f}'.format(result.api_p99 * 1000),
+                                result.api_errors,
+                                result.enqueued,
+                                '{:.1f}'.format(result.enqueue_rate),
+                                '{:.1f}'.format(result.task_p50 * 1000),
+                                '{:.1f}'.format(result.task_p99 * 1000),
+                                '{:.1f}'.format(result.queue_p50 * 1000),
+                                result.task_errors,
+                                result.unfinished,
+                                '{:.0%}'.format(result.busy)))
+    stream.write('(latencies in ms; task latency is from the request to the task finishing)\n')
+
+
+def levels(value):
+    """Parse a comma separated list of concurrency levels, i.e. "1,4,16"
+
+    :Returns: List of Integer
+    """
+    answer = [int(x) for x in value.split(',') if x.strip()]
+    if not answer or min(answer) < 1:
+        raise argparse.ArgumentTypeError('Concurrency levels must be 1 or more, not {}'.format(value))
+    return answer
+
+
+def parse_args(argv):
+    """Define the CLI
+
+    :Returns: argparse.Namespace
+    """
+    parser = argparse.ArgumentParser(prog='python -m benchmarks.load', description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--trace', help='Replay the requests in this JSONL file')
+    parser.add_argument('--requests', type=int, default=200, help='Requests in the synthetic trace')
+    parser.add_argument('--rate', type=float, default=0,
+                        help='Requests per second of the synthetic trace; 0 means as fast as possible')
+    parser.add_argument('--save-trace', help='Write the synthetic trace to this JSONL file')
+    parser.add_argument('--seed', type=int, default=None, help='Make the same synthetic trace every time')
+    parser.add_argument('--clients', type=levels, default=[1, 4, 16], help='Concurrent API requests, i.e. 1,4,16')
+    parser.add_argument('--workers', type=levels, default=[1, 4], help='Celery worker concurrency, i.e. 1,4')
+    parser.add_argument('--users', type=int, default=10, help='Users in the fake vCenter')
+    parser.add_argument('--vms', type=int, default=5, help='CentOS VMs in every user folder')
+    parser.add_argument('--latency-ms', type=float, default=2, help='Milliseconds every vCenter call takes')
+    parser.add_argument('--task-ms', type=float, default=50, help='Milliseconds every vCenter task takes')
+    parser.add_argument('--drain-timeout', type=float, default=120,
+                        help='Seconds to wait for the worker to finish, once every request is sent')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    """Run the load test
+
+    :Returns: Integer, the exit code
+    """
+    args = parse_args(argv)
+    # The access log, and the deletes that lose the race with their create,
+    # would drown out the report; failed tasks are counted in it instead
+    logging.disable(logging.ERROR)
+    if args.trace:
+        trace = read_trace(args.trace)
+        users = max(args.users, len(set(x['user'] for x in trace)))
+    else:
+        trace = synthetic(args.requests, args.users, vms_per_user=args.vms, rate=args.rate, seed=args.seed)
+        users = args.users
+        if args.save_trace:
+            write_trace(trace, args.save_trace)
+    results = []
+    for workers in args.workers:
+        for clients in args.clients:
+            # A fresh vCenter every time, so creates and deletes replay the same
+            world = World(users=users,
+                          vms_per_user=args.vms,
+                          latency=args.latency_ms / 1000.0,
+                          task_seconds=args.task_ms / 1000.0)
+            results.append(replay(trace, clients, world, workers, args.drain_timeout))
+    report(results, sys.stdout)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
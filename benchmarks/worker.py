@@ -0,0 +1,127 @@
+# -*- coding: UTF-8 -*-
+"""
+Benchmarks of the worker's business logic (``vmware.py``) against the fake vCenter.
+
+``installed`` points the worker's session pool, lookup index and deploy slots
+at a ``World`` instead of vCenter & RabbitMQ, for the life of a ``with``
+statement. The inventory cache is turned off, so ``show`` measures the crawl of
+a user's folder; that's what every show costs when the cache can't be trusted.
+
+``create`` uses linked clones of the World's templates. Importing an OVA is not
+benchmarked; it's dominated by the upload, which the fake has no stand-in for.
+"""
+import ssl
+import random
+import logging
+import contextlib
+from unittest.mock import patch
+
+import OpenSSL
+
+from vlab_centos_api.lib.worker import (vmware, session_pool, lookup_index, inventory, inventory_cache,
+                                        admission)
+from benchmarks import harness
+
+
+logger = logging.getLogger('benchmarks')
+
+
+def certificate():
+    """A self-signed TLS cert, for the console URL thumbprint of the fake vCenter
+
+    :Returns: String
+    """
+    key = OpenSSL.crypto.PKey()
+    key.generate_key(OpenSSL.crypto.TYPE_RSA, 2048)
+    cert = OpenSSL.crypto.X509()
+    cert.get_subject().CN = 'vcenter.fake'
+    cert.set_serial_number(1)
+    cert.gmtime_adj_notBefore(0)
+    cert.gmtime_adj_notAfter(3600)
+    cert.set_issuer(cert.get_subject())
+    cert.set_pubkey(key)
+    cert.sign(key, 'sha256')
+    return OpenSSL.crypto.dump_certificate(OpenSSL.crypto.FILETYPE_PEM, cert).decode()
+
+
+@contextlib.contextmanager
+def installed(world, pool_size=4, wait_for_ip=True):
+    """Point the worker at the fake vCenter
+
+    :Returns: Generator
+
+    :param world: The fake vCenter
+    :type world: benchmarks.fake_vcenter.World
+
+    :param pool_size: How many vCenter sessions the worker's pool holds
+    :type pool_size: Integer
+
+    :param wait_for_ip: Have ``create`` wait for the new VM to report an IP
+    :type wait_for_ip: Boolean
+    """
+    pem = certificate()
+    const = vmware.const._replace(VLAB_CENTOS_DEPLOY_MODE='linked', VLAB_CENTOS_WAIT_FOR_IP=wait_for_ip)
+    with contextlib.ExitStack() as stack:
+        stack.enter_context(patch.object(session_pool, 'vCenter', world.connect))
+        stack.enter_context(patch.object(session_pool, 'POOL', session_pool.SessionPool(host='vcenter.fake',
+                                                                                        user='bench',
+                                                                                        password='bench',
+                                                                                        size=pool_size)))
+        stack.enter_context(patch.object(lookup_index, 'INDEX', lookup_index.LookupIndex()))
+        stack.enter_context(patch.object(inventory_cache, 'CACHE', inventory_cache.InventoryCache(enabled=False)))
+        stack.enter_context(patch.object(admission, 'ADMISSION', admission.Admission('memory://')))
+        stack.enter_context(patch.object(inventory.ConsoleUrl, '_identity', None))
+        stack.enter_context(patch.object(ssl, 'get_server_certificate', lambda *args, **kwargs: pem))
+        stack.enter_context(patch.object(vmware, 'const', const))
+        yield
+
+
+def run(world, iterations=100, concurrency=1, benchmarks=('show', 'create', 'delete', 'update_network')):
+    """Benchmark the worker functions
+
+    :Returns: List of harness.Result
+
+    :param world: The fake vCenter
+    :type world: benchmarks.fake_vcenter.World
+
+    :param iterations: How many times to run each benchmark
+    :type iterations: Integer
+
+    :param concurrency: How many threads run each benchmark at once; i.e. a bulk request
+    :type concurrency: Integer
+
+    :param benchmarks: The names of the benchmarks to run
+    :type benchmarks: List
+    """
+    results = []
+    users = world.users
+    created = []
+
+    def show(index):
+        vmware.show_centos(random.choice(users))
+
+    def create(index):
+        username = users[index % len(users)]
+        name = 'bench{}'.format(index)
+        vmware.create_centos(username, name, '7', '{}_frontend'.format(username), False, 4, 4, logger)
+        created.append((username, name))
+
+    def delete(index):
+        username, name = targets[index]
+        vmware.delete_centos(username, name, logger)
+
+    def update_network(index):
+        username = users[index % len(users)]
+        vmware.update_network(username, 'vm0', '{}_frontend'.format(username))
+
+    with installed(world, pool_size=max(concurrency, 1)):
+        for name in benchmarks:
+            if name == 'delete':
+                # Delete what create made, or else the VMs every user starts with
+                targets = list(created) or [(x, y) for x in users for y in world.vm_names(x)]
+                count = min(iterations, len(targets))
+                results.append(harness.measure('worker.delete', delete, count, concurrency, world))
+                continue
+            operation = {'show': show, 'create': create, 'update_network': update_network}[name]
+            results.append(harness.measure('worker.{}'.format(name), operation, iterations, concurrency, world))
+    return results
@@ -10,10 +10,11 @@ setup(name="vlab-centos-api",
       author="Nicholas Willhite,",
       author_email='willnx84@gmail.com',
       version='2020.04.03',
-      packages=find_packages(),
+      packages=find_packages(exclude=['benchmarks']),
       include_package_data=True,
       package_files={'vlab_centos_api' : ['app.ini']},
       description="centos",
       install_requires=['flask', 'ldap3', 'pyjwt', 'uwsgi', 'vlab-api-common',
-                        'ujson', 'cryptography', 'vlab-inf-common', 'celery']
+                        'ujson', 'cryptography', 'vlab-inf-common', 'celery', 'redis',
+                        'prometheus_client']
       )
@@ -1 +1,22 @@
 # -*- coding: UTF-8 -*-
+from unittest.mock import patch
+
+from vlab_inf_common.vmware import vim
+
+
+def resolve_without_index(test_case):
+    """Make the worker's lookup index resolve folders & networks straight from
+    the (fake) vCenter object, like ``vcenter.get_by_name`` and ``vcenter.networks``
+
+    :param test_case: The test that's running
+    :type test_case: unittest.TestCase
+    """
+    from vlab_centos_api.lib.worker import lookup_index
+    fakes = {'folder': lambda vcenter, name: vcenter.get_by_name(name=name, vimtype=vim.Folder),
+             'network': lambda vcenter, name: vcenter.networks[name],
+             'networks': lambda vcenter: vcenter.networks,
+             'invalidate': lambda: None}
+    for name, fake in fakes.items():
+        patcher = patch.object(lookup_index, name, fake)
+        patcher.start()
+        test_case.addCleanup(patcher.stop)
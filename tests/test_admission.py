@@ -0,0 +1,193 @@
+# -*- coding: UTF-8 -*-
+"""
+A suite of tests for the functions in admission.py
+"""
+import unittest
+from unittest.mock import patch, MagicMock
+
+from vlab_centos_api.lib.worker import admission, placement
+
+
+class SlotTaken(Exception):
+    """Stands in for the broker refusing an exclusive queue"""
+
+
+class TestAdmission(unittest.TestCase):
+    """A set of test cases for the Admission object"""
+
+    def setUp(self):
+        """Runs before every test case"""
+        self.placement = placement.Placement(datastore=placement.vim.Datastore('datastore-1'),
+                                             host=placement.vim.HostSystem('host-1'),
+                                             datastore_name='ds1',
+                                             host_name='esxi1')
+        patcher = patch.object(admission.kombu, 'Connection')
+        self.fake_Connection = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.fake_conn = self.fake_Connection.return_value
+        self.fake_conn.channel_errors = (SlotTaken,)
+        self.fake_conn.connection_errors = (OSError,)
+        self.channel = self.fake_conn.channel.return_value
+
+    def declared(self):
+        """The names of every queue declared"""
+        return [kwargs['queue'] for _, kwargs in self.channel.queue_declare.call_args_list]
+
+    def test_slots(self):
+        """``Admission.slots`` holds a slot for the datastore and the host"""
+        with admission.Admission('someBroker').slots(self.placement):
+            released = self.fake_conn.release.called
+
+        self.assertFalse(released)
+        self.assertEqual(self.declared(), ['centos.deploy-slot.datastore-1.0', 'centos.deploy-slot.host-1.0'])
+        self.assertEqual(self.fake_conn.release.call_count, 2)
+
+    def test_slots_exclusive(self):
+        """``Admission.slots`` declares each slot as an exclusive queue"""
+        with admission.Admission('someBroker').slots(self.placement):
+            pass
+
+        _, the_kwargs = self.channel.queue_declare.call_args
+        self.assertTrue(the_kwargs['exclusive'])
+
+    def test_slots_next_free(self):
+        """``Admission.slots`` tries the next slot when one is taken"""
+        self.channel.queue_declare.side_effect = [SlotTaken('locked'), None, None]
+        with admission.Admission('someBroker', datastore_limit=2).slots(self.placement):
+            pass
+
+        self.assertEqual(self.declared()[:2], ['centos.deploy-slot.datastore-1.0', 'centos.deploy-slot.datastore-1.1'])
+
+    def test_slots_busy(self):
+        """``Admission.slots`` raises Busy when every slot is taken, and releases what it held"""
+        self.channel.queue_declare.side_effect = [None, SlotTaken('locked')]
+
+        with self.assertRaises(admission.Busy) as the_error:
+            with admission.Admission('someBroker', datastore_limit=1, host_limit=1).slots(self.placement):
+                pass
+
+        self.assertEqual(the_error.exception.resource, 'esxi1')
+        self.assertEqual(self.fake_conn.release.call_count, 2)
+
+    def test_slots_no_limit(self):
+        """``Admission.slots`` does not touch the broker when there's no limit"""
+        with admission.Admission('someBroker', datastore_limit=0, host_limit=0).slots(self.placement):
+            pass
+
+        self.assertFalse(self.fake_Connection.called)
+
+    def test_slots_broker_down(self):
+        """``Admission.slots`` raises Unreachable (a Busy) when the broker cannot be reached"""
+        self.fake_conn.connect.side_effect = OSError('testing')
+
+        with self.assertRaises(admission.Busy) as the_error:
+            with admission.Admission('someBroker').slots(self.placement):
+                pass
+
+        self.assertTrue(isinstance(the_error.exception, admission.Unreachable))
+        self.assertTrue(self.fake_conn.release.called)
+
+    def test_slots_broker_down_fail_open(self):
+        """``Admission.slots`` lets the deploy run when the broker cannot be reached, if told to fail open"""
+        self.fake_conn.connect.side_effect = OSError('testing')
+        ran = False
+        with admission.Admission('someBroker', fail_open=True).slots(self.placement):
+            ran = True
+
+        self.assertTrue(ran)
+
+    def make_placement(self, datastore, host):
+        """Build another place a VM could go"""
+        return placement.Placement(datastore=placement.vim.Datastore(datastore),
+                                   host=placement.vim.HostSystem(host),
+                                   datastore_name='ds-{}'.format(datastore),
+                                   host_name='esxi-{}'.format(host))
+
+    def busy_on(self, *moids):
+        """Make the slots of some datastores/hosts taken"""
+        def queue_declare(queue, **kwargs):
+            if any('.{}.'.format(x) in queue for x in moids):
+                raise SlotTaken('locked')
+        self.channel.queue_declare.side_effect = queue_declare
+
+    def test_first_free(self):
+        """``Admission.first_free`` holds the slots of the best placement that has them free"""
+        self.busy_on('datastore-1')
+        placements = [self.make_placement('datastore-1', 'host-1'), self.make_placement('datastore-2', 'host-1')]
+        with admission.Admission('someBroker', datastore_limit=1, host_limit=1).first_free(placements) as target:
+            pass
+
+        self.assertTrue(target is placements[1])
+
+    def test_first_free_skips_full(self):
+        """``Admission.first_free`` doesn't ask again about a datastore it already found full"""
+        self.busy_on('datastore-1')
+        placements = [self.make_placement('datastore-1', 'host-1'),
+                      self.make_placement('datastore-1', 'host-2'),
+                      self.make_placement('datastore-2', 'host-2')]
+        with admission.Admission('someBroker', datastore_limit=1, host_limit=1).first_free(placements):
+            pass
+
+        self.assertEqual(self.declared().count('centos.deploy-slot.datastore-1.0'), 1)
+
+    def test_first_free_all_busy(self):
+        """``Admission.first_free`` raises Busy, about the best placement, only once every placement is full"""
+        self.busy_on('datastore-1', 'datastore-2')
+        placements = [self.make_placement('datastore-1', 'host-1'), self.make_placement('datastore-2', 'host-1')]
+
+        with self.assertRaises(admission.Busy) as the_error:
+            with admission.Admission('someBroker', datastore_limit=1, host_limit=1).first_free(placements):
+                pass
+
+        self.assertEqual(the_error.exception.resource, 'ds-datastore-1')
+        self.assertTrue('centos.deploy-slot.datastore-2.0' in self.declared())
+
+    def test_first_free_releases(self):
+        """``Admission.first_free`` releases the datastore slot of a placement whose host is full"""
+        self.busy_on('host-1')
+        placements = [self.make_placement('datastore-1', 'host-1'), self.make_placement('datastore-1', 'host-2')]
+        with admission.Admission('someBroker', datastore_limit=1, host_limit=1).first_free(placements) as target:
+            released = self.fake_conn.release.call_count
+
+        self.assertTrue(target is placements[1])
+        # the datastore slot of the first placement, and the unused host connection
+        self.assertEqual(released, 2)
+
+    def test_first_free_broker_down(self):
+        """``Admission.first_free`` doesn't try every placement when the broker cannot be reached"""
+        self.fake_conn.connect.side_effect = OSError('testing')
+        placements = [self.make_placement('datastore-1', 'host-1'), self.make_placement('datastore-2', 'host-1')]
+
+        with self.assertRaises(admission.Unreachable):
+            with admission.Admission('someBroker').first_free(placements):
+                pass
+
+        self.assertEqual(self.fake_conn.connect.call_count, 1)
+
+    def test_exclusive_broker_down(self):
+        """``Admission.exclusive`` raises Unreachable when the broker cannot be reached"""
+        self.fake_conn.connect.side_effect = OSError('testing')
+
+        with self.assertRaises(admission.Unreachable):
+            with admission.Admission('someBroker').exclusive('create.alice.myCentOS', error='testing'):
+                pass
+
+    def test_exclusive(self):
+        """``Admission.exclusive`` holds a single slot named after the key"""
+        with admission.Admission('someBroker').exclusive('create.alice.myCentOS', error='testing'):
+            pass
+
+        self.assertEqual(self.declared(), ['centos.deploy-slot.lock.create.alice.myCentOS.0'])
+        self.assertEqual(self.fake_conn.release.call_count, 1)
+
+    def test_exclusive_held(self):
+        """``Admission.exclusive`` raises Locked (a ValueError) when another worker holds the lock"""
+        self.channel.queue_declare.side_effect = SlotTaken('locked')
+
+        with self.assertRaises(admission.Locked):
+            with admission.Admission('someBroker').exclusive('create.alice.myCentOS', error='testing'):
+                pass
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -22,6 +22,26 @@ class TestCentOSViewSchema(unittest.TestCase):
         self.assertTrue(schema_valid)
 
 
+    def test_bulk_schema(self):
+        """The schema defined for POST on /bulk is valid"""
+        try:
+            Draft4Validator.check_schema(centos.CentOSView.BULK_SCHEMA)
+            schema_valid = True
+        except RuntimeError:
+            schema_valid = False
+
+        self.assertTrue(schema_valid)
+
+    def test_bulk_delete_schema(self):
+        """The schema defined for DELETE on /bulk is valid"""
+        try:
+            Draft4Validator.check_schema(centos.CentOSView.BULK_DELETE_SCHEMA)
+            schema_valid = True
+        except RuntimeError:
+            schema_valid = False
+
+        self.assertTrue(schema_valid)
+
     def test_get_schema(self):
         """The schema defined for GET on is valid"""
         try:
@@ -0,0 +1,214 @@
+# -*- coding: UTF-8 -*-
+"""
+A suite of tests for the benchmarks, and the fake vCenter they run against
+"""
+import io
+import os
+import tempfile
+import unittest
+
+from vlab_centos_api.lib.worker import inventory
+from benchmarks import harness, worker, api, load
+from benchmarks.__main__ import regressions
+from benchmarks.fake_vcenter import World
+
+
+class TestFakeVCenter(unittest.TestCase):
+    """A set of test cases for the fake vCenter"""
+
+    @classmethod
+    def setUpClass(cls):
+        """Runs once for the whole test suite"""
+        cls.world = World(users=2, vms_per_user=3)
+
+    def test_retrieve(self):
+        """The fake vCenter answers the property collector specs the worker sends"""
+        vcenter = self.world.connect()
+        vms, network_names = inventory.retrieve(vcenter, self.world.folder_of('user0'))
+
+        names = sorted(x['name'] for x in vms.values())
+        expected = ['vm0', 'vm1', 'vm2']
+
+        self.assertEqual(names, expected)
+        self.assertEqual(sorted(network_names.values()), ['user0_frontend'])
+
+    def test_find_vm(self):
+        """The fake vCenter supports looking up a VM by name"""
+        vcenter = self.world.connect()
+        _, info = inventory.find_vm(vcenter, self.world.folder_of('user1'), 'vm1')
+
+        self.assertEqual(info['name'], 'vm1')
+        self.assertEqual(info['meta']['component'], 'CentOS')
+
+    def test_find_vm_missing(self):
+        """The fake vCenter returns None for a VM that doesn't exist"""
+        vcenter = self.world.connect()
+        found = inventory.find_vm(vcenter, self.world.folder_of('user1'), 'nope')
+
+        self.assertTrue(found is None)
+
+    def test_calls(self):
+        """The fake vCenter counts the calls made to it"""
+        world = World(users=1, vms_per_user=1)
+        vcenter = world.connect()
+        inventory.retrieve(vcenter, world.folder_of('user0'))
+
+        self.assertTrue(world.calls['RetrieveProperties'] >= 1)
+
+
+class TestHarness(unittest.TestCase):
+    """A set of test cases for harness.py"""
+
+    def test_percentile(self):
+        """``percentile`` uses the nearest rank"""
+        values = list(range(1, 101))
+
+        self.assertEqual(harness.percentile(values, 50), 50)
+        self.assertEqual(harness.percentile(values, 99), 99)
+
+    def test_percentile_empty(self):
+        """``percentile`` of no values is zero"""
+        self.assertEqual(harness.percentile([], 99), 0.0)
+
+    def test_measure(self):
+        """``measure`` counts every operation, and the ones that failed"""
+        def operation(index):
+            if index % 2:
+                raise RuntimeError('doh')
+
+        result = harness.measure('thing', operation, iterations=10, concurrency=2)
+
+        self.assertEqual(result.ops, 10)
+        self.assertEqual(result.errors, 5)
+        self.assertEqual(result.first_error, 'RuntimeError: doh')
+
+    def test_report(self):
+        """``report`` writes a row per benchmark, and the first error of failing ones"""
+        result = harness.Result(name='thing', ops=1, seconds=1.0, ops_per_sec=1.0, p50=0.1, p99=0.2,
+                                errors=1, calls_per_op=2.0, first_error='RuntimeError: doh')
+        stream = io.StringIO()
+        harness.report([result], stream)
+
+        self.assertTrue('thing' in stream.getvalue())
+        self.assertTrue('first with RuntimeError: doh' in stream.getvalue())
+
+
+class TestRegressions(unittest.TestCase):
+    """A set of test cases for ``regressions``"""
+
+    def setUp(self):
+        """Runs before every test case"""
+        self.result = harness.Result(name='worker.show', ops=1, seconds=1.0, ops_per_sec=70.0, p50=0.1,
+                                     p99=0.2, errors=0, calls_per_op=2.0, first_error=None)
+
+    def test_slower(self):
+        """``regressions`` reports benchmarks slower than the tolerance allows"""
+        found = regressions([self.result], {'worker.show': {'ops_per_sec': 100.0}}, 0.2)
+
+        self.assertEqual(len(found), 1)
+
+    def test_within_tolerance(self):
+        """``regressions`` ignores benchmarks that are only a little slower"""
+        found = regressions([self.result], {'worker.show': {'ops_per_sec': 80.0}}, 0.2)
+
+        self.assertEqual(found, [])
+
+    def test_new_benchmark(self):
+        """``regressions`` ignores benchmarks missing from the baseline"""
+        found = regressions([self.result], {}, 0.2)
+
+        self.assertEqual(found, [])
+
+
+class TestRun(unittest.TestCase):
+    """A set of test cases that run the benchmarks, briefly"""
+
+    def test_worker(self):
+        """Every worker benchmark runs against the fake vCenter without errors"""
+        world = World(users=2, vms_per_user=2)
+        results = worker.run(world, iterations=4, concurrency=2)
+
+        self.assertEqual([x.name for x in results],
+                         ['worker.show', 'worker.create', 'worker.delete', 'worker.update_network'])
+        self.assertEqual([x.first_error for x in results], [None, None, None, None])
+
+    def test_api(self):
+        """Every API benchmark runs without errors"""
+        results = api.run(users=2, iterations=4, concurrency=2)
+
+        self.assertEqual([x.first_error for x in results], [None, None, None, None, None])
+
+
+class TestLoad(unittest.TestCase):
+    """A set of test cases for load.py"""
+
+    def test_synthetic(self):
+        """``synthetic`` makes as many requests as asked for"""
+        trace = load.synthetic(50, users=3, seed=1)
+
+        self.assertEqual(len(trace), 50)
+        self.assertEqual(set(x['method'] for x in trace), {'GET', 'POST', 'DELETE'})
+
+    def test_synthetic_deletes(self):
+        """``synthetic`` only deletes the VMs a user starts with, and each only once"""
+        trace = load.synthetic(200, users=2, vms_per_user=2, seed=1)
+        deletes = [(x['user'], x['body']['name']) for x in trace if x['method'] == 'DELETE']
+
+        self.assertEqual(len(deletes), len(set(deletes)))
+        self.assertTrue(set(deletes) <= {('user0', 'vm0'), ('user0', 'vm1'), ('user1', 'vm0'), ('user1', 'vm1')})
+
+    def test_synthetic_rate(self):
+        """``synthetic`` spaces requests out to the rate asked for"""
+        trace = load.synthetic(3, rate=2, seed=1)
+
+        self.assertEqual([x['at'] for x in trace], [0.0, 0.5, 1.0])
+
+    def test_trace_round_trip(self):
+        """A trace that's written can be read back, in the order it's sent"""
+        trace = [{'method': 'GET', 'path': load.CENTOS, 'user': 'user0', 'at': 1},
+                 {'method': 'GET', 'path': load.CENTOS, 'user': 'user1', 'at': 0}]
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'trace.jsonl')
+            load.write_trace(trace, path)
+            found = load.read_trace(path)
+
+        self.assertEqual([x['user'] for x in found], ['user1', 'user0'])
+
+    def test_read_trace_invalid(self):
+        """``read_trace`` raises ValueError for a request without a user"""
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'trace.jsonl')
+            with open(path, 'w') as the_file:
+                the_file.write('{"method": "GET", "path": "/api/2/inf/centos"}\n')
+
+            with self.assertRaises(ValueError):
+                load.read_trace(path)
+
+    def test_tracker(self):
+        """The Tracker only counts a task as finished once it isn't waiting to run again"""
+        tracker = load.Tracker()
+        tracker.accept('some-task', 0)
+        tracker._prerun(task_id='some-task')
+        tracker._postrun(task_id='some-task', state='IGNORED')
+        unfinished = tracker.unfinished()
+        tracker._prerun(task_id='some-task')
+        tracker._postrun(task_id='some-task', state='SUCCESS', retval={'error': 'doh'})
+
+        self.assertEqual(unfinished, 1)
+        self.assertEqual(tracker.unfinished(), 0)
+        self.assertEqual(tracker.errors, 1)
+
+    def test_replay(self):
+        """``replay`` runs every task the API sends through the worker"""
+        trace = load.synthetic(12, users=2, vms_per_user=2, seed=1)
+        world = World(users=2, vms_per_user=2)
+        result = load.replay(trace, clients=2, world=world, workers=2, drain_timeout=30)
+
+        self.assertEqual(result.requests, 12)
+        self.assertEqual(result.api_errors, 0)
+        self.assertEqual(result.unfinished, 0)
+        self.assertEqual(result.completed, result.enqueued)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -33,6 +33,10 @@ class TestCentOSView(unittest.TestCase):
         cls.fake_task = MagicMock()
         cls.fake_task.id = 'asdf-asdf-asdf'
         app.celery_app.send_task.return_value = cls.fake_task
+        # Every test starts without any requests to deduplicate
+        centos.dedup.REQUESTS = centos.dedup.RequestLog()
+        centos.dedup.SHOWS = centos.dedup.SingleFlight()
+        centos.results.CACHE = centos.results.ResultCache()
 
     def test_v1_deprecated(self):
         """CentOSView - GET on /api/1/inf/centos returns an HTTP 404"""
@@ -54,6 +58,152 @@ class TestCentOSView(unittest.TestCase):
 
         self.assertEqual(task_id, expected)
 
+    def test_get_read_queue(self):
+        """CentOSView - GET on /api/2/inf/centos sends the task to the read only queue"""
+        self.app.get('/api/2/inf/centos',
+                     headers={'X-Auth': self.token})
+
+        _, the_kwargs = self.app.application.celery_app.send_task.call_args
+
+        self.assertEqual(the_kwargs['queue'], 'centos-read')
+
+    def test_post_deploy_queue(self):
+        """CentOSView - POST on /api/2/inf/centos sends the task to the deploy queue"""
+        self.app.post('/api/2/inf/centos',
+                      headers={'X-Auth': self.token},
+                      json={'network': "someLAN",
+                            'name': "myCentOSBox",
+                            'image': "someVersion"})
+
+        _, the_kwargs = self.app.application.celery_app.send_task.call_args
+
+        self.assertEqual(the_kwargs['queue'], 'centos-deploy')
+
+    def test_task_done(self):
+        """CentOSView - GET on /api/2/inf/centos/task/<id> returns the result of a finished task"""
+        result = self.app.application.celery_app.AsyncResult.return_value
+        result.status = 'SUCCESS'
+        result.result = {'content': {'myCentOS': {}}, 'error': None, 'params': {}}
+        resp = self.app.get('/api/2/inf/centos/task/asdf-asdf-asdf',
+                            headers={'X-Auth': self.token})
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.json['content'], {'myCentOS': {}})
+
+    def test_task_done_cached(self):
+        """CentOSView - GET on /api/2/inf/centos/task/<id> only looks up a finished task once"""
+        result = self.app.application.celery_app.AsyncResult.return_value
+        result.status = 'SUCCESS'
+        result.result = {'content': {}, 'error': None, 'params': {}}
+        for _ in range(3):
+            self.app.get('/api/2/inf/centos/task/asdf-asdf-asdf',
+                         headers={'X-Auth': self.token})
+
+        self.assertEqual(self.app.application.celery_app.AsyncResult.call_count, 1)
+
+    def test_task_error(self):
+        """CentOSView - GET on /api/2/inf/centos/task/<id> returns HTTP 400 when the task set an error"""
+        result = self.app.application.celery_app.AsyncResult.return_value
+        result.status = 'SUCCESS'
+        result.result = {'content': {}, 'error': 'doh', 'params': {}}
+        resp = self.app.get('/api/2/inf/centos/task?task-id=asdf-asdf-asdf',
+                            headers={'X-Auth': self.token})
+
+        self.assertEqual(resp.status_code, 400)
+        self.assertEqual(resp.json['error'], 'doh')
+
+    def test_task_pending(self):
+        """CentOSView - GET on /api/2/inf/centos/task/<id> returns HTTP 202 while the task runs"""
+        self.app.application.celery_app.AsyncResult.return_value.status = 'QUEUED'
+        resp = self.app.get('/api/2/inf/centos/task/asdf-asdf-asdf',
+                            headers={'X-Auth': self.token})
+
+        self.assertEqual(resp.status_code, 202)
+        self.assertEqual(resp.json['content']['status'], 'QUEUED')
+
+    def test_get_coalesced(self):
+        """CentOSView - GET on /api/2/inf/centos shares one task between requests moments apart"""
+        for _ in range(3):
+            resp = self.app.get('/api/2/inf/centos',
+                                headers={'X-Auth': self.token})
+
+        _, the_kwargs = self.app.application.celery_app.send_task.call_args
+
+        self.assertEqual(self.app.application.celery_app.send_task.call_count, 1)
+        self.assertEqual(resp.json['content']['task-id'], the_kwargs['task_id'])
+
+    def test_get_send_failed(self):
+        """CentOSView - GET on /api/2/inf/centos doesn't share a task that failed to send"""
+        self.app.application.celery_app.send_task.side_effect = [RuntimeError('broker down'), self.fake_task]
+        for _ in range(2):
+            try:
+                self.app.get('/api/2/inf/centos', headers={'X-Auth': self.token})
+            except RuntimeError:
+                pass
+
+        self.assertEqual(self.app.application.celery_app.send_task.call_count, 2)
+
+    def test_get_after_change(self):
+        """CentOSView - GET on /api/2/inf/centos does not share a task from before a create"""
+        self.app.get('/api/2/inf/centos', headers={'X-Auth': self.token})
+        self.app.post('/api/2/inf/centos',
+                      headers={'X-Auth': self.token},
+                      json={'network': "someLAN",
+                            'name': "myCentOSBox",
+                            'image': "someVersion"})
+        self.app.get('/api/2/inf/centos', headers={'X-Auth': self.token})
+
+        self.assertEqual(self.app.application.celery_app.send_task.call_count, 3)
+
+    def test_post_retry(self):
+        """CentOSView - POST on /api/2/inf/centos returns the original task when a request is retried"""
+        for _ in range(2):
+            resp = self.app.post('/api/2/inf/centos',
+                                 headers={'X-Auth': self.token, 'X-REQUEST-ID': 'req-1'},
+                                 json={'network': "someLAN",
+                                       'name': "myCentOSBox",
+                                       'image': "someVersion"})
+
+        _, the_kwargs = self.app.application.celery_app.send_task.call_args
+
+        self.assertEqual(self.app.application.celery_app.send_task.call_count, 1)
+        self.assertEqual(resp.json['content']['task-id'], the_kwargs['task_id'])
+
+    def test_post_retry_send_failed(self):
+        """CentOSView - POST on /api/2/inf/centos sends the task of a retry when the original failed to send"""
+        self.app.application.celery_app.send_task.side_effect = [RuntimeError('broker down'), self.fake_task]
+        for _ in range(2):
+            try:
+                self.app.post('/api/2/inf/centos',
+                              headers={'X-Auth': self.token, 'X-REQUEST-ID': 'req-1'},
+                              json={'network': "someLAN",
+                                    'name': "myCentOSBox",
+                                    'image': "someVersion"})
+            except RuntimeError:
+                pass
+
+        self.assertEqual(self.app.application.celery_app.send_task.call_count, 2)
+
+    def test_post_no_request_id(self):
+        """CentOSView - POST on /api/2/inf/centos never deduplicates requests without an X-REQUEST-ID"""
+        for _ in range(2):
+            self.app.post('/api/2/inf/centos',
+                          headers={'X-Auth': self.token},
+                          json={'network': "someLAN",
+                                'name': "myCentOSBox",
+                                'image': "someVersion"})
+
+        self.assertEqual(self.app.application.celery_app.send_task.call_count, 2)
+
+    def test_delete_retry(self):
+        """CentOSView - DELETE on /api/2/inf/centos does not destroy twice when a request is retried"""
+        for _ in range(2):
+            self.app.delete('/api/2/inf/centos',
+                            headers={'X-Auth': self.token, 'X-REQUEST-ID': 'req-1'},
+                            json={'name': "myCentOSBox"})
+
+        self.assertEqual(self.app.application.celery_app.send_task.call_count, 1)
+
     def test_get_task_link(self):
         """CentOSView - GET on /api/2/inf/centos sets the Link header"""
         resp = self.app.get('/api/2/inf/centos',
@@ -90,6 +240,68 @@ class TestCentOSView(unittest.TestCase):
 
         self.assertEqual(task_id, expected)
 
+    def test_bulk_task(self):
+        """CentOSView - POST on /api/2/inf/centos/bulk returns one task-id for all the VMs"""
+        resp = self.app.post('/api/2/inf/centos/bulk',
+                             headers={'X-Auth': self.token},
+                             json={'machines': [{'network': "someLAN", 'name': "box1", 'image': "7"},
+                                                {'network': "someLAN", 'name': "box2", 'image': "7"}]})
+
+        task_id = resp.json['content']['task-id']
+        expected = 'asdf-asdf-asdf'
+
+        self.assertEqual(task_id, expected)
+
+    def test_bulk_task_args(self):
+        """CentOSView - POST on /api/2/inf/centos/bulk sets defaults, and prefixes the network with the username"""
+        self.app.post('/api/2/inf/centos/bulk',
+                      headers={'X-Auth': self.token},
+                      json={'machines': [{'network': "someLAN", 'name': "box1", 'image': "7"}]})
+
+        the_args, _ = self.app.application.celery_app.send_task.call_args
+        sent_machines = the_args[1][1]
+        expected = [{'name': 'box1', 'image': '7', 'desktop': False, 'ram': 4,
+                     'cpu-count': 4, 'network': 'bob_someLAN'}]
+
+        self.assertEqual(sent_machines, expected)
+
+    def test_bulk_empty(self):
+        """CentOSView - POST on /api/2/inf/centos/bulk requires at least one machine"""
+        resp = self.app.post('/api/2/inf/centos/bulk',
+                             headers={'X-Auth': self.token},
+                             json={'machines': []})
+
+        self.assertEqual(resp.status_code, 400)
+
+    def test_bulk_delete_names(self):
+        """CentOSView - DELETE on /api/2/inf/centos/bulk sends the names of the VMs to destroy"""
+        resp = self.app.delete('/api/2/inf/centos/bulk',
+                               headers={'X-Auth': self.token},
+                               json={'names': ['box1', 'box2']})
+
+        the_args, _ = self.app.application.celery_app.send_task.call_args
+
+        self.assertEqual(resp.status_code, 202)
+        self.assertEqual(the_args, ('centos.bulk_delete', ['bob', ['box1', 'box2'], 'noId']))
+
+    def test_bulk_delete_all(self):
+        """CentOSView - DELETE on /api/2/inf/centos/bulk can destroy every CentOS VM"""
+        self.app.delete('/api/2/inf/centos/bulk',
+                        headers={'X-Auth': self.token},
+                        json={'all': True})
+
+        the_args, _ = self.app.application.celery_app.send_task.call_args
+
+        self.assertEqual(the_args, ('centos.bulk_delete', ['bob', None, 'noId']))
+
+    def test_bulk_delete_ambiguous(self):
+        """CentOSView - DELETE on /api/2/inf/centos/bulk rejects a body that sets both names and all"""
+        resp = self.app.delete('/api/2/inf/centos/bulk',
+                               headers={'X-Auth': self.token},
+                               json={'all': True, 'names': ['box1']})
+
+        self.assertEqual(resp.status_code, 400)
+
     def test_delete_task(self):
         """CentOSView - DELETE on /api/2/inf/centos returns a task-id"""
         resp = self.app.delete('/api/2/inf/centos',
@@ -112,8 +324,10 @@ class TestCentOSView(unittest.TestCase):
 
         self.assertEqual(task_id, expected)
 
-    def test_image(self):
+    @patch.object(centos.images, 'CATALOG')
+    def test_image(self, fake_catalog):
         """CentOSView - GET on the ./image end point returns the a task-id"""
+        fake_catalog.available.return_value = False
         resp = self.app.get('/api/2/inf/centos/image',
                             headers={'X-Auth': self.token})
 
@@ -122,8 +336,10 @@ class TestCentOSView(unittest.TestCase):
 
         self.assertEqual(task_id, expected)
 
-    def test_image(self):
+    @patch.object(centos.images, 'CATALOG')
+    def test_image(self, fake_catalog):
         """CentOSView - GET on the ./image end point returns the a task-id"""
+        fake_catalog.available.return_value = False
         resp = self.app.get('/api/2/inf/centos/image',
                             headers={'X-Auth': self.token})
 
@@ -132,6 +348,49 @@ class TestCentOSView(unittest.TestCase):
 
         self.assertEqual(task_id, expected)
 
+    @patch.object(centos.images, 'CATALOG')
+    def test_image_sync(self, fake_catalog):
+        """CentOSView - GET on the ./image end point returns the images, when the API can see them"""
+        fake_catalog.available.return_value = True
+        fake_catalog.etag = 'abc'
+        fake_catalog.versions.return_value = ['7', '8']
+        resp = self.app.get('/api/2/inf/centos/image',
+                            headers={'X-Auth': self.token})
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.json['content'], {'image': ['7', '8']})
+        self.assertTrue('ETag' in resp.headers)
+        self.assertEqual(resp.headers['Vary'], 'X-Auth')
+        self.assertFalse(self.app.application.celery_app.send_task.called)
+
+    @patch.object(centos.images, 'CATALOG')
+    def test_image_not_modified(self, fake_catalog):
+        """CentOSView - GET on the ./image end point supports If-None-Match"""
+        fake_catalog.available.return_value = True
+        fake_catalog.etag = 'abc'
+        fake_catalog.versions.return_value = ['7', '8']
+        etag = self.app.get('/api/2/inf/centos/image', headers={'X-Auth': self.token}).headers['ETag']
+        fake_catalog.versions.reset_mock()
+        resp = self.app.get('/api/2/inf/centos/image',
+                            headers={'X-Auth': self.token, 'If-None-Match': etag})
+
+        self.assertEqual(resp.status_code, 304)
+        self.assertFalse(fake_catalog.versions.called)
+
+    @patch.object(centos.images, 'CATALOG')
+    def test_image_etag_per_user(self, fake_catalog):
+        """CentOSView - GET on the ./image end point doesn't match the ETag of another user"""
+        fake_catalog.available.return_value = True
+        fake_catalog.etag = 'abc'
+        fake_catalog.versions.return_value = ['7', '8']
+        etag = self.app.get('/api/2/inf/centos/image', headers={'X-Auth': self.token}).headers['ETag']
+        other_token = generate_v2_test_token(username='alice')
+        resp = self.app.get('/api/2/inf/centos/image',
+                            headers={'X-Auth': other_token, 'If-None-Match': etag})
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.json['content'], {'image': ['7', '8']})
+
 
 if __name__ == '__main__':
     unittest.main()
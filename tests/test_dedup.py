@@ -0,0 +1,209 @@
+# -*- coding: UTF-8 -*-
+"""
+A suite of tests for the functions in dedup.py
+"""
+import unittest
+from unittest.mock import patch, MagicMock
+
+from vlab_centos_api.lib import dedup
+
+
+class TestRequestLog(unittest.TestCase):
+    """A set of test cases for the RequestLog object"""
+
+    def test_claim(self):
+        """``RequestLog.claim`` returns the task of an earlier, identical request"""
+        log = dedup.RequestLog()
+        log.claim('alice', 'req-1', 'centos.create', 'task-1')
+
+        self.assertEqual(log.claim('alice', 'req-1', 'centos.create', 'task-2'), 'task-1')
+
+    def test_claim_new(self):
+        """``RequestLog.claim`` returns the given task for a new request"""
+        log = dedup.RequestLog()
+
+        self.assertEqual(log.claim('alice', 'req-1', 'centos.create', 'task-1'), 'task-1')
+
+    def test_claim_keyed(self):
+        """``RequestLog.claim`` does not mix up users or tasks that share a request ID"""
+        log = dedup.RequestLog()
+        log.claim('alice', 'req-1', 'centos.create', 'task-1')
+
+        self.assertEqual(log.claim('bob', 'req-1', 'centos.create', 'task-2'), 'task-2')
+        self.assertEqual(log.claim('alice', 'req-1', 'centos.delete', 'task-3'), 'task-3')
+
+    def test_no_id(self):
+        """``RequestLog`` never deduplicates requests without an X-REQUEST-ID"""
+        log = dedup.RequestLog()
+        log.claim('alice', dedup.NO_ID, 'centos.create', 'task-1')
+
+        self.assertEqual(log.claim('alice', dedup.NO_ID, 'centos.create', 'task-2'), 'task-2')
+
+    @patch.object(dedup.time, 'time')
+    def test_ttl(self, fake_time):
+        """``RequestLog`` forgets requests older than the TTL"""
+        fake_time.return_value = 100
+        log = dedup.RequestLog(ttl=60)
+        log.claim('alice', 'req-1', 'centos.create', 'task-1')
+        fake_time.return_value = 200
+
+        self.assertEqual(log.claim('alice', 'req-1', 'centos.create', 'task-2'), 'task-2')
+
+    def test_max_entries(self):
+        """``RequestLog`` forgets the oldest requests once full"""
+        log = dedup.RequestLog(max_entries=2)
+        for index in range(3):
+            log.claim('alice', 'req-{}'.format(index), 'centos.create', 'task-{}'.format(index))
+
+        self.assertEqual(log.claim('alice', 'req-0', 'centos.create', 'task-3'), 'task-3')
+        self.assertEqual(log.claim('alice', 'req-2', 'centos.create', 'task-4'), 'task-2')
+
+    def test_release(self):
+        """``RequestLog.release`` lets the next identical request send its task"""
+        log = dedup.RequestLog()
+        log.claim('alice', 'req-1', 'centos.create', 'task-1')
+        log.release('alice', 'req-1', 'centos.create')
+
+        self.assertEqual(log.claim('alice', 'req-1', 'centos.create', 'task-2'), 'task-2')
+
+    def test_stats(self):
+        """``RequestLog`` counts the retries it answered"""
+        log = dedup.RequestLog()
+        log.claim('alice', 'req-1', 'centos.create', 'task-1')
+        log.claim('alice', 'req-1', 'centos.create', 'task-2')
+
+        self.assertEqual(log.stats['hits'], 1)
+        self.assertEqual(log.stats['misses'], 1)
+
+    def test_shared(self):
+        """``RequestLog`` claims a request in Redis, with SET NX and the TTL"""
+        client = MagicMock()
+        client.set.return_value = True
+        log = dedup.RequestLog(ttl=60, client=client)
+        owner = log.claim('alice', 'req-1', 'centos.create', 'task-1')
+        _, the_kwargs = client.set.call_args
+
+        self.assertEqual(owner, 'task-1')
+        self.assertEqual(the_kwargs, {'nx': True, 'ex': 60})
+
+    def test_shared_retry(self):
+        """``RequestLog`` returns the task another process claimed the request for"""
+        client = MagicMock()
+        client.set.return_value = None
+        client.get.return_value = b'task-1'
+        log = dedup.RequestLog(client=client)
+
+        self.assertEqual(log.claim('alice', 'req-1', 'centos.create', 'task-2'), 'task-1')
+        self.assertEqual(log.stats['hits'], 1)
+
+    def test_shared_keyed(self):
+        """``RequestLog`` can't be confused by a request ID that looks like part of the key"""
+        client = MagicMock()
+        log = dedup.RequestLog(client=client)
+        log.claim('alice', 'req-1', 'centos.create', 'task-1')
+        log.claim('alice', 'req-1", "centos.create', 'centos.create', 'task-2')
+        first = client.set.call_args_list[0][0][0]
+        second = client.set.call_args_list[1][0][0]
+
+        self.assertNotEqual(first, second)
+
+    def test_shared_down(self):
+        """``RequestLog`` doesn't fail a request when Redis is down; it just isn't deduplicated"""
+        client = MagicMock()
+        client.set.side_effect = dedup.redis.ConnectionError('nope')
+        log = dedup.RequestLog(client=client)
+
+        self.assertEqual(log.claim('alice', 'req-1', 'centos.create', 'task-1'), 'task-1')
+
+    def test_shared_release(self):
+        """``RequestLog.release`` deletes the claim from Redis"""
+        client = MagicMock()
+        log = dedup.RequestLog(client=client)
+        log.release('alice', 'req-1', 'centos.create')
+
+        self.assertTrue(client.delete.called)
+
+    def test_connect(self):
+        """``connect`` makes no client without a URL"""
+        self.assertTrue(dedup.connect('') is None)
+
+
+class TestSingleFlight(unittest.TestCase):
+    """A set of test cases for the SingleFlight object"""
+
+    def test_shared(self):
+        """``SingleFlight.claim`` returns the task sent moments ago"""
+        shows = dedup.SingleFlight(window=2)
+        shows.claim('alice', 'task-1')
+
+        self.assertEqual(shows.claim('alice', 'task-2'), 'task-1')
+        self.assertEqual(shows.stats['hits'], 1)
+
+    def test_other_key(self):
+        """``SingleFlight.claim`` does not share a task between users"""
+        shows = dedup.SingleFlight(window=2)
+        shows.claim('alice', 'task-1')
+
+        self.assertEqual(shows.claim('bob', 'task-2'), 'task-2')
+        self.assertEqual(shows.stats['misses'], 2)
+
+    @patch.object(dedup.time, 'time')
+    def test_window(self, fake_time):
+        """``SingleFlight.claim`` stops sharing a task once the window has passed"""
+        fake_time.return_value = 100
+        shows = dedup.SingleFlight(window=2)
+        shows.claim('alice', 'task-1')
+        fake_time.return_value = 102.5
+
+        self.assertEqual(shows.claim('alice', 'task-2'), 'task-2')
+
+    def test_disabled(self):
+        """``SingleFlight`` never shares a task when the window is zero"""
+        shows = dedup.SingleFlight(window=0)
+        shows.claim('alice', 'task-1')
+
+        self.assertEqual(shows.claim('alice', 'task-2'), 'task-2')
+
+    def test_forget(self):
+        """``SingleFlight.forget`` stops sharing a task"""
+        shows = dedup.SingleFlight(window=2)
+        shows.claim('alice', 'task-1')
+        shows.forget('alice')
+
+        self.assertEqual(shows.claim('alice', 'task-2'), 'task-2')
+
+    def test_shared_redis(self):
+        """``SingleFlight`` shares a task through Redis, for the window"""
+        client = MagicMock()
+        client.set.return_value = None
+        client.get.return_value = b'task-1'
+        shows = dedup.SingleFlight(window=2.5, client=client)
+        owner = shows.claim('alice', 'task-2')
+        _, the_kwargs = client.set.call_args
+
+        self.assertEqual(owner, 'task-1')
+        self.assertEqual(the_kwargs, {'nx': True, 'px': 2500})
+
+    def test_forget_redis(self):
+        """``SingleFlight.forget`` stops sharing the task in every process, by deleting it from Redis"""
+        client = MagicMock()
+        shows = dedup.SingleFlight(client=client)
+        shows.claim('alice', 'task-1')
+        shows.forget('alice')
+        claimed, = client.set.call_args[0][:1]
+
+        client.delete.assert_called_with(claimed)
+
+    def test_redis_down(self):
+        """``SingleFlight`` sends a task of its own when Redis is down"""
+        client = MagicMock()
+        client.set.side_effect = dedup.redis.ConnectionError('nope')
+        client.delete.side_effect = dedup.redis.ConnectionError('nope')
+        shows = dedup.SingleFlight(client=client)
+        shows.forget('alice')
+
+        self.assertEqual(shows.claim('alice', 'task-1'), 'task-1')
+
+
+if __name__ == '__main__':
+    unittest.main()
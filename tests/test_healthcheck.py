@@ -3,7 +3,9 @@
 A suite of tests for the healthcheck API end point
 """
 import unittest
+from unittest.mock import patch, MagicMock
 
+import ujson
 from flask import Flask
 
 from vlab_centos_api.lib.views import healthcheck
@@ -16,6 +18,7 @@ class TestHealthView(unittest.TestCase):
     def setUp(cls):
         """Runs before every test case"""
         app = Flask(__name__)
+        app.celery_app = MagicMock()
         healthcheck.HealthView.register(app)
         app.config['TESTING'] = True
         cls.app = app.test_client()
@@ -28,6 +31,31 @@ class TestHealthView(unittest.TestCase):
 
         self.assertEqual(expected, resp.status_code)
 
+    @patch.object(healthcheck.pkg_resources, 'get_distribution')
+    def test_health_check_cached(self, fake_get_distribution):
+        """The health check doesn't look up the version on every request"""
+        resp = self.app.get('/api/1/inf/centos/healthcheck')
+
+        self.assertEqual(ujson.loads(resp.data), {'version': healthcheck.VERSION})
+        self.assertFalse(fake_get_distribution.called)
+
+    @patch.object(healthcheck.readiness, 'READINESS')
+    def test_ready(self, fake_READINESS):
+        """The /ready end point returns 200 when every check is OK"""
+        fake_READINESS.report.return_value = (True, {'broker': {'ok': True}})
+        resp = self.app.get('/api/1/inf/centos/healthcheck/ready')
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(ujson.loads(resp.data)['checks'], {'broker': {'ok': True}})
+
+    @patch.object(healthcheck.readiness, 'READINESS')
+    def test_not_ready(self, fake_READINESS):
+        """The /ready end point returns 503 when a check is not OK"""
+        fake_READINESS.report.return_value = (False, {'broker': {'ok': False}})
+        resp = self.app.get('/api/1/inf/centos/healthcheck/ready')
+
+        self.assertEqual(resp.status_code, 503)
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,245 @@
+# -*- coding: UTF-8 -*-
+"""
+A suite of tests for the functions in images.py
+"""
+import os
+import time
+import shutil
+import tempfile
+import unittest
+from unittest.mock import patch
+
+from vlab_centos_api.lib import images
+
+
+class TestParseName(unittest.TestCase):
+    """A set of test cases for the ``parse_name`` function"""
+
+    def test_parse_name(self):
+        """``parse_name`` extracts the version from the name of an OVA"""
+        self.assertEqual(images.parse_name('CentOS-8.1.ova'), ('8.1', False))
+
+    def test_parse_name_desktop(self):
+        """``parse_name`` detects the variant with a GUI"""
+        self.assertEqual(images.parse_name('CentOS-desktop-7.ova'), ('7', True))
+
+    def test_parse_name_other(self):
+        """``parse_name`` returns None for files that are not CentOS OVAs"""
+        self.assertTrue(images.parse_name('notes.txt') is None)
+
+
+class TestImageCatalog(unittest.TestCase):
+    """A set of test cases for the ImageCatalog object"""
+
+    def setUp(self):
+        """Runs before every test case"""
+        self.images_dir = tempfile.mkdtemp()
+        for name in ('CentOS-7.ova', 'CentOS-desktop-7.ova', 'CentOS-8.ova', 'README'):
+            with open(os.path.join(self.images_dir, name), 'w') as the_file:
+                the_file.write('data')
+        self.catalog = images.ImageCatalog(self.images_dir, check_interval=60)
+
+    def tearDown(self):
+        """Runs after every test case"""
+        shutil.rmtree(self.images_dir)
+
+    def test_versions(self):
+        """``ImageCatalog`` - ``versions`` lists every version once"""
+        self.assertEqual(self.catalog.versions(), ['7', '8'])
+
+    def test_lookup(self):
+        """``ImageCatalog`` - ``lookup`` returns the path and size of the OVA"""
+        output = self.catalog.lookup('7', True)
+
+        self.assertEqual(output['path'], os.path.join(self.images_dir, 'CentOS-desktop-7.ova'))
+        self.assertEqual(output['size'], 4)
+
+    def test_lookup_missing(self):
+        """``ImageCatalog`` - ``lookup`` returns None for an image that doesn't exist"""
+        self.assertTrue(self.catalog.lookup('8', True) is None)
+
+    def test_no_directory(self):
+        """``ImageCatalog`` - an images directory that doesn't exist has no images"""
+        catalog = images.ImageCatalog('/no/such/dir')
+
+        self.assertEqual(catalog.versions(), [])
+        self.assertFalse(catalog.available())
+
+    def test_etag(self):
+        """``ImageCatalog`` - the etag changes when the versions change"""
+        before = self.catalog.etag
+        os.remove(os.path.join(self.images_dir, 'CentOS-8.ova'))
+        self.catalog.invalidate()
+
+        self.assertNotEqual(self.catalog.etag, before)
+
+    def test_cached(self):
+        """``ImageCatalog`` - does not look at the directory again until the check interval passes"""
+        self.catalog.versions()
+        with patch.object(images.os, 'stat') as fake_stat:
+            self.catalog.lookup('7', False)
+
+        self.assertFalse(fake_stat.called)
+
+    def test_unchanged(self):
+        """``ImageCatalog`` - does not rescan when the directory has not changed"""
+        self.catalog.versions()
+        self.catalog._checked_at = 0
+        with patch.object(images.os, 'scandir') as fake_scandir:
+            self.catalog.versions()
+
+        self.assertFalse(fake_scandir.called)
+
+    def test_invalidate(self):
+        """``ImageCatalog`` - ``invalidate`` picks up new OVAs on the next lookup"""
+        self.catalog.versions()
+        with open(os.path.join(self.images_dir, 'CentOS-9.ova'), 'w') as the_file:
+            the_file.write('data')
+        self.catalog.invalidate()
+
+        self.assertEqual(self.catalog.versions(), ['7', '8', '9'])
+
+    def test_replaced_in_place(self):
+        """``ImageCatalog`` - notices an OVA that was overwritten, though the directory didn't change"""
+        self.catalog.versions()
+        with open(os.path.join(self.images_dir, 'CentOS-7.ova'), 'w') as the_file:
+            the_file.write('new data')
+        self.catalog._checked_at = 0
+
+        self.assertEqual(self.catalog.lookup('7', False)['size'], 8)
+
+    def test_removed_unnoticed(self):
+        """``ImageCatalog`` - rescans when a known OVA is gone, though the directory mtime didn't change"""
+        self.catalog.versions()
+        os.remove(os.path.join(self.images_dir, 'CentOS-8.ova'))
+        # like an NFS client that hasn't seen the directory change yet
+        self.catalog._dir_mtime = os.stat(self.images_dir).st_mtime
+        self.catalog._checked_at = 0
+
+        self.assertEqual(self.catalog.versions(), ['7'])
+
+    def test_nfs_error(self):
+        """``ImageCatalog`` - keeps the last good index when the directory can't be read"""
+        self.catalog.versions()
+        self.catalog._checked_at = 0
+        with patch.object(images.os, 'stat') as fake_stat:
+            fake_stat.side_effect = OSError('Stale file handle')
+            output = self.catalog.lookup('7', False)
+
+        self.assertEqual(output['size'], 4)
+        self.assertEqual(self.catalog.health()['error'], 'Stale file handle')
+
+    def test_nfs_recovers(self):
+        """``ImageCatalog`` - forgets the error once the directory can be read again"""
+        self.catalog._checked_at = 0
+        with patch.object(images.os, 'stat') as fake_stat:
+            fake_stat.side_effect = OSError('Stale file handle')
+            self.catalog.versions()
+        self.catalog._checked_at = 0
+        self.catalog.versions()
+
+        self.assertTrue(self.catalog.health()['ok'])
+
+    def test_health(self):
+        """``ImageCatalog`` - ``health`` reports a current catalog as OK"""
+        self.catalog.versions()
+        output = self.catalog.health()
+
+        self.assertTrue(output['ok'])
+        self.assertTrue(output['mounted'])
+        self.assertEqual(output['versions'], 2)
+
+    def test_health_not_mounted(self):
+        """``ImageCatalog`` - ``health`` is OK without the images mounted"""
+        catalog = images.ImageCatalog('/no/such/dir')
+        catalog.versions()
+        output = catalog.health()
+
+        self.assertTrue(output['ok'])
+        self.assertFalse(output['mounted'])
+
+    def test_health_stale(self):
+        """``ImageCatalog`` - ``health`` is not OK when the directory can't be read"""
+        self.catalog.versions()
+        self.catalog._synced_at -= 600
+        self.catalog._checked_at = 0
+        with patch.object(images.os, 'stat') as fake_stat:
+            fake_stat.side_effect = OSError('Stale file handle')
+            self.catalog.versions()
+        output = self.catalog.health()
+
+        self.assertFalse(output['ok'])
+        self.assertEqual(output['error'], 'Stale file handle')
+
+    def test_health_no_io(self):
+        """``ImageCatalog`` - ``health`` reports the last look at the directory, without looking again"""
+        self.catalog.versions()
+        self.catalog._checked_at = 0
+        with patch.object(images.os, 'stat') as fake_stat:
+            self.catalog.health()
+
+        self.assertFalse(fake_stat.called)
+
+    def test_health_never_checked(self):
+        """``ImageCatalog`` - ``health`` is not OK before the directory has been looked at"""
+        self.assertFalse(self.catalog.health()['ok'])
+
+    def test_refresher_readers_no_io(self):
+        """``ImageCatalog`` - readers never look at the directory once the refresher is running"""
+        self.catalog.versions()
+        self.catalog._checked_at = 0
+        with patch.object(self.catalog, '_managed', return_value=True):
+            with patch.object(images.os, 'stat') as fake_stat:
+                self.catalog.versions()
+                self.catalog.lookup('7', False)
+                self.catalog.available()
+                self.catalog.etag
+
+        self.assertFalse(fake_stat.called)
+
+    def test_readers_dont_wait(self):
+        """``ImageCatalog`` - readers serve the last index, instead of waiting on a slow look at the directory"""
+        self.catalog.versions()
+        self.catalog._checked_at -= 600
+        self.catalog._io_lock.acquire()
+        try:
+            started = time.time()
+            output = self.catalog.versions()
+            waited = time.time() - started
+        finally:
+            self.catalog._io_lock.release()
+
+        self.assertEqual(output, ['7', '8'])
+        self.assertTrue(waited < 1)
+
+    def test_refresh_outside_lock(self):
+        """``ImageCatalog`` - looking at the directory doesn't hold the lock that ``health`` needs"""
+        self.catalog.versions()
+        held = []
+        real_stat = os.stat
+        def fake_stat(path, *args, **kwargs):
+            held.append(self.catalog._lock.locked())
+            return real_stat(path, *args, **kwargs)
+        with patch.object(images.os, 'stat', side_effect=fake_stat):
+            self.catalog._refresh(force=True)
+
+        self.assertEqual(held, [False] * len(held))
+        self.assertTrue(held)
+
+    def test_invalidate_during_refresh(self):
+        """``ImageCatalog`` - an invalidate while looking at the directory isn't lost"""
+        self.catalog.versions()
+        real_scan = self.catalog._scan
+        def scan():
+            self.catalog.invalidate()
+            return real_scan()
+        self.catalog._dir_mtime = None
+        with patch.object(self.catalog, '_scan', side_effect=scan):
+            self.catalog._refresh(force=True)
+
+        self.assertEqual(self.catalog._checked_at, 0)
+        self.assertTrue(self.catalog._dir_mtime is None)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,131 @@
+# -*- coding: UTF-8 -*-
+"""
+A suite of tests for the functions in inventory.py
+"""
+import unittest
+from unittest.mock import patch, MagicMock
+
+import ujson
+
+from vlab_centos_api.lib.worker import inventory
+
+
+def make_content(obj, **props):
+    """Build a PropertyCollector ObjectContent, like vCenter returns"""
+    content = MagicMock()
+    content.obj = obj
+    content.propSet = []
+    for name, val in props.items():
+        prop = MagicMock()
+        prop.name = name
+        prop.val = val
+        content.propSet.append(prop)
+    return content
+
+
+class TestInventory(unittest.TestCase):
+    """A set of test cases for the inventory.py module"""
+
+    def setUp(self):
+        """Runs before every test case"""
+        self.folder = inventory.vim.Folder('group-1')
+        self.network = inventory.vim.Network('network-1')
+        nic = MagicMock()
+        nic.ipAddress = ['192.168.1.2', 'fe80::1']
+        meta = {'component': 'CentOS', 'created': 1234, 'version': '7',
+                'configured': False, 'generation': 1}
+        centos = make_content(inventory.vim.VirtualMachine('vm-1'),
+                              **{'name': 'myCentOS',
+                                 'runtime.powerState': 'poweredOn',
+                                 'config.annotation': ujson.dumps(meta),
+                                 'guest.net': [nic],
+                                 'network': [self.network]})
+        other = make_content(inventory.vim.VirtualMachine('vm-2'),
+                             **{'name': 'myWindows',
+                                'runtime.powerState': 'poweredOn',
+                                'config.annotation': '{"component": "Windows"}'})
+        net = make_content(self.network, name='alice_frontend')
+        self.vcenter = MagicMock()
+        self.vcenter.content.propertyCollector.RetrieveContents.return_value = [centos, other, net]
+
+    @patch.object(inventory, 'ConsoleUrl')
+    def test_get_vms(self, fake_ConsoleUrl):
+        """``get_vms`` returns the same info as ``virtual_machine.get_info``"""
+        fake_ConsoleUrl.return_value.make.return_value = 'https://some-console'
+
+        output = inventory.get_vms(self.vcenter, self.folder, 'alice')
+        expected = {'myCentOS': {'state': 'poweredOn',
+                                 'console': 'https://some-console',
+                                 'ips': ['192.168.1.2'],
+                                 'networks': ['frontend'],
+                                 'moid': 'vm-1',
+                                 'meta': {'component': 'CentOS', 'created': 1234, 'version': '7',
+                                          'configured': False, 'generation': 1}}}
+
+        self.assertEqual(output, expected)
+
+    @patch.object(inventory, 'ConsoleUrl')
+    def test_get_vms_one_call(self, fake_ConsoleUrl):
+        """``get_vms`` makes a single RetrieveContents call no matter how many VMs exist"""
+        inventory.get_vms(self.vcenter, self.folder, 'alice')
+
+        self.assertEqual(self.vcenter.content.propertyCollector.RetrieveContents.call_count, 1)
+
+    @patch.object(inventory, 'ConsoleUrl')
+    def test_get_vms_none(self, fake_ConsoleUrl):
+        """``get_vms`` skips the console lookups when there are no matching VMs"""
+        output = inventory.get_vms(self.vcenter, self.folder, 'alice', component='IIQ')
+
+        self.assertEqual(output, {})
+        self.assertFalse(fake_ConsoleUrl.called)
+
+    def test_find_vm(self):
+        """``find_vm`` returns the VM and its power state & meta data"""
+        the_vm = inventory.vim.VirtualMachine('vm-1')
+        self.vcenter.content.searchIndex.FindChild.return_value = the_vm
+        self.vcenter.content.propertyCollector.RetrieveContents.return_value = [
+            make_content(the_vm, **{'runtime.powerState': 'poweredOff',
+                                    'config.annotation': '{"component": "CentOS"}'})]
+
+        found_vm, info = inventory.find_vm(self.vcenter, self.folder, 'myCentOS')
+
+        self.assertTrue(found_vm is the_vm)
+        self.assertEqual(info['state'], 'poweredOff')
+        self.assertEqual(info['meta']['component'], 'CentOS')
+
+    def test_find_vm_missing(self):
+        """``find_vm`` returns None when the folder has no child by that name"""
+        self.vcenter.content.searchIndex.FindChild.return_value = None
+
+        output = inventory.find_vm(self.vcenter, self.folder, 'myCentOS')
+
+        self.assertTrue(output is None)
+        self.assertFalse(self.vcenter.content.propertyCollector.RetrieveContents.called)
+
+    def test_find_vm_other_component(self):
+        """``find_vm`` returns None when the VM belongs to a different component"""
+        the_vm = inventory.vim.VirtualMachine('vm-2')
+        self.vcenter.content.searchIndex.FindChild.return_value = the_vm
+        self.vcenter.content.propertyCollector.RetrieveContents.return_value = [
+            make_content(the_vm, **{'runtime.powerState': 'poweredOn',
+                                    'config.annotation': '{"component": "Windows"}'})]
+
+        output = inventory.find_vm(self.vcenter, self.folder, 'myWindows')
+
+        self.assertTrue(output is None)
+
+    def test_parse_meta_missing(self):
+        """``parse_meta`` returns the 'Unknown' meta data when the VM has no notes"""
+        output = inventory.parse_meta(None)
+
+        self.assertEqual(output['component'], 'Unknown')
+
+    def test_parse_meta_not_json(self):
+        """``parse_meta`` returns the 'Unknown' meta data when the notes are not JSON"""
+        output = inventory.parse_meta('some notes')
+
+        self.assertEqual(output['component'], 'Unknown')
+
+
+if __name__ == '__main__':
+    unittest.main()
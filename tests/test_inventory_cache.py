@@ -0,0 +1,140 @@
+# -*- coding: UTF-8 -*-
+"""
+A suite of tests for the functions in inventory_cache.py
+"""
+import unittest
+from unittest.mock import patch, MagicMock
+
+from vlab_centos_api.lib.worker import inventory_cache
+
+
+def make_update(*object_updates):
+    """Build a WaitForUpdatesEx UpdateSet, like vCenter returns"""
+    update = MagicMock()
+    update.truncated = False
+    filter_update = MagicMock()
+    filter_update.objectSet = list(object_updates)
+    update.filterSet = [filter_update]
+    return update
+
+
+def make_object_update(obj, kind='enter', **props):
+    """Build one ObjectUpdate of an UpdateSet"""
+    object_update = MagicMock()
+    object_update.obj = obj
+    object_update.kind = kind
+    object_update.changeSet = []
+    for name, val in props.items():
+        change = MagicMock()
+        change.name = name
+        change.op = 'assign'
+        change.val = val
+        object_update.changeSet.append(change)
+    return object_update
+
+
+class TestInventoryCache(unittest.TestCase):
+    """A set of test cases for the InventoryCache object"""
+
+    def setUp(self):
+        """Runs before every test case"""
+        self.cache = inventory_cache.InventoryCache()
+        self.cache._ensure_started = MagicMock()
+        self.folder = inventory_cache.vim.Folder('group-1')
+        self.vm = inventory_cache.vim.VirtualMachine('vm-1')
+        self.network = inventory_cache.vim.Network('network-1')
+        update = make_update(make_object_update(self.folder, name='alice'),
+                             make_object_update(self.vm, **{'name': 'myCentOS',
+                                                            'parent': self.folder,
+                                                            'network': [self.network],
+                                                            'runtime.powerState': 'poweredOn'}),
+                             make_object_update(self.network, name='alice_frontend'))
+        self.cache._apply(update)
+        self.cache._connected = True
+        self.cache._synced_at = inventory_cache.time.time()
+
+    def test_lookup(self):
+        """``InventoryCache`` - ``lookup`` returns the VMs in the user's folder"""
+        vms, network_names = self.cache.lookup('alice')
+
+        self.assertEqual(vms[self.vm]['name'], 'myCentOS')
+        self.assertEqual(network_names, {self.network: 'alice_frontend'})
+
+    def test_lookup_unknown_user(self):
+        """``InventoryCache`` - ``lookup`` returns None for a folder it doesn't know about"""
+        self.assertTrue(self.cache.lookup('bob') is None)
+
+    def test_lookup_disconnected(self):
+        """``InventoryCache`` - ``lookup`` returns None when the listener is not connected"""
+        self.cache._connected = False
+
+        self.assertTrue(self.cache.lookup('alice') is None)
+
+    def test_lookup_stale(self):
+        """``InventoryCache`` - ``lookup`` returns None when the cache is too old"""
+        self.cache._synced_at = 0
+
+        self.assertTrue(self.cache.lookup('alice') is None)
+
+    def test_lookup_disabled(self):
+        """``InventoryCache`` - ``lookup`` always returns None when disabled"""
+        cache = inventory_cache.InventoryCache(enabled=False)
+
+        self.assertTrue(cache.lookup('alice') is None)
+
+    def test_invalidate(self):
+        """``InventoryCache`` - ``invalidate`` stops the user's VMs from being served until the next sync"""
+        self.cache._synced_at = inventory_cache.time.time() - 1
+        self.cache.invalidate('alice')
+
+        self.assertTrue(self.cache.lookup('alice') is None)
+
+    def test_leave(self):
+        """``InventoryCache`` - VMs that vCenter reports as gone are removed from the cache"""
+        self.cache._apply(make_update(make_object_update(self.vm, kind='leave')))
+        vms, _ = self.cache.lookup('alice')
+
+        self.assertEqual(vms, {})
+
+    def test_modify(self):
+        """``InventoryCache`` - changes to a VM are merged into the cache"""
+        self.cache._apply(make_update(make_object_update(self.vm, kind='modify',
+                                                         **{'runtime.powerState': 'poweredOff'})))
+        vms, _ = self.cache.lookup('alice')
+
+        self.assertEqual(vms[self.vm]['state'], 'poweredOff')
+        self.assertEqual(vms[self.vm]['name'], 'myCentOS')
+
+    def test_modify_network(self):
+        """``InventoryCache`` - a VM that loses one of its networks keeps the others"""
+        other_network = inventory_cache.vim.Network('network-2')
+        self.cache._apply(make_update(make_object_update(other_network, name='alice_backend'),
+                                      make_object_update(self.vm, kind='modify',
+                                                         network=[self.network, other_network])))
+        self.cache._apply(make_update(make_object_update(self.vm, kind='modify', network=[other_network])))
+        _, network_names = self.cache.lookup('alice')
+
+        self.assertEqual(network_names, {other_network: 'alice_backend'})
+
+    def test_unset(self):
+        """``InventoryCache`` - a property vCenter reports as removed is dropped"""
+        object_update = make_object_update(self.vm, kind='modify', network=None)
+        object_update.changeSet[0].op = 'remove'
+        self.cache._apply(make_update(object_update))
+        _, network_names = self.cache.lookup('alice')
+
+        self.assertEqual(network_names, {})
+
+    def test_full_updates(self):
+        """``InventoryCache`` - the listener asks vCenter for whole property values, not partial updates"""
+        self.cache._stop.set()
+        vcenter = MagicMock()
+        collector = vcenter.content.propertyCollector.CreatePropertyCollector.return_value
+        with patch.object(inventory_cache, '_top_folder_filter_spec'):
+            self.cache._follow(vcenter)
+
+        self.assertEqual(collector.CreateFilter.call_args[1], {'partialUpdates': False})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,170 @@
+# -*- coding: UTF-8 -*-
+"""
+A suite of tests for the functions in lookup_index.py
+"""
+import unittest
+from unittest.mock import patch, MagicMock, PropertyMock
+
+from vlab_centos_api.lib.worker import lookup_index
+
+
+def make_result(obj, name):
+    """Build one ObjectContent of a RetrieveContents call"""
+    result = MagicMock()
+    result.obj = obj
+    prop = MagicMock()
+    prop.val = name
+    result.propSet = [prop]
+    return result
+
+
+class TestLookupIndex(unittest.TestCase):
+    """A set of test cases for the LookupIndex object"""
+
+    def setUp(self):
+        """Runs before every test case"""
+        self.vcenter = MagicMock()
+        self.vcenter.get_vm_folder.return_value = lookup_index.vim.Folder('group-1')
+        self.retrieve = self.vcenter.content.propertyCollector.RetrieveContents
+        self.retrieve.return_value = [make_result(lookup_index.vim.Folder('group-2'), 'alice'),
+                                      make_result(lookup_index.vim.Network('network-1'), 'alice_frontend')]
+        self.index = lookup_index.LookupIndex(ttl=300)
+
+    @patch.object(lookup_index, '_view_filter_spec')
+    def test_folder(self, fake_view_filter_spec):
+        """``LookupIndex`` - ``folder`` returns the user's folder"""
+        folder = self.index.folder(self.vcenter, 'alice')
+
+        self.assertEqual(folder._moId, 'group-2')
+        self.assertTrue(isinstance(folder, lookup_index.vim.Folder))
+
+    @patch.object(lookup_index, '_view_filter_spec')
+    def test_network(self, fake_view_filter_spec):
+        """``LookupIndex`` - ``network`` returns the network"""
+        network = self.index.network(self.vcenter, 'alice_frontend')
+
+        self.assertEqual(network._moId, 'network-1')
+
+    @patch.object(lookup_index, '_view_filter_spec')
+    def test_bound_to_session(self, fake_view_filter_spec):
+        """``LookupIndex`` - the objects returned use the session of the caller"""
+        other_vcenter = MagicMock()
+        self.index.folder(self.vcenter, 'alice')
+        folder = self.index.folder(other_vcenter, 'alice')
+
+        self.assertTrue(folder._stub is other_vcenter.content.rootFolder._stub)
+
+    def test_stub_remembered(self):
+        """``bind`` only asks a session for its stub once"""
+        vcenter = MagicMock()
+        content = PropertyMock(return_value=MagicMock())
+        type(vcenter).content = content
+        first = lookup_index.bind(vcenter, (lookup_index.vim.Folder, 'group-1'))
+        second = lookup_index.bind(vcenter, (lookup_index.vim.Folder, 'group-2'))
+
+        self.assertEqual(content.call_count, 1)
+        self.assertTrue(first._stub is second._stub)
+
+    @patch.object(lookup_index, '_view_filter_spec')
+    def test_cached(self, fake_view_filter_spec):
+        """``LookupIndex`` - lookups within the TTL do not talk to vCenter"""
+        self.index.folder(self.vcenter, 'alice')
+        self.index.network(self.vcenter, 'alice_frontend')
+        self.index.networks(self.vcenter)
+
+        self.assertEqual(self.retrieve.call_count, 1)
+
+    @patch.object(lookup_index, '_view_filter_spec')
+    def test_expired(self, fake_view_filter_spec):
+        """``LookupIndex`` - the index is rebuilt once it's older than the TTL"""
+        self.index.folder(self.vcenter, 'alice')
+        self.index._refreshed_at -= 301
+        self.index.folder(self.vcenter, 'alice')
+
+        self.assertEqual(self.retrieve.call_count, 2)
+
+    @patch.object(lookup_index, '_view_filter_spec')
+    def test_miss_refresh(self, fake_view_filter_spec):
+        """``LookupIndex`` - a missing name triggers a refresh, so new folders are found"""
+        self.index.folder(self.vcenter, 'alice')
+        self.index._refreshed_at -= lookup_index.MISS_REFRESH + 1
+        self.retrieve.return_value = [make_result(lookup_index.vim.Folder('group-3'), 'bob')]
+
+        folder = self.index.folder(self.vcenter, 'bob')
+
+        self.assertEqual(folder._moId, 'group-3')
+
+    @patch.object(lookup_index, '_view_filter_spec')
+    def test_missing(self, fake_view_filter_spec):
+        """``LookupIndex`` - raises ValueError for a missing folder, and KeyError for a missing network"""
+        with self.assertRaises(ValueError):
+            self.index.folder(self.vcenter, 'bob')
+        with self.assertRaises(KeyError):
+            self.index.network(self.vcenter, 'bob_frontend')
+
+    def names(self, **names):
+        """Make vCenter answer a read of ``name`` for the moIds supplied; any other moId is gone"""
+        def invoke_accessor(the_object, info):
+            if the_object._moId not in names:
+                raise lookup_index.vmodl.fault.ManagedObjectNotFound()
+            return names[the_object._moId]
+        self.vcenter.content.rootFolder._stub.InvokeAccessor.side_effect = invoke_accessor
+
+    @patch.object(lookup_index, '_view_filter_spec')
+    def test_recreated(self, fake_view_filter_spec):
+        """``LookupIndex`` - a folder that was deleted and made again is found by its new moId"""
+        self.index.folder(self.vcenter, 'alice')
+        self.index._refreshed_at -= lookup_index.MISS_REFRESH + 1
+        self.names(**{'group-9': 'alice'})
+        self.retrieve.return_value = [make_result(lookup_index.vim.Folder('group-9'), 'alice')]
+
+        folder = self.index.folder(self.vcenter, 'alice')
+
+        self.assertEqual(folder._moId, 'group-9')
+
+    @patch.object(lookup_index, '_view_filter_spec')
+    def test_deleted(self, fake_view_filter_spec):
+        """``LookupIndex`` - a network that was deleted isn't handed out"""
+        self.index.network(self.vcenter, 'alice_frontend')
+        self.index._refreshed_at -= lookup_index.MISS_REFRESH + 1
+        self.names()
+        self.retrieve.return_value = []
+
+        with self.assertRaises(KeyError):
+            self.index.network(self.vcenter, 'alice_frontend')
+
+    @patch.object(lookup_index, '_view_filter_spec')
+    def test_renamed(self, fake_view_filter_spec):
+        """``LookupIndex`` - an object that now has another name isn't handed out for the old one"""
+        self.index.folder(self.vcenter, 'alice')
+        self.index._refreshed_at -= lookup_index.MISS_REFRESH + 1
+        self.names(**{'group-2': 'bob'})
+        self.retrieve.return_value = [make_result(lookup_index.vim.Folder('group-2'), 'bob')]
+
+        with self.assertRaises(ValueError):
+            self.index.folder(self.vcenter, 'alice')
+
+    @patch.object(lookup_index, '_view_filter_spec')
+    def test_still_current(self, fake_view_filter_spec):
+        """``LookupIndex`` - checking that an object still exists doesn't rebuild the index"""
+        self.index.folder(self.vcenter, 'alice')
+        self.index._refreshed_at -= lookup_index.MISS_REFRESH + 1
+        self.names(**{'group-2': 'alice'})
+
+        folder = self.index.folder(self.vcenter, 'alice')
+
+        self.assertEqual(folder._moId, 'group-2')
+        self.assertEqual(self.retrieve.call_count, 1)
+
+    @patch.object(lookup_index, '_view_filter_spec')
+    def test_invalidate(self, fake_view_filter_spec):
+        """``LookupIndex`` - ``invalidate`` rebuilds the index on the next lookup"""
+        self.index.folder(self.vcenter, 'alice')
+        self.index.invalidate()
+        self.index.folder(self.vcenter, 'alice')
+
+        self.assertEqual(self.retrieve.call_count, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
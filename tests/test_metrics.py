@@ -0,0 +1,237 @@
+# -*- coding: UTF-8 -*-
+"""
+A suite of tests for the functions in metrics.py
+"""
+import os
+import time
+import tempfile
+import unittest
+import collections
+from unittest.mock import patch, MagicMock
+
+from flask import Flask
+
+from vlab_centos_api.lib import metrics
+
+
+def sample(name, **labels):
+    """The current value of a metric, or zero if it's never been recorded"""
+    return metrics.REGISTRY.get_sample_value(name, labels) or 0
+
+
+class TestPhases(unittest.TestCase):
+    """A set of test cases for the Phases object"""
+
+    @patch.object(metrics, 'time')
+    def test_done(self, fake_time):
+        """``Phases.done`` returns how long since the last phase ended"""
+        fake_time.time.side_effect = [100, 103, 110]
+        phases = metrics.Phases('testing')
+
+        first = phases.done('one')
+        second = phases.done('two')
+
+        self.assertEqual((first, second), (3, 7))
+
+    def test_done_observed(self):
+        """``Phases.done`` records the phase in the histogram"""
+        before = sample('centos_phase_seconds_count', operation='testing', phase='observed')
+
+        metrics.Phases('testing').done('observed')
+        after = sample('centos_phase_seconds_count', operation='testing', phase='observed')
+
+        self.assertEqual(after - before, 1)
+
+    @patch.object(metrics, 'time')
+    def test_str(self, fake_time):
+        """``Phases`` renders every phase, in order, for logging"""
+        fake_time.time.side_effect = [100, 101.5, 103]
+        phases = metrics.Phases('testing')
+        phases.done('deploy')
+        phases.done('power_on')
+
+        self.assertEqual('{}'.format(phases), 'deploy 1.5s, power_on 1.5s')
+
+    def test_phase(self):
+        """``phase`` records the time spent in the ``with`` block"""
+        before = sample('centos_phase_seconds_count', operation='testing', phase='block')
+
+        with metrics.phase('testing', 'block'):
+            pass
+        after = sample('centos_phase_seconds_count', operation='testing', phase='block')
+
+        self.assertEqual(after - before, 1)
+
+
+class TestInstrument(unittest.TestCase):
+    """A set of test cases for the ``instrument`` function"""
+
+    def test_counts_calls(self):
+        """``instrument`` counts every SOAP call made by a session"""
+        service_instance = MagicMock()
+        info = MagicMock()
+        info.name = 'testingCall'
+        before = sample('centos_vcenter_calls_total', call='testingCall')
+
+        metrics.instrument(service_instance)
+        service_instance._stub.InvokeMethod('someMo', info, ())
+        service_instance._stub.InvokeMethod('someMo', info, ())
+        after = sample('centos_vcenter_calls_total', call='testingCall')
+
+        self.assertEqual(after - before, 2)
+
+    def test_passes_through(self):
+        """``instrument`` still makes the call, and returns what it returned"""
+        service_instance = MagicMock()
+        invoke = service_instance._stub.InvokeMethod
+        invoke.return_value = 'someResult'
+        info = MagicMock()
+        info.name = 'testingCall'
+
+        metrics.instrument(service_instance)
+        output = service_instance._stub.InvokeMethod('someMo', info, ('arg',))
+
+        invoke.assert_called_with('someMo', info, ('arg',))
+        self.assertEqual(output, 'someResult')
+
+
+class TestTaskMetrics(unittest.TestCase):
+    """A set of test cases for the task timing functions"""
+
+    def test_task_sent(self):
+        """``task_sent`` stamps the message headers with when it was sent"""
+        headers = {}
+
+        metrics.task_sent('centos.testing', headers)
+
+        self.assertTrue(isinstance(headers['sent_at'], float))
+
+    @patch.object(metrics, 'time')
+    def test_task_started(self, fake_time):
+        """``task_started`` records how long the task was queued"""
+        fake_time.time.return_value = 110
+        before = sample('centos_task_queue_seconds_sum', task='centos.queued')
+
+        metrics.task_started('centos.queued', 100)
+        after = sample('centos_task_queue_seconds_sum', task='centos.queued')
+
+        self.assertEqual(after - before, 10)
+
+    @patch.object(metrics, 'time')
+    def test_task_started_eta(self, fake_time):
+        """``task_started`` does not count a countdown as time queued"""
+        fake_time.time.return_value = 110
+        before = sample('centos_task_queue_seconds_sum', task='centos.eta')
+
+        metrics.task_started('centos.eta', 100, eta=108)
+        after = sample('centos_task_queue_seconds_sum', task='centos.eta')
+
+        self.assertEqual(after - before, 2)
+
+    def test_task_started_unknown(self):
+        """``task_started`` ignores tasks that were sent without a timestamp"""
+        before = sample('centos_task_queue_seconds_count', task='centos.unknown')
+
+        metrics.task_started('centos.unknown', None)
+        after = sample('centos_task_queue_seconds_count', task='centos.unknown')
+
+        self.assertEqual(after, before)
+
+    def test_task_finished(self):
+        """``task_finished`` records how long the task ran, by how it ended"""
+        before = sample('centos_task_run_seconds_count', task='centos.testing', state='SUCCESS')
+
+        metrics.task_finished('centos.testing', time.time(), 'SUCCESS')
+        after = sample('centos_task_run_seconds_count', task='centos.testing', state='SUCCESS')
+
+        self.assertEqual(after - before, 1)
+
+
+class TestExposition(unittest.TestCase):
+    """A set of test cases for serving the metrics"""
+
+    def test_cache_collector(self):
+        """``CacheCollector`` reports the hits and misses of each cache"""
+        stats = collections.Counter(hits=3, misses=1)
+        collector = metrics.CacheCollector({'testing': lambda: stats})
+
+        family = list(collector.collect())[0]
+        found = {(x.labels['cache'], x.labels['outcome']): x.value for x in family.samples if x.name.endswith('_total')}
+
+        self.assertEqual(found, {('testing', 'hits'): 3, ('testing', 'misses'): 1})
+
+    def test_exposition(self):
+        """``exposition`` renders the metrics in the Prometheus text format"""
+        body, content_type = metrics.exposition()
+
+        self.assertTrue(b'centos_phase_seconds' in body)
+        self.assertTrue(content_type.startswith('text/plain'))
+
+    @patch.dict(metrics.os.environ, {'PROMETHEUS_MULTIPROC_DIR': '/tmp/testing'})
+    @patch.object(metrics.multiprocess, 'MultiProcessCollector')
+    def test_registry_multiprocess(self, fake_MultiProcessCollector):
+        """``registry`` collects from every process when PROMETHEUS_MULTIPROC_DIR is set"""
+        the_registry = metrics.registry()
+
+        self.assertFalse(the_registry is metrics.REGISTRY)
+        fake_MultiProcessCollector.assert_called_with(the_registry)
+
+    @patch.object(metrics, 'start_http_server')
+    def test_serve_disabled(self, fake_start_http_server):
+        """``serve`` does nothing when the port is zero"""
+        metrics.serve(0)
+
+        self.assertFalse(fake_start_http_server.called)
+
+    @patch.object(metrics, 'start_http_server')
+    def test_serve_disabled_multiprocess(self, fake_start_http_server):
+        """``serve`` makes an empty PROMETHEUS_MULTIPROC_DIR even when the port is zero"""
+        with tempfile.TemporaryDirectory() as tmp:
+            directory = os.path.join(tmp, 'metrics')
+            with patch.dict(metrics.os.environ, {'PROMETHEUS_MULTIPROC_DIR': directory}):
+                metrics.serve(0)
+                made = os.listdir(directory)
+
+        self.assertEqual(made, [])
+        self.assertFalse(fake_start_http_server.called)
+
+    @patch.object(metrics, 'start_http_server')
+    def test_serve_stale(self, fake_start_http_server):
+        """``serve`` clears out the metrics of processes from before a restart"""
+        with tempfile.TemporaryDirectory() as tmp:
+            with open(os.path.join(tmp, 'histogram_1234.db'), 'w'):
+                pass
+            with patch.dict(metrics.os.environ, {'PROMETHEUS_MULTIPROC_DIR': tmp}):
+                metrics.serve(0)
+            left = os.listdir(tmp)
+
+        self.assertEqual(left, [])
+
+    @patch.object(metrics, 'start_http_server')
+    def test_serve(self, fake_start_http_server):
+        """``serve`` listens on the port supplied"""
+        metrics.serve(9102)
+
+        the_args, _ = fake_start_http_server.call_args
+        self.assertEqual(the_args, (9102,))
+
+
+class TestInstrumentApp(unittest.TestCase):
+    """A set of test cases for the ``instrument_app`` function"""
+
+    def test_request_timed(self):
+        """``instrument_app`` records requests by URL rule, not by path"""
+        app = Flask(__name__)
+        app.add_url_rule('/things/<name>', 'thing', lambda name: 'ok')
+        metrics.instrument_app(app)
+        before = sample('centos_api_request_seconds_count', method='GET', endpoint='/things/<name>', status='200')
+
+        app.test_client().get('/things/foo')
+        app.test_client().get('/things/bar')
+        after = sample('centos_api_request_seconds_count', method='GET', endpoint='/things/<name>', status='200')
+
+        self.assertEqual(after - before, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,32 @@
+# -*- coding: UTF-8 -*-
+"""
+A suite of tests for the metrics API end point
+"""
+import unittest
+
+from flask import Flask
+
+from vlab_centos_api.lib.views import metrics
+
+
+class TestMetricsView(unittest.TestCase):
+    """A set of test cases for the MetricsView object"""
+
+    @classmethod
+    def setUp(cls):
+        """Runs before every test case"""
+        app = Flask(__name__)
+        metrics.MetricsView.register(app)
+        app.config['TESTING'] = True
+        cls.app = app.test_client()
+
+    def test_metrics(self):
+        """A simple test to verify the /api/1/inf/centos/metrics end point works"""
+        resp = self.app.get('/api/1/inf/centos/metrics')
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertTrue(b'centos_vcenter_calls' in resp.data)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,188 @@
+# -*- coding: UTF-8 -*-
+"""
+A suite of tests for the functions in ova_cache.py
+"""
+import io
+import os
+import shutil
+import tarfile
+import tempfile
+import unittest
+from unittest.mock import patch, MagicMock
+
+from vlab_centos_api.lib.worker import ova_cache
+
+
+OVF = '<Envelope><NetworkSection><Network ovf:name="VM Network"></Network></NetworkSection></Envelope>'
+
+
+def make_ova(path, disk=b'0123456789'):
+    """Create a tiny OVA file"""
+    with tarfile.open(path, 'w') as tar:
+        for name, data in (('centos.ovf', OVF.encode()), ('centos-disk1.vmdk', disk)):
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            tar.addfile(info, io.BytesIO(data))
+
+
+class TestOvaCache(unittest.TestCase):
+    """A set of test cases for the OvaCache object"""
+
+    def setUp(self):
+        """Runs before every test case"""
+        self.tmp_dir = tempfile.mkdtemp()
+        self.ova_path = os.path.join(self.tmp_dir, 'CentOS-7.ova')
+        make_ova(self.ova_path)
+
+    def tearDown(self):
+        """Runs after every test case"""
+        shutil.rmtree(self.tmp_dir)
+
+    def get(self, cache, path=None):
+        """Look up an OVA in the cache, like ``open_ova`` does"""
+        path = path or self.ova_path
+        with open(path, 'rb') as the_file:
+            return cache.get(path, the_file)
+
+    def test_meta(self):
+        """``OvaMeta`` reads the networks and the location of the disks"""
+        with open(self.ova_path, 'rb') as the_file:
+            meta = ova_cache.OvaMeta(self.ova_path, the_file)
+
+        self.assertEqual(meta.networks, ['VM Network'])
+        offset, size = meta.disks['centos-disk1.vmdk']
+        with open(self.ova_path, 'rb') as the_file:
+            the_file.seek(offset)
+            self.assertEqual(the_file.read(size), b'0123456789')
+
+    def test_hit(self):
+        """``OvaCache`` only parses an OVA once"""
+        cache = ova_cache.OvaCache()
+        first = self.get(cache)
+        second = self.get(cache)
+
+        self.assertTrue(first is second)
+        self.assertEqual(cache.stats['misses'], 1)
+
+    def test_replaced(self):
+        """``OvaCache`` parses an OVA again once it's overwritten in place"""
+        cache = ova_cache.OvaCache()
+        first = self.get(cache)
+        make_ova(self.ova_path, disk=b'a different disk')
+        second = self.get(cache)
+
+        self.assertFalse(first is second)
+        self.assertEqual(second.disks['centos-disk1.vmdk'][1], 16)
+
+    def test_same_size_new_mtime(self):
+        """``OvaCache`` parses an OVA again when only its mtime changed"""
+        cache = ova_cache.OvaCache()
+        first = self.get(cache)
+        os.utime(self.ova_path, (1, 1))
+        second = self.get(cache)
+
+        self.assertFalse(first is second)
+
+    def test_eviction(self):
+        """``OvaCache`` evicts the least recently used OVA"""
+        cache = ova_cache.OvaCache(size=2)
+        paths = []
+        for version in ('7', '8', '9'):
+            paths.append(os.path.join(self.tmp_dir, 'CentOS-{}.ova'.format(version)))
+            make_ova(paths[-1])
+        self.get(cache, paths[0])
+        self.get(cache, paths[1])
+        self.get(cache, paths[0])
+        self.get(cache, paths[2])
+
+        self.assertEqual(list(cache._entries.keys()), [paths[0], paths[2]])
+
+    def test_open_ova(self):
+        """``open_ova`` keeps the OVA open until it's closed"""
+        with patch.object(ova_cache, 'CACHE', ova_cache.OvaCache()):
+            ova = ova_cache.open_ova(self.ova_path)
+        ova.close()
+
+        self.assertEqual(ova.networks, ['VM Network'])
+        self.assertTrue(ova._file.closed)
+
+    def test_open_ova_missing(self):
+        """``open_ova`` raises FileNotFoundError for an OVA that doesn't exist"""
+        with self.assertRaises(FileNotFoundError):
+            ova_cache.open_ova('/no/such/file.ova')
+
+
+class TestCachedOva(unittest.TestCase):
+    """A set of test cases for the CachedOva object"""
+
+    def setUp(self):
+        """Runs before every test case"""
+        self.tmp_dir = tempfile.mkdtemp()
+        ova_path = os.path.join(self.tmp_dir, 'CentOS-7.ova')
+        make_ova(ova_path, disk=b'x' * 3000)
+        the_file = open(ova_path, 'rb')
+        self.addCleanup(the_file.close)
+        self.ova = ova_cache.CachedOva(ova_cache.OvaMeta(ova_path, the_file), the_file)
+        self.lease = MagicMock()
+        device_url = MagicMock()
+        device_url.importKey = 'key-1'
+        device_url.url = 'https://esxi01/nfc/disk-0.vmdk'
+        self.lease.info.deviceUrl = [device_url]
+        file_item = MagicMock()
+        file_item.path = 'centos-disk1.vmdk'
+        file_item.deviceId = 'key-1'
+        self.spec = MagicMock()
+        self.spec.fileItem = [file_item]
+
+    def tearDown(self):
+        """Runs after every test case"""
+        shutil.rmtree(self.tmp_dir)
+
+    @patch.object(ova_cache.http.client, 'HTTPSConnection')
+    def test_deploy(self, fake_conn):
+        """``CachedOva`` streams the whole disk, and completes the lease"""
+        fake_conn.return_value.getresponse.return_value.status = 200
+
+        self.ova.deploy(self.spec, self.lease, 'esxi01')
+        sent = b''.join(x[0][0] for x in fake_conn.return_value.send.call_args_list)
+
+        self.assertEqual(sent, b'x' * 3000)
+        fake_conn.return_value.putheader.assert_any_call('Content-Length', '3000')
+        self.assertTrue(self.lease.Complete.called)
+        self.assertEqual(self.ova.deploy_progress, 100)
+
+    @patch.object(ova_cache, 'BUFFER_SIZE', 1024)
+    @patch.object(ova_cache.http.client, 'HTTPSConnection')
+    def test_deploy_large_blocks(self, fake_conn):
+        """``CachedOva`` sends the disk in BUFFER_SIZE chunks, without http.client's (3.7+) blocksize"""
+        fake_conn.return_value.getresponse.return_value.status = 200
+
+        self.ova.deploy(self.spec, self.lease, 'esxi01')
+        sizes = [len(x[0][0]) for x in fake_conn.return_value.send.call_args_list]
+
+        self.assertEqual(sizes, [1024, 1024, 952])
+        self.assertFalse('blocksize' in fake_conn.call_args[1])
+
+    @patch.object(ova_cache.http.client, 'HTTPSConnection')
+    def test_deploy_truncated(self, fake_conn):
+        """``CachedOva`` aborts the lease when the OVA is shorter than the disk it should hold"""
+        self.ova._meta.disks['centos-disk1.vmdk'] = (self.ova._meta.disks['centos-disk1.vmdk'][0], 10 ** 9)
+
+        with self.assertRaises(RuntimeError):
+            self.ova.deploy(self.spec, self.lease, 'esxi01')
+
+        self.assertTrue(self.lease.Abort.called)
+
+    @patch.object(ova_cache.http.client, 'HTTPSConnection')
+    def test_deploy_error(self, fake_conn):
+        """``CachedOva`` aborts the lease when the upload fails"""
+        fake_conn.return_value.getresponse.return_value.status = 500
+
+        with self.assertRaises(RuntimeError):
+            self.ova.deploy(self.spec, self.lease, 'esxi01')
+
+        self.assertTrue(self.lease.Abort.called)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,227 @@
+# -*- coding: UTF-8 -*-
+"""
+A suite of tests for the functions in placement.py
+"""
+import unittest
+from unittest.mock import patch, MagicMock
+
+from vlab_centos_api.lib.worker import placement
+
+GB = placement.GB
+
+
+def make_datastore(moid, free, capacity=100 * GB, hosts=('host-1', 'host-2')):
+    """Build a datastore candidate, like ``_retrieve`` returns"""
+    return {'moid': moid, 'name': 'ds-{}'.format(moid), 'free': free, 'capacity': capacity, 'hosts': set(hosts)}
+
+
+def make_host(moid, memory_used):
+    """Build a host candidate, like ``_retrieve`` returns"""
+    return {'moid': moid, 'name': 'esxi-{}'.format(moid), 'memory': 100 * GB, 'memory_used': memory_used}
+
+
+def make_result(obj, **props):
+    """Build a PropertyCollector ObjectContent, like vCenter returns"""
+    result = MagicMock()
+    result.obj = obj
+    result.propSet = []
+    for name, val in props.items():
+        prop = MagicMock()
+        prop.name = name
+        prop.val = val
+        result.propSet.append(prop)
+    return result
+
+
+class TestPlacer(unittest.TestCase):
+    """A set of test cases for the Placer object"""
+
+    def setUp(self):
+        """Runs before every test case"""
+        self.datastores = [make_datastore('datastore-1', 10 * GB), make_datastore('datastore-2', 50 * GB)]
+        self.hosts = [make_host('host-1', 90 * GB), make_host('host-2', 10 * GB)]
+        self.vcenter = MagicMock()
+        self.vcenter.content.propertyCollector.RetrieveContents.return_value = []
+        self.logger = MagicMock()
+
+    def make_placer(self, policy='least-loaded'):
+        """Create a Placer that uses the test's candidates"""
+        placer = placement.Placer(policy=policy)
+        placer._candidates = MagicMock(return_value=(self.datastores, self.hosts))
+        return placer
+
+    def test_unknown_policy(self):
+        """``Placer`` raises ValueError for a policy that isn't registered"""
+        with self.assertRaises(ValueError):
+            placement.Placer(policy='doh')
+
+    def test_least_loaded(self):
+        """``Placer.choose`` 'least-loaded' picks the most free datastore, and least used host"""
+        placer = self.make_placer()
+        target = placer.choose(self.vcenter, MagicMock(), '7', 1 * GB, self.logger)
+
+        self.assertEqual(target.datastore._moId, 'datastore-2')
+        self.assertEqual(target.host._moId, 'host-2')
+
+    def test_least_loaded_in_flight(self):
+        """``Placer.choose`` 'least-loaded' avoids datastores that are busy with other deploys"""
+        placer = self.make_placer()
+        placer.in_flight['datastore-2'] = 9
+        target = placer.choose(self.vcenter, MagicMock(), '7', 1 * GB, self.logger)
+
+        self.assertEqual(target.datastore._moId, 'datastore-1')
+
+    def test_least_loaded_latency(self):
+        """``Placer.choose`` 'least-loaded' avoids datastores that have been slow"""
+        placer = self.make_placer()
+        placer.record_latency('datastore-2', 6000)
+        target = placer.choose(self.vcenter, MagicMock(), '7', 1 * GB, self.logger)
+
+        self.assertEqual(target.datastore._moId, 'datastore-1')
+
+    def test_no_room(self):
+        """``Placer.choose`` raises ValueError when no datastore has room for the VM"""
+        placer = self.make_placer()
+
+        with self.assertRaises(ValueError):
+            placer.choose(self.vcenter, MagicMock(), '7', 60 * GB, self.logger)
+
+    def test_no_room_in_flight(self):
+        """``Placer.choose`` counts the space of deploys in flight as used"""
+        placer = self.make_placer()
+        placer.in_flight['datastore-2'] = 2
+
+        with self.assertRaises(ValueError):
+            placer.choose(self.vcenter, MagicMock(), '7', 20 * GB, self.logger)
+
+    def test_no_hosts(self):
+        """``Placer.choose`` raises ValueError when every host is unusable"""
+        self.hosts = []
+        placer = self.make_placer()
+
+        with self.assertRaises(ValueError):
+            placer.choose(self.vcenter, MagicMock(), '7', 1 * GB, self.logger)
+
+    def test_round_robin(self):
+        """``Placer.choose`` 'round-robin' rotates through the datastores"""
+        placer = self.make_placer(policy='round-robin')
+        picked = [placer.choose(self.vcenter, MagicMock(), '7', 1 * GB, self.logger).datastore._moId for _ in range(4)]
+
+        self.assertEqual(picked, ['datastore-1', 'datastore-2', 'datastore-1', 'datastore-2'])
+
+    def test_image_affinity(self):
+        """``Placer.choose`` 'image-affinity' always uses the same datastore for an image"""
+        placer = self.make_placer(policy='image-affinity')
+        picked = set(placer.choose(self.vcenter, MagicMock(), '7', 1 * GB, self.logger).datastore._moId for _ in range(4))
+
+        self.assertEqual(len(picked), 1)
+
+    def test_reachable_hosts(self):
+        """``Placer.choose`` only uses hosts that have the datastore mounted"""
+        self.datastores = [make_datastore('datastore-1', 50 * GB, hosts=['host-1'])]
+        placer = self.make_placer()
+        target = placer.choose(self.vcenter, MagicMock(), '7', 1 * GB, self.logger)
+
+        self.assertEqual(target.host._moId, 'host-1')
+
+    def test_candidates(self):
+        """``Placer.candidates`` offers the policy's pick first, then its other hosts, then the other datastores"""
+        placer = self.make_placer()
+        ranked = [(x.datastore._moId, x.host._moId) for x in placer.candidates(self.vcenter, MagicMock(), '7', 1 * GB, self.logger)]
+
+        self.assertEqual(ranked, [('datastore-2', 'host-2'), ('datastore-2', 'host-1'),
+                                  ('datastore-1', 'host-2'), ('datastore-1', 'host-1')])
+
+    def test_candidates_lazy(self):
+        """``Placer.candidates`` only asks the policy again once every host of its pick is passed over"""
+        placer = self.make_placer(policy='round-robin')
+        candidates = placer.candidates(self.vcenter, MagicMock(), '7', 1 * GB, self.logger)
+        next(candidates)
+        next(candidates)
+
+        self.assertEqual(next(placer._rotation), 1)
+
+    def test_deploying(self):
+        """``Placer.deploying`` counts the deploy as in flight until it's done"""
+        placer = self.make_placer()
+        target = placer.choose(self.vcenter, MagicMock(), '7', 1 * GB, self.logger)
+        with placer.deploying(target, 1 * GB):
+            in_flight = placer.in_flight['datastore-2']
+
+        self.assertEqual(in_flight, 1)
+        self.assertEqual(placer.in_flight['datastore-2'], 0)
+        self.assertTrue('datastore-2' in placer.latency)
+
+    def test_deploying_error(self):
+        """``Placer.deploying`` does not record the speed of a failed deploy"""
+        placer = self.make_placer()
+        target = placer.choose(self.vcenter, MagicMock(), '7', 1 * GB, self.logger)
+        try:
+            with placer.deploying(target, 1 * GB):
+                raise RuntimeError('testing')
+        except RuntimeError:
+            pass
+
+        self.assertEqual(placer.in_flight['datastore-2'], 0)
+        self.assertFalse('datastore-2' in placer.latency)
+
+    @patch.object(placement, '_retrieve')
+    def test_snapshot_cached(self, fake_retrieve):
+        """``Placer`` only fetches the capacity of vCenter once per TTL"""
+        fake_retrieve.return_value = (self.datastores, self.hosts)
+        placer = placement.Placer(ttl=60)
+        placer.choose(self.vcenter, MagicMock(), '7', 1 * GB, self.logger)
+        placer.choose(self.vcenter, MagicMock(), '7', 1 * GB, self.logger)
+
+        self.assertEqual(fake_retrieve.call_count, 1)
+
+    @patch.object(placement, '_retrieve')
+    def test_invalidate(self, fake_retrieve):
+        """``Placer.invalidate`` makes the next placement fetch a new snapshot"""
+        fake_retrieve.return_value = (self.datastores, self.hosts)
+        placer = placement.Placer(ttl=60)
+        placer.choose(self.vcenter, MagicMock(), '7', 1 * GB, self.logger)
+        placer.invalidate()
+        placer.choose(self.vcenter, MagicMock(), '7', 1 * GB, self.logger)
+
+        self.assertEqual(fake_retrieve.call_count, 2)
+
+
+class TestRetrieve(unittest.TestCase):
+    """A set of test cases for the ``_retrieve`` function"""
+
+    @patch.object(placement, '_capacity_filter_spec')
+    def test_retrieve(self, fake_capacity_filter_spec):
+        """``_retrieve`` expands datastore clusters, and skips unusable datastores & hosts"""
+        vim = placement.vim
+        mount = MagicMock()
+        mount.key = vim.HostSystem('host-1')
+        results = [make_result(vim.StoragePod('group-p1'), name='VM-Storage',
+                               childEntity=[vim.Datastore('datastore-1'), vim.Datastore('datastore-2')]),
+                   make_result(vim.Datastore('datastore-1'), **{'name': 'ds1', 'host': [mount],
+                                                                'summary.freeSpace': GB, 'summary.capacity': 2 * GB,
+                                                                'summary.accessible': True,
+                                                                'summary.maintenanceMode': 'normal'}),
+                   make_result(vim.Datastore('datastore-2'), **{'name': 'ds2', 'host': [],
+                                                                'summary.accessible': True,
+                                                                'summary.maintenanceMode': 'inMaintenance'}),
+                   make_result(vim.Datastore('datastore-3'), **{'name': 'someOtherStore',
+                                                                'summary.accessible': True}),
+                   make_result(vim.HostSystem('host-1'), **{'name': 'esxi1',
+                                                            'runtime.inMaintenanceMode': False,
+                                                            'runtime.connectionState': 'connected'}),
+                   make_result(vim.HostSystem('host-2'), **{'name': 'esxi2',
+                                                            'runtime.inMaintenanceMode': True,
+                                                            'runtime.connectionState': 'connected'})]
+        vcenter = MagicMock()
+        vcenter.content.propertyCollector.RetrieveContents.return_value = results
+
+        datastores, hosts = placement._retrieve(vcenter, MagicMock())
+
+        self.assertEqual([x['moid'] for x in datastores], ['datastore-1'])
+        self.assertEqual(datastores[0]['hosts'], set(['host-1']))
+        self.assertEqual([x['moid'] for x in hosts], ['host-1'])
+
+
+if __name__ == '__main__':
+    unittest.main()
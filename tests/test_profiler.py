@@ -0,0 +1,148 @@
+# -*- coding: UTF-8 -*-
+"""
+A suite of tests for the functions in profiler.py
+"""
+import os
+import sys
+import time
+import tempfile
+import unittest
+from unittest.mock import patch
+
+from flask import Flask
+
+from vlab_centos_api.lib import profiler
+
+
+def napping():
+    """Something for the profiler to find in a stack"""
+    time.sleep(0.1)
+
+
+class TestProfile(unittest.TestCase):
+    """A set of test cases for the Profile object"""
+
+    def test_add(self):
+        """``add`` records the stack, outermost function first"""
+        the_profile = profiler.Profile('centos.show', 'myId', 1)
+        the_profile.add(sys._getframe())
+
+        stack = list(the_profile.stacks.keys())[0]
+
+        self.assertTrue(stack.endswith('test_add (tests/test_profiler.py:25)'))
+        self.assertEqual(the_profile.samples, 1)
+
+    def test_folded(self):
+        """``folded`` has a line per stack, followed by how many times it was sampled"""
+        the_profile = profiler.Profile('centos.show', 'myId', 1)
+        the_profile.stacks['a;b'] = 3
+        the_profile.stacks['a;c'] = 1
+
+        self.assertEqual(the_profile.folded(), 'a;b 3\na;c 1\n')
+
+
+class TestSampler(unittest.TestCase):
+    """A set of test cases for the Sampler object"""
+
+    def test_sampled(self):
+        """The Sampler samples the stack of the calling thread, until stopped"""
+        sampler = profiler.Sampler(interval=0.005)
+        the_profile = sampler.start('centos.show', 'myId')
+        napping()
+        sampler.stop(the_profile)
+        samples = the_profile.samples
+        time.sleep(0.02)
+
+        self.assertTrue(samples > 0)
+        self.assertTrue(any('napping' in x for x in the_profile.stacks))
+        self.assertEqual(the_profile.samples, samples)
+
+    def test_stop_other(self):
+        """Stopping an old profile leaves the newer one of the same thread alone"""
+        sampler = profiler.Sampler(interval=0.005)
+        old = sampler.start('centos.show', 'oldId')
+        new = sampler.start('centos.show', 'newId')
+        sampler.stop(old)
+        napping()
+        sampler.stop(new)
+
+        self.assertTrue(new.samples > 0)
+
+
+class TestProfiling(unittest.TestCase):
+    """A set of test cases for starting, finishing and saving profiles"""
+
+    def setUp(self):
+        """Runs before every test case"""
+        self.tmp = tempfile.TemporaryDirectory()
+        self.const = profiler.const._replace(VLAB_CENTOS_PROFILE=True,
+                                             VLAB_CENTOS_PROFILE_THRESHOLD=0.05,
+                                             VLAB_CENTOS_PROFILE_DIR=self.tmp.name)
+
+    def tearDown(self):
+        """Runs after every test case"""
+        self.tmp.cleanup()
+
+    def test_off(self):
+        """Nothing is profiled when profiling is off"""
+        with profiler.profile('centos.show', 'myId') as the_profile:
+            pass
+
+        self.assertTrue(the_profile is None)
+
+    def test_slow(self):
+        """The profile of something slow is saved"""
+        with patch.object(profiler, 'const', self.const):
+            with profiler.profile('centos.create', 'myId'):
+                napping()
+
+        saved = os.listdir(self.tmp.name)
+
+        self.assertEqual(len(saved), 1)
+        self.assertTrue('-centos.create-myId-' in saved[0])
+
+    def test_fast(self):
+        """The profile of something quick is thrown away"""
+        with patch.object(profiler, 'const', self.const):
+            with profiler.profile('centos.show', 'myId'):
+                pass
+
+        self.assertEqual(os.listdir(self.tmp.name), [])
+
+    def test_finish_none(self):
+        """``finish`` is a no-op for the None ``start`` returns when profiling is off"""
+        self.assertTrue(profiler.finish(None) is None)
+
+    @patch.object(profiler, 'dump')
+    def test_dump_fails(self, fake_dump):
+        """Failing to save a profile doesn't fail the request"""
+        fake_dump.side_effect = OSError('disk full')
+        with patch.object(profiler, 'const', self.const):
+            the_profile = profiler.start('centos.create', 'myId')
+            the_profile.started -= 1
+            path = profiler.finish(the_profile)
+
+        self.assertTrue(path is None)
+
+    def test_unsafe_txn_id(self):
+        """The X-REQUEST-ID can't put the profile outside the directory"""
+        the_profile = profiler.Profile('centos.show', '../../etc/passwd', 1)
+        path = profiler.dump(the_profile, self.tmp.name)
+
+        self.assertEqual(os.path.dirname(path), self.tmp.name)
+
+    def test_view(self):
+        """``view`` profiles a request by the handler and X-REQUEST-ID"""
+        app = Flask(__name__)
+        def get():
+            return 'woot'
+        with patch.object(profiler, 'profile') as fake_profile:
+            with app.test_request_context(headers={'X-REQUEST-ID': 'myId'}):
+                output = profiler.view(get)()
+
+        fake_profile.assert_called_with('TestProfiling.test_view.<locals>.get', 'myId')
+        self.assertEqual(output, 'woot')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,108 @@
+# -*- coding: UTF-8 -*-
+"""
+A suite of tests for the functions in readiness.py
+"""
+import unittest
+from unittest.mock import patch, MagicMock
+
+from vlab_centos_api.lib import readiness
+
+
+class TestCheck(unittest.TestCase):
+    """A set of test cases for the Check object"""
+
+    def test_cached(self):
+        """``Check`` remembers the answer until the TTL passes"""
+        func = MagicMock(return_value={'ok': True})
+        check = readiness.Check(func, ttl=10)
+        check.result(MagicMock())
+        check.result(MagicMock())
+
+        self.assertEqual(func.call_count, 1)
+
+    @patch.object(readiness, 'time')
+    def test_expired(self, fake_time):
+        """``Check`` runs the check again once the TTL passes"""
+        fake_time.time.side_effect = [100, 111, 111]
+        func = MagicMock(return_value={'ok': True})
+        check = readiness.Check(func, ttl=10)
+        check.result(MagicMock())
+        check.result(MagicMock())
+
+        self.assertEqual(func.call_count, 2)
+
+    def test_error(self):
+        """``Check`` answers with the error of a check that raises"""
+        func = MagicMock(side_effect=RuntimeError('doh'))
+        check = readiness.Check(func, ttl=10)
+
+        self.assertEqual(check.result(MagicMock()), {'ok': False, 'error': 'doh'})
+
+
+class TestReadiness(unittest.TestCase):
+    """A set of test cases for the Readiness object"""
+
+    @patch.object(readiness, 'catalog')
+    @patch.object(readiness, 'sessions')
+    @patch.object(readiness, 'broker')
+    def test_report(self, fake_broker, fake_sessions, fake_catalog):
+        """``Readiness`` is ready when every check is OK"""
+        fake_broker.return_value = {'ok': True}
+        fake_sessions.return_value = {'ok': True}
+        fake_catalog.return_value = {'ok': True}
+        ok, checks = readiness.Readiness(ttl=10).report(MagicMock())
+
+        self.assertTrue(ok)
+        self.assertEqual(list(checks.keys()), ['broker', 'sessions', 'images'])
+
+    @patch.object(readiness, 'catalog')
+    @patch.object(readiness, 'sessions')
+    @patch.object(readiness, 'broker')
+    def test_report_not_ready(self, fake_broker, fake_sessions, fake_catalog):
+        """``Readiness`` is not ready when any check fails"""
+        fake_broker.side_effect = ConnectionRefusedError('nope')
+        fake_sessions.return_value = {'ok': True}
+        fake_catalog.return_value = {'ok': True}
+        ok, checks = readiness.Readiness(ttl=10).report(MagicMock())
+
+        self.assertFalse(ok)
+        self.assertEqual(checks['broker'], {'ok': False, 'error': 'nope'})
+
+
+class TestChecks(unittest.TestCase):
+    """A set of test cases for the individual checks"""
+
+    def test_broker(self):
+        """``broker`` is OK when the broker accepts a connection"""
+        celery_app = MagicMock()
+
+        self.assertEqual(readiness.broker(celery_app), {'ok': True})
+
+    def test_sessions(self):
+        """``sessions`` combines the reply of every worker"""
+        celery_app = MagicMock()
+        celery_app.control.broadcast.return_value = [{'worker1': {'ok': True}}, {'worker2': {'ok': False}}]
+        output = readiness.sessions(celery_app)
+
+        self.assertFalse(output['ok'])
+        self.assertEqual(sorted(output['workers'].keys()), ['worker1', 'worker2'])
+
+    def test_sessions_no_workers(self):
+        """``sessions`` only warns when no workers reply"""
+        celery_app = MagicMock()
+        celery_app.control.broadcast.return_value = []
+        output = readiness.sessions(celery_app)
+
+        self.assertTrue(output['ok'])
+        self.assertEqual(output['warning'], 'No workers replied')
+
+    @patch.object(readiness.images, 'CATALOG')
+    def test_catalog(self, fake_CATALOG):
+        """``catalog`` reports the health of the image catalog"""
+        fake_CATALOG.health.return_value = {'ok': True}
+
+        self.assertEqual(readiness.catalog(MagicMock()), {'ok': True})
+
+
+if __name__ == '__main__':
+    unittest.main()
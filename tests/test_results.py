@@ -0,0 +1,84 @@
+# -*- coding: UTF-8 -*-
+"""
+A suite of tests for the functions in results.py
+"""
+import unittest
+from unittest.mock import patch, MagicMock
+
+from vlab_centos_api.lib import results
+
+
+class TestResultCache(unittest.TestCase):
+    """A set of test cases for the ResultCache object"""
+
+    def setUp(self):
+        """Runs before every test case"""
+        self.celery_app = MagicMock()
+        self.celery_app.AsyncResult.return_value.status = 'SUCCESS'
+        self.celery_app.AsyncResult.return_value.result = {'content': {}, 'error': None, 'params': {}}
+
+    def test_status(self):
+        """``ResultCache.status`` returns the status and result of a task"""
+        cache = results.ResultCache()
+        output = cache.status(self.celery_app, 'task-1')
+        expected = ('SUCCESS', {'content': {}, 'error': None, 'params': {}})
+
+        self.assertEqual(output, expected)
+
+    def test_status_cached(self):
+        """``ResultCache.status`` only asks the result backend once about a finished task"""
+        cache = results.ResultCache()
+        cache.status(self.celery_app, 'task-1')
+        cache.status(self.celery_app, 'task-1')
+
+        self.assertEqual(self.celery_app.AsyncResult.call_count, 1)
+        self.assertEqual(cache.stats['hits'], 1)
+
+    def test_status_pending(self):
+        """``ResultCache.status`` does not remember a task that's still running"""
+        self.celery_app.AsyncResult.return_value.status = 'PENDING'
+        cache = results.ResultCache()
+        cache.status(self.celery_app, 'task-1')
+        cache.status(self.celery_app, 'task-1')
+
+        self.assertEqual(self.celery_app.AsyncResult.call_count, 2)
+
+    def test_status_failure(self):
+        """``ResultCache.status`` does not return the exception of a failed task"""
+        self.celery_app.AsyncResult.return_value.status = 'FAILURE'
+        self.celery_app.AsyncResult.return_value.result = RuntimeError('testing')
+        cache = results.ResultCache()
+
+        self.assertEqual(cache.status(self.celery_app, 'task-1'), ('FAILURE', None))
+
+    @patch.object(results.time, 'time')
+    def test_status_expires(self, fake_time):
+        """``ResultCache.status`` forgets a result after the TTL"""
+        fake_time.return_value = 100
+        cache = results.ResultCache(ttl=60)
+        cache.status(self.celery_app, 'task-1')
+        fake_time.return_value = 200
+        cache.status(self.celery_app, 'task-1')
+
+        self.assertEqual(self.celery_app.AsyncResult.call_count, 2)
+
+    def test_max_entries(self):
+        """``ResultCache`` forgets the oldest results once full"""
+        cache = results.ResultCache(max_entries=2)
+        for task_id in ['task-1', 'task-2', 'task-3', 'task-1']:
+            cache.status(self.celery_app, task_id)
+
+        self.assertEqual(self.celery_app.AsyncResult.call_count, 4)
+
+    def test_configure(self):
+        """``configure`` sets the result backend, expiry and serializer"""
+        fake_app = MagicMock()
+        results.configure(fake_app)
+
+        self.assertEqual(fake_app.conf.result_backend, results.const.VLAB_CENTOS_RESULT_BACKEND)
+        self.assertEqual(fake_app.conf.result_expires, results.const.VLAB_CENTOS_RESULT_EXPIRES)
+        self.assertEqual(fake_app.conf.result_serializer, 'json')
+
+
+if __name__ == '__main__':
+    unittest.main()
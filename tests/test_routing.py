@@ -0,0 +1,52 @@
+# -*- coding: UTF-8 -*-
+"""
+A suite of tests for the functions in routing.py
+"""
+import unittest
+from unittest.mock import MagicMock
+
+from vlab_centos_api.lib import routing
+from vlab_centos_api.lib.worker import tasks
+
+
+class TestRouting(unittest.TestCase):
+    """A set of test cases for the routing.py module"""
+
+    def test_every_task_routed(self):
+        """``routing.ROUTES`` has a queue for every CentOS task the worker defines"""
+        defined = set(x for x in tasks.app.tasks.keys() if x.startswith('centos.'))
+
+        self.assertEqual(defined, set(routing.ROUTES.keys()))
+
+    def test_options(self):
+        """``routing.options`` returns the queue and priority of a task"""
+        output = routing.options('centos.show')
+        expected = {'queue': 'centos-read', 'priority': 9}
+
+        self.assertEqual(output, expected)
+
+    def test_options_copy(self):
+        """``routing.options`` returns a copy, so callers cannot change the routes"""
+        routing.options('centos.show')['queue'] = 'doh'
+
+        self.assertEqual(routing.ROUTES['centos.show']['queue'], 'centos-read')
+
+    def test_priorities(self):
+        """``routing.ROUTES`` only uses priorities the queues support"""
+        for route in routing.ROUTES.values():
+            self.assertTrue(0 <= route['priority'] <= routing.MAX_PRIORITY)
+
+    def test_configure(self):
+        """``routing.configure`` declares every queue with priorities enabled"""
+        fake_app = MagicMock()
+        routing.configure(fake_app)
+
+        names = [x.name for x in fake_app.conf.task_queues]
+        max_priority = set(x.queue_arguments['x-max-priority'] for x in fake_app.conf.task_queues)
+
+        self.assertEqual(names, ['centos-change', 'centos-deploy', 'centos-read'])
+        self.assertEqual(max_priority, set([routing.MAX_PRIORITY]))
+
+
+if __name__ == '__main__':
+    unittest.main()
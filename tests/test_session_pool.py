@@ -0,0 +1,234 @@
+# -*- coding: UTF-8 -*-
+"""
+A suite of tests for the functions in session_pool.py
+"""
+import os
+import tempfile
+import unittest
+import threading
+from unittest.mock import patch, MagicMock
+
+from vlab_inf_common.vmware import vCenter
+
+from vlab_centos_api.lib.worker import session_pool
+
+
+class TestSessionPool(unittest.TestCase):
+    """A set of test cases for the SessionPool object"""
+
+    def setUp(self):
+        """Runs before every test case"""
+        self.pool = session_pool.SessionPool(host='vcenter', user='bob', password='a', size=2)
+
+    @patch.object(session_pool, 'vCenter')
+    def test_reuse(self, fake_vCenter):
+        """``SessionPool`` reuses a session instead of logging in again"""
+        with self.pool.session():
+            pass
+        with self.pool.session():
+            pass
+
+        self.assertEqual(fake_vCenter.call_count, 1)
+
+    @patch.object(session_pool.metrics, 'instrument')
+    @patch.object(session_pool, 'vCenter')
+    def test_instrumented(self, fake_vCenter, fake_instrument):
+        """``SessionPool`` counts the vCenter calls of every new session"""
+        with self.pool.session():
+            pass
+
+        fake_instrument.assert_called_with(fake_vCenter.return_value._conn)
+
+    @patch.object(session_pool, 'vCenter')
+    def test_stats(self, fake_vCenter):
+        """``SessionPool`` counts pool hits and misses"""
+        with self.pool.session():
+            pass
+        with self.pool.session():
+            pass
+
+        self.assertEqual(self.pool.stats['misses'], 1)
+        self.assertEqual(self.pool.stats['hits'], 1)
+
+    @patch.object(session_pool, 'vCenter')
+    def test_stats_threaded(self, fake_vCenter):
+        """``SessionPool`` doesn't lose count when threads share the pool"""
+        def borrow():
+            for _ in range(200):
+                with self.pool.session():
+                    pass
+
+        threads = [threading.Thread(target=borrow) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(self.pool.stats['hits'] + self.pool.stats['misses'], 800)
+
+    @patch.object(session_pool, 'vCenter')
+    def test_network_renamed(self, fake_vCenter):
+        """``SessionPool`` doesn't hand out a session that remembers a network renamed since it was used"""
+        # The real ``networks`` property, minus the login
+        vcenter = vCenter.__new__(vCenter)
+        vcenter._conn = MagicMock()
+        vcenter._net_cache = None
+        vcenter.get_by_type = MagicMock()
+        fake_vCenter.return_value = vcenter
+        old, new = MagicMock(), MagicMock()
+        old.name = 'alice_frontend'
+        new.name = 'alice_backend'
+        vcenter.get_by_type.return_value = [old]
+        with self.pool.session() as borrowed:
+            borrowed.networks
+        vcenter.get_by_type.return_value = [new]
+        with self.pool.session() as borrowed:
+            networks = borrowed.networks
+
+        self.assertEqual(list(networks.keys()), ['alice_backend'])
+
+    @patch.object(session_pool, 'vCenter')
+    def test_concurrent_borrow(self, fake_vCenter):
+        """``SessionPool`` never hands the same session to two borrowers"""
+        fake_vCenter.side_effect = [MagicMock(), MagicMock()]
+        with self.pool.session() as first:
+            with self.pool.session() as second:
+                self.assertFalse(first is second)
+
+    @patch.object(session_pool.time, 'time')
+    @patch.object(session_pool, 'vCenter')
+    def test_relogin(self, fake_vCenter, fake_time):
+        """``SessionPool`` replaces an idle session that vCenter has expired"""
+        fake_time.side_effect = [0, 9000, 9000]
+        expired = MagicMock()
+        expired.content.sessionManager.currentSession = None
+        fake_vCenter.side_effect = [expired, MagicMock()]
+        with self.pool.session():
+            pass
+        with self.pool.session() as vcenter:
+            pass
+
+        self.assertFalse(vcenter is expired)
+        self.assertEqual(self.pool.stats['relogins'], 1)
+
+    @patch.object(session_pool, 'vCenter')
+    def test_discard_not_authenticated(self, fake_vCenter):
+        """``SessionPool`` does not recycle a session that vCenter rejected"""
+        with self.assertRaises(session_pool.vim.fault.NotAuthenticated):
+            with self.pool.session():
+                raise session_pool.vim.fault.NotAuthenticated()
+
+        self.assertEqual(self.pool.idle, 0)
+
+    @patch.object(session_pool, 'vCenter')
+    def test_recycle_on_error(self, fake_vCenter):
+        """``SessionPool`` recycles the session when the caller hits a normal error"""
+        with self.assertRaises(ValueError):
+            with self.pool.session():
+                raise ValueError('testing')
+
+        self.assertEqual(self.pool.idle, 1)
+
+    @patch.object(session_pool, 'vCenter')
+    def test_close(self, fake_vCenter):
+        """``SessionPool`` - ``close`` logs out of every idle session"""
+        with self.pool.session():
+            pass
+        self.pool.close()
+
+        self.assertTrue(fake_vCenter.return_value.close.called)
+        self.assertEqual(self.pool.idle, 0)
+
+    @patch.object(session_pool, 'vCenter')
+    def test_health(self, fake_vCenter):
+        """``SessionPool`` - ``health`` counts the sessions in use, without calling vCenter"""
+        with self.pool.session():
+            output = self.pool.health()
+
+        self.assertTrue(output['ok'])
+        self.assertEqual(output['in_use'], 1)
+        self.assertEqual(self.pool.health()['in_use'], 0)
+        self.assertFalse(fake_vCenter.return_value.content.called)
+
+    @patch.object(session_pool, 'vCenter')
+    def test_health_login_failed(self, fake_vCenter):
+        """``SessionPool`` - ``health`` is not OK after failing to login"""
+        fake_vCenter.side_effect = RuntimeError('bad password')
+        with self.assertRaises(RuntimeError):
+            with self.pool.session():
+                pass
+
+        output = self.pool.health()
+
+        self.assertFalse(output['ok'])
+        self.assertEqual(output['last_error'], 'bad password')
+
+    @patch.object(session_pool, 'vCenter')
+    def test_health_recovers(self, fake_vCenter):
+        """``SessionPool`` - ``health`` is OK again once a login works"""
+        fake_vCenter.side_effect = [RuntimeError('bad password'), MagicMock()]
+        with self.assertRaises(RuntimeError):
+            with self.pool.session():
+                pass
+        with self.pool.session():
+            pass
+
+        self.assertTrue(self.pool.health()['ok'])
+
+
+class TestHealthReports(unittest.TestCase):
+    """A set of test cases for the health reports of child processes"""
+
+    def setUp(self):
+        """Runs before every test case"""
+        self.tmp = tempfile.TemporaryDirectory()
+        self.directory = os.path.join(self.tmp.name, 'sessions')
+        session_pool.reset_health(self.directory)
+
+    def tearDown(self):
+        """Runs after every test case"""
+        self.tmp.cleanup()
+
+    @patch.object(session_pool, 'POOL')
+    def test_save_load(self, fake_POOL):
+        """``load_health`` reads what each child process saved"""
+        fake_POOL.health.return_value = {'ok': True, 'in_use': 1}
+        session_pool.save_health(self.directory, 101)
+        fake_POOL.health.return_value = {'ok': False, 'in_use': 0}
+        session_pool.save_health(self.directory, 102)
+
+        output = session_pool.load_health(self.directory)
+
+        self.assertEqual(output, {'101': {'ok': True, 'in_use': 1}, '102': {'ok': False, 'in_use': 0}})
+
+    @patch.object(session_pool, 'POOL')
+    def test_forget(self, fake_POOL):
+        """``forget_health`` drops the report of a child process that exited"""
+        fake_POOL.health.return_value = {'ok': False}
+        session_pool.save_health(self.directory, 101)
+        session_pool.forget_health(self.directory, 101)
+        session_pool.forget_health(self.directory, 101)
+
+        self.assertEqual(session_pool.load_health(self.directory), {})
+
+    def test_reset(self):
+        """``reset_health`` drops the reports of processes from before a restart"""
+        with open(os.path.join(self.directory, 'sessions-101.json'), 'w') as the_file:
+            the_file.write('{"ok": false}')
+        session_pool.reset_health(self.directory)
+
+        self.assertEqual(session_pool.load_health(self.directory), {})
+
+    def test_load_missing(self):
+        """``load_health`` finds no reports when the directory doesn't exist"""
+        self.assertEqual(session_pool.load_health(os.path.join(self.tmp.name, 'nope')), {})
+
+    @patch.object(session_pool, 'POOL')
+    def test_save_error(self, fake_POOL):
+        """``save_health`` doesn't fail the task when it can't write"""
+        fake_POOL.health.return_value = {'ok': True}
+        session_pool.save_health(os.path.join(self.tmp.name, 'nope'), 101)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,108 @@
+# -*- coding: UTF-8 -*-
+"""
+A suite of tests for the functions in task_waiter.py
+"""
+import unittest
+from unittest.mock import MagicMock
+
+from vlab_centos_api.lib.worker import task_waiter
+
+
+def make_update(task, **props):
+    """Build a WaitForUpdatesEx UpdateSet for a single task"""
+    update = MagicMock()
+    object_update = MagicMock()
+    object_update.obj = task
+    object_update.changeSet = []
+    for name, val in props.items():
+        change = MagicMock()
+        change.name = name
+        change.val = val
+        object_update.changeSet.append(change)
+    filter_update = MagicMock()
+    filter_update.objectSet = [object_update]
+    update.filterSet = [filter_update]
+    return update
+
+
+class TestWaitForTasks(unittest.TestCase):
+    """A set of test cases for the ``wait_for_tasks`` function"""
+
+    def setUp(self):
+        """Runs before every test case"""
+        self.vcenter = MagicMock()
+        self.collector = self.vcenter.content.propertyCollector.CreatePropertyCollector.return_value
+        self.task1 = task_waiter.vim.Task('task-1')
+        self.task2 = task_waiter.vim.Task('task-2')
+
+    def test_no_tasks(self):
+        """``wait_for_tasks`` does not talk to vCenter when there's nothing to wait on"""
+        output = task_waiter.wait_for_tasks(self.vcenter, [])
+
+        self.assertEqual(output, {})
+        self.assertFalse(self.vcenter.content.propertyCollector.CreatePropertyCollector.called)
+
+    def test_all_tasks(self):
+        """``wait_for_tasks`` returns the outcome of every task"""
+        error = MagicMock()
+        error.msg = 'doh'
+        self.collector.WaitForUpdatesEx.side_effect = [make_update(self.task1, **{'info.state': 'running'}),
+                                                       None,
+                                                       make_update(self.task2, **{'info.state': 'error', 'info.error': error}),
+                                                       make_update(self.task1, **{'info.state': 'success', 'info.result': 'yay'})]
+
+        output = task_waiter.wait_for_tasks(self.vcenter, [self.task1, self.task2])
+        expected = {self.task1: ('yay', None), self.task2: (None, 'doh')}
+
+        self.assertEqual(output, expected)
+
+    def test_single_filter(self):
+        """``wait_for_tasks`` watches every task with one PropertyCollector filter"""
+        self.collector.WaitForUpdatesEx.side_effect = [make_update(self.task1, **{'info.state': 'success'}),
+                                                       make_update(self.task2, **{'info.state': 'success'})]
+
+        task_waiter.wait_for_tasks(self.vcenter, [self.task1, self.task2])
+
+        self.assertEqual(self.collector.CreateFilter.call_count, 1)
+        self.assertTrue(self.collector.DestroyPropertyCollector.called)
+
+    def test_timeout(self):
+        """``wait_for_tasks`` reports an error for tasks that do not finish in time"""
+        output = task_waiter.wait_for_tasks(self.vcenter, [self.task1], timeout=0)
+
+        self.assertTrue(output[self.task1][1].startswith('Timeout'))
+
+
+class TestWaitForIp(unittest.TestCase):
+    """A set of test cases for the ``wait_for_ip`` function"""
+
+    def setUp(self):
+        """Runs before every test case"""
+        self.vcenter = MagicMock()
+        self.collector = self.vcenter.content.propertyCollector.CreatePropertyCollector.return_value
+        self.vm = task_waiter.vim.VirtualMachine('vm-1')
+
+    def test_wait_for_ip(self):
+        """``wait_for_ip`` returns the IPs once VMware Tools reports them"""
+        link_local, nic = MagicMock(), MagicMock()
+        link_local.ipAddress = ['fe80::1']
+        nic.ipAddress = ['fe80::1', '192.168.1.2']
+        self.collector.WaitForUpdatesEx.side_effect = [make_update(self.vm, **{'guest.net': []}),
+                                                       make_update(self.vm, **{'guest.net': [link_local]}),
+                                                       make_update(self.vm, **{'guest.net': [nic]})]
+
+        output = task_waiter.wait_for_ip(self.vcenter, self.vm)
+
+        self.assertEqual(output, ['192.168.1.2'])
+        self.assertTrue(self.collector.DestroyPropertyCollector.called)
+
+    def test_wait_for_ip_timeout(self):
+        """``wait_for_ip`` returns an empty list when the VM does not get an IP in time"""
+        output = task_waiter.wait_for_ip(self.vcenter, self.vm, timeout=0)
+
+        self.assertEqual(output, [])
+        self.assertTrue(self.collector.DestroyPropertyCollector.called)
+
+
+if __name__ == '__main__':
+    unittest.main()
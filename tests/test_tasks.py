@@ -5,6 +5,8 @@ A suite of tests for the functions in tasks.py
 import unittest
 from unittest.mock import patch, MagicMock
 
+from celery.app.task import Context
+
 from vlab_centos_api.lib.worker import tasks
 
 
@@ -120,5 +122,188 @@ class TestTasks(unittest.TestCase):
 
         self.assertEqual(output, expected)
 
+    @patch.object(tasks, 'vmware')
+    def test_refill_warm_pool(self, fake_vmware):
+        """``refill_warm_pool`` returns the status of the warm pool"""
+        fake_vmware.refill_warm_pool.return_value = {'depth': {'7': 2}}
+
+        output = tasks.refill_warm_pool(txn_id='someTransactionID')
+        expected = {'content': {'depth': {'7': 2}}, 'error': None, 'params': {}}
+
+        self.assertEqual(output, expected)
+
+    @patch.object(tasks.app, 'send_task')
+    @patch.object(tasks, 'vmware')
+    def test_create_refills_warm_pool(self, fake_vmware, fake_send_task):
+        """``create`` triggers a refill of the warm pool, when the warm pool is configured"""
+        with patch.object(tasks.warm_pool, 'DEPTHS', {('7', False): 2}):
+            tasks.create(username='bob',
+                         machine_name='centosBox',
+                         image='7',
+                         network='someLAN',
+                         desktop=False,
+                         ram=4,
+                         cpu_count=4,
+                         txn_id='myId')
+
+        fake_send_task.assert_called_with('centos.refill_warm_pool', ['myId'], queue='centos-deploy', priority=1)
+
+
+    @patch.object(tasks.create, 'signature_from_request')
+    @patch.object(tasks.create, 'update_state')
+    @patch.object(tasks.vmware, 'create_centos')
+    def test_create_queued(self, fake_create_centos, fake_update_state, fake_signature_from_request):
+        """``create`` reports a QUEUED state, and sends itself again, when no deploy slot is free"""
+        fake_create_centos.side_effect = tasks.admission.Busy('ds1')
+
+        with self.assertRaises(tasks.Ignore):
+            tasks.create(username='bob',
+                         machine_name='centosBox',
+                         image='7',
+                         network='someLAN',
+                         desktop=False,
+                         ram=4,
+                         cpu_count=4,
+                         txn_id='myId')
+
+        _, the_kwargs = fake_update_state.call_args
+        self.assertEqual(the_kwargs['state'], 'QUEUED')
+        self.assertEqual(the_kwargs['meta']['waiting_for'], 'ds1')
+        self.assertTrue(fake_signature_from_request.return_value.apply_async.called)
+
+    @patch.object(tasks.build_template, 'signature_from_request')
+    @patch.object(tasks.build_template, 'update_state')
+    @patch.object(tasks.vmware, 'build_template')
+    def test_build_template_queued(self, fake_build_template, fake_update_state, fake_signature_from_request):
+        """``build_template`` waits for a free deploy slot without holding a worker"""
+        fake_build_template.side_effect = tasks.admission.Busy('esxi1')
+
+        with self.assertRaises(tasks.Ignore):
+            tasks.build_template(image='7', desktop=False, txn_id='someTransactionID')
+
+        self.assertTrue(fake_signature_from_request.return_value.apply_async.called)
+
+    @patch.object(tasks, 'vmware')
+    def test_build_template_error(self, fake_vmware):
+        """``build_template`` Catches ValueError, and sets the response accordingly"""
+        fake_vmware.build_template.side_effect = ValueError('wrong mode')
+
+        output = tasks.build_template(image='7', desktop=False, txn_id='someTransactionID')
+        expected = {'content': {}, 'error': 'wrong mode', 'params': {}}
+
+        self.assertEqual(output, expected)
+
+    @patch.object(tasks, 'vmware')
+    def test_bulk_create(self, fake_vmware):
+        """``bulk_create`` reports on every VM, including the ones that failed validation"""
+        fake_vmware.check_bulk.return_value = ([{'name': 'box1'}], {'box2': 'No such network named foo'}, {})
+        fake_vmware.create_centos_bulk.return_value = {'box1': {'content': {'box1': {}}, 'error': None}}
+
+        output = tasks.bulk_create(username='bob', machines=[], txn_id='myId')
+        expected = {'box1': {'content': {'box1': {}}, 'error': None},
+                    'box2': {'content': {}, 'error': 'No such network named foo'}}
+
+        self.assertEqual(output['content'], expected)
+        self.assertEqual(output['error'], 'Failed to create 1 of 2 VMs: box2')
+
+    @patch.object(tasks, 'vmware')
+    def test_bulk_create_ok(self, fake_vmware):
+        """``bulk_create`` does not set the error when every VM was created"""
+        fake_vmware.check_bulk.return_value = ([{'name': 'box1'}], {}, {})
+        fake_vmware.create_centos_bulk.return_value = {'box1': {'content': {'box1': {}}, 'error': None}}
+
+        output = tasks.bulk_create(username='bob', machines=[], txn_id='myId')
+
+        self.assertTrue(output['error'] is None)
+
+    @patch.object(tasks, 'vmware')
+    def test_bulk_delete(self, fake_vmware):
+        """``bulk_delete`` sets the error when some VMs could not be deleted"""
+        fake_vmware.delete_centos_bulk.return_value = {'box1': {'content': {}, 'error': None},
+                                                       'box2': {'content': {}, 'error': 'No centos named box2 found'}}
+
+        output = tasks.bulk_delete(username='bob', machine_names=['box1', 'box2'], txn_id='myId')
+
+        self.assertEqual(output['error'], 'Failed to delete 1 of 2 VMs: box2')
+
+    @patch.object(tasks.metrics, 'task_finished')
+    @patch.object(tasks.metrics, 'task_started')
+    def test_task_timed(self, fake_task_started, fake_task_finished):
+        """The time a task queued and ran for are recorded"""
+        fake_task_started.return_value = 100
+        task = MagicMock()
+        task.name = 'centos.show'
+        task.request = Context({'sent_at': 90.0, 'eta': None})
+
+        tasks.task_starting(task_id='someId', task=task)
+        tasks.task_done(task_id='someId', task=task, state='SUCCESS')
+
+        fake_task_started.assert_called_with('centos.show', 90.0, None)
+        fake_task_finished.assert_called_with('centos.show', 100, 'SUCCESS')
+
+    @patch.object(tasks.metrics, 'task_started')
+    def test_task_timed_eta(self, fake_task_started):
+        """The countdown of a task is passed on, so it's not counted as queued"""
+        task = MagicMock()
+        task.name = 'centos.create'
+        task.request = Context({'sent_at': 90.0, 'eta': '2020-01-01T00:00:10+00:00'})
+
+        tasks.task_starting(task_id='someId', task=task)
+        tasks._STARTED.pop('someId', None)
+
+        the_args, _ = fake_task_started.call_args
+        self.assertEqual(the_args[2], 1577836810)
+
+    @patch.object(tasks.profiler, 'finish')
+    @patch.object(tasks.profiler, 'start')
+    def test_task_profiled(self, fake_start, fake_finish):
+        """A task is profiled by its name and txn_id"""
+        task = MagicMock()
+        task.name = 'centos.delete'
+
+        tasks.profile_task(task_id='someId', task=task, args=['bob', 'myBox', 'myId'])
+        tasks.profile_done(task_id='someId', task=task)
+
+        fake_start.assert_called_with('centos.delete', 'myId')
+        fake_finish.assert_called_with(fake_start.return_value)
+
+    @patch.object(tasks.session_pool, 'load_health')
+    def test_centos_sessions(self, fake_load_health):
+        """Workers report the health of their child processes' session pools to the API"""
+        fake_load_health.return_value = {'101': {'ok': True}, '102': {'ok': False}}
+
+        output = tasks.centos_sessions(state=MagicMock())
+
+        self.assertFalse(output['ok'])
+        self.assertEqual(sorted(output['processes'].keys()), ['101', '102'])
+
+    @patch.object(tasks.session_pool, 'load_health')
+    def test_centos_sessions_idle(self, fake_load_health):
+        """A worker whose child processes haven't run a task yet only warns"""
+        fake_load_health.return_value = {}
+
+        output = tasks.centos_sessions(state=MagicMock())
+
+        self.assertTrue(output['ok'])
+        self.assertTrue('warning' in output)
+
+    @patch.object(tasks.session_pool, 'save_health')
+    def test_save_sessions(self, fake_save_health):
+        """A child process reports the health of its session pool after every task"""
+        tasks.save_sessions(task_id='someId', task=MagicMock())
+
+        fake_save_health.assert_called_with(tasks.const.VLAB_CENTOS_SESSIONS_DIR, tasks.os.getpid())
+
+    @patch.object(tasks.profiler, 'start')
+    def test_task_profiled_off(self, fake_start):
+        """Nothing is kept for a task when profiling is off"""
+        fake_start.return_value = None
+        task = MagicMock()
+
+        tasks.profile_task(task_id='someId', task=task, args=['myId'])
+
+        self.assertFalse('someId' in tasks._PROFILES)
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,78 @@
+# -*- coding: UTF-8 -*-
+"""
+A suite of tests for the functions in templates.py
+"""
+import unittest
+from unittest.mock import patch, MagicMock
+
+from tests import resolve_without_index
+
+from vlab_centos_api.lib.worker import templates
+
+
+class TestTemplates(unittest.TestCase):
+    """A set of test cases for the templates.py module"""
+
+    def setUp(self):
+        """Runs before every test case"""
+        resolve_without_index(self)
+        self.vcenter = MagicMock()
+        self.vcenter.get_by_name.return_value = templates.vim.Folder('group-1')
+        self.vcenter.resource_pools = {'Resources': templates.vim.ResourcePool('resgroup-1')}
+        self.template = MagicMock()
+        self.template.snapshot.currentSnapshot = templates.vim.vm.Snapshot('snapshot-1')
+
+    def test_template_name(self):
+        """``template_name`` is unique per image and desktop flag"""
+        self.assertNotEqual(templates.template_name('7', True), templates.template_name('7', False))
+
+    def test_find_template_no_folder(self):
+        """``find_template`` returns None when there's no template folder"""
+        fake_vcenter = MagicMock()
+        fake_vcenter.get_by_name.side_effect = ValueError('testing')
+
+        self.assertTrue(templates.find_template(fake_vcenter, '7', False) is None)
+
+    def test_find_template(self):
+        """``find_template`` looks up the template by name with the SearchIndex"""
+        fake_vcenter = MagicMock()
+        templates.find_template(fake_vcenter, '7', False)
+
+        the_args, _ = fake_vcenter.content.searchIndex.FindChild.call_args
+        self.assertEqual(the_args[1], 'centos-template-7-cli')
+
+    @patch.object(templates, 'consume_task')
+    def test_clone_linked(self, fake_consume_task):
+        """``clone`` makes a linked clone that only creates a delta disk"""
+        templates.clone(self.vcenter, self.template, 'alice', 'myCentOS', 'linked', MagicMock())
+
+        _, the_kwargs = self.template.CloneVM_Task.call_args
+        disk_move = the_kwargs['spec'].location.diskMoveType
+        self.assertEqual(disk_move, 'createNewChildDiskBacking')
+
+    @patch.object(templates.virtual_machine, 'power')
+    @patch.object(templates, 'consume_task')
+    def test_clone_instant(self, fake_consume_task, fake_power):
+        """``clone`` powers off an instant clone, so CPU and RAM can be changed"""
+        templates.clone(self.vcenter, self.template, 'alice', 'myCentOS', 'instant', MagicMock())
+
+        self.assertTrue(self.template.InstantClone_Task.called)
+        fake_power.assert_called_with(fake_consume_task.return_value, state='off')
+
+    def test_clone_bad_name(self):
+        """``clone`` raises ValueError for an invalid machine name"""
+        with self.assertRaises(ValueError):
+            templates.clone(MagicMock(), MagicMock(), 'alice', 'not_valid!', 'linked', MagicMock())
+
+    @patch.object(templates, 'consume_task')
+    def test_finalize_template(self, fake_consume_task):
+        """``finalize_template`` snapshots the VM, and marks it as a template for linked clones"""
+        fake_vm = MagicMock()
+        templates.finalize_template(fake_vm, 'linked')
+
+        self.assertTrue(fake_vm.CreateSnapshot_Task.called)
+        self.assertTrue(fake_vm.MarkAsTemplate.called)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -5,27 +5,33 @@ A suite of tests for the functions in vmware.py
 import unittest
 from unittest.mock import patch, MagicMock
 
+from tests import resolve_without_index
+
 from vlab_centos_api.lib.worker import vmware
 
 
 class TestVMware(unittest.TestCase):
     """A set of test cases for the vmware.py module"""
 
-    @patch.object(vmware.virtual_machine, 'get_info')
+    def setUp(self):
+        """Runs before every test case"""
+        resolve_without_index(self)
+        patcher = patch.object(vmware.admission, 'exclusive')
+        self.fake_exclusive = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    @patch.object(vmware, 'inventory_cache')
+    @patch.object(vmware.inventory, 'get_vms')
     @patch.object(vmware, 'consume_task')
-    @patch.object(vmware, 'vCenter')
-    def test_show_gateway(self, fake_vCenter, fake_consume_task, fake_get_info):
+    @patch.object(vmware.session_pool, 'session')
+    def test_show_gateway(self, fake_session, fake_consume_task, fake_get_vms, fake_inventory_cache):
         """``centos`` returns a dictionary when everything works as expected"""
-        fake_vm = MagicMock()
-        fake_vm.name = 'myCentOS'
-        fake_folder = MagicMock()
-        fake_folder.childEntity = [fake_vm]
-        fake_vCenter.return_value.__enter__.return_value.get_by_name.return_value = fake_folder
-        fake_get_info.return_value = {'meta' : {'component': 'CentOS',
-                                                'created': 1234,
-                                                'version': '7',
-                                                'configured': False,
-                                                'generation': 1}}
+        fake_inventory_cache.lookup.return_value = None
+        fake_get_vms.return_value = {'myCentOS': {'meta' : {'component': 'CentOS',
+                                                            'created': 1234,
+                                                            'version': '7',
+                                                            'configured': False,
+                                                            'generation': 1}}}
 
         output = vmware.show_centos(username='alice')
         expected = {'myCentOS': {'meta' : {'component': 'CentOS',
@@ -36,63 +42,197 @@ class TestVMware(unittest.TestCase):
 
         self.assertEqual(output, expected)
 
-    @patch.object(vmware.virtual_machine, 'get_info')
+    @patch.object(vmware, 'inventory_cache')
+    @patch.object(vmware.inventory, 'get_vms')
+    @patch.object(vmware.session_pool, 'session')
+    def test_show_only_centos(self, fake_session, fake_get_vms, fake_inventory_cache):
+        """``show_centos`` only asks for VMs with the CentOS component"""
+        fake_inventory_cache.lookup.return_value = None
+        vmware.show_centos(username='alice')
+
+        _, the_kwargs = fake_get_vms.call_args
+        self.assertEqual(the_kwargs['component'], 'CentOS')
+
+    @patch.object(vmware, 'inventory_cache')
+    @patch.object(vmware.inventory, 'render')
+    @patch.object(vmware.inventory, 'get_vms')
+    @patch.object(vmware.session_pool, 'session')
+    def test_show_cached(self, fake_session, fake_get_vms, fake_render, fake_inventory_cache):
+        """``show_centos`` does not crawl vCenter when the inventory cache can be used"""
+        fake_inventory_cache.lookup.return_value = ({}, {})
+        vmware.show_centos(username='alice')
+
+        self.assertTrue(fake_render.called)
+        self.assertFalse(fake_get_vms.called)
+
+    @patch.object(vmware, 'inventory_cache')
+    @patch.object(vmware.virtual_machine, 'change_network')
+    @patch.object(vmware.inventory, 'find_vm')
+    @patch.object(vmware.session_pool, 'session')
+    def test_update_network_invalidates(self, fake_session, fake_find_vm, fake_change_network, fake_inventory_cache):
+        """``update_network`` invalidates the cached inventory of the user, even upon failure"""
+        fake_find_vm.return_value = None
+
+        with self.assertRaises(ValueError):
+            vmware.update_network(username='pat', machine_name='myCentOS', new_network='wootTown')
+
+        fake_inventory_cache.invalidate.assert_called_with('pat')
+
+    @patch.object(vmware.inventory, 'find_vm')
     @patch.object(vmware.virtual_machine, 'power')
     @patch.object(vmware, 'consume_task')
-    @patch.object(vmware, 'vCenter')
-    def test_delete_centos(self, fake_vCenter, fake_consume_task, fake_power, fake_get_info):
+    @patch.object(vmware.session_pool, 'session')
+    def test_delete_centos(self, fake_session, fake_consume_task, fake_power, fake_find_vm):
         """``delete_centos`` returns None when everything works as expected"""
         fake_logger = MagicMock()
         fake_vm = MagicMock()
-        fake_vm.name = 'CentOSBox'
-        fake_folder = MagicMock()
-        fake_folder.childEntity = [fake_vm]
-        fake_vCenter.return_value.__enter__.return_value.get_by_name.return_value = fake_folder
-        fake_get_info.return_value = {'meta' : {'component': 'CentOS',
-                                                'created': 1234,
-                                                'version': '7',
-                                                'configured': False,
-                                                'generation': 1}}
+        fake_find_vm.return_value = (fake_vm, {'name': 'CentOSBox', 'state': 'poweredOn', 'meta': {'component': 'CentOS'}})
 
         output = vmware.delete_centos(username='bob', machine_name='CentOSBox', logger=fake_logger)
         expected = None
 
         self.assertEqual(output, expected)
+        self.assertTrue(fake_vm.Destroy_Task.called)
 
-    @patch.object(vmware.virtual_machine, 'get_info')
+    @patch.object(vmware.inventory, 'find_vm')
     @patch.object(vmware.virtual_machine, 'power')
     @patch.object(vmware, 'consume_task')
-    @patch.object(vmware, 'vCenter')
-    def test_delete_centos_value_error(self, fake_vCenter, fake_consume_task, fake_power, fake_get_info):
-        """``delete_centos`` raises ValueError when unable to find requested vm for deletion"""
+    @patch.object(vmware.session_pool, 'session')
+    def test_delete_centos_powered_off(self, fake_session, fake_consume_task, fake_power, fake_find_vm):
+        """``delete_centos`` does not power off a VM that's already off"""
         fake_logger = MagicMock()
         fake_vm = MagicMock()
-        fake_vm.name = 'win10'
-        fake_folder = MagicMock()
-        fake_folder.childEntity = [fake_vm]
-        fake_vCenter.return_value.__enter__.return_value.get_by_name.return_value = fake_folder
-        fake_get_info.return_value = {'note' : 'CentOS=1.0.0'}
+        fake_find_vm.return_value = (fake_vm, {'name': 'CentOSBox', 'state': 'poweredOff', 'meta': {'component': 'CentOS'}})
+
+        vmware.delete_centos(username='bob', machine_name='CentOSBox', logger=fake_logger)
+
+        self.assertFalse(fake_power.called)
+
+    @patch.object(vmware.inventory, 'find_vm')
+    @patch.object(vmware.virtual_machine, 'power')
+    @patch.object(vmware, 'consume_task')
+    @patch.object(vmware.session_pool, 'session')
+    def test_delete_centos_value_error(self, fake_session, fake_consume_task, fake_power, fake_find_vm):
+        """``delete_centos`` raises ValueError when unable to find requested vm for deletion"""
+        fake_logger = MagicMock()
+        fake_find_vm.return_value = None
 
         with self.assertRaises(ValueError):
             vmware.delete_centos(username='bob', machine_name='myOtherCentOSBox', logger=fake_logger)
 
-    @patch.object(vmware.virtual_machine, 'adjust_ram')
-    @patch.object(vmware.virtual_machine, 'adjust_cpu')
-    @patch.object(vmware.virtual_machine, 'set_meta')
-    @patch.object(vmware, 'Ova')
+    @patch.object(vmware, '_create_centos')
+    @patch.object(vmware.session_pool, 'session')
+    def test_create_centos_in_progress(self, fake_session, fake_create_centos):
+        """``create_centos`` raises ValueError when another worker is creating the same VM"""
+        self.fake_exclusive.return_value.__enter__.side_effect = ValueError('already being created')
+
+        with self.assertRaises(ValueError):
+            vmware.create_centos(username='alice',
+                                 machine_name='CentOSBox',
+                                 image='7',
+                                 network='someLAN',
+                                 desktop=False,
+                                 ram=4,
+                                 cpu_count=4,
+                                 logger=MagicMock())
+
+        self.assertFalse(fake_create_centos.called)
+
+    @patch.object(vmware, '_create_centos')
+    @patch.object(vmware.session_pool, 'session')
+    def test_create_centos_lock_key(self, fake_session, fake_create_centos):
+        """``create_centos`` locks on the user and the name of the new VM"""
+        vmware.create_centos(username='alice',
+                             machine_name='CentOSBox',
+                             image='7',
+                             network='someLAN',
+                             desktop=False,
+                             ram=4,
+                             cpu_count=4,
+                             logger=MagicMock())
+
+        the_args, _ = self.fake_exclusive.call_args
+        self.assertEqual(the_args[0], 'create.alice.CentOSBox')
+
+    @patch.object(vmware.time, 'sleep')
+    @patch.object(vmware, '_create_centos')
+    @patch.object(vmware.session_pool, 'session')
+    def test_create_one_busy(self, fake_session, fake_create_centos, fake_sleep):
+        """``_create_one`` waits for a deploy slot, instead of failing that VM of a bulk request"""
+        fake_create_centos.side_effect = [vmware.admission.Busy('ds1'), {'myCentOS': {}}]
+        spec = {'name': 'myCentOS', 'image': '7', 'desktop': False, 'ram': 4, 'cpu-count': 4}
+
+        output = vmware._create_one('alice', spec, MagicMock(), MagicMock())
+
+        self.assertEqual(output, {'myCentOS': {}})
+        self.assertEqual(fake_sleep.call_count, 1)
+
+    @patch.object(vmware.time, 'time')
+    @patch.object(vmware.time, 'sleep')
+    @patch.object(vmware, '_create_centos')
+    @patch.object(vmware.session_pool, 'session')
+    def test_create_one_gives_up(self, fake_session, fake_create_centos, fake_sleep, fake_time):
+        """``_create_one`` fails that VM of a bulk request once it's waited too long for a deploy slot"""
+        fake_create_centos.side_effect = vmware.admission.Busy('ds1')
+        fake_time.side_effect = [0, 10, 3601]
+        spec = {'name': 'myCentOS', 'image': '7', 'desktop': False, 'ram': 4, 'cpu-count': 4}
+
+        with self.assertRaises(ValueError):
+            vmware._create_one('alice', spec, MagicMock(), MagicMock())
+
+        self.assertEqual(fake_sleep.call_count, 1)
+
+    @patch.object(vmware.admission, 'first_free')
+    @patch.object(vmware.placement, 'deploying')
+    @patch.object(vmware.placement, 'candidates')
+    @patch.object(vmware.virtual_machine, '_get_lease')
+    def test_import_ova(self, fake_get_lease, fake_candidates, fake_deploying, fake_first_free):
+        """``_import_ova`` deploys onto the datastore & host it holds deploy slots for"""
+        fake_vcenter = MagicMock()
+        fake_ova = MagicMock()
+        target = vmware.placement.Placement(datastore=vmware.vim.Datastore('datastore-1'),
+                                            host=vmware.vim.HostSystem('host-1'),
+                                            datastore_name='ds1',
+                                            host_name='esxi1')
+        fake_first_free.return_value.__enter__.return_value = target
+
+        the_vm = vmware._import_ova(fake_vcenter, fake_ova, [], 'alice', 'CentOSBox', '7', MagicMock())
+
+        _, the_kwargs = fake_vcenter.ovf_manager.CreateImportSpec.call_args
+        the_args, _ = fake_get_lease.call_args
+        self.assertEqual(the_kwargs['datastore']._moId, 'datastore-1')
+        self.assertEqual(the_args[3]._moId, 'host-1')
+        fake_first_free.assert_called_with(fake_candidates.return_value)
+        fake_deploying.assert_called_with(target, fake_ova.size)
+        self.assertTrue(the_vm is fake_vcenter.content.searchIndex.FindChild.return_value)
+
+    @patch.object(vmware.admission, 'first_free')
+    @patch.object(vmware.placement, 'deploying')
+    @patch.object(vmware.placement, 'candidates')
+    @patch.object(vmware.virtual_machine, '_get_lease')
+    def test_import_ova_no_vm(self, fake_get_lease, fake_candidates, fake_deploying, fake_first_free):
+        """``_import_ova`` raises RuntimeError if the new VM cannot be found"""
+        fake_vcenter = MagicMock()
+        fake_vcenter.content.searchIndex.FindChild.return_value = None
+
+        with self.assertRaises(RuntimeError):
+            vmware._import_ova(fake_vcenter, MagicMock(), [], 'alice', 'CentOSBox', '7', MagicMock())
+
+    @patch.object(vmware.images, 'lookup')
+    @patch.object(vmware.task_waiter, 'wait_for_ip')
+    @patch.object(vmware.ova_cache, 'open_ova')
     @patch.object(vmware.virtual_machine, 'get_info')
-    @patch.object(vmware.virtual_machine, 'deploy_from_ova')
+    @patch.object(vmware, '_import_ova')
     @patch.object(vmware, 'consume_task')
-    @patch.object(vmware, 'vCenter')
-    def test_create_centos(self, fake_vCenter, fake_consume_task, fake_deploy_from_ova,
-                           fake_get_info, fake_Ova, fake_set_meta, fake_adjust_cpu,
-                           fake_adjust_ram):
+    @patch.object(vmware.session_pool, 'session')
+    def test_create_centos(self, fake_session, fake_consume_task, fake_import_ova,
+                           fake_get_info, fake_open_ova, fake_wait_for_ip, fake_lookup):
         """``create_centos`` returns a dictionary upon success"""
         fake_logger = MagicMock()
-        fake_deploy_from_ova.return_value.name = "CentOSBox"
+        fake_import_ova.return_value.name = "CentOSBox"
         fake_get_info.return_value = {'worked': True}
-        fake_Ova.return_value.networks = ['someLAN']
-        fake_vCenter.return_value.__enter__.return_value.networks = {'someLAN' : vmware.vim.Network(moId='1')}
+        fake_open_ova.return_value.networks = ['someLAN']
+        fake_session.return_value.__enter__.return_value.networks = {'someLAN' : vmware.vim.Network(moId='1')}
 
         output = vmware.create_centos(username='alice',
                                        machine_name='CentOSBox',
@@ -105,18 +245,262 @@ class TestVMware(unittest.TestCase):
         expected = {'CentOSBox' : {'worked': True}}
 
         self.assertEqual(output, expected)
+        # RAM, CPU and meta data are set with one reconfigure
+        self.assertEqual(fake_import_ova.return_value.ReconfigVM_Task.call_count, 1)
+
+    @patch.object(vmware.images, 'lookup')
+    @patch.object(vmware.task_waiter, 'wait_for_ip')
+    @patch.object(vmware.ova_cache, 'open_ova')
+    @patch.object(vmware.virtual_machine, 'get_info')
+    @patch.object(vmware, '_import_ova')
+    @patch.object(vmware, 'consume_task')
+    @patch.object(vmware.session_pool, 'session')
+    def test_create_centos_no_wait(self, fake_session, fake_consume_task, fake_import_ova,
+                                   fake_get_info, fake_open_ova, fake_wait_for_ip, fake_lookup):
+        """``create_centos`` returns once the VM is powered on, when not waiting on an IP"""
+        fake_import_ova.return_value.name = "CentOSBox"
+        fake_open_ova.return_value.networks = ['someLAN']
+        fake_session.return_value.__enter__.return_value.networks = {'someLAN' : vmware.vim.Network(moId='1')}
+        with patch.object(vmware, 'const', vmware.const._replace(VLAB_CENTOS_WAIT_FOR_IP=False)):
+            vmware.create_centos(username='alice',
+                                 machine_name='CentOSBox',
+                                 image='1.0.0',
+                                 network='someLAN',
+                                 desktop=False,
+                                 ram=4,
+                                 cpu_count=4,
+                                 logger=MagicMock())
+
+        self.assertFalse(fake_wait_for_ip.called)
+
+    @patch.object(vmware.images, 'lookup')
+    @patch.object(vmware.task_waiter, 'wait_for_ip')
+    @patch.object(vmware.ova_cache, 'open_ova')
+    @patch.object(vmware.virtual_machine, 'get_info')
+    @patch.object(vmware, '_import_ova')
+    @patch.object(vmware, 'consume_task')
+    @patch.object(vmware.session_pool, 'session')
+    def test_create_centos_no_ip(self, fake_session, fake_consume_task, fake_import_ova,
+                                 fake_get_info, fake_open_ova, fake_wait_for_ip, fake_lookup):
+        """``create_centos`` returns the new VM, even when it doesn't get an IP in time"""
+        fake_import_ova.return_value.name = "CentOSBox"
+        fake_get_info.return_value = {'ips': []}
+        fake_open_ova.return_value.networks = ['someLAN']
+        fake_session.return_value.__enter__.return_value.networks = {'someLAN' : vmware.vim.Network(moId='1')}
+        fake_wait_for_ip.return_value = []
+
+        output = vmware.create_centos(username='alice',
+                                      machine_name='CentOSBox',
+                                      image='1.0.0',
+                                      network='someLAN',
+                                      desktop=False,
+                                      ram=4,
+                                      cpu_count=4,
+                                      logger=MagicMock())
+
+        self.assertEqual(output, {'CentOSBox': {'ips': []}})
+        self.assertFalse(fake_import_ova.return_value.Destroy_Task.called)
+
+    def test_config_spec(self):
+        """``config_spec`` sets the RAM, CPU and meta data in one spec"""
+        spec = vmware.config_spec(MagicMock(), ram=4, cpu_count=8, meta_data={'component': 'CentOS'})
+
+        self.assertEqual((spec.memoryMB, spec.numCPUs), (4096, 8))
+        self.assertEqual(vmware.ujson.loads(spec.annotation), {'component': 'CentOS'})
+        self.assertEqual(spec.deviceChange, [])
+
+    def test_config_spec_network(self):
+        """``config_spec`` also changes the NIC's network, when a network is supplied"""
+        nic = vmware.vim.vm.device.VirtualVmxnet3(key=4000,
+                                                  deviceInfo=vmware.vim.Description(label='Network adapter 1', summary=''))
+        fake_vm = MagicMock()
+        fake_vm.config.hardware.device = [nic]
+        fake_network = MagicMock()
+        fake_network.key = 'dvportgroup-1'
+        fake_network.config.distributedVirtualSwitch.uuid = 'some-uuid'
+
+        spec = vmware.config_spec(fake_vm, ram=4, cpu_count=4, meta_data={}, network=fake_network)
+
+        self.assertEqual(spec.deviceChange[0].device.backing.port.portgroupKey, 'dvportgroup-1')
+
+    def test_config_spec_no_nic(self):
+        """``config_spec`` raises ValueError if the VM has no NIC to connect to the network"""
+        fake_vm = MagicMock()
+        fake_vm.config.hardware.device = []
+
+        with self.assertRaises(ValueError):
+            vmware.config_spec(fake_vm, ram=4, cpu_count=4, meta_data={}, network=MagicMock())
+
+    @patch.object(vmware.task_waiter, 'wait_for_ip')
+    @patch.object(vmware, 'config_spec')
+    @patch.object(vmware.warm_pool, 'assign')
+    @patch.object(vmware.warm_pool, 'claim')
+    @patch.object(vmware, 'consume_task')
+    @patch.object(vmware.virtual_machine, 'power')
+    @patch.object(vmware.ova_cache, 'open_ova')
+    @patch.object(vmware.virtual_machine, 'get_info')
+    @patch.object(vmware, '_import_ova')
+    @patch.object(vmware.session_pool, 'session')
+    def test_create_centos_warm(self, fake_session, fake_import_ova, fake_get_info, fake_open_ova,
+                                fake_power, fake_consume_task, fake_claim, fake_assign, fake_config_spec,
+                                fake_wait_for_ip):
+        """``create_centos`` uses a VM from the warm pool instead of deploying the OVA when it can"""
+        fake_logger = MagicMock()
+        fake_claim.return_value.name = 'CentOSBox'
+        fake_get_info.return_value = {'worked': True}
+        the_network = vmware.vim.Network(moId='1')
+        fake_session.return_value.__enter__.return_value.networks = {'someLAN' : the_network}
+
+        output = vmware.create_centos(username='alice',
+                                      machine_name='CentOSBox',
+                                      image='1.0.0',
+                                      network='someLAN',
+                                      desktop=False,
+                                      ram=4,
+                                      cpu_count=4,
+                                      logger=fake_logger)
+        expected = {'CentOSBox' : {'worked': True}}
+
+        self.assertEqual(output, expected)
+        self.assertTrue(fake_assign.called)
+        self.assertFalse(fake_import_ova.called)
+        # the warm VM must be moved onto the user's network
+        _, the_kwargs = fake_config_spec.call_args
+        self.assertTrue(the_kwargs['network'] is the_network)
+
+    @patch.object(vmware, '_clone_from_template')
+    @patch.object(vmware.task_waiter, 'wait_for_ip')
+    @patch.object(vmware, 'config_spec')
+    @patch.object(vmware.warm_pool, 'assign')
+    @patch.object(vmware.warm_pool, 'claim')
+    @patch.object(vmware, 'consume_task')
+    @patch.object(vmware.virtual_machine, 'power')
+    @patch.object(vmware.virtual_machine, 'get_info')
+    @patch.object(vmware.session_pool, 'session')
+    def test_create_centos_warm_assign_failed(self, fake_session, fake_get_info, fake_power, fake_consume_task,
+                                              fake_claim, fake_assign, fake_config_spec, fake_wait_for_ip,
+                                              fake_clone_from_template):
+        """``create_centos`` makes a fresh VM when the warm VM can't be assigned to the user"""
+        fake_assign.return_value = False
+        fake_clone_from_template.return_value.name = 'CentOSBox'
+        fake_get_info.return_value = {'worked': True}
+        fake_session.return_value.__enter__.return_value.networks = {'someLAN' : vmware.vim.Network(moId='1')}
+
+        output = vmware.create_centos(username='alice',
+                                      machine_name='CentOSBox',
+                                      image='1.0.0',
+                                      network='someLAN',
+                                      desktop=False,
+                                      ram=4,
+                                      cpu_count=4,
+                                      logger=MagicMock())
+
+        self.assertEqual(output, {'CentOSBox': {'worked': True}})
+        self.assertTrue(fake_clone_from_template.called)
+
+    @patch.object(vmware.warm_pool, 'claim')
+    def test_create_centos_warm_bad_name(self, fake_claim):
+        """``_create_centos`` rejects a bad machine name before claiming a warm VM"""
+        with self.assertRaises(ValueError):
+            vmware._create_centos(MagicMock(), 'alice', 'not_valid!', '7', MagicMock(), False, 4, 4, MagicMock())
+
+        self.assertFalse(fake_claim.called)
+
+    @patch.object(vmware.lookup_index, 'folder')
+    @patch.object(vmware.warm_pool, 'claim')
+    def test_create_centos_warm_no_folder(self, fake_claim, fake_folder):
+        """``_create_centos`` doesn't claim a warm VM for a user without a folder"""
+        fake_folder.side_effect = ValueError('Unable to locate object named alice')
+        with self.assertRaises(ValueError):
+            vmware._create_centos(MagicMock(), 'alice', 'myCentOS', '7', MagicMock(), False, 4, 4, MagicMock())
+
+        self.assertFalse(fake_claim.called)
+
+    @patch.object(vmware.templates, 'clone')
+    @patch.object(vmware.templates, 'find_template')
+    def test_clone_from_template(self, fake_find_template, fake_clone):
+        """``_clone_from_template`` clones the template"""
+        with patch.object(vmware, 'const', vmware.const._replace(VLAB_CENTOS_DEPLOY_MODE='linked')):
+            output = vmware._clone_from_template(MagicMock(), 'alice', 'myCentOS', '7', False, MagicMock())
+
+        self.assertTrue(output is fake_clone.return_value)
+
+    @patch.object(vmware.templates, 'clone')
+    @patch.object(vmware.templates, 'find_template')
+    def test_clone_from_template_missing(self, fake_find_template, fake_clone):
+        """``_clone_from_template`` returns None, so the OVA is imported, when there's no template"""
+        fake_find_template.return_value = None
+        with patch.object(vmware, 'const', vmware.const._replace(VLAB_CENTOS_DEPLOY_MODE='linked')):
+            output = vmware._clone_from_template(MagicMock(), 'alice', 'myCentOS', '7', False, MagicMock())
 
-    @patch.object(vmware, 'Ova')
+        self.assertTrue(output is None)
+        self.assertFalse(fake_clone.called)
+
+    @patch.object(vmware.templates, 'find_template')
+    def test_clone_from_template_ova_mode(self, fake_find_template):
+        """``_clone_from_template`` does nothing when the deploy mode is 'ova'"""
+        with patch.object(vmware, 'const', vmware.const._replace(VLAB_CENTOS_DEPLOY_MODE='ova')):
+            output = vmware._clone_from_template(MagicMock(), 'alice', 'myCentOS', '7', False, MagicMock())
+
+        self.assertTrue(output is None)
+        self.assertFalse(fake_find_template.called)
+
+    def test_build_template_ova_mode(self):
+        """``build_template`` raises ValueError when the deploy mode doesn't use templates"""
+        with patch.object(vmware, 'const', vmware.const._replace(VLAB_CENTOS_DEPLOY_MODE='ova')):
+            with self.assertRaises(ValueError):
+                vmware.build_template('7', False, MagicMock())
+
+    @patch.object(vmware.virtual_machine, 'set_meta')
+    @patch.object(vmware, '_deploy_from_image')
+    @patch.object(vmware.warm_pool, 'reap')
+    @patch.object(vmware.warm_pool, 'census')
+    @patch.object(vmware.warm_pool, 'holding_folder')
+    @patch.object(vmware.session_pool, 'session')
+    def test_refill_warm_pool(self, fake_session, fake_holding_folder, fake_census, fake_reap,
+                              fake_deploy_from_image, fake_set_meta):
+        """``refill_warm_pool`` only deploys the VMs needed to reach the configured depth"""
+        fake_session.return_value.__enter__.return_value.networks = {'centos-warm-pool' : vmware.vim.Network(moId='1')}
+        fake_census.return_value = {('7', False): {'ready': [MagicMock()], 'pending': [], 'claimed': []}}
+        with patch.object(vmware.warm_pool, 'DEPTHS', {('7', False): 3}):
+            vmware.refill_warm_pool(MagicMock())
+
+        self.assertEqual(fake_deploy_from_image.call_count, 2)
+
+    @patch.object(vmware, '_deploy_from_image')
+    @patch.object(vmware.warm_pool, 'census')
+    @patch.object(vmware.session_pool, 'session')
+    def test_refill_warm_pool_locked(self, fake_session, fake_census, fake_deploy_from_image):
+        """``refill_warm_pool`` holds a lock across workers, so refills never run at once"""
+        with patch.object(vmware.warm_pool, 'DEPTHS', {}):
+            vmware.refill_warm_pool(MagicMock())
+
+        self.assertEqual(self.fake_exclusive.call_args[0][0], 'warm-pool-refill')
+
+    @patch.object(vmware, '_deploy_from_image')
+    @patch.object(vmware.warm_pool, 'census')
+    @patch.object(vmware.session_pool, 'session')
+    def test_refill_warm_pool_running(self, fake_session, fake_census, fake_deploy_from_image):
+        """``refill_warm_pool`` skips when another refill is already running"""
+        self.fake_exclusive.side_effect = vmware.admission.Locked('testing')
+        with patch.object(vmware.warm_pool, 'DEPTHS', {('7', False): 3}):
+            output = vmware.refill_warm_pool(MagicMock())
+
+        self.assertFalse(fake_census.called)
+        self.assertFalse(fake_deploy_from_image.called)
+        self.assertTrue('depth' in output)
+
+    @patch.object(vmware.ova_cache, 'open_ova')
     @patch.object(vmware.virtual_machine, 'get_info')
-    @patch.object(vmware.virtual_machine, 'deploy_from_ova')
+    @patch.object(vmware, '_import_ova')
     @patch.object(vmware, 'consume_task')
-    @patch.object(vmware, 'vCenter')
-    def test_create_centos_invalid_network(self, fake_vCenter, fake_consume_task, fake_deploy_from_ova, fake_get_info, fake_Ova):
+    @patch.object(vmware.session_pool, 'session')
+    def test_create_centos_invalid_network(self, fake_session, fake_consume_task, fake_import_ova, fake_get_info, fake_open_ova):
         """``create_centos`` raises ValueError if supplied with a non-existing network"""
         fake_logger = MagicMock()
         fake_get_info.return_value = {'worked': True}
-        fake_Ova.return_value.networks = ['someLAN']
-        fake_vCenter.return_value.__enter__.return_value.networks = {'someLAN' : vmware.vim.Network(moId='1')}
+        fake_open_ova.return_value.networks = ['someLAN']
+        fake_session.return_value.__enter__.return_value.networks = {'someLAN' : vmware.vim.Network(moId='1')}
 
         with self.assertRaises(ValueError):
             vmware.create_centos(username='alice',
@@ -128,17 +512,18 @@ class TestVMware(unittest.TestCase):
                                   cpu_count=4,
                                   logger=fake_logger)
 
-    @patch.object(vmware, 'Ova')
+    @patch.object(vmware.images, 'lookup')
+    @patch.object(vmware.ova_cache, 'open_ova')
     @patch.object(vmware.virtual_machine, 'get_info')
-    @patch.object(vmware.virtual_machine, 'deploy_from_ova')
+    @patch.object(vmware, '_import_ova')
     @patch.object(vmware, 'consume_task')
-    @patch.object(vmware, 'vCenter')
-    def test_create_centos_bad_image(self, fake_vCenter, fake_consume_task, fake_deploy_from_ova, fake_get_info, fake_Ova):
+    @patch.object(vmware.session_pool, 'session')
+    def test_create_centos_bad_image(self, fake_session, fake_consume_task, fake_import_ova, fake_get_info, fake_open_ova, fake_lookup):
         """``create_centos`` raises ValueError if supplied with a non-existing image/version of CentOS to deploy"""
         fake_logger = MagicMock()
         fake_get_info.return_value = {'worked': True}
-        fake_Ova.side_effect = FileNotFoundError('testing')
-        fake_vCenter.return_value.__enter__.return_value.networks = {'someLAN' : vmware.vim.Network(moId='1')}
+        fake_lookup.return_value = None
+        fake_session.return_value.__enter__.return_value.networks = {'someLAN' : vmware.vim.Network(moId='1')}
 
         with self.assertRaises(ValueError):
             vmware.create_centos(username='alice',
@@ -150,10 +535,82 @@ class TestVMware(unittest.TestCase):
                                   cpu_count=4,
                                   logger=fake_logger)
 
-    @patch.object(vmware.os, 'listdir')
-    def test_list_images(self, fake_listdir):
+    @patch.object(vmware.task_waiter, 'wait_for_tasks')
+    @patch.object(vmware.inventory, 'retrieve')
+    @patch.object(vmware.session_pool, 'session')
+    def test_delete_centos_bulk(self, fake_session, fake_retrieve, fake_wait_for_tasks):
+        """``delete_centos_bulk`` powers off and destroys VMs together, and reports on each one"""
+        vm1, vm2, other = MagicMock(), MagicMock(), MagicMock()
+        fake_retrieve.return_value = ({vm1: {'name': 'box1', 'state': 'poweredOn', 'meta': {'component': 'CentOS'}},
+                                       vm2: {'name': 'box2', 'state': 'poweredOff', 'meta': {'component': 'CentOS'}},
+                                       other: {'name': 'box3', 'state': 'poweredOn', 'meta': {'component': 'OneFS'}}},
+                                      {})
+        fake_wait_for_tasks.side_effect = lambda vcenter, tasks: {x: (None, None) for x in tasks}
+
+        output = vmware.delete_centos_bulk('bob', None, MagicMock())
+        expected = {'box1': {'content': {}, 'error': None},
+                    'box2': {'content': {}, 'error': None}}
+
+        self.assertEqual(output, expected)
+        self.assertEqual(fake_wait_for_tasks.call_count, 2)
+        self.assertFalse(other.Destroy_Task.called)
+
+    @patch.object(vmware.task_waiter, 'wait_for_tasks')
+    @patch.object(vmware.inventory, 'retrieve')
+    @patch.object(vmware.session_pool, 'session')
+    def test_delete_centos_bulk_errors(self, fake_session, fake_retrieve, fake_wait_for_tasks):
+        """``delete_centos_bulk`` does not destroy VMs that failed to power off, and reports missing VMs"""
+        vm1 = MagicMock()
+        fake_retrieve.return_value = ({vm1: {'name': 'box1', 'state': 'poweredOn', 'meta': {'component': 'CentOS'}}}, {})
+        fake_wait_for_tasks.side_effect = lambda vcenter, tasks: {x: (None, 'doh') for x in tasks}
+
+        output = vmware.delete_centos_bulk('bob', ['box1', 'box9'], MagicMock())
+        expected = {'box1': {'content': {}, 'error': 'doh'},
+                    'box9': {'content': {}, 'error': 'No centos named box9 found'}}
+
+        self.assertEqual(output, expected)
+        self.assertFalse(vm1.Destroy_Task.called)
+
+    @patch.object(vmware.images, 'lookup')
+    @patch.object(vmware.session_pool, 'session')
+    def test_check_bulk(self, fake_session, fake_lookup):
+        """``check_bulk`` rejects duplicate names, missing images and missing networks"""
+        fake_session.return_value.__enter__.return_value.networks = {'bob_lan' : vmware.vim.Network(moId='1')}
+        fake_lookup.side_effect = lambda version, desktop: {'path': '/images/CentOS-7.ova'} if version == '7' else None
+        spec = {'name': 'box1', 'image': '7', 'network': 'bob_lan', 'desktop': False, 'ram': 4, 'cpu-count': 4}
+        machines = [spec,
+                    dict(spec, name='box2'),
+                    dict(spec, name='box2'),
+                    dict(spec, name='box3', image='6'),
+                    dict(spec, name='box4', network='bob_wan')]
+
+        valid, errors, _ = vmware.check_bulk(machines)
+
+        self.assertEqual([x['name'] for x in valid], ['box1'])
+        self.assertEqual(set(errors.keys()), {'box2', 'box3', 'box4'})
+
+    @patch.object(vmware, '_create_centos')
+    @patch.object(vmware.session_pool, 'session')
+    def test_create_centos_bulk(self, fake_session, fake_create_centos):
+        """``create_centos_bulk`` returns the result of every VM, even when some fail"""
+        def fake_create(vcenter, username, name, *args):
+            if name == 'box2':
+                raise ValueError('testing')
+            return {name: {}}
+        fake_create_centos.side_effect = fake_create
+        spec = {'name': 'box1', 'image': '7', 'network': 'bob_lan', 'desktop': False, 'ram': 4, 'cpu-count': 4}
+        networks = {'bob_lan': vmware.vim.Network(moId='1')}
+
+        output = vmware.create_centos_bulk('bob', [spec, dict(spec, name='box2')], networks, MagicMock())
+        expected = {'box1': {'content': {'box1': {}}, 'error': None},
+                    'box2': {'content': {}, 'error': 'testing'}}
+
+        self.assertEqual(output, expected)
+
+    @patch.object(vmware.images, 'versions')
+    def test_list_images(self, fake_versions):
         """``list_images`` - Returns a list of available CentOS versions that can be deployed"""
-        fake_listdir.return_value = ['CentOS-6.ova', 'CentOS-7.ova']
+        fake_versions.return_value = ['6', '7']
 
         output = vmware.list_images()
         expected = ['6', '7']
@@ -176,40 +633,30 @@ class TestVMware(unittest.TestCase):
         self.assertEqual(output, expected)
 
     @patch.object(vmware.virtual_machine, 'change_network')
-    @patch.object(vmware.virtual_machine, 'get_info')
+    @patch.object(vmware.inventory, 'find_vm')
     @patch.object(vmware, 'consume_task')
-    @patch.object(vmware, 'vCenter')
-    def test_update_network(self, fake_vCenter, fake_consume_task, fake_get_info, fake_change_network):
+    @patch.object(vmware.session_pool, 'session')
+    def test_update_network(self, fake_session, fake_consume_task, fake_find_vm, fake_change_network):
         """``update_network`` Returns None upon success"""
-        fake_logger = MagicMock()
         fake_vm = MagicMock()
-        fake_vm.name = 'myCentOS'
-        fake_folder = MagicMock()
-        fake_folder.childEntity = [fake_vm]
-        fake_vCenter.return_value.__enter__.return_value.get_by_name.return_value = fake_folder
-        fake_vCenter.return_value.__enter__.return_value.networks = {'wootTown' : 'someNetworkObject'}
-        fake_get_info.return_value = {'meta': {'component' : 'CentOS'}}
+        fake_find_vm.return_value = (fake_vm, {'name': 'myCentOS', 'state': 'poweredOn', 'meta': {'component': 'CentOS'}})
+        fake_session.return_value.__enter__.return_value.networks = {'wootTown' : 'someNetworkObject'}
 
         result = vmware.update_network(username='pat',
                                        machine_name='myCentOS',
                                        new_network='wootTown')
 
         self.assertTrue(result is None)
+        fake_change_network.assert_called_with(fake_vm, 'someNetworkObject')
 
     @patch.object(vmware.virtual_machine, 'change_network')
-    @patch.object(vmware.virtual_machine, 'get_info')
+    @patch.object(vmware.inventory, 'find_vm')
     @patch.object(vmware, 'consume_task')
-    @patch.object(vmware, 'vCenter')
-    def test_update_network_no_vm(self, fake_vCenter, fake_consume_task, fake_get_info, fake_change_network):
+    @patch.object(vmware.session_pool, 'session')
+    def test_update_network_no_vm(self, fake_session, fake_consume_task, fake_find_vm, fake_change_network):
         """``update_network`` Raises ValueError if the supplied VM doesn't exist"""
-        fake_logger = MagicMock()
-        fake_vm = MagicMock()
-        fake_vm.name = 'myCentOS'
-        fake_folder = MagicMock()
-        fake_folder.childEntity = [fake_vm]
-        fake_vCenter.return_value.__enter__.return_value.get_by_name.return_value = fake_folder
-        fake_vCenter.return_value.__enter__.return_value.networks = {'wootTown' : 'someNetworkObject'}
-        fake_get_info.return_value = {'meta': {'component' : 'CentOS'}}
+        fake_find_vm.return_value = None
+        fake_session.return_value.__enter__.return_value.networks = {'wootTown' : 'someNetworkObject'}
 
         with self.assertRaises(ValueError):
             vmware.update_network(username='pat',
@@ -217,25 +664,18 @@ class TestVMware(unittest.TestCase):
                                   new_network='wootTown')
 
     @patch.object(vmware.virtual_machine, 'change_network')
-    @patch.object(vmware.virtual_machine, 'get_info')
+    @patch.object(vmware.inventory, 'find_vm')
     @patch.object(vmware, 'consume_task')
-    @patch.object(vmware, 'vCenter')
-    def test_update_network_no_network(self, fake_vCenter, fake_consume_task, fake_get_info, fake_change_network):
+    @patch.object(vmware.session_pool, 'session')
+    def test_update_network_no_network(self, fake_session, fake_consume_task, fake_find_vm, fake_change_network):
         """``update_network`` Raises ValueError if the supplied new network doesn't exist"""
-        fake_logger = MagicMock()
-        fake_vm = MagicMock()
-        fake_vm.name = 'myCentOS'
-        fake_folder = MagicMock()
-        fake_folder.childEntity = [fake_vm]
-        fake_vCenter.return_value.__enter__.return_value.get_by_name.return_value = fake_folder
-        fake_vCenter.return_value.__enter__.return_value.networks = {'wootTown' : 'someNetworkObject'}
-        fake_get_info.return_value = {'meta': {'component' : 'CentOS'}}
+        fake_find_vm.return_value = (MagicMock(), {'name': 'myCentOS', 'state': 'poweredOn', 'meta': {'component': 'CentOS'}})
+        fake_session.return_value.__enter__.return_value.networks = {'wootTown' : 'someNetworkObject'}
 
         with self.assertRaises(ValueError):
             vmware.update_network(username='pat',
                                   machine_name='myCentOS',
                                   new_network='dohNet')
 
-
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,115 @@
+# -*- coding: UTF-8 -*-
+"""
+A suite of tests for the functions in warm_pool.py
+"""
+import unittest
+from unittest.mock import patch, MagicMock
+
+from tests import resolve_without_index
+
+from vlab_centos_api.lib.worker import warm_pool
+
+
+class TestWarmPool(unittest.TestCase):
+    """A set of test cases for the warm_pool.py module"""
+
+    def setUp(self):
+        """Runs before every test case"""
+        resolve_without_index(self)
+
+    def test_parse_depths(self):
+        """``parse_depths`` maps the image and desktop flag to the number of VMs to keep warm"""
+        output = warm_pool.parse_depths('7:2, 7-desktop:1')
+        expected = {('7', False): 2, ('7', True): 1}
+
+        self.assertEqual(output, expected)
+
+    def test_parse_depths_empty(self):
+        """``parse_depths`` returns an empty dictionary when the warm pool is not configured"""
+        self.assertEqual(warm_pool.parse_depths(''), {})
+
+    def test_parse_depths_bad(self):
+        """``parse_depths`` raises ValueError for a bad setting"""
+        with self.assertRaises(ValueError):
+            warm_pool.parse_depths('7:lots')
+
+    def test_name_round_trip(self):
+        """``parse_name`` extracts the variant from a name created by ``make_name``"""
+        name = warm_pool.make_name('8.1', True)
+
+        self.assertEqual(warm_pool.parse_name(name), ('8.1', True))
+
+    def test_parse_name_other(self):
+        """``parse_name`` returns None for VMs that are not warm VMs"""
+        self.assertTrue(warm_pool.parse_name('myCentOS') is None)
+
+    def test_claim_not_configured(self):
+        """``claim`` does not touch vCenter for images without a warm pool"""
+        fake_vcenter = MagicMock()
+        with patch.object(warm_pool, 'DEPTHS', {}):
+            output = warm_pool.claim(fake_vcenter, '7', False, MagicMock())
+
+        self.assertTrue(output is None)
+        self.assertFalse(fake_vcenter.get_by_name.called)
+
+    @patch.object(warm_pool, 'consume_task')
+    @patch.object(warm_pool, 'census')
+    def test_claim_race(self, fake_census, fake_consume_task):
+        """``claim`` moves on to the next warm VM when another worker claimed the first one"""
+        first, second = MagicMock(), MagicMock()
+        props = {'name': 'centos-warm-7-cli-1234', 'meta': warm_pool.warm_meta('7', False), 'change_version': '1'}
+        fake_census.return_value = {('7', False): {'ready': [(first, props), (second, props)]}}
+        fake_consume_task.side_effect = [RuntimeError('ConcurrentAccess'), None]
+        with patch.object(warm_pool, 'DEPTHS', {('7', False): 2}):
+            output = warm_pool.claim(MagicMock(), '7', False, MagicMock())
+
+        self.assertTrue(output is second)
+
+    @patch.object(warm_pool, 'consume_task')
+    @patch.object(warm_pool, 'census')
+    def test_claim_empty(self, fake_census, fake_consume_task):
+        """``claim`` returns None when the warm pool is empty"""
+        fake_census.return_value = {('7', False): {'ready': []}}
+        with patch.object(warm_pool, 'DEPTHS', {('7', False): 2}):
+            output = warm_pool.claim(MagicMock(), '7', False, MagicMock())
+
+        self.assertTrue(output is None)
+
+    @patch.object(warm_pool, 'consume_task')
+    def test_assign(self, fake_consume_task):
+        """``assign`` returns True once the warm VM is the user's VM"""
+        fake_vm = MagicMock()
+        fake_folder = MagicMock()
+
+        self.assertTrue(warm_pool.assign(MagicMock(), fake_vm, fake_folder, 'myCentOS', MagicMock()))
+        fake_folder.MoveIntoFolder_Task.assert_called_with([fake_vm])
+        self.assertFalse(fake_vm.Destroy_Task.called)
+
+    @patch.object(warm_pool, 'consume_task')
+    def test_assign_fault(self, fake_consume_task):
+        """``assign`` destroys the claimed VM, and returns False when vCenter refuses to rename it"""
+        fake_vm = MagicMock()
+        fake_vm.Rename_Task.side_effect = warm_pool.vim.fault.DuplicateName()
+
+        self.assertFalse(warm_pool.assign(MagicMock(), fake_vm, MagicMock(), 'myCentOS', MagicMock()))
+        self.assertTrue(fake_vm.Destroy_Task.called)
+
+    @patch.object(warm_pool, 'consume_task')
+    def test_assign_task_failed(self, fake_consume_task):
+        """``assign`` returns False when the task to move the VM fails"""
+        fake_consume_task.side_effect = [None, RuntimeError('InvalidState'), None]
+
+        self.assertFalse(warm_pool.assign(MagicMock(), MagicMock(), MagicMock(), 'myCentOS', MagicMock()))
+
+    @patch.object(warm_pool.virtual_machine, 'power')
+    @patch.object(warm_pool, 'consume_task')
+    def test_reap(self, fake_consume_task, fake_power):
+        """``reap`` destroys claimed VMs that were abandoned"""
+        meta = {'claimed': 0}
+        entry = {'claimed': [(MagicMock(), {'name': 'centos-warm-7-cli-1234', 'meta': meta})]}
+
+        self.assertEqual(warm_pool.reap(entry, MagicMock()), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,16 +1,34 @@
 # -*- coding: UTF-8 -*-
 from flask import Flask
 from celery import Celery
+from celery.signals import before_task_publish
 
-from vlab_centos_api.lib import const
-from vlab_centos_api.lib.views import HealthView, CentOSView
+from vlab_centos_api.lib import const, routing, results, metrics, dedup, images
+from vlab_centos_api.lib.views import HealthView, CentOSView, MetricsView
 
 app = Flask(__name__)
-app.celery_app = Celery('centos', backend='rpc://', broker=const.VLAB_MESSAGE_BROKER)
+app.celery_app = Celery('centos', backend=const.VLAB_CENTOS_RESULT_BACKEND, broker=const.VLAB_MESSAGE_BROKER)
 app.celery_app.conf.broker_heartbeat = 0 #https://github.com/celery/celery/issues/4895
+routing.configure(app.celery_app)
+results.configure(app.celery_app)
+
+metrics.instrument_app(app)
+metrics.register(metrics.CacheCollector({'dedup': lambda: dedup.REQUESTS.stats,
+                                         'show_coalesce': lambda: dedup.SHOWS.stats,
+                                         'results': lambda: results.CACHE.stats}))
+# Once, before uWSGI forks; from then on each process' refresher keeps it current
+images.CATALOG.load()
+
+
+@before_task_publish.connect
+def stamp_sent(sender=None, headers=None, **kwargs):
+    """Count every task sent, and note when so the worker can tell how long it queued"""
+    metrics.task_sent(sender, headers)
+
 
 HealthView.register(app)
 CentOSView.register(app)
+MetricsView.register(app)
 
 
 if __name__ == '__main__':
@@ -24,6 +24,45 @@ DEFINED = OrderedDict([
             ('VLAB_URL', environ.get('VLAB_URL', 'https://localhost')),
             ('VLAB_CENTOS_IMAGES_DIR', environ.get('VLAB_CENTOS_IMAGES_DIR', '/images')),
             ('VLAB_VERIFY_TOKEN', environ.get('VLAB_VERIFY_TOKEN', False)),
+            ('VLAB_CENTOS_SESSION_POOL_SIZE', int(environ.get('VLAB_CENTOS_SESSION_POOL_SIZE', 4))),
+            ('VLAB_CENTOS_SESSION_CHECK_INTERVAL', int(environ.get('VLAB_CENTOS_SESSION_CHECK_INTERVAL', 60))),
+            ('VLAB_CENTOS_INVENTORY_CACHE', environ.get('VLAB_CENTOS_INVENTORY_CACHE', 'true').lower() == 'true'),
+            ('VLAB_CENTOS_INVENTORY_MAX_STALENESS', int(environ.get('VLAB_CENTOS_INVENTORY_MAX_STALENESS', 30))),
+            ('VLAB_CENTOS_WARM_POOL', environ.get('VLAB_CENTOS_WARM_POOL', '')),
+            ('VLAB_CENTOS_WARM_POOL_DIR', environ.get('VLAB_CENTOS_WARM_POOL_DIR', 'centos-warm-pool')),
+            ('VLAB_CENTOS_WARM_POOL_NETWORK', environ.get('VLAB_CENTOS_WARM_POOL_NETWORK', 'centos-warm-pool')),
+            ('VLAB_CENTOS_WARM_POOL_REFILL_INTERVAL', int(environ.get('VLAB_CENTOS_WARM_POOL_REFILL_INTERVAL', 300))),
+            ('VLAB_CENTOS_DEPLOY_MODE', environ.get('VLAB_CENTOS_DEPLOY_MODE', 'ova').lower()),
+            ('VLAB_CENTOS_TEMPLATE_DIR', environ.get('VLAB_CENTOS_TEMPLATE_DIR', 'centos-templates')),
+            ('VLAB_CENTOS_TEMPLATE_NETWORK', environ.get('VLAB_CENTOS_TEMPLATE_NETWORK', 'centos-warm-pool')),
+            ('VLAB_CENTOS_BULK_CONCURRENCY', int(environ.get('VLAB_CENTOS_BULK_CONCURRENCY', 4))),
+            ('VLAB_CENTOS_BULK_TIME_LIMIT', int(environ.get('VLAB_CENTOS_BULK_TIME_LIMIT', 7200))),
+            ('VLAB_CENTOS_WAIT_FOR_IP', environ.get('VLAB_CENTOS_WAIT_FOR_IP', 'true').lower() == 'true'),
+            ('VLAB_CENTOS_IP_TIMEOUT', int(environ.get('VLAB_CENTOS_IP_TIMEOUT', 600))),
+            ('VLAB_CENTOS_IMAGE_CHECK_INTERVAL', int(environ.get('VLAB_CENTOS_IMAGE_CHECK_INTERVAL', 60))),
+            ('VLAB_CENTOS_OVA_CACHE_SIZE', int(environ.get('VLAB_CENTOS_OVA_CACHE_SIZE', 8))),
+            ('VLAB_CENTOS_LOOKUP_TTL', int(environ.get('VLAB_CENTOS_LOOKUP_TTL', 300))),
+            ('VLAB_CENTOS_PLACEMENT_POLICY', environ.get('VLAB_CENTOS_PLACEMENT_POLICY', 'least-loaded').lower()),
+            ('VLAB_CENTOS_PLACEMENT_TTL', int(environ.get('VLAB_CENTOS_PLACEMENT_TTL', 60))),
+            ('VLAB_CENTOS_DEPLOY_LIMIT_DATASTORE', int(environ.get('VLAB_CENTOS_DEPLOY_LIMIT_DATASTORE', 2))),
+            ('VLAB_CENTOS_DEPLOY_LIMIT_HOST', int(environ.get('VLAB_CENTOS_DEPLOY_LIMIT_HOST', 4))),
+            ('VLAB_CENTOS_DEPLOY_RETRY', int(environ.get('VLAB_CENTOS_DEPLOY_RETRY', 15))),
+            ('VLAB_CENTOS_DEPLOY_FAIL_OPEN', environ.get('VLAB_CENTOS_DEPLOY_FAIL_OPEN', 'false').lower() == 'true'),
+            ('VLAB_CENTOS_DEPLOY_WAIT', int(environ.get('VLAB_CENTOS_DEPLOY_WAIT', 3600))),
+            ('VLAB_CENTOS_DEDUP_TTL', int(environ.get('VLAB_CENTOS_DEDUP_TTL', 900))),
+            ('VLAB_CENTOS_DEDUP_REDIS', environ.get('VLAB_CENTOS_DEDUP_REDIS', '')),
+            ('VLAB_CENTOS_SHOW_COALESCE', float(environ.get('VLAB_CENTOS_SHOW_COALESCE', 2))),
+            ('VLAB_CENTOS_RESULT_BACKEND', environ.get('VLAB_CENTOS_RESULT_BACKEND', 'rpc://')),
+            ('VLAB_CENTOS_RESULT_EXPIRES', int(environ.get('VLAB_CENTOS_RESULT_EXPIRES', 3600))),
+            ('VLAB_CENTOS_RESULT_COMPRESSION', environ.get('VLAB_CENTOS_RESULT_COMPRESSION', '')),
+            ('VLAB_CENTOS_METRICS_PORT', int(environ.get('VLAB_CENTOS_METRICS_PORT', 0))),
+            ('VLAB_CENTOS_PROFILE', environ.get('VLAB_CENTOS_PROFILE', 'false').lower() == 'true'),
+            ('VLAB_CENTOS_PROFILE_INTERVAL', float(environ.get('VLAB_CENTOS_PROFILE_INTERVAL', 0.005))),
+            ('VLAB_CENTOS_PROFILE_THRESHOLD', float(environ.get('VLAB_CENTOS_PROFILE_THRESHOLD', 5))),
+            ('VLAB_CENTOS_PROFILE_DIR', environ.get('VLAB_CENTOS_PROFILE_DIR', '/tmp/centos-profiles')),
+            ('VLAB_CENTOS_READY_TTL', int(environ.get('VLAB_CENTOS_READY_TTL', 10))),
+            ('VLAB_CENTOS_READY_TIMEOUT', float(environ.get('VLAB_CENTOS_READY_TIMEOUT', 1))),
+            ('VLAB_CENTOS_SESSIONS_DIR', environ.get('VLAB_CENTOS_SESSIONS_DIR', '/tmp/centos-sessions')),
           ])
 
 Constants = namedtuple('Constants', list(DEFINED.keys()))
@@ -0,0 +1,281 @@
+# -*- coding: UTF-8 -*-
+"""
+Answer a retried request with the task of the original request.
+
+A client that times out waiting on a response will often send the same request
+again, with the same ``X-REQUEST-ID`` header. Without deduplication, that's a
+second deploy (or delete) of the same VM. Instead, the API remembers which
+task each (user, request ID, task name) was sent as, for ``ttl`` seconds, and
+returns that task for a repeat. The retry can land on any uwsgi process of any
+replica, so with ``VLAB_CENTOS_DEDUP_REDIS`` set, that memory is kept in Redis.
+
+Requests without an ``X-REQUEST-ID`` are never deduplicated.
+
+Separately, ``SingleFlight`` lets every ``centos.show`` for the same user
+within a short window share one task (and so one crawl of vCenter), no matter
+the request ID; i.e. a dashboard refreshing in several browser tabs at once.
+A create or delete stops the sharing in every process, through the same Redis.
+"""
+import time
+import threading
+import collections
+
+import redis
+import ujson
+from vlab_api_common import get_logger
+
+from vlab_centos_api.lib import const
+
+
+logger = get_logger(__name__, loglevel=const.VLAB_CENTOS_LOG_LEVEL)
+NO_ID = 'noId'
+MAX_ENTRIES = 10000
+
+
+class RequestLog(object):
+    """Maps recent requests to the ID of the task they were sent as
+
+    Given a Redis client, the map lives in Redis, so a retry is recognized by
+    every API process (and replica), not just the one that took the original
+    request. Without one, each process keeps a map of its own.
+
+    :param ttl: How many seconds to remember a request for
+    :type ttl: Integer
+
+    :param max_entries: The most requests a process remembers; the oldest are forgotten first
+    :type max_entries: Integer
+
+    :param client: Where to share the map between processes
+    :type client: redis.StrictRedis
+    """
+    def __init__(self, ttl=900, max_entries=MAX_ENTRIES, client=None):
+        self._ttl = ttl
+        self._max_entries = max_entries
+        self._client = client
+        self._lock = threading.Lock()
+        # (username, txn_id, task_name) -> (task_id, recorded at)
+        self._entries = collections.OrderedDict()
+        self.stats = collections.Counter(hits=0, misses=0)
+
+    def claim(self, username, txn_id, task_name, task_id):
+        """Record the task a request is about to be sent as, unless an identical
+        request already was
+
+        Claiming is atomic; of several identical requests, exactly one gets its
+        own ``task_id`` back, and should send the task.
+
+        :Returns: String, the ID of the task that owns the request
+
+        :param username: The user making the request
+        :type username: String
+
+        :param txn_id: The value of the X-REQUEST-ID header
+        :type txn_id: String
+
+        :param task_name: The name of the Celery task, i.e. "centos.create"
+        :type task_name: String
+
+        :param task_id: The ID to send the task with
+        :type task_id: String
+        """
+        if txn_id == NO_ID:
+            return task_id
+        key = (username, txn_id, task_name)
+        if self._client is None:
+            owner = self._claim_local(key, task_id)
+        else:
+            owner = self._claim_shared(key, task_id)
+        with self._lock:
+            if owner == task_id:
+                self.stats['misses'] += 1
+            else:
+                self.stats['hits'] += 1
+        return owner
+
+    def release(self, username, txn_id, task_name):
+        """Forget a claimed request, i.e. because sending its task failed
+
+        :Returns: None
+
+        :param username: The user making the request
+        :type username: String
+
+        :param txn_id: The value of the X-REQUEST-ID header
+        :type txn_id: String
+
+        :param task_name: The name of the Celery task, i.e. "centos.create"
+        :type task_name: String
+        """
+        if txn_id == NO_ID:
+            return
+        key = (username, txn_id, task_name)
+        if self._client is None:
+            with self._lock:
+                self._entries.pop(key, None)
+            return
+        try:
+            self._client.delete(_redis_key('request', key))
+        except redis.RedisError as doh:
+            logger.warning('Unable to release request {}: {}'.format(txn_id, doh))
+
+    def _claim_local(self, key, task_id):
+        """Claim a request in the map of this process"""
+        with self._lock:
+            self._expire()
+            entry = self._entries.get(key, None)
+            if entry is not None:
+                return entry[0]
+            self._entries[key] = (task_id, time.time())
+            while len(self._entries) > self._max_entries:
+                self._entries.popitem(last=False)
+            return task_id
+
+    def _claim_shared(self, key, task_id):
+        """Claim a request in Redis; when Redis is down, the request isn't deduplicated"""
+        try:
+            return _set_once(self._client, _redis_key('request', key), task_id, ex=self._ttl)
+        except redis.RedisError as doh:
+            logger.warning('Unable to deduplicate request {}: {}'.format(key[1], doh))
+            return task_id
+
+    def _expire(self):
+        """Forget the requests older than the TTL; the caller must hold the lock"""
+        oldest = time.time() - self._ttl
+        while self._entries:
+            key, (_, recorded) = next(iter(self._entries.items()))
+            if recorded > oldest:
+                break
+            self._entries.popitem(last=False)
+
+
+class SingleFlight(object):
+    """Shares one task between identical requests made within a few seconds
+
+    Like ``RequestLog``, given a Redis client the shared tasks live in Redis;
+    requests share a task no matter which API process they land on, and
+    ``forget`` reaches every process.
+
+    :param window: How many seconds a task is shared for; zero to never share
+    :type window: Float
+
+    :param client: Where to share tasks between processes
+    :type client: redis.StrictRedis
+    """
+    def __init__(self, window=2, client=None):
+        self._window = window
+        self._client = client
+        self._lock = threading.Lock()
+        # key -> (task_id, sent at)
+        self._in_flight = {}
+        self.stats = collections.Counter(hits=0, misses=0)
+
+    def claim(self, key, task_id):
+        """Share a task with the identical requests that follow, unless an
+        identical request moments ago already did
+
+        :Returns: String, the ID of the task to share
+
+        :param key: What identifies identical requests, like the username
+        :type key: String
+
+        :param task_id: The ID to send the task with
+        :type task_id: String
+        """
+        if self._window <= 0:
+            return task_id
+        if self._client is None:
+            owner = self._claim_local(key, task_id)
+        else:
+            owner = self._claim_shared(key, task_id)
+        with self._lock:
+            if owner == task_id:
+                self.stats['misses'] += 1
+            else:
+                self.stats['hits'] += 1
+        return owner
+
+    def forget(self, key):
+        """Stop sharing a task, i.e. because the answer is about to change
+
+        :Returns: None
+
+        :param key: What identifies identical requests, like the username
+        :type key: String
+        """
+        if self._client is None:
+            with self._lock:
+                self._in_flight.pop(key, None)
+            return
+        try:
+            self._client.delete(_redis_key('show', [key]))
+        except redis.RedisError as doh:
+            logger.warning('Unable to stop sharing the task of {}: {}'.format(key, doh))
+
+    def _claim_local(self, key, task_id):
+        """Claim the task to share in the map of this process"""
+        with self._lock:
+            now = time.time()
+            entry = self._in_flight.get(key, None)
+            if entry is not None and now - entry[1] < self._window:
+                return entry[0]
+            self._in_flight[key] = (task_id, now)
+            if len(self._in_flight) > MAX_ENTRIES:
+                self._in_flight = {k: v for k, v in self._in_flight.items() if now - v[1] < self._window}
+            return task_id
+
+    def _claim_shared(self, key, task_id):
+        """Claim the task to share in Redis; when Redis is down, nothing is shared"""
+        try:
+            return _set_once(self._client, _redis_key('show', [key]), task_id, px=int(self._window * 1000))
+        except redis.RedisError as doh:
+            logger.warning('Unable to share the task of {}: {}'.format(key, doh))
+            return task_id
+
+
+def connect(url):
+    """Make a client for the Redis that API processes share dedup state in
+
+    :Returns: redis.StrictRedis, or None when there's no URL
+
+    :param url: Where Redis is, i.e. "redis://centos-results:6379/1"
+    :type url: String
+    """
+    if not url:
+        return None
+    return redis.StrictRedis.from_url(url, socket_connect_timeout=1, socket_timeout=1)
+
+
+def _redis_key(kind, key):
+    """The name in Redis of a key, i.e. a (username, txn_id, task_name); the txn_id is client supplied, so it's quoted"""
+    return 'centos:{}:{}'.format(kind, ujson.dumps(list(key)))
+
+
+def _set_once(client, name, task_id, **expiry):
+    """Atomically set a key in Redis unless it's already set
+
+    :Returns: String, the task ID the key ends up holding
+
+    :param client: The Redis to set the key in
+    :type client: redis.StrictRedis
+
+    :param name: The key
+    :type name: String
+
+    :param task_id: The value to set
+    :type task_id: String
+
+    :param expiry: When the key expires; the ``ex`` or ``px`` of ``SET``
+    :type expiry: Dictionary
+    """
+    if client.set(name, task_id, nx=True, **expiry):
+        return task_id
+    owner = client.get(name)
+    if owner is None:
+        # The key expired between the SET and the GET
+        return task_id
+    return owner.decode()
+
+
+STORE = connect(const.VLAB_CENTOS_DEDUP_REDIS)
+REQUESTS = RequestLog(ttl=const.VLAB_CENTOS_DEDUP_TTL, client=STORE)
+SHOWS = SingleFlight(window=const.VLAB_CENTOS_SHOW_COALESCE, client=STORE)
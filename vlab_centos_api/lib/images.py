@@ -0,0 +1,321 @@
+# -*- coding: UTF-8 -*-
+"""
+An in-memory index of the CentOS OVAs that can be deployed.
+
+``VLAB_CENTOS_IMAGES_DIR`` is usually an NFS mount, so listing it on every
+``centos.image`` call (and opening an OVA just to find out it does not exist)
+puts a round trip to the file server on the hot path. The catalog instead maps
+(version, desktop) to the OVA's path, size and mtime, and only looks at the
+directory again once ``check_interval`` seconds have passed. Even then, the
+directory is only listed again if its mtime changed (i.e. an OVA was added,
+removed or renamed); otherwise just the OVAs already known are stat'ed, which
+catches an OVA that was overwritten in place.
+
+When NFS fails (i.e. ESTALE or EIO), the catalog keeps serving what it last
+knew, and reports the error via ``health``.
+
+inotify is not used because it does not see changes made by other NFS clients.
+
+The catalog is shared by the worker (to validate and find OVAs) and the API
+(to answer ``GET /api/2/inf/centos/image`` without a task). In the API, a
+background thread keeps the catalog current, so requests (and the readiness
+probe) never wait on NFS.
+"""
+import os
+import time
+import hashlib
+import threading
+
+import ujson
+
+from vlab_centos_api.lib import const
+
+
+DESKTOP_PREFIX = 'CentOS-desktop-'
+PREFIX = 'CentOS-'
+
+
+def parse_name(filename):
+    """Extract the (version, desktop) of an OVA from its file name.
+
+    OVA files are named ``CentOS-<version>.ova`` or ``CentOS-desktop-<version>.ova``.
+
+    :Returns: Tuple, or None if the file isn't a CentOS OVA
+
+    :param filename: The name of a file in the images directory
+    :type filename: String
+    """
+    if not filename.endswith('.ova'):
+        return None
+    if filename.startswith(DESKTOP_PREFIX):
+        return filename[len(DESKTOP_PREFIX):-len('.ova')], True
+    elif filename.startswith(PREFIX):
+        return filename[len(PREFIX):-len('.ova')], False
+    return None
+
+
+class ImageCatalog(object):
+    """Tracks the OVAs in a directory.
+
+    Looking at the directory happens outside of the lock that guards the index,
+    so a slow (or hung) NFS mount never blocks a reader; once the background
+    refresher is running, readers never touch the directory at all.
+
+    :param images_dir: The directory that contains the OVAs
+    :type images_dir: String
+
+    :param check_interval: The fewest seconds between looking at the directory
+    :type check_interval: Integer
+    """
+    def __init__(self, images_dir, check_interval=60):
+        self._images_dir = images_dir
+        self._check_interval = check_interval
+        # Guards the state below; never held while touching the directory
+        self._lock = threading.Lock()
+        # Only one thread looks at the directory at a time
+        self._io_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._index = {}
+        self._found = False
+        self._etag = ''
+        self._dir_mtime = None
+        self._generation = 0
+        self._checked_at = 0
+        self._synced_at = 0
+        self._error = None
+        self._pid = None
+        self._thread = None
+
+    def lookup(self, version, desktop):
+        """Find the OVA for a version of CentOS
+
+        The returned dictionary has the keys ``path``, ``size`` and ``mtime``.
+
+        :Returns: Dictionary, or None if there's no such image
+
+        :param version: The image/version of CentOS
+        :type version: String
+
+        :param desktop: True for the variant with a GUI
+        :type desktop: Boolean
+        """
+        self._refresh()
+        return self._index.get((version, desktop), None)
+
+    def versions(self):
+        """The versions of CentOS that can be deployed (with or without a GUI)
+
+        :Returns: List
+        """
+        self._refresh()
+        return sorted(set(version for version, _ in self._index.keys()))
+
+    def available(self):
+        """Tells you if the images directory exists; the API container might not
+        have the images mounted.
+
+        :Returns: Boolean
+        """
+        self._refresh()
+        return self._found
+
+    @property
+    def etag(self):
+        """Changes whenever the list of versions changes
+
+        :Returns: String
+        """
+        self._refresh()
+        return self._etag
+
+    def health(self):
+        """How current the catalog is, for a readiness probe
+
+        Reports on the last look at the directory, without looking again. The
+        catalog is stale when it's failed to look at the directory for more
+        than twice ``check_interval``; i.e. a hung NFS mount. Not having the
+        images mounted at all is fine; the API asks a worker instead.
+
+        :Returns: Dictionary
+        """
+        with self._lock:
+            age = time.time() - self._synced_at
+            return {'ok': self._error is None and age <= 2 * self._check_interval,
+                    'mounted': self._found,
+                    'versions': len(set(version for version, _ in self._index.keys())),
+                    'age': round(age, 1),
+                    'error': self._error,
+                   }
+
+    def load(self):
+        """Look at the directory now, whether or not it's due; i.e. when the API
+        starts, before the refresher takes over
+
+        :Returns: None
+        """
+        self._refresh(force=True)
+
+    def start_refresher(self):
+        """Keep the catalog current in a background thread, once per process.
+
+        :Returns: None
+        """
+        # uWSGI & Celery fork their workers; threads don't survive a fork
+        if self._managed():
+            return
+        with self._lock:
+            if self._managed():
+                return
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._refresh_forever, name='image-catalog', daemon=True)
+            self._thread.start()
+
+    def _managed(self):
+        """True when this process' refresher thread keeps the catalog current"""
+        return self._pid == os.getpid() and self._thread is not None and self._thread.is_alive()
+
+    def _refresh_forever(self):
+        """Look at the images directory every ``check_interval`` seconds, or
+        sooner when invalidated
+
+        :Returns: None
+        """
+        while True:
+            self._refresh(force=True)
+            self._wake.wait(self._check_interval)
+            self._wake.clear()
+
+    def invalidate(self):
+        """Look at the directory again on the next lookup (or right away, when
+        the refresher is running)"""
+        with self._lock:
+            self._checked_at = 0
+            self._dir_mtime = None
+            self._generation += 1
+        self._wake.set()
+
+    def _refresh(self, force=False):
+        """Update the index if it's due a check. Errors reading the directory
+        are recorded for ``health``, and the last good index is kept.
+
+        Without ``force``, nothing happens when the refresher is running, and
+        nothing waits on another thread that's already looking at the directory
+        (unless the catalog has never been loaded).
+
+        :Returns: None
+
+        :param force: Look at the directory whether or not it's due
+        :type force: Boolean
+        """
+        if not force and (self._managed() or time.time() - self._checked_at < self._check_interval):
+            return
+        if not self._io_lock.acquire(blocking=force or self._checked_at == 0):
+            # another thread is already looking; serve what we have
+            return
+        try:
+            with self._lock:
+                if not force and time.time() - self._checked_at < self._check_interval:
+                    # another thread refreshed while we waited on the lock
+                    return
+                index, dir_mtime, generation = self._index, self._dir_mtime, self._generation
+            try:
+                found, dir_mtime, index = self._update(index, dir_mtime)
+            except OSError as doh:
+                with self._lock:
+                    self._error = '{}'.format(doh)
+                    self._checked_at = time.time()
+                return
+            versions = sorted(set(version for version, _ in index.keys()))
+            etag = hashlib.md5(ujson.dumps(versions).encode()).hexdigest()
+            with self._lock:
+                self._index, self._found, self._etag = index, found, etag
+                self._error = None
+                self._synced_at = time.time()
+                if generation == self._generation:
+                    self._dir_mtime = dir_mtime
+                    self._checked_at = self._synced_at
+        finally:
+            self._io_lock.release()
+
+    def _update(self, index, dir_mtime):
+        """Rescan the directory if it changed, otherwise re-stat the OVAs already
+        in the index. Touches the directory, but none of the catalog's state.
+
+        :Returns: Tuple (found, dir_mtime, index)
+
+        :Raises: OSError
+
+        :param index: The OVAs already known
+        :type index: Dictionary
+
+        :param dir_mtime: The mtime of the directory when it was last scanned
+        :type dir_mtime: Float
+        """
+        try:
+            new_mtime = os.stat(self._images_dir).st_mtime
+        except FileNotFoundError:
+            return False, None, {}
+        if new_mtime == dir_mtime:
+            try:
+                return True, dir_mtime, self._restat(index)
+            except FileNotFoundError:
+                # removed without the directory changing, as far as NFS told us
+                pass
+        return True, new_mtime, self._scan()
+
+    @staticmethod
+    def _restat(index):
+        """Refresh the size and mtime of every OVA in the index
+
+        :Returns: Dictionary
+
+        :Raises: OSError
+
+        :param index: The OVAs already known
+        :type index: Dictionary
+        """
+        updated = {}
+        for variant, entry in index.items():
+            info = os.stat(entry['path'])
+            updated[variant] = {'path': entry['path'],
+                                'size': info.st_size,
+                                'mtime': info.st_mtime,
+                               }
+        return updated
+
+    def _scan(self):
+        """Stat every OVA in the images directory
+
+        :Returns: Dictionary
+        """
+        index = {}
+        with os.scandir(self._images_dir) as entries:
+            for entry in entries:
+                variant = parse_name(entry.name)
+                if variant is None:
+                    continue
+                info = entry.stat()
+                index[variant] = {'path': entry.path,
+                                  'size': info.st_size,
+                                  'mtime': info.st_mtime,
+                                 }
+        return index
+
+
+CATALOG = ImageCatalog(const.VLAB_CENTOS_IMAGES_DIR, const.VLAB_CENTOS_IMAGE_CHECK_INTERVAL)
+
+
+def lookup(version, desktop):
+    """Find the OVA for a version of CentOS, via the worker's catalog
+
+    :Returns: Dictionary, or None if there's no such image
+    """
+    return CATALOG.lookup(version, desktop)
+
+
+def versions():
+    """The versions of CentOS that can be deployed, via the worker's catalog
+
+    :Returns: List
+    """
+    return CATALOG.versions()
@@ -0,0 +1,298 @@
+# -*- coding: UTF-8 -*-
+"""
+Prometheus metrics for the API and the worker.
+
+The worker records how long each phase of an operation takes (i.e. the OVA
+upload vs. the power on of ``centos.create``), how many SOAP calls it makes to
+vCenter and how long they take, and for every task, how long it sat in the queue
+vs. how long it ran. The API records every task it sends, how long its own
+requests take, and the hit rates of its caches.
+
+The API serves the metrics at ``/api/1/inf/centos/metrics``. The worker serves
+them on ``VLAB_CENTOS_METRICS_PORT`` (zero to not serve them). Celery runs tasks
+in child processes, so the worker needs ``PROMETHEUS_MULTIPROC_DIR`` set to an
+empty directory for the children to share their metrics with the exporter.
+"""
+import os
+import time
+import shutil
+import functools
+import collections
+from contextlib import contextmanager
+
+from flask import g, request
+from prometheus_client import Counter, Histogram, CollectorRegistry, REGISTRY, CONTENT_TYPE_LATEST
+from prometheus_client import generate_latest, start_http_server, multiprocess
+from prometheus_client.core import CounterMetricFamily
+
+
+# From a quick SOAP call to a 30 minute OVA import
+PHASE_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1200, 1800, float('inf'))
+CALL_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, float('inf'))
+
+PHASE_SECONDS = Histogram('centos_phase_seconds',
+                          'Seconds spent in each phase of an operation',
+                          ['operation', 'phase'],
+                          buckets=PHASE_BUCKETS)
+VCENTER_CALLS = Counter('centos_vcenter_calls',
+                        'SOAP calls made to vCenter, by method or property',
+                        ['call'])
+VCENTER_SECONDS = Histogram('centos_vcenter_call_seconds',
+                            'Seconds each SOAP call to vCenter took',
+                            ['call'],
+                            buckets=CALL_BUCKETS)
+TASKS_SENT = Counter('centos_tasks_sent',
+                     'Tasks sent to the broker',
+                     ['task'])
+TASK_QUEUE_SECONDS = Histogram('centos_task_queue_seconds',
+                               'Seconds between a task being sent (or its countdown ending) and a worker starting it',
+                               ['task'],
+                               buckets=PHASE_BUCKETS)
+TASK_RUN_SECONDS = Histogram('centos_task_run_seconds',
+                             'Seconds a worker spent running a task',
+                             ['task', 'state'],
+                             buckets=PHASE_BUCKETS)
+REQUEST_SECONDS = Histogram('centos_api_request_seconds',
+                            'Seconds the API took to answer a request',
+                            ['method', 'endpoint', 'status'],
+                            buckets=CALL_BUCKETS)
+
+
+class Phases(object):
+    """Times the back-to-back phases of one operation, like creating a VM
+
+    :param operation: What's being timed, i.e. "create"
+    :type operation: String
+    """
+    def __init__(self, operation):
+        self.operation = operation
+        self.timings = collections.OrderedDict()
+        self._started = time.time()
+        self._mark = self._started
+
+    def done(self, phase):
+        """Record that a phase just ended; it started when the last one ended
+
+        :Returns: Float
+
+        :param phase: The name of the phase, i.e. "power_on"
+        :type phase: String
+        """
+        now = time.time()
+        seconds = now - self._mark
+        self._mark = now
+        self.timings[phase] = seconds
+        PHASE_SECONDS.labels(self.operation, phase).observe(seconds)
+        return seconds
+
+    @property
+    def elapsed(self):
+        """The number of seconds since the operation started
+
+        :Returns: Float
+        """
+        return time.time() - self._started
+
+    def __str__(self):
+        return ', '.join('{} {:.1f}s'.format(phase, seconds) for phase, seconds in self.timings.items())
+
+
+@contextmanager
+def phase(operation, name):
+    """Time a single phase of an operation, i.e. opening an OVA
+
+    :Returns: Generator
+
+    :param operation: What's being timed, i.e. "import_ova"
+    :type operation: String
+
+    :param name: The name of the phase, i.e. "open"
+    :type name: String
+    """
+    with PHASE_SECONDS.labels(operation, name).time():
+        yield
+
+
+def instrument(service_instance):
+    """Count and time every SOAP call made with a vCenter session
+
+    Property reads (like ``vm.name``) are counted too; they're a SOAP call each.
+
+    :Returns: None
+
+    :param service_instance: The connection of a vCenter session, i.e. ``vcenter._conn``
+    :type service_instance: vim.ServiceInstance
+    """
+    stub = service_instance._stub
+    invoke = stub.InvokeMethod
+
+    @functools.wraps(invoke)
+    def counted(mo, info, args, *more):
+        VCENTER_CALLS.labels(info.name).inc()
+        with VCENTER_SECONDS.labels(info.name).time():
+            return invoke(mo, info, args, *more)
+    stub.InvokeMethod = counted
+
+
+def task_sent(task_name, headers):
+    """Count a task being sent, and stamp when it was sent
+
+    :Returns: None
+
+    :param task_name: The name of the Celery task, i.e. "centos.create"
+    :type task_name: String
+
+    :param headers: The (mutable) headers of the task message
+    :type headers: Dictionary
+    """
+    TASKS_SENT.labels(task_name).inc()
+    headers['sent_at'] = time.time()
+
+
+def task_started(task_name, sent_at, eta=None):
+    """Record how long a task waited in the queue
+
+    :Returns: Float, the time the task started
+
+    :param task_name: The name of the Celery task, i.e. "centos.create"
+    :type task_name: String
+
+    :param sent_at: The epoch time the task was sent, or None if it's unknown
+    :type sent_at: Float
+
+    :param eta: The epoch time the task was not to run before, if it had a countdown
+    :type eta: Float
+    """
+    now = time.time()
+    if sent_at is not None:
+        TASK_QUEUE_SECONDS.labels(task_name).observe(max(now - max(sent_at, eta or 0), 0))
+    return now
+
+
+def task_finished(task_name, started, state):
+    """Record how long a task ran for
+
+    :Returns: None
+
+    :param task_name: The name of the Celery task, i.e. "centos.create"
+    :type task_name: String
+
+    :param started: The epoch time the task started
+    :type started: Float
+
+    :param state: How the task ended, i.e. "SUCCESS"
+    :type state: String
+    """
+    TASK_RUN_SECONDS.labels(task_name, state).observe(time.time() - started)
+
+
+def instrument_app(flask_app):
+    """Time every request the API answers
+
+    :Returns: None
+
+    :param flask_app: The API
+    :type flask_app: flask.Flask
+    """
+    @flask_app.before_request
+    def start_timer():
+        g.metrics_started = time.time()
+
+    @flask_app.after_request
+    def record_timing(response):
+        started = g.get('metrics_started', None)
+        if started is not None:
+            # The rule, not the path, so VM names don't become labels
+            endpoint = request.url_rule.rule if request.url_rule else 'unmatched'
+            REQUEST_SECONDS.labels(request.method, endpoint, response.status_code).observe(time.time() - started)
+        return response
+
+
+class CacheCollector(object):
+    """Exposes the hit & miss counts of the caches in this process
+
+    :param caches: A mapping of cache name to a function that returns its ``stats`` Counter
+    :type caches: Dictionary
+    """
+    def __init__(self, caches):
+        self._caches = caches
+
+    def collect(self):
+        family = CounterMetricFamily('centos_cache_lookups',
+                                     'Lookups of the in-memory caches, by outcome',
+                                     labels=['cache', 'outcome'])
+        for name, stats in sorted(self._caches.items()):
+            for outcome, count in sorted(stats().items()):
+                family.add_metric([name, outcome], count)
+        yield family
+
+
+COLLECTORS = []
+
+
+def register(collector):
+    """Add a collector of this process' own metrics, like ``CacheCollector``
+
+    :Returns: None
+
+    :param collector: Anything with a ``collect`` method that yields metric families
+    :type collector: Object
+    """
+    COLLECTORS.append(collector)
+    REGISTRY.register(collector)
+
+
+def registry():
+    """The registry to serve metrics from; every process' metrics in multiprocess mode
+
+    :Returns: prometheus_client.CollectorRegistry
+    """
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        the_registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(the_registry)
+        for collector in COLLECTORS:
+            the_registry.register(collector)
+        return the_registry
+    return REGISTRY
+
+
+def exposition():
+    """Render every metric in the Prometheus text format
+
+    :Returns: Tuple (bytes, content type)
+    """
+    return generate_latest(registry()), CONTENT_TYPE_LATEST
+
+
+def serve(port):
+    """Serve the metrics over HTTP from a background thread, i.e. in the worker
+
+    In multiprocess mode, the directory is (re)made empty even when metrics
+    aren't served; every process records its metrics there regardless, and
+    fails to if it doesn't exist.
+
+    :Returns: None
+
+    :param port: The TCP port to listen on; zero to not serve metrics
+    :type port: Integer
+    """
+    directory = os.environ.get('PROMETHEUS_MULTIPROC_DIR')
+    if directory:
+        # Clear out metrics left over from before a restart
+        shutil.rmtree(directory, ignore_errors=True)
+        os.makedirs(directory)
+    if not port:
+        return
+    start_http_server(port, registry=registry())
+
+
+def process_exited(pid):
+    """Drop the live-only metrics of a worker child process that exited
+
+    :Returns: None
+
+    :param pid: The process ID of the child
+    :type pid: Integer
+    """
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        multiprocess.mark_process_dead(pid)
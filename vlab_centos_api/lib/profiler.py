@@ -0,0 +1,265 @@
+# -*- coding: UTF-8 -*-
+"""
+Opt-in profiling of API requests and worker tasks.
+
+With ``VLAB_CENTOS_PROFILE=true``, a thread samples the stack of every request
+and task in flight, every ``VLAB_CENTOS_PROFILE_INTERVAL`` seconds. The samples
+are of wall-clock time, so time spent waiting (on vCenter, a lock, or reading an
+OVA) shows up in the stack that's waiting, right next to time spent computing
+(like pyVmomi parsing a SOAP response).
+
+When a request or task takes longer than ``VLAB_CENTOS_PROFILE_THRESHOLD``
+seconds, its samples are written to ``VLAB_CENTOS_PROFILE_DIR``; one "folded"
+stack per line, followed by how many times it was sampled. That's what
+flamegraph.pl and speedscope read. Files are named for when the work started,
+what it was (i.e. "centos.create") and its X-REQUEST-ID.
+"""
+import os
+import re
+import sys
+import time
+import functools
+import threading
+import collections
+from contextlib import contextmanager
+
+from flask import request
+from vlab_api_common import get_logger
+
+from vlab_centos_api.lib import const
+
+
+logger = get_logger(__name__, loglevel=const.VLAB_CENTOS_LOG_LEVEL)
+
+
+class Profile(object):
+    """The stack samples of one request or task
+
+    :param name: What's being profiled, i.e. "centos.create"
+    :type name: String
+
+    :param txn_id: The X-REQUEST-ID of the request
+    :type txn_id: String
+
+    :param thread_id: The thread doing the work
+    :type thread_id: Integer
+    """
+    def __init__(self, name, txn_id, thread_id):
+        self.name = name
+        self.txn_id = txn_id
+        self.thread_id = thread_id
+        self.started = time.time()
+        self.stacks = collections.Counter()
+
+    @property
+    def samples(self):
+        """How many times the stack was sampled"""
+        return sum(self.stacks.values())
+
+    def add(self, frame):
+        """Record one sample of the stack
+
+        :Returns: None
+
+        :param frame: The innermost frame of the thread doing the work
+        :type frame: frame
+        """
+        names = []
+        while frame is not None:
+            names.append(_label(frame.f_code))
+            frame = frame.f_back
+        self.stacks[';'.join(reversed(names))] += 1
+
+    def folded(self):
+        """The samples, in the "folded" format of flame graphs
+
+        :Returns: String
+        """
+        return ''.join('{} {}\n'.format(stack, count) for stack, count in sorted(self.stacks.items()))
+
+
+class Sampler(object):
+    """Samples the stacks of the threads being profiled, from a thread of its own
+
+    The thread only wakes up while something is being profiled, and is started
+    again in a process that forked (i.e. a Celery worker child).
+
+    :param interval: Seconds between samples
+    :type interval: Float
+    """
+    def __init__(self, interval):
+        self.interval = interval
+        self._cond = threading.Condition()
+        self._profiles = {}
+        self._thread = None
+        self._pid = None
+
+    def start(self, name, txn_id):
+        """Begin profiling the calling thread
+
+        :Returns: Profile
+
+        :param name: What's being profiled, i.e. "centos.create"
+        :type name: String
+
+        :param txn_id: The X-REQUEST-ID of the request
+        :type txn_id: String
+        """
+        profile = Profile(name, txn_id, threading.get_ident())
+        with self._cond:
+            if self._pid != os.getpid() or not self._thread.is_alive():
+                self._pid = os.getpid()
+                self._thread = threading.Thread(target=self._run, name='profiler', daemon=True)
+                self._thread.start()
+            self._profiles[profile.thread_id] = profile
+            self._cond.notify()
+        return profile
+
+    def stop(self, profile):
+        """Stop profiling a thread
+
+        :Returns: None
+
+        :param profile: What ``start`` returned
+        :type profile: Profile
+        """
+        with self._cond:
+            if self._profiles.get(profile.thread_id) is profile:
+                del self._profiles[profile.thread_id]
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._profiles:
+                    self._cond.wait()
+                profiles = list(self._profiles.values())
+            frames = sys._current_frames()
+            for profile in profiles:
+                frame = frames.get(profile.thread_id, None)
+                if frame is not None:
+                    profile.add(frame)
+            del frames
+            time.sleep(self.interval)
+
+
+SAMPLER = Sampler(const.VLAB_CENTOS_PROFILE_INTERVAL)
+
+
+def start(name, txn_id):
+    """Begin profiling the calling thread, if profiling is turned on
+
+    :Returns: Profile, or None when profiling is off
+
+    :param name: What's being profiled, i.e. "centos.create"
+    :type name: String
+
+    :param txn_id: The X-REQUEST-ID of the request
+    :type txn_id: String
+    """
+    if not const.VLAB_CENTOS_PROFILE:
+        return None
+    return SAMPLER.start(name, txn_id)
+
+
+def finish(profile):
+    """Stop profiling, and write the samples to disk if it took too long
+
+    :Returns: String, the file the samples were written to (None if they weren't)
+
+    :param profile: What ``start`` returned
+    :type profile: Profile
+    """
+    if profile is None:
+        return None
+    SAMPLER.stop(profile)
+    elapsed = time.time() - profile.started
+    if elapsed < const.VLAB_CENTOS_PROFILE_THRESHOLD:
+        return None
+    try:
+        path = dump(profile, const.VLAB_CENTOS_PROFILE_DIR)
+    except OSError as doh:
+        logger.warning('Unable to save profile of {} {}: {}'.format(profile.name, profile.txn_id, doh))
+        return None
+    logger.info('{} {} took {:.1f}s; profile saved to {}'.format(profile.name, profile.txn_id, elapsed, path))
+    return path
+
+
+@contextmanager
+def profile(name, txn_id):
+    """Profile the body of a ``with`` statement
+
+    :Returns: Generator, yielding the Profile (None when profiling is off)
+
+    :param name: What's being profiled, i.e. "centos.create"
+    :type name: String
+
+    :param txn_id: The X-REQUEST-ID of the request
+    :type txn_id: String
+    """
+    the_profile = start(name, txn_id)
+    try:
+        yield the_profile
+    finally:
+        finish(the_profile)
+
+
+def view(func):
+    """Decorate a Flask handler, to profile each request it handles
+
+    :Returns: Function
+
+    :param func: The handler
+    :type func: Function
+    """
+    name = func.__qualname__
+
+    @functools.wraps(func)
+    def inner(*args, **kwargs):
+        with profile(name, request.headers.get('X-REQUEST-ID', 'noId')):
+            return func(*args, **kwargs)
+    return inner
+
+
+def dump(profile, directory):
+    """Write the samples of a profile to a file
+
+    :Returns: String, the path of the file
+
+    :param profile: What ``start`` returned
+    :type profile: Profile
+
+    :param directory: Where to write the file
+    :type directory: String
+    """
+    os.makedirs(directory, exist_ok=True)
+    file_name = '{}-{}-{}-{}-{}.folded'.format(time.strftime('%Y%m%dT%H%M%S', time.gmtime(profile.started)),
+                                               _safe(profile.name),
+                                               _safe(profile.txn_id),
+                                               os.getpid(),
+                                               profile.thread_id)
+    path = os.path.join(directory, file_name)
+    with open(path, 'w') as the_file:
+        the_file.write(profile.folded())
+    return path
+
+
+def _safe(value):
+    """Make a (client supplied) value fit for the name of a file"""
+    return re.sub(r'[^A-Za-z0-9_.-]', '_', value)[:64]
+
+
+@functools.lru_cache(maxsize=4096)
+def _label(code):
+    """How a function appears in a flame graph, i.e. "wait_for_ip (vlab_centos_api/lib/worker/task_waiter.py:69)" """
+    file_name = code.co_filename
+    for prefix in _path_prefixes():
+        if file_name.startswith(prefix):
+            file_name = file_name[len(prefix):]
+            break
+    return '{} ({}:{})'.format(code.co_name, file_name, code.co_firstlineno)
+
+
+@functools.lru_cache(maxsize=1)
+def _path_prefixes():
+    """The directories on sys.path, longest first, so labels show module paths"""
+    return sorted(set(os.path.join(x, '') for x in sys.path if x), key=len, reverse=True)
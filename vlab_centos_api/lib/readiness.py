@@ -0,0 +1,127 @@
+# -*- coding: UTF-8 -*-
+"""
+The deep checks behind the readiness probe, ``/api/1/inf/centos/healthcheck/ready``.
+
+Each check is cached for ``VLAB_CENTOS_READY_TTL`` seconds, so a load balancer
+probing every replica every few seconds costs (at most) one check per TTL:
+
+* broker - Can the API connect to the message broker, to send tasks?
+* sessions - Are the workers' pools of vCenter sessions healthy? Workers answer
+  from what their pools already know, so the probe never calls vCenter. No
+  worker replying is a warning, not a failure.
+* images - Is the catalog of OVAs current?
+"""
+import time
+import threading
+import collections
+
+from vlab_centos_api.lib import const, images
+
+
+class Check(object):
+    """Runs a check at most once per ``ttl`` seconds, and remembers the answer
+
+    A check that raises an exception failed; the error is the answer.
+
+    :param func: The check; takes the Celery app, and returns a Dictionary with an "ok" key
+    :type func: Function
+
+    :param ttl: How many seconds to remember the answer
+    :type ttl: Integer
+    """
+    def __init__(self, func, ttl):
+        self._func = func
+        self._ttl = ttl
+        self._lock = threading.Lock()
+        self._answer = None
+        self._checked_at = 0
+
+    def result(self, celery_app):
+        """The (cached) answer of the check
+
+        :Returns: Dictionary
+
+        :param celery_app: The Celery application of the API
+        :type celery_app: celery.Celery
+        """
+        with self._lock:
+            if self._answer is None or time.time() - self._checked_at >= self._ttl:
+                try:
+                    self._answer = self._func(celery_app)
+                except Exception as doh:
+                    self._answer = {'ok': False, 'error': '{}'.format(doh)}
+                self._checked_at = time.time()
+            return self._answer
+
+
+class Readiness(object):
+    """Every check of the readiness probe
+
+    :param ttl: How many seconds to remember the answer of each check
+    :type ttl: Integer
+    """
+    def __init__(self, ttl):
+        self._checks = collections.OrderedDict([('broker', Check(broker, ttl)),
+                                                ('sessions', Check(sessions, ttl)),
+                                                ('images', Check(catalog, ttl)),
+                                               ])
+
+    def report(self, celery_app):
+        """Run (or remember) every check
+
+        :Returns: Tuple (Boolean, Dictionary), if every check is OK, and the answer of each
+
+        :param celery_app: The Celery application of the API
+        :type celery_app: celery.Celery
+        """
+        answers = collections.OrderedDict((name, check.result(celery_app)) for name, check in self._checks.items())
+        return all(x['ok'] for x in answers.values()), answers
+
+
+def broker(celery_app):
+    """Check that the message broker accepts connections
+
+    :Returns: Dictionary
+
+    :param celery_app: The Celery application of the API
+    :type celery_app: celery.Celery
+    """
+    with celery_app.connection_for_write(connect_timeout=const.VLAB_CENTOS_READY_TIMEOUT) as conn:
+        conn.ensure_connection(max_retries=1, interval_start=0)
+    return {'ok': True}
+
+
+def sessions(celery_app):
+    """Ask every worker how its pool of vCenter sessions is doing
+
+    Workers answer with ``tasks.centos_sessions``.
+
+    :Returns: Dictionary
+
+    :param celery_app: The Celery application of the API
+    :type celery_app: celery.Celery
+    """
+    replies = celery_app.control.broadcast('centos_sessions', reply=True, timeout=const.VLAB_CENTOS_READY_TIMEOUT)
+    workers = {}
+    for reply in replies or []:
+        workers.update(reply)
+    if not workers:
+        # Workers busy with deploys can be slow to reply; that's no reason to pull every API replica
+        return {'ok': True, 'warning': 'No workers replied', 'workers': {}}
+    return {'ok': all(x.get('ok', False) for x in workers.values()), 'workers': workers}
+
+
+def catalog(celery_app):
+    """Check that the catalog of OVAs is current
+
+    :Returns: Dictionary
+
+    :param celery_app: Unused; every check takes the Celery app
+    :type celery_app: celery.Celery
+    """
+    # The refresher looks at the directory; the probe only reads the last result
+    images.CATALOG.start_refresher()
+    return images.CATALOG.health()
+
+
+READINESS = Readiness(const.VLAB_CENTOS_READY_TTL)
@@ -0,0 +1,92 @@
+# -*- coding: UTF-8 -*-
+"""
+Where task results are stored, and a cache of the finished ones in the API.
+
+With the ``rpc://`` result backend, a result is sent back to the process that
+sent the task, so only that one API process can answer a status poll. Setting
+``VLAB_CENTOS_RESULT_BACKEND`` to a shared store (i.e. ``redis://host:6379/0``)
+lets any number of API replicas answer the polls. Results are kept for
+``VLAB_CENTOS_RESULT_EXPIRES`` seconds.
+
+Once a task has finished its result never changes, so the API keeps finished
+results in memory; polling a task more than once after it's done does not
+touch the result backend (or the broker) again. Every task has an ID of its
+own, so this cache can't serve a stale ``show``; a poll that lands on another
+process just reads the shared backend once. Sharing a ``show`` task between
+requests (and stopping once a create or delete changes the answer) is
+``dedup.SingleFlight``, in Redis.
+"""
+import time
+import threading
+import collections
+
+from vlab_centos_api.lib import const
+
+
+READY_STATES = ('SUCCESS', 'FAILURE')
+MAX_ENTRIES = 5000
+
+
+def configure(celery_app):
+    """Set the result backend, how long results live, and how they're serialized
+
+    :Returns: None
+
+    :param celery_app: The Celery application of the API or the worker
+    :type celery_app: celery.Celery
+    """
+    celery_app.conf.result_backend = const.VLAB_CENTOS_RESULT_BACKEND
+    celery_app.conf.result_expires = const.VLAB_CENTOS_RESULT_EXPIRES
+    celery_app.conf.result_serializer = 'json'
+    celery_app.conf.result_accept_content = ['json']
+    # Only store the result; not the args, worker name, etc.
+    celery_app.conf.result_extended = False
+    celery_app.conf.result_compression = const.VLAB_CENTOS_RESULT_COMPRESSION or None
+
+
+class ResultCache(object):
+    """Remembers the result of every finished task, for a while
+
+    :param ttl: How many seconds to remember a result for
+    :type ttl: Integer
+
+    :param max_entries: The most results to remember; the oldest are forgotten first
+    :type max_entries: Integer
+    """
+    def __init__(self, ttl=3600, max_entries=MAX_ENTRIES):
+        self._ttl = ttl
+        self._max_entries = max_entries
+        self._lock = threading.Lock()
+        # task_id -> (status, result, finished at)
+        self._entries = collections.OrderedDict()
+        self.stats = collections.Counter(hits=0, misses=0)
+
+    def status(self, celery_app, task_id):
+        """Obtain the status of a task, and its result if it worked
+
+        :Returns: Tuple (status, result)
+
+        :param celery_app: The Celery application of the API
+        :type celery_app: celery.Celery
+
+        :param task_id: The ID of the task
+        :type task_id: String
+        """
+        with self._lock:
+            entry = self._entries.get(task_id, None)
+            if entry is not None and time.time() - entry[2] < self._ttl:
+                self.stats['hits'] += 1
+                return entry[0], entry[1]
+            self.stats['misses'] += 1
+        async_result = celery_app.AsyncResult(task_id)
+        status = async_result.status
+        result = async_result.result if status == 'SUCCESS' else None
+        if status in READY_STATES:
+            with self._lock:
+                self._entries[task_id] = (status, result, time.time())
+                while len(self._entries) > self._max_entries:
+                    self._entries.popitem(last=False)
+        return status, result
+
+
+CACHE = ResultCache(ttl=const.VLAB_CENTOS_RESULT_EXPIRES)
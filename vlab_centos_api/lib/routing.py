@@ -0,0 +1,64 @@
+# -*- coding: UTF-8 -*-
+"""
+Which Celery queue, and with what priority, each CentOS task is sent to.
+
+A handful of 10 minute deploys on one shared queue would starve the sub-second
+``centos.show`` calls behind them. Instead, tasks are split by how long they
+take, so each queue can have its own pool of workers:
+
+- ``centos-read`` - read only tasks that finish in about a second
+- ``centos-change`` - deletes and network changes; seconds, not minutes
+- ``centos-deploy`` - anything that creates VMs; minutes
+
+Within a queue, a higher priority (0 - 9) is delivered first; i.e. a user
+waiting on a new VM goes ahead of a warm pool refill.
+
+Both the API and the worker call ``configure`` on their Celery app, so the
+queues get declared the same way no matter which side declares them first.
+"""
+from kombu import Queue
+
+
+MAX_PRIORITY = 9
+READ_QUEUE = 'centos-read'
+CHANGE_QUEUE = 'centos-change'
+DEPLOY_QUEUE = 'centos-deploy'
+
+ROUTES = {'centos.show': {'queue': READ_QUEUE, 'priority': 9},
+          'centos.image': {'queue': READ_QUEUE, 'priority': 5},
+          'centos.delete': {'queue': CHANGE_QUEUE, 'priority': 7},
+          'centos.modify_network': {'queue': CHANGE_QUEUE, 'priority': 7},
+          'centos.bulk_delete': {'queue': CHANGE_QUEUE, 'priority': 5},
+          'centos.create': {'queue': DEPLOY_QUEUE, 'priority': 8},
+          'centos.bulk_create': {'queue': DEPLOY_QUEUE, 'priority': 6},
+          'centos.build_template': {'queue': DEPLOY_QUEUE, 'priority': 3},
+          'centos.refill_warm_pool': {'queue': DEPLOY_QUEUE, 'priority': 1},
+         }
+
+
+def options(task_name):
+    """The ``send_task`` keyword arguments that route a task to its queue
+
+    :Returns: Dictionary
+
+    :param task_name: The name of the Celery task, i.e. "centos.show"
+    :type task_name: String
+    """
+    return dict(ROUTES[task_name])
+
+
+def configure(celery_app):
+    """Declare the queues, and route every task to its queue
+
+    :Returns: None
+
+    :param celery_app: The Celery application of the API or the worker
+    :type celery_app: celery.Celery
+    """
+    names = sorted(set(x['queue'] for x in ROUTES.values()))
+    celery_app.conf.task_queues = [Queue(x, routing_key=x, queue_arguments={'x-max-priority': MAX_PRIORITY})
+                                   for x in names]
+    # Covers the tasks sent without explicit options, like ``modify_network``
+    # from the base MachineView
+    celery_app.conf.task_routes = ROUTES
+    celery_app.conf.task_default_priority = 5
@@ -2,6 +2,9 @@
 """
 Defines the RESTful API for the CentOS service
 """
+import uuid
+import hashlib
+
 import ujson
 from flask import current_app
 from flask_classy import request, route, Response
@@ -10,7 +13,7 @@ from vlab_inf_common.vmware import vCenter, vim
 from vlab_api_common import describe, get_logger, requires, validate_input
 
 
-from vlab_centos_api.lib import const
+from vlab_centos_api.lib import const, images, routing, dedup, results, profiler
 
 
 logger = get_logger(__name__, loglevel=const.VLAB_CENTOS_LOG_LEVEL)
@@ -20,6 +23,7 @@ class CentOSView(MachineView):
     """API end point for working with CentOS VMs"""
     route_base = '/api/2/inf/centos'
     RESROUCE = 'centos'
+    decorators = [profiler.view]
     POST_SCHEMA = { "$schema": "http://json-schema.org/draft-04/schema#",
                     "type": "object",
                     "description": "Create a centos",
@@ -56,6 +60,37 @@ class CentOSView(MachineView):
                     },
                     "required": ["name", "image", "network"]
                   }
+    BULK_SCHEMA = {"$schema": "http://json-schema.org/draft-04/schema#",
+                   "type": "object",
+                   "description": "Create many CentOS instances with one request",
+                   "properties": {
+                       "machines": {
+                           "description": "The CentOS instances to create; each item is the same as the body to create one instance",
+                           "type": "array",
+                           "minItems": 1,
+                           "items": POST_SCHEMA
+                       }
+                   },
+                   "required": ["machines"]
+                  }
+    BULK_DELETE_SCHEMA = {"$schema": "http://json-schema.org/draft-04/schema#",
+                          "type": "object",
+                          "description": "Destroy many CentOS instances with one request",
+                          "properties": {
+                              "names": {
+                                  "description": "The names of the CentOS instances to destroy",
+                                  "type": "array",
+                                  "minItems": 1,
+                                  "items": {"type": "string"}
+                              },
+                              "all": {
+                                  "description": "Destroy every CentOS instance you own",
+                                  "type": "boolean",
+                                  "enum": [True]
+                              }
+                          },
+                          "oneOf": [{"required": ["names"]}, {"required": ["all"]}]
+                         }
     DELETE_SCHEMA = {"$schema": "http://json-schema.org/draft-04/schema#",
                      "description": "Destroy a CentOS",
                      "type": "object",
@@ -82,11 +117,23 @@ class CentOSView(MachineView):
         username = kwargs['token']['username']
         txn_id = request.headers.get('X-REQUEST-ID', 'noId')
         resp_data = {'user' : username}
-        task = current_app.celery_app.send_task('centos.show', [username, txn_id])
-        resp_data['content'] = {'task-id': task.id}
+        # Identical shows moments apart (like several browser tabs) share one task
+        task_id = str(uuid.uuid4())
+        owner = dedup.SHOWS.claim(username, task_id)
+        if owner == task_id:
+            try:
+                task = current_app.celery_app.send_task('centos.show', [username, txn_id], task_id=task_id,
+                                                        **routing.options('centos.show'))
+            except Exception:
+                dedup.SHOWS.forget(username)
+                raise
+            task_id = task.id
+        else:
+            task_id = owner
+        resp_data['content'] = {'task-id': task_id}
         resp = Response(ujson.dumps(resp_data))
         resp.status_code = 202
-        resp.headers.add('Link', '<{0}{1}/task/{2}>; rel=status'.format(const.VLAB_URL, self.route_base, task.id))
+        resp.headers.add('Link', '<{0}{1}/task/{2}>; rel=status'.format(const.VLAB_URL, self.route_base, task_id))
         return resp
 
     @requires(verify=const.VLAB_VERIFY_TOKEN, version=2)
@@ -103,18 +150,59 @@ class CentOSView(MachineView):
         ram = body.get('ram', 4)
         cpu_count = body.get('cpu-count', 4)
         network = '{}_{}'.format(username, body['network'])
-        task = current_app.celery_app.send_task('centos.create', [username,
-                                                                  machine_name,
-                                                                  image,
-                                                                  network,
-                                                                  desktop,
-                                                                  ram,
-                                                                  cpu_count,
-                                                                  txn_id])
-        resp_data['content'] = {'task-id': task.id}
+        task_id = send_once('centos.create', [username,
+                                              machine_name,
+                                              image,
+                                              network,
+                                              desktop,
+                                              ram,
+                                              cpu_count,
+                                              txn_id], username, txn_id)
+        resp_data['content'] = {'task-id': task_id}
         resp = Response(ujson.dumps(resp_data))
         resp.status_code = 202
-        resp.headers.add('Link', '<{0}{1}/task/{2}>; rel=status'.format(const.VLAB_URL, self.route_base, task.id))
+        resp.headers.add('Link', '<{0}{1}/task/{2}>; rel=status'.format(const.VLAB_URL, self.route_base, task_id))
+        return resp
+
+    @route('/bulk', methods=["POST"])
+    @requires(verify=const.VLAB_VERIFY_TOKEN, version=2)
+    @describe(post=BULK_SCHEMA, delete=BULK_DELETE_SCHEMA)
+    @validate_input(schema=BULK_SCHEMA)
+    def bulk(self, *args, **kwargs):
+        """Create many CentOS instances, tracked by a single task"""
+        username = kwargs['token']['username']
+        txn_id = request.headers.get('X-REQUEST-ID', 'noId')
+        resp_data = {'user' : username}
+        machines = []
+        for body in kwargs['body']['machines']:
+            machines.append({'name': body['name'],
+                             'image': body['image'],
+                             'desktop': body.get('desktop', False),
+                             'ram': body.get('ram', 4),
+                             'cpu-count': body.get('cpu-count', 4),
+                             'network': '{}_{}'.format(username, body['network'])})
+        task_id = send_once('centos.bulk_create', [username, machines, txn_id], username, txn_id)
+        resp_data['content'] = {'task-id': task_id}
+        resp = Response(ujson.dumps(resp_data))
+        resp.status_code = 202
+        resp.headers.add('Link', '<{0}{1}/task/{2}>; rel=status'.format(const.VLAB_URL, self.route_base, task_id))
+        return resp
+
+    @route('/bulk', methods=["DELETE"])
+    @requires(verify=const.VLAB_VERIFY_TOKEN, version=2)
+    @validate_input(schema=BULK_DELETE_SCHEMA)
+    def bulk_delete(self, *args, **kwargs):
+        """Destroy many CentOS instances, tracked by a single task"""
+        username = kwargs['token']['username']
+        txn_id = request.headers.get('X-REQUEST-ID', 'noId')
+        resp_data = {'user' : username}
+        # None means "every CentOS instance the user owns"
+        machine_names = kwargs['body'].get('names', None)
+        task_id = send_once('centos.bulk_delete', [username, machine_names, txn_id], username, txn_id)
+        resp_data['content'] = {'task-id': task_id}
+        resp = Response(ujson.dumps(resp_data))
+        resp.status_code = 202
+        resp.headers.add('Link', '<{0}{1}/task/{2}>; rel=status'.format(const.VLAB_URL, self.route_base, task_id))
         return resp
 
     @requires(verify=const.VLAB_VERIFY_TOKEN, version=2)
@@ -125,11 +213,11 @@ class CentOSView(MachineView):
         txn_id = request.headers.get('X-REQUEST-ID', 'noId')
         resp_data = {'user' : username}
         machine_name = kwargs['body']['name']
-        task = current_app.celery_app.send_task('centos.delete', [username, machine_name, txn_id])
-        resp_data['content'] = {'task-id': task.id}
+        task_id = send_once('centos.delete', [username, machine_name, txn_id], username, txn_id)
+        resp_data['content'] = {'task-id': task_id}
         resp = Response(ujson.dumps(resp_data))
         resp.status_code = 202
-        resp.headers.add('Link', '<{0}{1}/task/{2}>; rel=status'.format(const.VLAB_URL, self.route_base, task.id))
+        resp.headers.add('Link', '<{0}{1}/task/{2}>; rel=status'.format(const.VLAB_URL, self.route_base, task_id))
         return resp
 
     @route('/image', methods=["GET"])
@@ -140,9 +228,91 @@ class CentOSView(MachineView):
         username = kwargs['token']['username']
         txn_id = request.headers.get('X-REQUEST-ID', 'noId')
         resp_data = {'user' : username}
-        task = current_app.celery_app.send_task('centos.image', [txn_id])
+        images.CATALOG.start_refresher()
+        if images.CATALOG.available():
+            # The images are mounted in the API too; no need to bother a worker.
+            # The body echoes the user, so one user's ETag mustn't match another's
+            etag = hashlib.md5('{}:{}'.format(username, images.CATALOG.etag).encode()).hexdigest()
+            if request.if_none_match.contains(etag):
+                resp = Response(status=304)
+            else:
+                resp_data['content'] = {'image': images.CATALOG.versions()}
+                resp = Response(ujson.dumps(resp_data))
+                resp.status_code = 200
+                resp.headers['Content-Type'] = 'application/json'
+            resp.set_etag(etag)
+            resp.headers['Cache-Control'] = 'private, max-age={}'.format(const.VLAB_CENTOS_IMAGE_CHECK_INTERVAL)
+            resp.headers['Vary'] = 'X-Auth'
+            return resp
+        task = current_app.celery_app.send_task('centos.image', [txn_id], **routing.options('centos.image'))
         resp_data['content'] = {'task-id': task.id}
         resp = Response(ujson.dumps(resp_data))
         resp.status_code = 202
         resp.headers.add('Link', '<{0}{1}/task/{2}>; rel=status'.format(const.VLAB_URL, self.route_base, task.id))
         return resp
+
+    @route('/task', methods=["GET"])
+    @route('/task/<tid>', methods=["GET"])
+    @requires(verify=const.VLAB_VERIFY_TOKEN, version=2)
+    @describe(get_args=MachineView.TASK_ARGS)
+    def handle_task(self, *args, **kwargs):
+        """End point for checking the status of Celery tasks
+
+        Same as ``TaskView.handle_task``, except the results of finished tasks
+        are served from memory after the first poll.
+        """
+        resp = {'user': kwargs['token']['username'], 'content' : {}}
+        if request.args.get('task-id', None) and kwargs.get('tid', None):
+            resp['error'] = 'task-id supplied in URL and as param'
+            return ujson.dumps(resp), 400
+
+        task_id = request.args.get('task-id', kwargs.get('tid', None))
+        if task_id is None:
+            resp['error'] = "no task id provided"
+            return ujson.dumps(resp), 400
+
+        status, result = results.CACHE.status(current_app.celery_app, task_id)
+        resp['content']['status'] = status
+        if status == 'SUCCESS':
+            resp.update(result)
+            if result['error']:
+                resp['error'] = result['error']
+                return ujson.dumps(resp), 400
+            return ujson.dumps(result), 200
+        elif status == 'FAILURE':
+            return ujson.dumps(resp), 500
+        else:
+            return ujson.dumps(resp), 202
+
+
+def send_once(task_name, args, username, txn_id):
+    """Send a task, unless a retry of the same request already sent it
+
+    :Returns: String
+
+    :param task_name: The name of the Celery task, i.e. "centos.create"
+    :type task_name: String
+
+    :param args: The arguments of the task
+    :type args: List
+
+    :param username: The user making the request
+    :type username: String
+
+    :param txn_id: The value of the X-REQUEST-ID header
+    :type txn_id: String
+    """
+    task_id = str(uuid.uuid4())
+    owner = dedup.REQUESTS.claim(username, txn_id, task_name, task_id)
+    if owner != task_id:
+        logger.info('Request {} is a retry; returning task {}'.format(txn_id, owner))
+        return owner
+    try:
+        task = current_app.celery_app.send_task(task_name, args, task_id=task_id, **routing.options(task_name))
+    except Exception:
+        # Let a retry of the request try again
+        dedup.REQUESTS.release(username, txn_id, task_name)
+        raise
+    # A shared show from before this change would be stale
+    dedup.SHOWS.forget(username)
+    return task.id
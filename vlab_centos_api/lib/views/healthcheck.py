@@ -6,10 +6,23 @@ from time import time
 import pkg_resources
 
 import ujson
+from flask import current_app
 from flask_classy import FlaskView, Response
 from vlab_inf_common.vmware import vCenter
 
-from vlab_centos_api.lib import const
+from vlab_centos_api.lib import const, readiness
+
+
+def _version():
+    """Looking up the version walks every installed package; only do it once"""
+    try:
+        return pkg_resources.get_distribution('vlab-centos-api').version
+    except pkg_resources.DistributionNotFound:
+        return 'unknown'
+
+
+VERSION = _version()
+HEALTHY = ujson.dumps({'version': VERSION})
 
 
 class HealthView(FlaskView):
@@ -21,10 +34,15 @@ class HealthView(FlaskView):
 
     def get(self):
         """End point for health checks"""
-        resp = {}
-        status = 200
-        resp['version'] = pkg_resources.get_distribution('vlab-centos-api').version
-        response = Response(ujson.dumps(resp))
-        response.status_code = status
+        response = Response(HEALTHY)
+        response.status_code = 200
+        response.headers['Content-Type'] = 'application/json'
+        return response
+
+    def ready(self):
+        """End point for readiness checks; can this replica do its job?"""
+        ok, checks = readiness.READINESS.report(current_app.celery_app)
+        response = Response(ujson.dumps({'version': VERSION, 'ready': ok, 'checks': checks}))
+        response.status_code = 200 if ok else 503
         response.headers['Content-Type'] = 'application/json'
         return response
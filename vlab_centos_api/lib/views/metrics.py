@@ -0,0 +1,23 @@
+# -*- coding: UTF-8 -*-
+"""
+Enables Prometheus to scrape the metrics of the API
+"""
+from flask_classy import FlaskView, Response
+
+from vlab_centos_api.lib import metrics
+
+
+class MetricsView(FlaskView):
+    """
+    End point for Prometheus to scrape
+    """
+    route_base = '/api/1/inf/centos/metrics'
+    trailing_slash = False
+
+    def get(self):
+        """End point for the metrics of this API process"""
+        body, content_type = metrics.exposition()
+        response = Response(body)
+        response.status_code = 200
+        response.headers['Content-Type'] = content_type
+        return response
@@ -0,0 +1,276 @@
+# -*- coding: UTF-8 -*-
+"""
+Limit how many OVA imports run at once against each datastore and ESXi host.
+
+When a burst of ``centos.create`` tasks all start importing at the same time,
+they saturate the storage and every import slows to a crawl. Instead, an import
+must first hold a slot for its datastore *and* its host. There are
+``VLAB_CENTOS_DEPLOY_LIMIT_DATASTORE`` slots per datastore, and
+``VLAB_CENTOS_DEPLOY_LIMIT_HOST`` slots per host (zero means no limit).
+
+The slots are shared by every worker via the message broker. Each slot is a
+RabbitMQ queue named ``centos.deploy-slot.<moId>.<index>``, and holding a slot
+means having declared that queue as ``exclusive`` on a connection we keep open.
+The broker refuses to let a second connection declare the same exclusive queue,
+and deletes it once the connection holding it closes; so a worker that dies
+mid-deploy can never leak a slot.
+
+Placement ranks every datastore & host, so ``first_free`` takes the slots of
+the best placement that has them free, instead of waiting on the one the policy
+liked best. When every slot of every candidate is taken, ``Busy`` is raised.
+The caller is expected to give up its worker and try again later (see
+``tasks.create``), rather than block until the task hits its time limit.
+
+When the broker can't be reached, no slot can be held, so ``Unreachable`` (a
+kind of ``Busy``) is raised; the limits hold even while the broker struggles.
+``VLAB_CENTOS_DEPLOY_FAIL_OPEN=true`` lets deploys run without a slot instead.
+
+A lock is just a single slot; ``exclusive`` uses one to stop two workers from
+creating the same VM at the same time.
+"""
+import contextlib
+
+import kombu
+from vlab_api_common import get_logger
+
+from vlab_centos_api.lib import const
+
+
+logger = get_logger(__name__, loglevel=const.VLAB_CENTOS_LOG_LEVEL)
+
+SLOT_PREFIX = 'centos.deploy-slot'
+
+
+class Busy(Exception):
+    """Every deploy slot of a datastore or host is taken
+
+    :param resource: The name of the datastore or host
+    :type resource: String
+    """
+    def __init__(self, resource):
+        super(Busy, self).__init__('Every deploy slot for {} is in use'.format(resource))
+        self.resource = resource
+
+
+class Unreachable(Busy):
+    """The broker that hands out the slots can't be reached
+
+    :param resource: The name of the datastore, host or lock
+    :type resource: String
+
+    :param error: Why the broker can't be reached
+    :type error: Exception
+    """
+    def __init__(self, resource, error):
+        Exception.__init__(self, 'Unable to reach the broker for a slot of {}: {}'.format(resource, error))
+        self.resource = resource
+
+
+class Locked(ValueError):
+    """Another worker holds the lock"""
+
+
+class Admission(object):
+    """Hands out the deploy slots of datastores and hosts
+
+    :param broker: The URL of the message broker
+    :type broker: String
+
+    :param datastore_limit: The most imports per datastore, zero for no limit
+    :type datastore_limit: Integer
+
+    :param host_limit: The most imports per ESXi host, zero for no limit
+    :type host_limit: Integer
+
+    :param fail_open: Let deploys run without a slot when the broker can't be reached
+    :type fail_open: Boolean
+    """
+    def __init__(self, broker, datastore_limit=2, host_limit=4, fail_open=False):
+        self._broker = broker
+        self._datastore_limit = datastore_limit
+        self._host_limit = host_limit
+        self._fail_open = fail_open
+
+    @contextlib.contextmanager
+    def slots(self, placement):
+        """Hold a slot for the datastore and host of a deploy
+
+        :Returns: Generator
+
+        :Raises: Busy, Unreachable
+
+        :param placement: Where the VM is being deployed
+        :type placement: vlab_centos_api.lib.worker.placement.Placement
+        """
+        with self.first_free([placement]):
+            yield
+
+    @contextlib.contextmanager
+    def first_free(self, placements):
+        """Hold the slots of the first placement whose datastore and host both
+        have one free
+
+        A datastore or host found full isn't asked again for a later placement.
+        ``Busy`` is only raised once every placement was full; it's about the
+        first one, the one the placement policy liked best.
+
+        :Returns: Generator, yielding the Placement the slots are held for
+
+        :Raises: Busy, Unreachable
+
+        :param placements: Where the VM could be deployed, best first
+        :type placements: Iterable
+        """
+        busy = None
+        full = set()
+        for placement in placements:
+            if placement.datastore_name in full or placement.host_name in full:
+                continue
+            try:
+                held = self._hold(placement)
+            except Unreachable:
+                raise
+            except Busy as doh:
+                full.add(doh.resource)
+                busy = busy or doh
+                continue
+            try:
+                yield placement
+            finally:
+                for conn in held:
+                    _close(conn)
+            return
+        if busy is None:
+            raise ValueError('Nowhere to deploy the VM')
+        raise busy
+
+    def _hold(self, placement):
+        """Take a slot for the datastore and the host of one placement
+
+        :Returns: List, the connections holding the slots
+
+        :Raises: Busy, Unreachable
+
+        :param placement: Where the VM is being deployed
+        :type placement: vlab_centos_api.lib.worker.placement.Placement
+        """
+        wanted = [(placement.datastore._moId, placement.datastore_name, self._datastore_limit),
+                  (placement.host._moId, placement.host_name, self._host_limit)]
+        held = []
+        try:
+            for moid, name, limit in wanted:
+                if not limit:
+                    continue
+                conn = self._acquire(moid, limit, name)
+                if conn is None:
+                    raise Busy(name)
+                held.append(conn)
+        except Exception:
+            for conn in held:
+                _close(conn)
+            raise
+        return held
+
+    @contextlib.contextmanager
+    def exclusive(self, key, error):
+        """Hold a lock across every worker, i.e. while creating a VM
+
+        :Returns: Generator
+
+        :Raises: Locked, Unreachable
+
+        :param key: What's being locked
+        :type key: String
+
+        :param error: The message of the Locked error raised if another worker holds the lock
+        :type error: String
+        """
+        conn = self._acquire('lock.{}'.format(key), 1, key)
+        if conn is None:
+            raise Locked(error)
+        try:
+            yield
+        finally:
+            _close(conn)
+
+    def _acquire(self, key, limit, resource):
+        """Try every slot until one is free
+
+        :Returns: kombu.Connection, or None if every slot is taken
+
+        :Raises: Unreachable
+
+        :param key: What the slots are for, like the managed object ID of the datastore/host
+        :type key: String
+
+        :param limit: How many slots there are
+        :type limit: Integer
+
+        :param resource: The name of what the slots are for, for errors
+        :type resource: String
+        """
+        conn = kombu.Connection(self._broker)
+        try:
+            conn.connect()
+            for index in range(limit):
+                name = '{}.{}.{}'.format(SLOT_PREFIX, key, index)
+                channel = conn.channel()
+                try:
+                    channel.queue_declare(queue=name, exclusive=True, auto_delete=True)
+                except conn.channel_errors:
+                    # RESOURCE_LOCKED; another connection holds the slot, and
+                    # the broker closed the channel on us
+                    continue
+                return conn
+        except conn.connection_errors as doh:
+            if self._fail_open:
+                logger.warning('Unable to reach the broker for a slot of {}; going ahead without one: {}'.format(resource, doh))
+                return conn
+            _close(conn)
+            raise Unreachable(resource, doh)
+        _close(conn)
+        return None
+
+
+def _close(conn):
+    """Release a slot, ignoring a connection that's already gone"""
+    try:
+        conn.release()
+    except Exception:
+        pass
+
+
+ADMISSION = Admission(const.VLAB_MESSAGE_BROKER,
+                      datastore_limit=const.VLAB_CENTOS_DEPLOY_LIMIT_DATASTORE,
+                      host_limit=const.VLAB_CENTOS_DEPLOY_LIMIT_HOST,
+                      fail_open=const.VLAB_CENTOS_DEPLOY_FAIL_OPEN)
+
+
+def slots(placement):
+    """Hold a slot for the datastore and host of a deploy, via the worker's broker
+
+    :Returns: contextlib.ContextManager
+
+    :Raises: Busy, Unreachable
+    """
+    return ADMISSION.slots(placement)
+
+
+def first_free(placements):
+    """Hold the slots of the first placement with a free datastore and host, via the worker's broker
+
+    :Returns: contextlib.ContextManager
+
+    :Raises: Busy, Unreachable
+    """
+    return ADMISSION.first_free(placements)
+
+
+def exclusive(key, error):
+    """Hold a lock across every worker, via the worker's broker
+
+    :Returns: contextlib.ContextManager
+
+    :Raises: Locked, Unreachable
+    """
+    return ADMISSION.exclusive(key, error)
@@ -0,0 +1,318 @@
+# -*- coding: UTF-8 -*-
+"""
+Bulk lookups of a user's virtual machines.
+
+Calling ``virtual_machine.get_info`` per VM triggers a handful of lazy property
+fetches for every VM (plus a walk of every user network), so the cost of
+``centos.show`` grows with the number of VMs a user owns. The functions here
+pull everything we need for a whole folder with a single PropertyCollector
+``RetrieveContents`` call, and build the same dictionary ``get_info`` returns.
+"""
+import ssl
+import time
+import textwrap
+
+import ujson
+import OpenSSL
+from pyVmomi import vmodl
+from vlab_inf_common.vmware import vim
+
+from vlab_centos_api.lib import const
+
+
+VM_PROPERTIES = ['name', 'runtime.powerState', 'config.annotation', 'config.changeVersion',
+                 'guest.net', 'network']
+UNKNOWN_META = {'component': 'Unknown',
+                'created': 0,
+                'version': "Unknown",
+                'generation': 0,
+                'configured': False,
+               }
+
+
+def get_vms(vcenter, folder, username, component='CentOS'):
+    """Obtain info about every VM of a given component within a folder.
+
+    :Returns: Dictionary
+
+    :param vcenter: The vCenter object
+    :type vcenter: vlab_inf_common.vmware.vcenter.vCenter
+
+    :param folder: The user's folder of VMs
+    :type folder: vim.Folder
+
+    :param username: The name of the user who owns the folder
+    :type username: String
+
+    :param component: Only include VMs whose meta data has this component
+    :type component: String
+    """
+    vms, network_names = retrieve(vcenter, folder)
+    return render(vcenter, vms, network_names, username, component=component)
+
+
+def render(vcenter, vms, network_names, username, component='CentOS'):
+    """Build the ``get_info`` style dictionary for the VMs of a given component.
+
+    :Returns: Dictionary
+
+    :param vcenter: The vCenter object
+    :type vcenter: vlab_inf_common.vmware.vcenter.vCenter
+
+    :param vms: A mapping of VM objects to their parsed properties
+    :type vms: Dictionary
+
+    :param network_names: A mapping of network objects to their names
+    :type network_names: Dictionary
+
+    :param username: The name of the user who owns the VMs
+    :type username: String
+
+    :param component: Only include VMs whose meta data has this component
+    :type component: String
+    """
+    wanted = {ref: props for ref, props in vms.items() if props['meta']['component'] == component}
+    if not wanted:
+        return {}
+    console = ConsoleUrl(vcenter)
+    answer = {}
+    for ref, props in wanted.items():
+        answer[props['name']] = {'state': props['state'],
+                                 'console': console.make(ref._moId, props['name']),
+                                 'ips': props['ips'],
+                                 'networks': _user_networks(props['networks'], network_names, username),
+                                 'moid': ref._moId,
+                                 'meta': props['meta'],
+                                }
+    return answer
+
+
+def retrieve(vcenter, folder):
+    """Fetch the properties of every VM in a folder, and the names of the networks
+    those VMs use, in a single round trip to vCenter.
+
+    :Returns: Tuple (Dictionary of VM -> properties, Dictionary of network -> name)
+
+    :param vcenter: The vCenter object
+    :type vcenter: vlab_inf_common.vmware.vcenter.vCenter
+
+    :param folder: The folder of VMs
+    :type folder: vim.Folder
+    """
+    collector = vcenter.content.propertyCollector
+    results = collector.RetrieveContents([_folder_filter_spec(folder)])
+    vms = {}
+    network_names = {}
+    for item in results:
+        props = {x.name: x.val for x in item.propSet}
+        if isinstance(item.obj, vim.VirtualMachine):
+            vms[item.obj] = parse_vm(props)
+        elif isinstance(item.obj, vim.Network):
+            network_names[item.obj] = props.get('name', '')
+    return vms, network_names
+
+
+def find_vm(vcenter, folder, name, component='CentOS'):
+    """Lookup one VM by name, and read just its power state and meta data.
+
+    Unlike walking ``folder.childEntity``, the cost is two round trips to
+    vCenter no matter how many VMs are in the folder.
+
+    :Returns: Tuple (vim.VirtualMachine, Dictionary), or None if no such VM exists
+
+    :param vcenter: The vCenter object
+    :type vcenter: vlab_inf_common.vmware.vcenter.vCenter
+
+    :param folder: The folder the VM lives in
+    :type folder: vim.Folder
+
+    :param name: The name of the VM
+    :type name: String
+
+    :param component: Only find the VM if its meta data has this component
+    :type component: String
+    """
+    content = vcenter.content
+    the_vm = content.searchIndex.FindChild(folder, name)
+    if not isinstance(the_vm, vim.VirtualMachine):
+        # no child by that name, or it's a folder/vApp
+        return None
+    results = content.propertyCollector.RetrieveContents([_vm_filter_spec(the_vm)])
+    props = {}
+    for item in results:
+        props.update({x.name: x.val for x in item.propSet})
+    info = {'name': name,
+            'state': props.get('runtime.powerState', ''),
+            'meta': parse_meta(props.get('config.annotation', None)),
+           }
+    if info['meta']['component'] != component:
+        return None
+    return the_vm, info
+
+
+def parse_vm(props):
+    """Convert the raw PropertyCollector values of a VM into simple Python types
+
+    :Returns: Dictionary
+
+    :param props: The property path -> value mapping for one VM
+    :type props: Dictionary
+    """
+    return {'name': props.get('name', ''),
+            'state': props.get('runtime.powerState', ''),
+            'ips': parse_ips(props.get('guest.net', [])),
+            'meta': parse_meta(props.get('config.annotation', None)),
+            'networks': list(props.get('network', [])),
+            'change_version': props.get('config.changeVersion', None),
+           }
+
+
+def parse_meta(annotation):
+    """Load the meta data stored in the notes/annotation of a VM
+
+    :Returns: Dictionary
+
+    :param annotation: The raw annotation of the VM
+    :type annotation: String
+    """
+    try:
+        meta_data = ujson.loads(annotation)
+    except (ValueError, TypeError):
+        # ValueError -> VM created, but notes not updated
+        # TypeError  -> VM failed to be created (or is still deploying); no notes
+        meta_data = dict(UNKNOWN_META)
+    return meta_data
+
+
+def parse_ips(guest_nics):
+    """Flatten the IPs of every NIC, ignoring the IPv6 link local addresses
+
+    :Returns: List
+
+    :param guest_nics: The ``guest.net`` property of a VM
+    :type guest_nics: List
+    """
+    ips = []
+    for nic in guest_nics:
+        ips += nic.ipAddress
+    return [x for x in ips if not x.startswith('fe80::')]
+
+
+def _user_networks(network_refs, network_names, username):
+    """Convert the networks a VM is using into the names the user knows them by
+
+    :Returns: List
+
+    :param network_refs: The networks the VM is connected to
+    :type network_refs: List
+
+    :param network_names: A mapping of network objects to their names
+    :type network_names: Dictionary
+
+    :param username: The user that owns the VM
+    :type username: String
+    """
+    prefix = '{}_'.format(username)
+    names = [network_names.get(x, '') for x in network_refs]
+    return [x.replace(prefix, '') for x in names if x.startswith(username)]
+
+
+def _folder_filter_spec(folder):
+    """Build the PropertyCollector spec for the VMs in a folder, and their networks
+
+    :Returns: vmodl.query.PropertyCollector.FilterSpec
+
+    :param folder: The folder of VMs
+    :type folder: vim.Folder
+    """
+    PropertyCollector = vmodl.query.PropertyCollector
+    vm_to_network = PropertyCollector.TraversalSpec(name='vmToNetwork',
+                                                    type=vim.VirtualMachine,
+                                                    path='network',
+                                                    skip=False)
+    folder_to_vm = PropertyCollector.TraversalSpec(name='folderToChild',
+                                                   type=vim.Folder,
+                                                   path='childEntity',
+                                                   skip=False,
+                                                   selectSet=[vm_to_network])
+    obj_spec = PropertyCollector.ObjectSpec(obj=folder, skip=True, selectSet=[folder_to_vm])
+    vm_props = PropertyCollector.PropertySpec(type=vim.VirtualMachine,
+                                              pathSet=VM_PROPERTIES)
+    net_props = PropertyCollector.PropertySpec(type=vim.Network, pathSet=['name'])
+    return PropertyCollector.FilterSpec(objectSet=[obj_spec], propSet=[vm_props, net_props])
+
+
+def _vm_filter_spec(the_vm):
+    """Build the PropertyCollector spec for the power state and notes of one VM
+
+    :Returns: vmodl.query.PropertyCollector.FilterSpec
+
+    :param the_vm: The virtual machine
+    :type the_vm: vim.VirtualMachine
+    """
+    PropertyCollector = vmodl.query.PropertyCollector
+    obj_spec = PropertyCollector.ObjectSpec(obj=the_vm, skip=False)
+    vm_props = PropertyCollector.PropertySpec(type=vim.VirtualMachine,
+                                              pathSet=['runtime.powerState', 'config.annotation'])
+    return PropertyCollector.FilterSpec(objectSet=[obj_spec], propSet=[vm_props])
+
+
+class ConsoleUrl(object):
+    """Builds the HTML5 console URLs for many VMs, only looking up the details
+    common to every VM (the vCenter TLS thumbprint and instance UUID) once per
+    ``IDENTITY_TTL`` seconds.
+
+    :param vcenter: The vCenter object
+    :type vcenter: vlab_inf_common.vmware.vcenter.vCenter
+    """
+    IDENTITY_TTL = 3600
+    _identity = None
+    _identity_expires = 0
+
+    def __init__(self, vcenter):
+        # Every access of vcenter.content is a round trip, so only do it once
+        content = vcenter.content
+        self._session_manager = content.sessionManager
+        self._thumbprint, self._server_guid = self._lookup_identity(content)
+
+    @classmethod
+    def _lookup_identity(cls, content):
+        """Obtain the TLS thumbprint and instance UUID of vCenter. Neither changes
+        unless vCenter is rebuilt (or has its cert replaced), so they're cached
+        for the whole worker process.
+
+        :Returns: Tuple
+
+        :param content: The vCenter service content
+        :type content: vim.ServiceInstanceContent
+        """
+        if cls._identity is None or time.time() > cls._identity_expires:
+            vcenter_cert = ssl.get_server_certificate((const.INF_VCENTER_SERVER, const.INF_VCENTER_PORT))
+            thumbprint = OpenSSL.crypto.load_certificate(OpenSSL.crypto.FILETYPE_PEM, vcenter_cert).digest('sha1').decode()
+            cls._identity = (thumbprint, content.about.instanceUuid)
+            cls._identity_expires = time.time() + cls.IDENTITY_TTL
+        return cls._identity
+
+    def make(self, moid, vm_name):
+        """Create the console URL for a single VM
+
+        :Returns: String
+
+        :param moid: The managed object id of the VM
+        :type moid: String
+
+        :param vm_name: The name of the VM
+        :type vm_name: String
+        """
+        # Clone tickets are single use, so every VM needs its own
+        ticket = self._session_manager.AcquireCloneTicket()
+        url = """\
+        https://{0}/ui/webconsole.html?vmId={1}&vmName={2}&serverGuid={3}&
+        locale=en_US&host={0}&sessionTicket={4}&thumbprint={5}
+        """.format(const.INF_VCENTER_SERVER,
+                   moid,
+                   vm_name,
+                   self._server_guid,
+                   ticket,
+                   self._thumbprint)
+        return textwrap.dedent(url).replace('\n', '')
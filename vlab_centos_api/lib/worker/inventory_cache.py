@@ -0,0 +1,304 @@
+# -*- coding: UTF-8 -*-
+"""
+An in-memory copy of every user's VMs, kept current by vCenter itself.
+
+A background thread holds open a PropertyCollector ``WaitForUpdatesEx`` call on
+the top level vLab folder. vCenter answers that call as soon as a VM, folder or
+network we care about changes, so ``centos.show`` can be answered from memory
+instead of crawling vCenter.
+
+The cache is only trusted when:
+
+- the listener is connected,
+- the listener heard from vCenter within ``max_staleness`` seconds, and
+- the listener has synced since the user's folder was last invalidated.
+
+Otherwise ``lookup`` returns None, and the caller should do a live crawl.
+
+.. note::
+
+   Every worker process has its own cache. Invalidating a user only affects the
+   cache in the calling process; the other processes catch up as soon as vCenter
+   tells their listener about the change.
+"""
+import os
+import time
+import threading
+
+from pyVmomi import vmodl
+from vlab_api_common import get_logger
+from vlab_inf_common.vmware import vim
+
+from vlab_centos_api.lib import const
+from vlab_centos_api.lib.worker import inventory
+from vlab_centos_api.lib.worker.session_pool import SessionPool
+
+
+logger = get_logger(__name__, loglevel=const.VLAB_CENTOS_LOG_LEVEL)
+
+
+class InventoryCache(object):
+    """Tracks the VMs of every user, via a ``WaitForUpdatesEx`` listener thread.
+
+    :param max_staleness: How old (in seconds) the cache can be before it's ignored
+    :type max_staleness: Integer
+
+    :param wait_seconds: The longest a single ``WaitForUpdatesEx`` call blocks
+    :type wait_seconds: Integer
+
+    :param enabled: Set to False to always fallback to a live crawl
+    :type enabled: Boolean
+    """
+    def __init__(self, max_staleness=30, wait_seconds=5, enabled=True):
+        self._max_staleness = max_staleness
+        self._wait_seconds = wait_seconds
+        self._enabled = enabled
+        self._lock = threading.Lock()
+        self._objects = {}
+        self._folders = {}
+        self._children = {}
+        self._invalidated = {}
+        self._synced_at = 0
+        self._connected = False
+        self._thread = None
+        self._pid = None
+        self._stop = threading.Event()
+
+    @property
+    def connected(self):
+        """True when the listener is receiving updates from vCenter
+
+        :Returns: Boolean
+        """
+        return self._connected
+
+    @property
+    def synced_at(self):
+        """When (epoch) the listener last confirmed the cache matched vCenter
+
+        :Returns: Float
+        """
+        return self._synced_at
+
+    def lookup(self, username):
+        """Obtain the VMs within a user's folder, if the cache can be trusted.
+
+        :Returns: Tuple (Dictionary of VM -> properties, Dictionary of network -> name), or None
+
+        :param username: The user who owns the folder
+        :type username: String
+        """
+        if not self._enabled:
+            return None
+        self._ensure_started()
+        with self._lock:
+            if not self._connected:
+                return None
+            if time.time() - self._synced_at > self._max_staleness:
+                return None
+            if self._synced_at < self._invalidated.get(username, 0):
+                return None
+            folder = self._folders.get(username, None)
+            if folder is None:
+                return None
+            vms = {}
+            network_names = {}
+            for ref in self._children.get(folder, []):
+                props = self._objects[ref]
+                vms[ref] = inventory.parse_vm(props)
+                for network in props.get('network', []):
+                    network_names[network] = self._objects.get(network, {}).get('name', '')
+        return vms, network_names
+
+    def invalidate(self, username):
+        """Stop trusting the cached VMs of a user until the listener syncs again.
+        Call this after changing the VMs in a user's folder.
+
+        :Returns: None
+
+        :param username: The user who owns the folder
+        :type username: String
+        """
+        with self._lock:
+            self._invalidated[username] = time.time()
+
+    def stop(self):
+        """Terminate the listener thread
+
+        :Returns: None
+        """
+        self._stop.set()
+
+    def _ensure_started(self):
+        """Start the listener, once per worker process
+
+        :Returns: None
+        """
+        # Celery forks worker processes; threads don't survive a fork
+        if self._pid == os.getpid() and self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._pid == os.getpid() and self._thread is not None and self._thread.is_alive():
+                return
+            self._pid = os.getpid()
+            self._connected = False
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._listen, name='inventory-cache', daemon=True)
+            self._thread.start()
+
+    def _listen(self):
+        """Keep the cache in sync with vCenter, reconnecting upon failure
+
+        :Returns: None
+        """
+        sessions = SessionPool(host=const.INF_VCENTER_SERVER,
+                               user=const.INF_VCENTER_USER,
+                               password=const.INF_VCENTER_PASSWORD,
+                               port=const.INF_VCENTER_PORT,
+                               size=1)
+        backoff = 1
+        while not self._stop.is_set():
+            try:
+                with sessions.session() as vcenter:
+                    self._follow(vcenter)
+            except Exception as doh:
+                logger.error('Inventory cache lost connection to vCenter: {}'.format(doh))
+                with self._lock:
+                    self._connected = False
+                self._stop.wait(backoff)
+                backoff = min(backoff * 2, 60)
+            else:
+                backoff = 1
+        sessions.close()
+
+    def _follow(self, vcenter):
+        """Apply every update vCenter sends, until told to stop
+
+        :Returns: None
+
+        :param vcenter: The session to listen on
+        :type vcenter: vlab_inf_common.vmware.vcenter.vCenter
+        """
+        content = vcenter.content
+        top_folder = vcenter.get_vm_folder(path=const.INF_VCENTER_TOP_LVL_DIR)
+        collector = content.propertyCollector.CreatePropertyCollector()
+        try:
+            # Without partial updates, every change is the whole new value of a
+            # property we asked for; never an add/remove of one element of an
+            # array, under an indexed name like "config.hardware.device[4000]"
+            collector.CreateFilter(_top_folder_filter_spec(top_folder), partialUpdates=False)
+            options = vmodl.query.PropertyCollector.WaitOptions(maxWaitSeconds=self._wait_seconds)
+            with self._lock:
+                self._objects = {}
+            version = ''
+            while not self._stop.is_set():
+                issued = time.time()
+                update = collector.WaitForUpdatesEx(version, options)
+                if update is not None:
+                    self._apply(update)
+                    version = update.version
+                    if update.truncated:
+                        # more changes are queued up; we're not in sync yet
+                        continue
+                with self._lock:
+                    self._synced_at = issued
+                    self._connected = True
+        finally:
+            try:
+                collector.DestroyPropertyCollector()
+            except Exception:
+                pass
+
+    def _apply(self, update):
+        """Merge an UpdateSet from vCenter into the cache
+
+        :Returns: None
+
+        :param update: The changes reported by WaitForUpdatesEx
+        :type update: vmodl.query.PropertyCollector.UpdateSet
+        """
+        with self._lock:
+            for filter_update in update.filterSet:
+                for object_update in filter_update.objectSet:
+                    ref = object_update.obj
+                    if object_update.kind == 'leave':
+                        self._objects.pop(ref, None)
+                        continue
+                    props = self._objects.setdefault(ref, {})
+                    for change in object_update.changeSet:
+                        if change.op == 'assign':
+                            props[change.name] = change.val
+                        else:
+                            # the filter doesn't do partial updates, so the property was unset
+                            props.pop(change.name, None)
+            self._reindex()
+
+    def _reindex(self):
+        """Rebuild the username -> folder, and folder -> VMs lookup tables.
+        Caller must hold the lock.
+
+        :Returns: None
+        """
+        folders = {}
+        children = {}
+        for ref, props in self._objects.items():
+            if isinstance(ref, vim.Folder):
+                folders.setdefault(props.get('name', ''), ref)
+            elif isinstance(ref, vim.VirtualMachine):
+                children.setdefault(props.get('parent', None), []).append(ref)
+        self._folders = folders
+        self._children = children
+
+
+def _top_folder_filter_spec(top_folder):
+    """Build the PropertyCollector spec for every folder, VM and network under
+    the top level vLab folder.
+
+    :Returns: vmodl.query.PropertyCollector.FilterSpec
+
+    :param top_folder: The folder that contains every user's folder
+    :type top_folder: vim.Folder
+    """
+    PropertyCollector = vmodl.query.PropertyCollector
+    vm_to_network = PropertyCollector.TraversalSpec(name='vmToNetwork',
+                                                    type=vim.VirtualMachine,
+                                                    path='network',
+                                                    skip=False)
+    folder_to_child = PropertyCollector.TraversalSpec(name='folderToChild',
+                                                      type=vim.Folder,
+                                                      path='childEntity',
+                                                      skip=False,
+                                                      selectSet=[PropertyCollector.SelectionSpec(name='folderToChild'),
+                                                                 vm_to_network])
+    obj_spec = PropertyCollector.ObjectSpec(obj=top_folder, skip=True, selectSet=[folder_to_child])
+    folder_props = PropertyCollector.PropertySpec(type=vim.Folder, pathSet=['name'])
+    vm_props = PropertyCollector.PropertySpec(type=vim.VirtualMachine,
+                                              pathSet=inventory.VM_PROPERTIES + ['parent'])
+    net_props = PropertyCollector.PropertySpec(type=vim.Network, pathSet=['name'])
+    return PropertyCollector.FilterSpec(objectSet=[obj_spec], propSet=[folder_props, vm_props, net_props])
+
+
+CACHE = InventoryCache(max_staleness=const.VLAB_CENTOS_INVENTORY_MAX_STALENESS,
+                       enabled=const.VLAB_CENTOS_INVENTORY_CACHE)
+
+
+def lookup(username):
+    """Obtain the cached VMs of a user, or None if the cache cannot be trusted.
+
+    :Returns: Tuple, or None
+
+    :param username: The user who owns the VMs
+    :type username: String
+    """
+    return CACHE.lookup(username)
+
+
+def invalidate(username):
+    """Stop serving the cached VMs of a user until the cache syncs with vCenter again.
+
+    :Returns: None
+
+    :param username: The user who owns the VMs
+    :type username: String
+    """
+    CACHE.invalidate(username)
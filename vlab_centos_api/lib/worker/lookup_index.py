@@ -0,0 +1,275 @@
+# -*- coding: UTF-8 -*-
+"""
+A name -> managed object index of the folders and networks in vCenter.
+
+Both ``vcenter.get_by_name`` and ``vcenter.networks`` create a ContainerView,
+then fetch the ``name`` of every object in it one round trip at a time. The
+index instead pulls the name of every folder (under the top level vLab folder)
+and every network with a single PropertyCollector call, and serves lookups
+from memory until the index is ``ttl`` seconds old.
+
+Only the type and moId of each object are stored; the managed objects are
+rebuilt for the session doing the lookup, because the session pool hands out
+a different session each time.
+
+A name that's not in the index triggers a refresh (at most once every
+``MISS_REFRESH`` seconds) before giving up, so a folder or network made
+moments ago is still found. Once the index is older than that, a name that is
+found is checked against vCenter (one property read) before being returned;
+a folder or network that was deleted, or deleted and made again, triggers a
+refresh instead of handing out a dead moId.
+"""
+import time
+import weakref
+import threading
+
+from pyVmomi import vmodl
+from vlab_inf_common.vmware import vim
+
+from vlab_centos_api.lib import const
+
+
+MISS_REFRESH = 5
+# vCenter session -> the SOAP stub its managed objects are bound to
+_STUBS = weakref.WeakKeyDictionary()
+
+
+class LookupIndex(object):
+    """Maps the names of folders and networks to their managed object IDs
+
+    :param ttl: How many seconds to trust the index for
+    :type ttl: Integer
+    """
+    def __init__(self, ttl=300):
+        self._ttl = ttl
+        self._lock = threading.Lock()
+        self._folders = {}
+        self._networks = {}
+        self._refreshed_at = 0
+
+    def folder(self, vcenter, name):
+        """Find a folder, like ``vcenter.get_by_name(name=name, vimtype=vim.Folder)``
+
+        :Returns: vim.Folder
+
+        :Raises: ValueError
+
+        :param vcenter: The vCenter object
+        :type vcenter: vlab_inf_common.vmware.vcenter.vCenter
+
+        :param name: The name of the folder
+        :type name: String
+        """
+        found = self._find(vcenter, '_folders', name)
+        if found is None:
+            raise ValueError('Unable to locate object named {}'.format(name))
+        return found
+
+    def network(self, vcenter, name):
+        """Find a network, like ``vcenter.networks[name]``
+
+        :Returns: vim.Network
+
+        :Raises: KeyError
+
+        :param vcenter: The vCenter object
+        :type vcenter: vlab_inf_common.vmware.vcenter.vCenter
+
+        :param name: The name of the network
+        :type name: String
+        """
+        found = self._find(vcenter, '_networks', name)
+        if found is None:
+            raise KeyError(name)
+        return found
+
+    def networks(self, vcenter):
+        """Every network, like ``vcenter.networks``
+
+        :Returns: Dictionary
+
+        :param vcenter: The vCenter object
+        :type vcenter: vlab_inf_common.vmware.vcenter.vCenter
+        """
+        self._maybe_refresh(vcenter)
+        with self._lock:
+            networks = dict(self._networks)
+        return {name: bind(vcenter, ref) for name, ref in networks.items()}
+
+    def invalidate(self):
+        """Refresh the index on the next lookup
+
+        :Returns: None
+        """
+        with self._lock:
+            self._refreshed_at = 0
+
+    def _find(self, vcenter, table, name):
+        """Lookup a name, refreshing the index if it's too old, the name is
+        missing, or the object it names is gone
+
+        :Returns: pyVmomi.VmomiSupport.ManagedObject, or None
+        """
+        self._maybe_refresh(vcenter)
+        ref = getattr(self, table).get(name, None)
+        if ref is None and time.time() - self._refreshed_at > MISS_REFRESH:
+            self._refresh(vcenter)
+            ref = getattr(self, table).get(name, None)
+        if ref is None:
+            return None
+        found = bind(vcenter, ref)
+        if time.time() - self._refreshed_at > MISS_REFRESH and not _is_current(found, name):
+            # Deleted (and maybe made again, with a new moId) since the index was built
+            self._refresh(vcenter)
+            ref = getattr(self, table).get(name, None)
+            if ref is None:
+                return None
+            found = bind(vcenter, ref)
+        return found
+
+    def _maybe_refresh(self, vcenter):
+        """Refresh the index if it's older than the TTL
+
+        :Returns: None
+        """
+        if time.time() - self._refreshed_at > self._ttl:
+            self._refresh(vcenter)
+
+    def _refresh(self, vcenter):
+        """Rebuild the index with one PropertyCollector call
+
+        :Returns: None
+        """
+        started = time.time()
+        content = vcenter.content
+        top_folder = vcenter.get_vm_folder(path=const.INF_VCENTER_TOP_LVL_DIR)
+        views = [content.viewManager.CreateContainerView(container=top_folder, type=[vim.Folder], recursive=True),
+                 content.viewManager.CreateContainerView(container=content.rootFolder, type=[vim.Network], recursive=True)]
+        try:
+            results = content.propertyCollector.RetrieveContents([_view_filter_spec(views)])
+        finally:
+            for view in views:
+                view.DestroyView()
+        folders = {}
+        networks = {}
+        for result in results:
+            name = result.propSet[0].val
+            ref = (type(result.obj), result.obj._moId)
+            if isinstance(result.obj, vim.Folder):
+                # same as get_by_name; first match wins
+                folders.setdefault(name, ref)
+            else:
+                # same as vcenter.networks; last match wins
+                networks[name] = ref
+        with self._lock:
+            self._folders = folders
+            self._networks = networks
+            self._refreshed_at = started
+
+
+def bind(vcenter, ref):
+    """Create the managed object for the session doing the lookup
+
+    :Returns: pyVmomi.VmomiSupport.ManagedObject
+
+    :param vcenter: The vCenter object
+    :type vcenter: vlab_inf_common.vmware.vcenter.vCenter
+
+    :param ref: The type and moId of the object
+    :type ref: Tuple
+    """
+    vimtype, moid = ref
+    return vimtype(moid, _stub_of(vcenter))
+
+
+def _is_current(the_object, name):
+    """Check that an object from the index still exists, and still has the name
+    it was indexed by; one round trip, instead of the full rebuild of the index
+
+    :Returns: Boolean
+
+    :param the_object: What the index found
+    :type the_object: pyVmomi.VmomiSupport.ManagedObject
+
+    :param name: The name it was found by
+    :type name: String
+    """
+    try:
+        return the_object.name == name
+    except vmodl.fault.ManagedObjectNotFound:
+        return False
+
+
+def _stub_of(vcenter):
+    """The SOAP stub of a session, from a managed object it hands out publicly.
+    ``vcenter.content`` is a round trip, so the stub is remembered for the life
+    of the session.
+
+    :Returns: pyVmomi.SoapAdapter.SoapStubAdapter
+
+    :param vcenter: The vCenter object
+    :type vcenter: vlab_inf_common.vmware.vcenter.vCenter
+    """
+    stub = _STUBS.get(vcenter, None)
+    if stub is None:
+        stub = vcenter.content.rootFolder._stub
+        _STUBS[vcenter] = stub
+    return stub
+
+
+def _view_filter_spec(views):
+    """Build the PropertyCollector spec for the name of every object in some ContainerViews
+
+    :Returns: vmodl.query.PropertyCollector.FilterSpec
+
+    :param views: The ContainerViews of folders and networks
+    :type views: List
+    """
+    PropertyCollector = vmodl.query.PropertyCollector
+    traversal = PropertyCollector.TraversalSpec(name='traverseView',
+                                                type=vim.view.ContainerView,
+                                                path='view',
+                                                skip=False)
+    object_specs = [PropertyCollector.ObjectSpec(obj=view, skip=True, selectSet=[traversal]) for view in views]
+    prop_specs = [PropertyCollector.PropertySpec(type=vim.Folder, pathSet=['name']),
+                  PropertyCollector.PropertySpec(type=vim.Network, pathSet=['name'])]
+    return PropertyCollector.FilterSpec(objectSet=object_specs, propSet=prop_specs)
+
+
+INDEX = LookupIndex(ttl=const.VLAB_CENTOS_LOOKUP_TTL)
+
+
+def folder(vcenter, name):
+    """Find a folder, via the worker's index
+
+    :Returns: vim.Folder
+
+    :Raises: ValueError
+    """
+    return INDEX.folder(vcenter, name)
+
+
+def network(vcenter, name):
+    """Find a network, via the worker's index
+
+    :Returns: vim.Network
+
+    :Raises: KeyError
+    """
+    return INDEX.network(vcenter, name)
+
+
+def networks(vcenter):
+    """Every network, via the worker's index
+
+    :Returns: Dictionary
+    """
+    return INDEX.networks(vcenter)
+
+
+def invalidate():
+    """Refresh the worker's index on the next lookup
+
+    :Returns: None
+    """
+    INDEX.invalidate()
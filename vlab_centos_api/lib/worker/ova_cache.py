@@ -0,0 +1,282 @@
+# -*- coding: UTF-8 -*-
+"""
+Parse each OVA once per worker process, instead of once per deploy.
+
+``vlab_inf_common.vmware.Ova`` walks every header in the tarball and reads the
+OVF descriptor each time it's created, just so the deploy can find the network
+names and build the import spec. Here, the OVF descriptor and the location
+(offset & size) of every VMDK within the tarball are cached by path. Before a
+cached entry is used, the mtime and size of the opened OVA (from ``fstat``) are
+checked against the ones it was parsed from; an OVA that was replaced, even in
+place, gets parsed again. The same opened file is then used for the upload, so
+the offsets always describe the bytes being sent.
+
+The only time a deploy touches the OVA is to stream the VMDKs to vCenter. The
+disks are read straight out of the tarball, and sent, in ``BUFFER_SIZE`` chunks
+(instead of the 8KB blocks ``http.client`` uses for a file-like body).
+"""
+import os
+import re
+import tarfile
+import threading
+import collections
+import http.client
+from urllib.parse import urlparse
+
+from pyVmomi import vmodl
+from vlab_inf_common.ssl_context import get_context
+
+from vlab_centos_api.lib import const
+
+
+BUFFER_SIZE = 1024 * 1024
+CHIME_INTERVAL = 5
+
+
+class OvaMeta(object):
+    """The parts of an OVA needed to deploy it, read with one pass over the tarball.
+
+    :param path: The location of the OVA file
+    :type path: String
+
+    :param the_file: The opened OVA file
+    :type the_file: io.BufferedReader
+    """
+    def __init__(self, path, the_file):
+        self.path = path
+        self.stamp = stamp(the_file)
+        self.ovf = None
+        # disk name -> (offset within the tarball, size)
+        self.disks = collections.OrderedDict()
+        the_file.seek(0)
+        with tarfile.open(fileobj=the_file) as tar:
+            for member in tar:
+                if member.name.endswith('.vmdk'):
+                    self.disks[member.name] = (member.offset_data, member.size)
+                elif member.name.endswith('.ovf'):
+                    self.ovf = tar.extractfile(member).read().decode()
+        if self.ovf is None:
+            raise ValueError('No OVF descriptor found in {}'.format(path))
+        # Same parsing as vlab_inf_common.vmware.Ova.networks
+        networks = re.findall(r'Network ovf:name=[\w\ \"]{1,50}', self.ovf)
+        self.networks = [x.split('=')[1].replace('"', '') for x in networks]
+
+    @property
+    def size(self):
+        """The total number of bytes of every disk"""
+        return sum(size for _, size in self.disks.values())
+
+
+class OvaCache(object):
+    """A least recently used cache of parsed OVAs
+
+    :param size: The most OVAs to keep parsed
+    :type size: Integer
+    """
+    def __init__(self, size=8):
+        self._size = size
+        self._lock = threading.Lock()
+        self._entries = collections.OrderedDict()
+        self.stats = collections.Counter(hits=0, misses=0, evictions=0)
+
+    def get(self, path, the_file):
+        """Obtain the parsed OVA, parsing it if it's new or has changed
+
+        :Returns: OvaMeta
+
+        :param path: The location of the OVA file
+        :type path: String
+
+        :param the_file: The opened OVA file
+        :type the_file: io.BufferedReader
+        """
+        current = stamp(the_file)
+        with self._lock:
+            meta = self._entries.get(path, None)
+            if meta is not None and meta.stamp == current:
+                self._entries.move_to_end(path)
+                self.stats['hits'] += 1
+                return meta
+        # Parse without the lock, so other images can be looked up meanwhile
+        meta = OvaMeta(path, the_file)
+        with self._lock:
+            self.stats['misses'] += 1
+            self._entries[path] = meta
+            self._entries.move_to_end(path)
+            while len(self._entries) > self._size:
+                self._entries.popitem(last=False)
+                self.stats['evictions'] += 1
+        return meta
+
+
+class CachedOva(object):
+    """Quacks like ``vlab_inf_common.vmware.Ova``, so it can be passed to
+    ``virtual_machine.deploy_from_ova``
+
+    :param meta: The parsed OVA
+    :type meta: OvaMeta
+
+    :param the_file: The opened OVA file that ``meta`` describes
+    :type the_file: io.BufferedReader
+    """
+    def __init__(self, meta, the_file):
+        self._meta = meta
+        self._file = the_file
+        self._sent = 0
+
+    @property
+    def ovf(self):
+        """Return the XML that describes the OVA"""
+        return self._meta.ovf
+
+    @property
+    def networks(self):
+        """Return a list of network names that a VM has configured"""
+        return self._meta.networks
+
+    @property
+    def vmdks(self):
+        """Return a list of VMDK file names within the OVA"""
+        return list(self._meta.disks.keys())
+
+    @property
+    def size(self):
+        """The total number of bytes of every VMDK"""
+        return self._meta.size
+
+    @property
+    def deploy_progress(self):
+        """How much of the VMDKs have been uploaded, as a percentage"""
+        if not self._meta.size:
+            return 100
+        return min(int(100.0 * self._sent / self._meta.size), 100)
+
+    def close(self):
+        """Close the OVA file"""
+        self._file.close()
+
+    def deploy(self, deploy_spec, lease, host):
+        """Upload the VMDKs to create a new VM
+
+        :Returns: None
+
+        :param deploy_spec: The OVA deployment spec
+        :type deploy_spec: vim.OvfManager.CreateImportSpecResult
+
+        :param lease: The vSphere lease that enables VM creation
+        :type lease: vim.HttpNfcLease
+
+        :param host: The FQDN of the ESXi host (unused; the lease has the URLs)
+        :type host: String
+        """
+        self._sent = 0
+        stop = threading.Event()
+        chimer = threading.Thread(target=self._chime, args=(lease, stop), name='ova-chimer', daemon=True)
+        chimer.start()
+        try:
+            for file_item in deploy_spec.fileItem:
+                if file_item.path in self._meta.disks:
+                    self._upload_disk(self._file, file_item, lease)
+            lease.Progress(100)
+            lease.Complete()
+        except vmodl.MethodFault as doh:
+            lease.Abort(doh)
+            raise
+        except Exception as doh:
+            lease.Abort(vmodl.fault.SystemError(reason=str(doh)))
+            raise
+        finally:
+            stop.set()
+            chimer.join()
+
+    def _upload_disk(self, the_file, file_item, lease):
+        """Stream one VMDK out of the tarball to vCenter
+
+        :Returns: None
+
+        :Raises: RuntimeError
+
+        :param the_file: The opened OVA file
+        :type the_file: io.BufferedReader
+
+        :param file_item: The disk to upload
+        :type file_item: vim.OvfManager.FileItem
+
+        :param lease: The vSphere lease that enables VM creation
+        :type lease: vim.HttpNfcLease
+        """
+        offset, size = self._meta.disks[file_item.path]
+        for device_url in lease.info.deviceUrl:
+            if device_url.importKey == file_item.deviceId:
+                url = urlparse(device_url.url)
+                break
+        else:
+            raise RuntimeError('Failed to find deviceUrl for file {}'.format(file_item.path))
+        conn = http.client.HTTPSConnection(url.hostname, url.port or 443, context=get_context())
+        try:
+            path = '{}?{}'.format(url.path, url.query) if url.query else url.path
+            conn.putrequest('POST', path)
+            conn.putheader('Content-Length', str(size))
+            conn.putheader('Content-Type', 'application/x-vnd.vmware-streamVmdk')
+            conn.endheaders()
+            the_file.seek(offset)
+            remaining = size
+            while remaining:
+                data = the_file.read(min(BUFFER_SIZE, remaining))
+                if not data:
+                    raise RuntimeError('{} ended before all of {} was read'.format(self._meta.path, file_item.path))
+                conn.send(data)
+                remaining -= len(data)
+                self._sent += len(data)
+            resp = conn.getresponse()
+            resp.read()
+            if resp.status >= 300:
+                raise RuntimeError('Upload of {} failed: HTTP {} {}'.format(file_item.path, resp.status, resp.reason))
+        finally:
+            conn.close()
+
+    def _chime(self, lease, stop):
+        """Report progress so vCenter doesn't time out the lease
+
+        :Returns: None
+        """
+        while not stop.wait(CHIME_INTERVAL):
+            try:
+                lease.Progress(self.deploy_progress)
+            except Exception:
+                # the lease was completed/aborted between checking & chiming
+                pass
+
+
+CACHE = OvaCache(size=const.VLAB_CENTOS_OVA_CACHE_SIZE)
+
+
+def stamp(the_file):
+    """What identifies a version of an OVA; a replaced OVA has a new mtime or size
+
+    :Returns: Tuple (mtime, size)
+
+    :param the_file: The opened OVA file
+    :type the_file: io.BufferedReader
+    """
+    info = os.fstat(the_file.fileno())
+    return info.st_mtime, info.st_size
+
+
+def open_ova(path):
+    """Obtain an Ova-like object for deploying, using the worker's cache.
+    Call ``close`` on it when done.
+
+    :Returns: CachedOva
+
+    :Raises: FileNotFoundError
+
+    :param path: The location of the OVA file
+    :type path: String
+    """
+    the_file = open(path, 'rb')
+    try:
+        return CachedOva(CACHE.get(path, the_file), the_file)
+    except Exception:
+        the_file.close()
+        raise
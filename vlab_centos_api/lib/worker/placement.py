@@ -0,0 +1,372 @@
+# -*- coding: UTF-8 -*-
+"""
+Pick the datastore and ESXi host that a new CentOS VM is imported onto.
+
+``virtual_machine.deploy_from_ova`` picks both at random, so a datastore that's
+nearly full (or already busy with other imports) gets as many deploys as an
+idle one. Instead, every candidate is scored by a placement policy, using:
+
+- a snapshot of the free space of every datastore in ``INF_VCENTER_DATASTORE``
+  (datastore clusters are expanded to their datastores), and the memory usage of
+  every host in ``INF_VCENTER_RESORUCE_POOL``; one PropertyCollector call,
+  re-fetched once the snapshot is ``ttl`` seconds old,
+- how many deploys this worker is currently running against each datastore & host, and
+- how long recent deploys to each datastore took, in seconds per GB.
+
+The policy is set via ``VLAB_CENTOS_PLACEMENT_POLICY``:
+
+- ``least-loaded`` - the most free, least busy, fastest datastore (the default)
+- ``round-robin`` - rotate through every datastore with room for the VM
+- ``image-affinity`` - always use the same datastore for a given image, so the
+  storage array can deduplicate the disks
+
+Extra policies can be added with the ``register_policy`` decorator.
+"""
+import time
+import zlib
+import threading
+import itertools
+import contextlib
+import collections
+
+from pyVmomi import vmodl
+from vlab_inf_common.vmware import vim
+
+from vlab_centos_api.lib import const
+from vlab_centos_api.lib.worker.lookup_index import bind
+
+
+# A datastore that takes this many seconds to write a GB scores half as well
+# as one that takes no time at all.
+LATENCY_SCALE = 60
+# How much weight the latest deploy has in the seconds per GB average
+LATENCY_WEIGHT = 0.3
+GB = 1024 ** 3
+
+Placement = collections.namedtuple('Placement', 'datastore host datastore_name host_name')
+POLICIES = {}
+
+
+def register_policy(name):
+    """Make a placement policy available via ``VLAB_CENTOS_PLACEMENT_POLICY``
+
+    A policy is called with the ``Placer``, the datastores with room for the
+    VM, the hosts that are usable, and the image being deployed. It must return
+    a (datastore, host) tuple from the supplied candidates.
+
+    :Returns: Function
+
+    :param name: The name of the policy
+    :type name: String
+    """
+    def decorator(func):
+        POLICIES[name] = func
+        return func
+    return decorator
+
+
+class Placer(object):
+    """Chooses where to import each new VM, and tracks the deploys in flight
+
+    :param policy: The name of a registered placement policy
+    :type policy: String
+
+    :param ttl: How many seconds to trust the capacity snapshot for
+    :type ttl: Integer
+    """
+    def __init__(self, policy='least-loaded', ttl=60):
+        if policy not in POLICIES:
+            raise ValueError('Unknown placement policy {}, must be one of {}'.format(policy, sorted(POLICIES.keys())))
+        self._policy = POLICIES[policy]
+        self._ttl = ttl
+        self._lock = threading.Lock()
+        self._snapshot = None
+        self._snapshot_at = 0
+        self._rotation = itertools.count()
+        self.in_flight = collections.Counter()
+        self.latency = {}
+
+    def choose(self, vcenter, resource_pool, image, size, logger):
+        """Pick the datastore & host to import a VM onto
+
+        :Returns: Placement
+
+        :Raises: ValueError
+
+        :param vcenter: The vCenter object
+        :type vcenter: vlab_inf_common.vmware.vcenter.vCenter
+
+        :param resource_pool: The resource pool the new VM will be part of
+        :type resource_pool: vim.ResourcePool
+
+        :param image: The image/version of CentOS being deployed
+        :type image: String
+
+        :param size: How many bytes of disk the new VM needs
+        :type size: Integer
+        """
+        return next(self.candidates(vcenter, resource_pool, image, size, logger))
+
+    def candidates(self, vcenter, resource_pool, image, size, logger):
+        """Every datastore & host a VM could be imported onto, best first
+
+        The policy picks a datastore, which is offered with the host the policy
+        picked, then its other hosts, least loaded first. Only when all of those
+        are passed over (i.e. their deploy slots are taken) does the policy pick
+        again, from the datastores that are left.
+
+        :Returns: Generator of Placement
+
+        :Raises: ValueError
+
+        :param vcenter: The vCenter object
+        :type vcenter: vlab_inf_common.vmware.vcenter.vCenter
+
+        :param resource_pool: The resource pool the new VM will be part of
+        :type resource_pool: vim.ResourcePool
+
+        :param image: The image/version of CentOS being deployed
+        :type image: String
+
+        :param size: How many bytes of disk the new VM needs
+        :type size: Integer
+        """
+        datastores, hosts = self._candidates(vcenter, resource_pool)
+        with self._lock:
+            roomy = [x for x in datastores if x['free'] - (self.in_flight[x['moid']] + 1) * size > 0]
+        if not roomy:
+            raise ValueError('No datastore has {:.1f}GB free to deploy CentOS {}'.format(size / GB, image))
+        if not hosts:
+            raise ValueError('No ESXi host is available to deploy CentOS {}'.format(image))
+        while roomy:
+            datastore, host = self._policy(self, roomy, hosts, image)
+            others = [x for x in _hosts_by_load(self, datastore, hosts) if x is not host]
+            for a_host in [host] + others:
+                logger.info('Placing CentOS {} on datastore {} ({:.1f}GB free, {} deploys) via host {}'.format(
+                            image, datastore['name'], datastore['free'] / GB, self.in_flight[datastore['moid']],
+                            a_host['name']))
+                yield Placement(datastore=bind(vcenter, (vim.Datastore, datastore['moid'])),
+                                host=bind(vcenter, (vim.HostSystem, a_host['moid'])),
+                                datastore_name=datastore['name'],
+                                host_name=a_host['name'])
+            roomy = [x for x in roomy if x is not datastore]
+
+    @contextlib.contextmanager
+    def deploying(self, placement, size):
+        """Count a deploy as in flight, and record how long it took when it works
+
+        :Returns: Generator
+
+        :param placement: Where the VM is being deployed
+        :type placement: Placement
+
+        :param size: How many bytes are being written
+        :type size: Integer
+        """
+        keys = (placement.datastore._moId, placement.host._moId)
+        with self._lock:
+            self.in_flight.update(keys)
+        started = time.time()
+        try:
+            yield
+        finally:
+            with self._lock:
+                self.in_flight.subtract(keys)
+        if size:
+            self.record_latency(placement.datastore._moId, (time.time() - started) / (size / GB))
+
+    def record_latency(self, moid, seconds_per_gb):
+        """Fold the speed of a finished deploy into the average for its datastore
+
+        :Returns: None
+
+        :param moid: The managed object ID of the datastore
+        :type moid: String
+
+        :param seconds_per_gb: How long each GB took to deploy
+        :type seconds_per_gb: Float
+        """
+        with self._lock:
+            previous = self.latency.get(moid, seconds_per_gb)
+            self.latency[moid] = (1 - LATENCY_WEIGHT) * previous + LATENCY_WEIGHT * seconds_per_gb
+
+    def invalidate(self):
+        """Fetch a new capacity snapshot on the next placement
+
+        :Returns: None
+        """
+        with self._lock:
+            self._snapshot_at = 0
+
+    def _candidates(self, vcenter, resource_pool):
+        """The usable datastores & hosts, from the cached snapshot
+
+        :Returns: Tuple
+        """
+        if time.time() - self._snapshot_at > self._ttl:
+            snapshot = _retrieve(vcenter, resource_pool)
+            with self._lock:
+                self._snapshot = snapshot
+                self._snapshot_at = time.time()
+        return self._snapshot
+
+
+@register_policy('least-loaded')
+def least_loaded(placer, datastores, hosts, image):
+    """Most free space, fewest deploys in flight & fastest recent deploys wins"""
+    def datastore_score(datastore):
+        free_ratio = datastore['free'] / max(datastore['capacity'], 1)
+        latency = placer.latency.get(datastore['moid'], 0)
+        return free_ratio / (1 + placer.in_flight[datastore['moid']]) / (1 + latency / LATENCY_SCALE)
+    datastore = max(datastores, key=datastore_score)
+    return datastore, _least_loaded_host(placer, datastore, hosts)
+
+
+@register_policy('round-robin')
+def round_robin(placer, datastores, hosts, image):
+    """Rotate through the datastores, and the hosts that can reach each one"""
+    turn = next(placer._rotation)
+    datastore = datastores[turn % len(datastores)]
+    reachable = _reachable(datastore, hosts)
+    return datastore, reachable[turn % len(reachable)]
+
+
+@register_policy('image-affinity')
+def image_affinity(placer, datastores, hosts, image):
+    """The same image always lands on the same datastore, while it has room"""
+    datastore = datastores[zlib.crc32(image.encode()) % len(datastores)]
+    return datastore, _least_loaded_host(placer, datastore, hosts)
+
+
+def _least_loaded_host(placer, datastore, hosts):
+    """The host with the most free memory, and fewest deploys in flight"""
+    return _hosts_by_load(placer, datastore, hosts)[0]
+
+
+def _hosts_by_load(placer, datastore, hosts):
+    """The hosts that can reach a datastore, most free memory & fewest deploys in flight first"""
+    def host_score(host):
+        free_ratio = 1 - host['memory_used'] / max(host['memory'], 1)
+        return free_ratio / (1 + placer.in_flight[host['moid']])
+    return sorted(_reachable(datastore, hosts), key=host_score, reverse=True)
+
+
+def _reachable(datastore, hosts):
+    """The hosts that have the datastore mounted; every host if that's unknown"""
+    return [x for x in hosts if x['moid'] in datastore['hosts']] or hosts
+
+
+def _retrieve(vcenter, resource_pool):
+    """Fetch the capacity of every candidate datastore & host with one PropertyCollector call
+
+    :Returns: Tuple (List of datastores, List of hosts), sorted by name
+
+    :param vcenter: The vCenter object
+    :type vcenter: vlab_inf_common.vmware.vcenter.vCenter
+
+    :param resource_pool: The resource pool the new VMs will be part of
+    :type resource_pool: vim.ResourcePool
+    """
+    content = vcenter.content
+    views = [content.viewManager.CreateContainerView(container=content.rootFolder,
+                                                     type=[vim.Datastore, vim.StoragePod],
+                                                     recursive=True),
+             content.viewManager.CreateContainerView(container=resource_pool.owner,
+                                                     type=[vim.HostSystem],
+                                                     recursive=True)]
+    try:
+        results = content.propertyCollector.RetrieveContents([_capacity_filter_spec(views)])
+    finally:
+        for view in views:
+            view.DestroyView()
+    wanted = set(x.strip() for x in const.INF_VCENTER_DATASTORE.split(',') if x.strip())
+    objects = {}
+    for result in results:
+        objects[result.obj._moId] = (result.obj, {x.name: x.val for x in result.propSet})
+    datastores = {}
+    hosts = []
+    for obj, props in objects.values():
+        if isinstance(obj, vim.StoragePod):
+            if props.get('name') in wanted:
+                for child in props.get('childEntity', []):
+                    if child._moId in objects:
+                        datastores[child._moId] = objects[child._moId][1]
+        elif isinstance(obj, vim.Datastore):
+            if props.get('name') in wanted:
+                datastores[obj._moId] = props
+        elif not props.get('runtime.inMaintenanceMode') and props.get('runtime.connectionState') == 'connected':
+            hosts.append({'moid': obj._moId,
+                          'name': props.get('name', ''),
+                          'memory': props.get('summary.hardware.memorySize', 0) or 0,
+                          # reported in MB, but the size of the host is in bytes
+                          'memory_used': (props.get('summary.quickStats.overallMemoryUsage', 0) or 0) * 1024 * 1024,
+                         })
+    usable = []
+    for moid, props in datastores.items():
+        if not props.get('summary.accessible', False):
+            continue
+        if props.get('summary.maintenanceMode', 'normal') != 'normal':
+            continue
+        usable.append({'moid': moid,
+                       'name': props.get('name', ''),
+                       'free': props.get('summary.freeSpace', 0) or 0,
+                       'capacity': props.get('summary.capacity', 0) or 0,
+                       'hosts': set(x.key._moId for x in props.get('host', [])),
+                      })
+    return sorted(usable, key=lambda x: x['name']), sorted(hosts, key=lambda x: x['name'])
+
+
+def _capacity_filter_spec(views):
+    """Build the PropertyCollector spec for the capacity of every datastore & host in some ContainerViews
+
+    :Returns: vmodl.query.PropertyCollector.FilterSpec
+
+    :param views: The ContainerViews of datastores and hosts
+    :type views: List
+    """
+    PropertyCollector = vmodl.query.PropertyCollector
+    traversal = PropertyCollector.TraversalSpec(name='traverseView',
+                                                type=vim.view.ContainerView,
+                                                path='view',
+                                                skip=False)
+    object_specs = [PropertyCollector.ObjectSpec(obj=view, skip=True, selectSet=[traversal]) for view in views]
+    prop_specs = [PropertyCollector.PropertySpec(type=vim.Datastore,
+                                                 pathSet=['name', 'host', 'summary.freeSpace', 'summary.capacity',
+                                                          'summary.accessible', 'summary.maintenanceMode']),
+                  PropertyCollector.PropertySpec(type=vim.StoragePod, pathSet=['name', 'childEntity']),
+                  PropertyCollector.PropertySpec(type=vim.HostSystem,
+                                                 pathSet=['name', 'runtime.inMaintenanceMode', 'runtime.connectionState',
+                                                          'summary.hardware.memorySize',
+                                                          'summary.quickStats.overallMemoryUsage'])]
+    return PropertyCollector.FilterSpec(objectSet=object_specs, propSet=prop_specs)
+
+
+PLACER = Placer(policy=const.VLAB_CENTOS_PLACEMENT_POLICY, ttl=const.VLAB_CENTOS_PLACEMENT_TTL)
+
+
+def choose(vcenter, resource_pool, image, size, logger):
+    """Pick the datastore & host to import a VM onto, via the worker's placer
+
+    :Returns: Placement
+
+    :Raises: ValueError
+    """
+    return PLACER.choose(vcenter, resource_pool, image, size, logger)
+
+
+def candidates(vcenter, resource_pool, image, size, logger):
+    """Every datastore & host a VM could be imported onto, best first, via the worker's placer
+
+    :Returns: Generator of Placement
+
+    :Raises: ValueError
+    """
+    return PLACER.candidates(vcenter, resource_pool, image, size, logger)
+
+
+def deploying(placement, size):
+    """Track a deploy that's in flight, via the worker's placer
+
+    :Returns: contextlib.ContextManager
+    """
+    return PLACER.deploying(placement, size)
@@ -0,0 +1,300 @@
+# -*- coding: UTF-8 -*-
+"""
+A pool of long-lived, authenticated sessions to vCenter.
+
+Logging into vCenter is a full SOAP round trip (plus a logout when done), and
+for quick tasks like ``centos.show`` that login is most of the work. Instead of
+every task creating its own ``vCenter`` object, tasks borrow an already
+authenticated session from this pool, and hand it back when they're done.
+
+Each Celery child process has a pool of its own. After every task, a child
+writes the health of its pool to ``VLAB_CENTOS_SESSIONS_DIR``, so the main
+worker process (which answers the API's readiness probe, but never runs a task)
+can report on the pools that are actually in use.
+"""
+import os
+import time
+import shutil
+import threading
+import collections
+from contextlib import contextmanager
+
+import ujson
+
+from vlab_api_common import get_logger
+from vlab_inf_common.vmware import vCenter, vim
+
+from vlab_centos_api.lib import const, metrics
+
+
+logger = get_logger(__name__, loglevel=const.VLAB_CENTOS_LOG_LEVEL)
+
+
+class SessionPool(object):
+    """A capped, thread-safe collection of reusable vCenter sessions.
+
+    Sessions are created on demand, and kept around after being used. A session
+    that has sat idle for more than ``check_interval`` seconds is health checked
+    before being handed out again, and replaced with a fresh login if vCenter
+    has expired it.
+
+    :param host: The IP/FQDN of the vCenter server
+    :type host: String
+
+    :param user: The account to authenticate with
+    :type user: String
+
+    :param password: The password of the account
+    :type password: String
+
+    :param port: The port vCenter listens on
+    :type port: Integer
+
+    :param size: The maximum number of sessions that can exist at one time
+    :type size: Integer
+
+    :param check_interval: How long (in seconds) a session can be idle before it's health checked
+    :type check_interval: Integer
+    """
+    def __init__(self, host, user, password, port=443, size=4, check_interval=60):
+        self._host = host
+        self._user = user
+        self._password = password
+        self._port = port
+        self._check_interval = check_interval
+        self._slots = threading.BoundedSemaphore(size)
+        self._lock = threading.Lock()
+        self._idle = collections.deque()
+        self.size = size
+        self.in_use = 0
+        self.last_error = None
+        self.stats = collections.Counter(hits=0, misses=0, relogins=0, discards=0)
+
+    @contextmanager
+    def session(self):
+        """Borrow an authenticated connection to vCenter for the life of the
+        ``with`` statement. Blocks if every session in the pool is already in use.
+
+        :Returns: vlab_inf_common.vmware.vCenter
+        """
+        self._slots.acquire()
+        try:
+            vcenter = self._checkout()
+        except Exception:
+            self._slots.release()
+            raise
+        with self._lock:
+            self.in_use += 1
+        try:
+            yield vcenter
+        except vim.fault.NotAuthenticated:
+            # vCenter killed the session while we were using it; don't recycle it
+            with self._lock:
+                self.stats['discards'] += 1
+            self._logout(vcenter)
+            vcenter = None
+            raise
+        finally:
+            with self._lock:
+                self.in_use -= 1
+                if vcenter is not None:
+                    self._idle.append((vcenter, time.time()))
+            self._slots.release()
+
+    @property
+    def idle(self):
+        """The number of authenticated sessions not currently borrowed
+
+        :Returns: Integer
+        """
+        return len(self._idle)
+
+    def health(self):
+        """How the pool is doing, going only on what it already knows; it doesn't
+        call vCenter, so it's cheap enough for a readiness probe.
+
+        The pool is healthy unless the last attempt to login failed.
+
+        :Returns: Dictionary
+        """
+        with self._lock:
+            return {'ok': self.last_error is None,
+                    'size': self.size,
+                    'in_use': self.in_use,
+                    'idle': len(self._idle),
+                    'last_error': self.last_error,
+                    'stats': dict(self.stats),
+                   }
+
+    def close(self):
+        """Logout of every idle session. Sessions currently borrowed are unaffected.
+
+        :Returns: None
+        """
+        with self._lock:
+            sessions = list(self._idle)
+            self._idle.clear()
+        for vcenter, _ in sessions:
+            self._logout(vcenter)
+
+    def _checkout(self):
+        """Pick an idle session, or make a new one
+
+        :Returns: vlab_inf_common.vmware.vCenter
+        """
+        with self._lock:
+            # LIFO keeps the most recently used (i.e. least likely expired) session hot
+            entry = self._idle.pop() if self._idle else None
+            if entry is None:
+                self.stats['misses'] += 1
+        if entry is None:
+            logger.debug('Session pool miss; logging into vCenter')
+            return self._login()
+        vcenter, last_used = entry
+        if time.time() - last_used > self._check_interval and not self._is_alive(vcenter):
+            with self._lock:
+                self.stats['relogins'] += 1
+            logger.debug('Pooled session expired; logging into vCenter again')
+            self._logout(vcenter)
+            return self._login()
+        with self._lock:
+            self.stats['hits'] += 1
+        # The vCenter object caches networks forever (``virtual_machine.get_info``
+        # reads them), but users create/delete networks all the time. Don't let a
+        # long-lived session serve stale data.
+        vcenter._net_cache = None
+        return vcenter
+
+    def _login(self):
+        """Create a new, authenticated session
+
+        :Returns: vlab_inf_common.vmware.vCenter
+        """
+        try:
+            vcenter = vCenter(host=self._host, user=self._user, password=self._password, port=self._port)
+        except Exception as doh:
+            self.last_error = '{}'.format(doh)
+            raise
+        self.last_error = None
+        metrics.instrument(vcenter._conn)
+        return vcenter
+
+    @staticmethod
+    def _is_alive(vcenter):
+        """Check if vCenter still considers a session valid
+
+        :Returns: Boolean
+
+        :param vcenter: The session to check
+        :type vcenter: vlab_inf_common.vmware.vCenter
+        """
+        try:
+            return vcenter.content.sessionManager.currentSession is not None
+        except Exception:
+            return False
+
+    @staticmethod
+    def _logout(vcenter):
+        """Terminate a session, ignoring any errors from an already dead session
+
+        :Returns: None
+
+        :param vcenter: The session to terminate
+        :type vcenter: vlab_inf_common.vmware.vCenter
+        """
+        try:
+            vcenter.close()
+        except Exception as doh:
+            logger.debug('Ignoring error while logging out of vCenter: {}'.format(doh))
+
+
+POOL = SessionPool(host=const.INF_VCENTER_SERVER,
+                   user=const.INF_VCENTER_USER,
+                   password=const.INF_VCENTER_PASSWORD,
+                   port=const.INF_VCENTER_PORT,
+                   size=const.VLAB_CENTOS_SESSION_POOL_SIZE,
+                   check_interval=const.VLAB_CENTOS_SESSION_CHECK_INTERVAL)
+
+
+def session():
+    """Borrow a session from the worker's pool of vCenter sessions.
+
+    :Returns: contextmanager
+    """
+    return POOL.session()
+
+
+def reset_health(directory):
+    """Empty (or make) the directory children report the health of their pools in
+
+    :Returns: None
+
+    :param directory: Where the reports go
+    :type directory: String
+    """
+    shutil.rmtree(directory, ignore_errors=True)
+    os.makedirs(directory)
+
+
+def save_health(directory, pid):
+    """Write the health of this process' pool, for the main worker process to read
+
+    :Returns: None
+
+    :param directory: Where the reports go
+    :type directory: String
+
+    :param pid: The ID of this process
+    :type pid: Integer
+    """
+    path = os.path.join(directory, 'sessions-{}.json'.format(pid))
+    try:
+        # Write then rename, so a reader never sees half a report
+        with open(path + '.tmp', 'w') as the_file:
+            the_file.write(ujson.dumps(POOL.health()))
+        os.replace(path + '.tmp', path)
+    except OSError as doh:
+        logger.warning('Unable to save the health of the session pool: {}'.format(doh))
+
+
+def forget_health(directory, pid):
+    """Drop the report of a child process that exited
+
+    :Returns: None
+
+    :param directory: Where the reports go
+    :type directory: String
+
+    :param pid: The ID of the child
+    :type pid: Integer
+    """
+    try:
+        os.remove(os.path.join(directory, 'sessions-{}.json'.format(pid)))
+    except FileNotFoundError:
+        pass
+
+
+def load_health(directory):
+    """Read the health every child process reported for its pool
+
+    :Returns: Dictionary, the process ID -> the health of its pool
+
+    :param directory: Where the reports go
+    :type directory: String
+    """
+    reports = {}
+    try:
+        file_names = os.listdir(directory)
+    except FileNotFoundError:
+        return reports
+    for file_name in file_names:
+        if not (file_name.startswith('sessions-') and file_name.endswith('.json')):
+            continue
+        pid = file_name[len('sessions-'):-len('.json')]
+        try:
+            with open(os.path.join(directory, file_name)) as the_file:
+                reports[pid] = ujson.loads(the_file.read())
+        except (OSError, ValueError) as doh:
+            # i.e. the child exited between the listdir and the open
+            logger.debug('Ignoring report of process {}: {}'.format(pid, doh))
+    return reports
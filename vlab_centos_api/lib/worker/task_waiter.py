@@ -0,0 +1,158 @@
+# -*- coding: UTF-8 -*-
+"""
+Wait on vSphere without polling.
+
+``consume_task`` polls a single task once a second, so waiting on N tasks one
+after another costs at least N seconds (and N * M property fetches). Instead,
+``wait_for_tasks`` puts every task into one PropertyCollector filter, and blocks
+in ``WaitForUpdatesEx`` until vCenter reports that the tasks have finished.
+
+Likewise, ``wait_for_ip`` blocks until vCenter reports a change to the
+``guest.net`` of a VM, instead of re-reading it every second.
+"""
+import time
+
+from pyVmomi import vmodl
+from vlab_inf_common.vmware import vim
+
+from vlab_centos_api.lib.worker.inventory import parse_ips
+
+
+TASK_PROPERTIES = ['info.state', 'info.error', 'info.result']
+DONE_STATES = ('success', 'error')
+
+
+def wait_for_tasks(vcenter, tasks, timeout=600):
+    """Block until every task completes, or the timeout is exceeded.
+
+    The returned dictionary maps each task to a tuple of (result, error). The
+    error is None when the task was successful, otherwise it's a String.
+
+    :Returns: Dictionary
+
+    :param vcenter: The vCenter object
+    :type vcenter: vlab_inf_common.vmware.vcenter.vCenter
+
+    :param tasks: The tasks to wait on
+    :type tasks: List
+
+    :param timeout: How many seconds to wait for all the tasks to complete
+    :type timeout: Integer
+    """
+    outcome = {}
+    if not tasks:
+        return outcome
+    pending = {task: {} for task in tasks}
+    collector = vcenter.content.propertyCollector.CreatePropertyCollector()
+    try:
+        collector.CreateFilter(_task_filter_spec(tasks), partialUpdates=True)
+        for object_update in _object_updates(collector, timeout):
+            props = pending.get(object_update.obj)
+            if props is None:
+                continue
+            for change in object_update.changeSet:
+                props[change.name] = change.val
+            if props.get('info.state') in DONE_STATES:
+                outcome[object_update.obj] = _task_outcome(props)
+                pending.pop(object_update.obj)
+            if not pending:
+                break
+    finally:
+        _destroy(collector)
+    for task in pending:
+        outcome[task] = (None, 'Timeout of {} seconds exceeded for task {}'.format(timeout, task))
+    return outcome
+
+
+def wait_for_ip(vcenter, the_vm, timeout=600):
+    """Block until VMware Tools reports an IP for a VM
+
+    :Returns: List, empty if the VM didn't get an IP before the timeout
+
+    :param vcenter: The vCenter object
+    :type vcenter: vlab_inf_common.vmware.vcenter.vCenter
+
+    :param the_vm: The powered on virtual machine
+    :type the_vm: vim.VirtualMachine
+
+    :param timeout: How many seconds to wait for an IP
+    :type timeout: Integer
+    """
+    collector = vcenter.content.propertyCollector.CreatePropertyCollector()
+    try:
+        object_spec = vmodl.query.PropertyCollector.ObjectSpec(obj=the_vm, skip=False)
+        property_spec = vmodl.query.PropertyCollector.PropertySpec(type=vim.VirtualMachine, pathSet=['guest.net'], all=False)
+        filter_spec = vmodl.query.PropertyCollector.FilterSpec(objectSet=[object_spec], propSet=[property_spec])
+        collector.CreateFilter(filter_spec, partialUpdates=False)
+        # The first update is the current value, so an IP that's already set is returned right away
+        for object_update in _object_updates(collector, timeout):
+            for change in object_update.changeSet:
+                ips = parse_ips(change.val or [])
+                if ips:
+                    return ips
+    finally:
+        _destroy(collector)
+    return []
+
+
+def _object_updates(collector, timeout):
+    """Yield every object update the PropertyCollector reports, until the timeout
+
+    :Returns: Generator
+
+    :param collector: A PropertyCollector with a filter already created
+    :type collector: vmodl.query.PropertyCollector
+
+    :param timeout: How many seconds to wait for updates
+    :type timeout: Integer
+    """
+    deadline = time.time() + timeout
+    version = ''
+    while True:
+        remaining = int(deadline - time.time())
+        if remaining <= 0:
+            return
+        options = vmodl.query.PropertyCollector.WaitOptions(maxWaitSeconds=min(remaining, 60))
+        update = collector.WaitForUpdatesEx(version, options)
+        if update is None:
+            continue
+        version = update.version
+        for filter_update in update.filterSet:
+            for object_update in filter_update.objectSet:
+                yield object_update
+
+
+def _destroy(collector):
+    """Cleanup a PropertyCollector, ignoring a session that's already gone"""
+    try:
+        collector.DestroyPropertyCollector()
+    except Exception:
+        pass
+
+
+def _task_outcome(props):
+    """Convert the properties of a completed task into a (result, error) tuple
+
+    :Returns: Tuple
+
+    :param props: The TaskInfo properties reported by the PropertyCollector
+    :type props: Dictionary
+    """
+    if props['info.state'] == 'error':
+        error = props.get('info.error')
+        msg = getattr(error, 'msg', None) or '{}'.format(error)
+        return None, msg
+    return props.get('info.result'), None
+
+
+def _task_filter_spec(tasks):
+    """Build the PropertyCollector filter that watches the state of every task
+
+    :Returns: vmodl.query.PropertyCollector.FilterSpec
+
+    :param tasks: The tasks to watch
+    :type tasks: List
+    """
+    object_specs = [vmodl.query.PropertyCollector.ObjectSpec(obj=task, skip=False) for task in tasks]
+    property_spec = vmodl.query.PropertyCollector.PropertySpec(type=vim.Task, pathSet=TASK_PROPERTIES, all=False)
+    return vmodl.query.PropertyCollector.FilterSpec(objectSet=object_specs, propSet=[property_spec])
@@ -2,13 +2,139 @@
 """
 Entry point logic for available backend worker tasks
 """
+import os
+import random
+
 from celery import Celery
+from celery.exceptions import Ignore
+from celery.worker.control import inspect_command
+from celery.utils.time import maybe_iso8601
+from celery.signals import worker_process_shutdown, worker_init, before_task_publish, task_prerun, task_postrun
 from vlab_api_common import get_task_logger
 
-from vlab_centos_api.lib import const
-from vlab_centos_api.lib.worker import vmware
+from vlab_centos_api.lib import const, routing, results, metrics, profiler
+from vlab_centos_api.lib.worker import vmware, session_pool, inventory_cache, warm_pool, admission
+
+app = Celery('centos', backend=const.VLAB_CENTOS_RESULT_BACKEND, broker=const.VLAB_MESSAGE_BROKER)
+routing.configure(app)
+results.configure(app)
+if warm_pool.DEPTHS:
+    # Only does anything if you run `celery beat` too; creates also trigger a refill
+    app.conf.beat_schedule = {'refill-warm-pool': {'task': 'centos.refill_warm_pool',
+                                                   'schedule': const.VLAB_CENTOS_WARM_POOL_REFILL_INTERVAL,
+                                                   'args': ['warmPoolBeat']}}
+
+
+@worker_process_shutdown.connect
+def close_sessions(**kwargs):
+    """Stop listening for inventory changes, and logout of the pooled vCenter
+    sessions when a worker process exits"""
+    inventory_cache.CACHE.stop()
+    session_pool.POOL.close()
+    pid = kwargs.get('pid') or os.getpid()
+    metrics.process_exited(pid)
+    session_pool.forget_health(const.VLAB_CENTOS_SESSIONS_DIR, pid)
+
+
+@worker_init.connect
+def serve_metrics(**kwargs):
+    """Serve the metrics of every worker process, from the main worker process"""
+    metrics.serve(const.VLAB_CENTOS_METRICS_PORT)
+    session_pool.reset_health(const.VLAB_CENTOS_SESSIONS_DIR)
+
+
+@before_task_publish.connect
+def stamp_sent(sender=None, headers=None, **kwargs):
+    """Note when a task is sent (i.e. a refill, or a queued task sent again)"""
+    metrics.task_sent(sender, headers)
+
+
+# task_id -> when the task started running
+_STARTED = {}
+
+
+@task_prerun.connect
+def task_starting(sender=None, task_id=None, task=None, **kwargs):
+    """Record how long a task sat in the queue before a worker picked it up"""
+    eta = task.request.eta
+    if eta:
+        eta = maybe_iso8601(eta).timestamp()
+    _STARTED[task_id] = metrics.task_started(task.name, task.request.get('sent_at', None), eta)
+
+
+@task_postrun.connect
+def task_done(sender=None, task_id=None, task=None, state=None, **kwargs):
+    """Record how long a task ran for"""
+    started = _STARTED.pop(task_id, None)
+    if started is not None:
+        metrics.task_finished(task.name, started, state or 'UNKNOWN')
+
+
+@task_postrun.connect
+def save_sessions(**kwargs):
+    """Tell the main worker process how this child's pool of vCenter sessions is doing"""
+    session_pool.save_health(const.VLAB_CENTOS_SESSIONS_DIR, os.getpid())
+
+
+@inspect_command()
+def centos_sessions(state, **kwargs):
+    """Report how the child processes' pools of vCenter sessions are doing, for
+    the API's readiness probe
+
+    This runs in the main worker process, whose own pool is never used; the
+    children report on theirs after every task.
+    """
+    children = session_pool.load_health(const.VLAB_CENTOS_SESSIONS_DIR)
+    if not children:
+        return {'ok': True, 'warning': 'No worker process has run a task yet', 'processes': {}}
+    return {'ok': all(x['ok'] for x in children.values()), 'processes': children}
+
+
+# task_id -> the profile of the running task
+_PROFILES = {}
+
+
+@task_prerun.connect
+def profile_task(sender=None, task_id=None, task=None, args=None, **kwargs):
+    """Sample the stack of the task while it runs, if profiling is turned on"""
+    # Every task takes the txn_id last
+    txn_id = args[-1] if args else 'noId'
+    the_profile = profiler.start(task.name, txn_id)
+    if the_profile is not None:
+        _PROFILES[task_id] = the_profile
+
+
+@task_postrun.connect
+def profile_done(sender=None, task_id=None, **kwargs):
+    """Stop sampling the task, and keep the profile if the task was slow"""
+    profiler.finish(_PROFILES.pop(task_id, None))
+
+
+def queue_until_free(task, busy, logger):
+    """Give up the worker, and run the task again once a deploy slot may be free.
+
+    The task is sent again with the same ID, and the status clients see is
+    "QUEUED" until it runs again. Unlike ``task.retry``, the worker's time limit
+    starts over for every attempt.
 
-app = Celery('centos', backend='rpc://', broker=const.VLAB_MESSAGE_BROKER)
+    :Raises: celery.exceptions.Ignore
+
+    :param task: The task that's waiting on a deploy slot
+    :type task: celery.Task
+
+    :param busy: The error about which datastore/host is at its limit
+    :type busy: admission.Busy
+
+    :param logger: An object for logging messages
+    :type logger: logging.LoggerAdapter
+    """
+    attempt = task.request.retries + 1
+    logger.info('Task queued: {}'.format(busy))
+    task.update_state(state='QUEUED', meta={'waiting_for': busy.resource, 'attempt': attempt})
+    # The jitter stops every queued task from retrying at the same moment
+    countdown = const.VLAB_CENTOS_DEPLOY_RETRY * random.uniform(1, 2)
+    task.signature_from_request(task.request, countdown=countdown, retries=attempt).apply_async()
+    raise Ignore()
 
 
 @app.task(name='centos.show', bind=True)
@@ -79,9 +205,51 @@ def create(self, username, machine_name, image, network, desktop, ram, cpu_count
                                                ram,
                                                cpu_count,
                                                logger)
+    except admission.Busy as doh:
+        queue_until_free(self, doh, logger)
+    except ValueError as doh:
+        logger.error('Task failed: {}'.format(doh))
+        resp['error'] = '{}'.format(doh)
+    if warm_pool.DEPTHS:
+        app.send_task('centos.refill_warm_pool', [txn_id], **routing.options('centos.refill_warm_pool'))
+    logger.info('Task complete')
+    return resp
+
+
+@app.task(name='centos.bulk_create', bind=True, time_limit=const.VLAB_CENTOS_BULK_TIME_LIMIT)
+def bulk_create(self, username, machines, txn_id):
+    """Deploy many new instances of CentOS, and report on each one
+
+    :Returns: Dictionary
+
+    :param username: The name of the user who wants to create the CentOS instances
+    :type username: String
+
+    :param machines: The specs of the VMs to create. Each spec has the keys
+                     "name", "image", "network", "desktop", "ram" and "cpu-count".
+    :type machines: List
+
+    :param txn_id: A unique string supplied by the client to track the call through logs
+    :type txn_id: String
+    """
+    logger = get_task_logger(txn_id=txn_id, task_id=self.request.id, loglevel=const.VLAB_CENTOS_LOG_LEVEL.upper())
+    resp = {'content' : {}, 'error': None, 'params': {}}
+    logger.info('Task starting')
+    try:
+        valid, errors, networks = vmware.check_bulk(machines)
+        results = vmware.create_centos_bulk(username, valid, networks, logger)
     except ValueError as doh:
         logger.error('Task failed: {}'.format(doh))
         resp['error'] = '{}'.format(doh)
+    else:
+        for name, error in errors.items():
+            results[name] = {'content': {}, 'error': error}
+        resp['content'] = results
+        failed = sorted(x for x, result in results.items() if result['error'])
+        if failed:
+            resp['error'] = 'Failed to create {} of {} VMs: {}'.format(len(failed), len(results), ', '.join(failed))
+    if warm_pool.DEPTHS:
+        app.send_task('centos.refill_warm_pool', [txn_id], **routing.options('centos.refill_warm_pool'))
     logger.info('Task complete')
     return resp
 
@@ -114,6 +282,38 @@ def delete(self, username, machine_name, txn_id):
     return resp
 
 
+@app.task(name='centos.bulk_delete', bind=True)
+def bulk_delete(self, username, machine_names, txn_id):
+    """Destroy many instances of CentOS, and report on each one
+
+    :Returns: Dictionary
+
+    :param username: The name of the user who wants to delete the CentOS instances
+    :type username: String
+
+    :param machine_names: The names of the instances to delete, or None for all of them
+    :type machine_names: List
+
+    :param txn_id: A unique string supplied by the client to track the call through logs
+    :type txn_id: String
+    """
+    logger = get_task_logger(txn_id=txn_id, task_id=self.request.id, loglevel=const.VLAB_CENTOS_LOG_LEVEL.upper())
+    resp = {'content' : {}, 'error': None, 'params': {}}
+    logger.info('Task starting')
+    try:
+        results = vmware.delete_centos_bulk(username, machine_names, logger)
+    except ValueError as doh:
+        logger.error('Task failed: {}'.format(doh))
+        resp['error'] = '{}'.format(doh)
+    else:
+        resp['content'] = results
+        failed = sorted(x for x, result in results.items() if result['error'])
+        if failed:
+            resp['error'] = 'Failed to delete {} of {} VMs: {}'.format(len(failed), len(results), ', '.join(failed))
+    logger.info('Task complete')
+    return resp
+
+
 @app.task(name='centos.image', bind=True)
 def image(self, txn_id):
     """Obtain a list of available images/versions of CentOS that can be created
@@ -144,3 +344,53 @@ def modify_network(self, username, machine_name, new_network, txn_id):
         resp['error'] = '{}'.format(doh)
     logger.info('Task complete')
     return resp
+
+
+@app.task(name='centos.refill_warm_pool', bind=True)
+def refill_warm_pool(self, txn_id):
+    """Deploy new VMs into the warm pool, replacing the ones that have been claimed
+
+    :Returns: Dictionary
+
+    :param txn_id: A unique string supplied by the client to track the call through logs
+    :type txn_id: String
+    """
+    logger = get_task_logger(txn_id=txn_id, task_id=self.request.id, loglevel=const.VLAB_CENTOS_LOG_LEVEL.upper())
+    resp = {'content' : {}, 'error': None, 'params': {}}
+    logger.info('Task starting')
+    try:
+        resp['content'] = vmware.refill_warm_pool(logger)
+    except ValueError as doh:
+        logger.error('Task failed: {}'.format(doh))
+        resp['error'] = '{}'.format(doh)
+    logger.info('Task complete')
+    return resp
+
+
+@app.task(name='centos.build_template', bind=True)
+def build_template(self, image, desktop, txn_id):
+    """Import an OVA as the template that linked/instant clones are made from
+
+    :Returns: Dictionary
+
+    :param image: The image/version of CentOS
+    :type image: String
+
+    :param desktop: Build the template for the variant with a GUI
+    :type desktop: Boolean
+
+    :param txn_id: A unique string supplied by the client to track the call through logs
+    :type txn_id: String
+    """
+    logger = get_task_logger(txn_id=txn_id, task_id=self.request.id, loglevel=const.VLAB_CENTOS_LOG_LEVEL.upper())
+    resp = {'content' : {}, 'error': None, 'params': {}}
+    logger.info('Task starting')
+    try:
+        resp['content'] = vmware.build_template(image, desktop, logger)
+    except admission.Busy as doh:
+        queue_until_free(self, doh, logger)
+    except ValueError as doh:
+        logger.error('Task failed: {}'.format(doh))
+        resp['error'] = '{}'.format(doh)
+    logger.info('Task complete')
+    return resp
@@ -0,0 +1,155 @@
+# -*- coding: UTF-8 -*-
+"""
+Create CentOS VMs by cloning a template, instead of importing the OVA.
+
+Importing an OVA copies the whole disk to the datastore. Instead, each OVA can
+be imported once as a template with a ``base`` snapshot. User VMs are then made
+as clones of that snapshot, which only needs a (tiny) delta disk.
+
+The mode is set via ``VLAB_CENTOS_DEPLOY_MODE``:
+
+- ``ova`` - always import the OVA (the default)
+- ``linked`` - linked clone of a template
+- ``instant`` - instant clone of a running parent VM
+
+Templates live in the ``VLAB_CENTOS_TEMPLATE_DIR`` folder, and are named
+``centos-template-<image>-<cli|gui>``. When the template for an image does not
+exist, ``find_template`` returns None and the caller should import the OVA.
+"""
+from vlab_inf_common.vmware import vim, virtual_machine, consume_task
+
+from vlab_centos_api.lib import const
+from vlab_centos_api.lib.worker import lookup_index
+from vlab_centos_api.lib.worker.warm_pool import check_machine_name
+
+
+TEMPLATE_PREFIX = 'centos-template'
+SNAPSHOT_NAME = 'base'
+DEPLOY_MODES = ('ova', 'linked', 'instant')
+
+
+def template_name(image, desktop):
+    """The name of the template for a given image
+
+    :Returns: String
+
+    :param image: The image/version of CentOS
+    :type image: String
+
+    :param desktop: True for the variant with a GUI
+    :type desktop: Boolean
+    """
+    kind = 'gui' if desktop else 'cli'
+    return '{}-{}-{}'.format(TEMPLATE_PREFIX, image, kind)
+
+
+def template_folder(vcenter, create=False):
+    """Find the folder that templates live in
+
+    :Returns: vim.Folder, or None if the folder doesn't exist
+
+    :param vcenter: The vCenter object
+    :type vcenter: vlab_inf_common.vmware.vcenter.vCenter
+
+    :param create: Set to True to make the folder if it doesn't exist
+    :type create: Boolean
+    """
+    try:
+        return lookup_index.folder(vcenter, const.VLAB_CENTOS_TEMPLATE_DIR)
+    except ValueError:
+        if not create:
+            return None
+    path = '{}/{}'.format(const.INF_VCENTER_TOP_LVL_DIR.rstrip('/'), const.VLAB_CENTOS_TEMPLATE_DIR)
+    vcenter.create_vm_folder(path)
+    lookup_index.invalidate()
+    return lookup_index.folder(vcenter, const.VLAB_CENTOS_TEMPLATE_DIR)
+
+
+def find_template(vcenter, image, desktop):
+    """Lookup the template for an image
+
+    :Returns: vim.VirtualMachine, or None if no template exists
+
+    :param vcenter: The vCenter object
+    :type vcenter: vlab_inf_common.vmware.vcenter.vCenter
+
+    :param image: The image/version of CentOS
+    :type image: String
+
+    :param desktop: True for the variant with a GUI
+    :type desktop: Boolean
+    """
+    folder = template_folder(vcenter)
+    if folder is None:
+        return None
+    return vcenter.content.searchIndex.FindChild(folder, template_name(image, desktop))
+
+
+def clone(vcenter, template, username, machine_name, mode, logger):
+    """Create a new, powered off, VM in the user's folder from a template
+
+    :Returns: vim.VirtualMachine
+
+    :Raises: ValueError
+
+    :param vcenter: The vCenter object
+    :type vcenter: vlab_inf_common.vmware.vcenter.vCenter
+
+    :param template: The template (or instant clone parent) to clone
+    :type template: vim.VirtualMachine
+
+    :param username: The user who will own the new VM
+    :type username: String
+
+    :param machine_name: The name of the new VM
+    :type machine_name: String
+
+    :param mode: Either "linked" or "instant"
+    :type mode: String
+
+    :param logger: An object for logging messages
+    :type logger: logging.LoggerAdapter
+    """
+    check_machine_name(machine_name)
+    folder = lookup_index.folder(vcenter, username)
+    resource_pool = vcenter.resource_pools[const.INF_VCENTER_RESORUCE_POOL]
+    if mode == 'instant':
+        logger.debug('Instant cloning {}'.format(machine_name))
+        location = vim.vm.RelocateSpec(folder=folder, pool=resource_pool)
+        spec = vim.vm.InstantCloneSpec(name=machine_name, location=location)
+        the_vm = consume_task(template.InstantClone_Task(spec))
+        # Instant clones boot immediately, but CPU & RAM can only be changed
+        # while powered off.
+        virtual_machine.power(the_vm, state='off')
+    else:
+        logger.debug('Linked cloning {}'.format(machine_name))
+        location = vim.vm.RelocateSpec(pool=resource_pool,
+                                       diskMoveType=vim.vm.RelocateSpec.DiskMoveOptions.createNewChildDiskBacking)
+        spec = vim.vm.CloneSpec(location=location,
+                                snapshot=template.snapshot.currentSnapshot,
+                                powerOn=False,
+                                template=False)
+        the_vm = consume_task(template.CloneVM_Task(folder=folder, name=machine_name, spec=spec))
+    return the_vm
+
+
+def finalize_template(the_vm, mode):
+    """Turn a freshly deployed VM into something that can be cloned
+
+    :Returns: None
+
+    :param the_vm: The VM that was just deployed from the OVA
+    :type the_vm: vim.VirtualMachine
+
+    :param mode: Either "linked" or "instant"
+    :type mode: String
+    """
+    consume_task(the_vm.CreateSnapshot_Task(name=SNAPSHOT_NAME,
+                                            description='Linked clones are made from this snapshot',
+                                            memory=False,
+                                            quiesce=False))
+    if mode == 'instant':
+        # Instant clones are forked from a running VM
+        virtual_machine.power(the_vm, state='on')
+    else:
+        the_vm.MarkAsTemplate()
@@ -3,16 +3,37 @@
 import time
 import random
 import os.path
+import functools
+import contextlib
+from concurrent import futures
+import ujson
 from celery.utils.log import get_task_logger
-from vlab_inf_common.vmware import vCenter, Ova, vim, virtual_machine, consume_task
+from vlab_inf_common.vmware import vim, virtual_machine, consume_task
 
-from vlab_centos_api.lib import const
+from vlab_centos_api.lib import const, images, metrics
+from vlab_centos_api.lib.worker import session_pool, inventory, inventory_cache, warm_pool, templates, task_waiter, ova_cache, lookup_index, placement, admission
 
 
 logger = get_task_logger(__name__)
 logger.setLevel(const.VLAB_CENTOS_LOG_LEVEL.upper())
 
 
+def invalidates_inventory(func):
+    """Decorator for functions that change the VMs in a user's folder. Ensures
+    the cached inventory of that user is not served until it's synced again,
+    even if the change fails part way through.
+
+    The decorated function must accept the username as its first argument.
+    """
+    @functools.wraps(func)
+    def inner(username, *args, **kwargs):
+        try:
+            return func(username, *args, **kwargs)
+        finally:
+            inventory_cache.invalidate(username)
+    return inner
+
+
 def show_centos(username):
     """Obtain basic information about CentOS
 
@@ -21,17 +42,22 @@ def show_centos(username):
     :param username: The user requesting info about their CentOS
     :type username: String
     """
-    centos_vms = {}
-    with vCenter(host=const.INF_VCENTER_SERVER, user=const.INF_VCENTER_USER, \
-                 password=const.INF_VCENTER_PASSWORD) as vcenter:
-        folder = vcenter.get_by_name(name=username, vimtype=vim.Folder)
-        for vm in folder.childEntity:
-            info = virtual_machine.get_info(vcenter, vm, username)
-            if info['meta']['component'] == 'CentOS':
-                centos_vms[vm.name] = info
+    phases = metrics.Phases('show')
+    with session_pool.session() as vcenter:
+        phases.done('session')
+        cached = inventory_cache.lookup(username)
+        if cached is None:
+            folder = lookup_index.folder(vcenter, username)
+            centos_vms = inventory.get_vms(vcenter, folder, username, component='CentOS')
+            phases.done('crawl')
+        else:
+            vms, network_names = cached
+            centos_vms = inventory.render(vcenter, vms, network_names, username, component='CentOS')
+            phases.done('render')
     return centos_vms
 
 
+@invalidates_inventory
 def delete_centos(username, machine_name, logger):
     """Unregister and destroy a user's CentOS
 
@@ -46,23 +72,75 @@ def delete_centos(username, machine_name, logger):
     :param logger: An object for logging messages
     :type logger: logging.LoggerAdapter
     """
-    with vCenter(host=const.INF_VCENTER_SERVER, user=const.INF_VCENTER_USER, \
-                 password=const.INF_VCENTER_PASSWORD) as vcenter:
-        folder = vcenter.get_by_name(name=username, vimtype=vim.Folder)
-        for entity in folder.childEntity:
-            if entity.name == machine_name:
-                info = virtual_machine.get_info(vcenter, entity, username)
-                if info['meta']['component'] == 'CentOS':
-                    logger.debug('powering off VM')
-                    virtual_machine.power(entity, state='off')
-                    delete_task = entity.Destroy_Task()
-                    logger.debug('blocking while VM is being destroyed')
-                    consume_task(delete_task)
-                    break
-        else:
+    phases = metrics.Phases('delete')
+    with session_pool.session() as vcenter:
+        phases.done('session')
+        folder = lookup_index.folder(vcenter, username)
+        found = inventory.find_vm(vcenter, folder, machine_name, component='CentOS')
+        phases.done('lookup')
+        if found is None:
             raise ValueError('No {} named {} found'.format('centos', machine_name))
+        the_vm, info = found
+        if info['state'] == 'poweredOn':
+            logger.debug('powering off VM')
+            virtual_machine.power(the_vm, state='off')
+            phases.done('power_off')
+        delete_task = the_vm.Destroy_Task()
+        logger.debug('blocking while VM is being destroyed')
+        consume_task(delete_task)
+        phases.done('destroy')
 
 
+@invalidates_inventory
+def delete_centos_bulk(username, machine_names, logger):
+    """Destroy many of a user's CentOS instances at once.
+
+    Every power off is issued before waiting on any of them, then every destroy
+    is issued before waiting on any of them.
+
+    :Returns: Dictionary
+
+    :param username: The user who wants to delete their CentOS instances
+    :type username: String
+
+    :param machine_names: The names of the VMs to delete, or None to delete every CentOS VM
+    :type machine_names: List
+
+    :param logger: An object for logging messages
+    :type logger: logging.LoggerAdapter
+    """
+    results = {}
+    with session_pool.session() as vcenter:
+        folder = lookup_index.folder(vcenter, username)
+        vms, _ = inventory.retrieve(vcenter, folder)
+        targets = {}
+        for the_vm, props in vms.items():
+            if props['meta']['component'] != 'CentOS':
+                continue
+            if machine_names is None or props['name'] in machine_names:
+                targets[props['name']] = (the_vm, props)
+        for machine_name in machine_names or []:
+            if machine_name not in targets:
+                results[machine_name] = {'content': {}, 'error': 'No {} named {} found'.format('centos', machine_name)}
+        power_tasks = {}
+        for machine_name, (the_vm, props) in targets.items():
+            if props['state'] == 'poweredOn':
+                power_tasks[the_vm.PowerOffVM_Task()] = machine_name
+        logger.debug('powering off {} VMs'.format(len(power_tasks)))
+        for task, (_, error) in task_waiter.wait_for_tasks(vcenter, list(power_tasks)).items():
+            if error:
+                results[power_tasks[task]] = {'content': {}, 'error': error}
+        destroy_tasks = {}
+        for machine_name, (the_vm, _) in targets.items():
+            if machine_name not in results:
+                destroy_tasks[the_vm.Destroy_Task()] = machine_name
+        logger.debug('blocking while {} VMs are being destroyed'.format(len(destroy_tasks)))
+        for task, (_, error) in task_waiter.wait_for_tasks(vcenter, list(destroy_tasks)).items():
+            results[destroy_tasks[task]] = {'content': {}, 'error': error}
+    return results
+
+
+@invalidates_inventory
 def create_centos(username, machine_name, image, network, desktop, ram, cpu_count, logger):
     """Deploy a new instance of CentOS
 
@@ -95,49 +173,459 @@ def create_centos(username, machine_name, image, network, desktop, ram, cpu_coun
     :param logger: An object for logging messages
     :type logger: logging.LoggerAdapter
     """
-    with vCenter(host=const.INF_VCENTER_SERVER, user=const.INF_VCENTER_USER,
-                 password=const.INF_VCENTER_PASSWORD) as vcenter:
-        image_name = convert_name(image, desktop=desktop)
-        logger.info(image_name)
-        try:
-            ova = Ova(os.path.join(const.VLAB_CENTOS_IMAGES_DIR, image_name))
-        except FileNotFoundError:
-            error = "Invalid version of CentOS supplied: {}".format(image)
-            raise ValueError(error)
+    with _creating(username, machine_name), session_pool.session() as vcenter:
         try:
-            network_map = vim.OvfManager.NetworkMapping()
-            network_map.name = ova.networks[0]
+            the_network = lookup_index.network(vcenter, network)
+        except KeyError:
+            raise ValueError('No such network named {}'.format(network))
+        return _create_centos(vcenter, username, machine_name, image, the_network, desktop, ram, cpu_count, logger)
+
+
+def _creating(username, machine_name):
+    """Stop a retried request from deploying the same VM twice at the same time
+
+    :Returns: contextlib.ContextManager
+
+    :Raises: ValueError
+    """
+    return admission.exclusive('create.{}.{}'.format(username, machine_name),
+                               error='CentOS instance {} is already being created'.format(machine_name))
+
+
+def _create_centos(vcenter, username, machine_name, image, the_network, desktop, ram, cpu_count, logger):
+    """Deploy and configure a new instance of CentOS, once the network is known
+
+    :Returns: Dictionary
+
+    :param vcenter: The vCenter object
+    :type vcenter: vlab_inf_common.vmware.vcenter.vCenter
+
+    :param the_network: The network to connect the new CentOS instance up to
+    :type the_network: vim.Network
+
+    The other params are the same as ``create_centos``.
+    """
+    phases = metrics.Phases('create')
+    # VMs deployed from the OVA are connected to the network by the OVF network mapping
+    network = the_network
+    # Mistakes by the user must fail here, not after a warm VM is claimed (and destroyed)
+    warm_pool.check_machine_name(machine_name)
+    folder = lookup_index.folder(vcenter, username)
+    the_vm = warm_pool.claim(vcenter, image, desktop, logger)
+    if the_vm is not None and not warm_pool.assign(vcenter, the_vm, folder, machine_name, logger):
+        the_vm = None
+    if the_vm is None:
+        the_vm = _clone_from_template(vcenter, username, machine_name, image, desktop, logger)
+    if the_vm is None:
+        the_vm = _deploy_from_image(vcenter, username, machine_name, image, desktop, the_network, logger)
+        network = None
+    phases.done('deploy')
+    meta_data = {'component' : "CentOS",
+                 'created': time.time(),
+                 'version': image,
+                 'configured': False,
+                 'generation': 1,
+                }
+    spec = config_spec(the_vm, ram, cpu_count, meta_data, network=network)
+    consume_task(the_vm.ReconfigVM_Task(spec))
+    phases.done('reconfigure')
+    virtual_machine.power(the_vm, state='on')
+    phases.done('power_on')
+    if const.VLAB_CENTOS_WAIT_FOR_IP:
+        if not task_waiter.wait_for_ip(vcenter, the_vm, timeout=const.VLAB_CENTOS_IP_TIMEOUT):
+            # The VM is made and running; failing now would orphan it
+            logger.warning('{} has no IP after {} seconds'.format(machine_name, const.VLAB_CENTOS_IP_TIMEOUT))
+        phases.done('ip')
+    # Otherwise (or when it timed out), ``centos.show`` reports the IP once VMware Tools has it
+    info = virtual_machine.get_info(vcenter, the_vm, username)
+    phases.done('info')
+    logger.info('Created {} in {:.1f}s ({})'.format(machine_name, phases.elapsed, phases))
+    return {the_vm.name: info}
+
+
+def config_spec(the_vm, ram, cpu_count, meta_data, network=None, adapter_label='Network adapter 1'):
+    """Express all the post-deploy changes to a VM as one ConfigSpec, so they're
+    applied with a single reconfigure task.
+
+    :Returns: vim.vm.ConfigSpec
+
+    :Raises: ValueError
+
+    :param the_vm: The new, powered off, virtual machine
+    :type the_vm: vim.VirtualMachine
+
+    :param ram: The number of GB of RAM to allocate for the VM
+    :type ram: Integer
+
+    :param cpu_count: The number of CPU cores to allocate for the VM
+    :type cpu_count: Integer
+
+    :param meta_data: The extra information to associate to the virtual machine
+    :type meta_data: Dictionary
+
+    :param network: Optional - The network to connect the VM's NIC to
+    :type network: vim.dvs.DistributedVirtualPortgroup
+
+    :param adapter_label: The name of the virtual NIC to connect to the network
+    :type adapter_label: String
+    """
+    spec = vim.vm.ConfigSpec(memoryMB=ram * 1024,
+                             numCPUs=cpu_count,
+                             annotation=ujson.dumps(meta_data))
+    if network is not None:
+        devices = [x for x in the_vm.config.hardware.device if x.deviceInfo.label == adapter_label]
+        if not devices:
+            raise ValueError("VM has no network adapter named {}".format(adapter_label))
+        nic = devices[0]
+        nic.wakeOnLanEnabled = True
+        nic.backing = vim.vm.device.VirtualEthernetCard.DistributedVirtualPortBackingInfo()
+        nic.backing.port = vim.dvs.PortConnection(portgroupKey=network.key,
+                                                  switchUuid=network.config.distributedVirtualSwitch.uuid)
+        nic.connectable = vim.vm.device.VirtualDevice.ConnectInfo(startConnected=True,
+                                                                  allowGuestControl=True,
+                                                                  connected=True)
+        nic_spec = vim.vm.device.VirtualDeviceSpec(operation=vim.vm.device.VirtualDeviceSpec.Operation.edit,
+                                                   device=nic)
+        spec.deviceChange = [nic_spec]
+    return spec
+
+
+def check_bulk(machines):
+    """Validate a bulk create request up front, so bad specs don't use a worker.
+    Every spec is checked against the same network lookup.
+
+    :Returns: Tuple (List of valid specs, Dictionary of machine name -> error, Dictionary of networks)
+
+    :param machines: The specs of the VMs to create. Each spec has the keys
+                     "name", "image", "network", "desktop", "ram" and "cpu-count".
+    :type machines: List
+    """
+    valid = []
+    errors = {}
+    with session_pool.session() as vcenter:
+        networks = lookup_index.networks(vcenter)
+    for spec in machines:
+        name = spec['name']
+        if name in errors or any(x['name'] == name for x in valid):
+            errors[name] = 'Duplicate machine name {}'.format(name)
+        elif images.lookup(spec['image'], spec['desktop']) is None:
+            errors[name] = 'Invalid version of CentOS supplied: {}'.format(spec['image'])
+        elif spec['network'] not in networks:
+            errors[name] = 'No such network named {}'.format(spec['network'])
+        else:
+            valid.append(spec)
+    # Don't create any VM that shares a name with a duplicate
+    valid = [x for x in valid if x['name'] not in errors]
+    return valid, errors, networks
+
+
+@invalidates_inventory
+def create_centos_bulk(username, machines, networks, logger):
+    """Deploy many instances of CentOS concurrently, within this worker process.
+
+    Every deploy borrows a session from the worker's session pool, and uses the
+    network objects that were already looked up by ``check_bulk``.
+
+    :Returns: Dictionary
+
+    :param username: The name of the user who wants to create the CentOS instances
+    :type username: String
+
+    :param machines: The (already validated) specs of the VMs to create
+    :type machines: List
+
+    :param networks: A mapping of network name to vim.Network
+    :type networks: Dictionary
+
+    :param logger: An object for logging messages
+    :type logger: logging.LoggerAdapter
+    """
+    results = {}
+    workers = min(const.VLAB_CENTOS_BULK_CONCURRENCY, const.VLAB_CENTOS_SESSION_POOL_SIZE)
+    with futures.ThreadPoolExecutor(max_workers=max(workers, 1)) as executor:
+        jobs = {executor.submit(_create_one, username, spec, networks[spec['network']], logger): spec['name'] for spec in machines}
+        for job in futures.as_completed(jobs):
+            name = jobs[job]
             try:
-                network_map.network = vcenter.networks[network]
-            except KeyError:
-                raise ValueError('No such network named {}'.format(network))
-            the_vm = virtual_machine.deploy_from_ova(vcenter, ova, [network_map],
-                                                     username, machine_name, logger,
-                                                     power_on=False)
-        finally:
-            ova.close()
-        mb_of_ram = ram * 1024
-        virtual_machine.adjust_ram(the_vm, mb_of_ram)
-        virtual_machine.adjust_cpu(the_vm, cpu_count)
-        virtual_machine.power(the_vm, state='on')
-        meta_data = {'component' : "CentOS",
-                     'created': time.time(),
-                     'version': image,
-                     'configured': False,
-                     'generation': 1,
-                    }
-        virtual_machine.set_meta(the_vm, meta_data)
-        info = virtual_machine.get_info(vcenter, the_vm, username, ensure_ip=True)
-        return {the_vm.name: info}
+                results[name] = {'content': job.result(), 'error': None}
+            except ValueError as doh:
+                logger.error('Failed to create {}: {}'.format(name, doh))
+                results[name] = {'content': {}, 'error': '{}'.format(doh)}
+    return results
+
+
+def _create_one(username, spec, the_network, logger):
+    """Create a single VM of a bulk request, using a pooled session
+
+    The bulk task has a long time limit, so a deploy that's waiting on a slot
+    just tries again in this thread, for up to ``VLAB_CENTOS_DEPLOY_WAIT`` seconds.
+
+    :Returns: Dictionary
+
+    :Raises: ValueError
+    """
+    deadline = time.time() + const.VLAB_CENTOS_DEPLOY_WAIT
+    while True:
+        try:
+            with _creating(username, spec['name']), session_pool.session() as vcenter:
+                return _create_centos(vcenter, username, spec['name'], spec['image'], the_network,
+                                      spec['desktop'], spec['ram'], spec['cpu-count'], logger)
+        except admission.Busy as doh:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                raise ValueError('Gave up after waiting {} seconds: {}'.format(const.VLAB_CENTOS_DEPLOY_WAIT, doh))
+            logger.info('Queued {}: {}'.format(spec['name'], doh))
+            time.sleep(min(const.VLAB_CENTOS_DEPLOY_RETRY, remaining))
+
+
+def _clone_from_template(vcenter, username, machine_name, image, desktop, logger):
+    """Create a new, powered off, CentOS VM by cloning a template. Only used
+    when ``VLAB_CENTOS_DEPLOY_MODE`` is "linked" or "instant".
+
+    :Returns: vim.VirtualMachine, or None if the OVA needs to be imported instead
+
+    :param vcenter: The vCenter object
+    :type vcenter: vlab_inf_common.vmware.vcenter.vCenter
+
+    :param username: The user who will own the new VM
+    :type username: String
+
+    :param machine_name: The name of the new VM
+    :type machine_name: String
+
+    :param image: The image/version of CentOS to create
+    :type image: String
+
+    :param desktop: Deploy the VM with a GUI
+    :type desktop: Boolean
+
+    :param logger: An object for logging messages
+    :type logger: logging.LoggerAdapter
+    """
+    mode = const.VLAB_CENTOS_DEPLOY_MODE
+    if mode not in ('linked', 'instant'):
+        return None
+    template = templates.find_template(vcenter, image, desktop)
+    if template is None:
+        logger.info('No template for CentOS {} (desktop={}); importing the OVA'.format(image, desktop))
+        return None
+    return templates.clone(vcenter, template, username, machine_name, mode, logger)
+
+
+def _deploy_from_image(vcenter, folder_name, machine_name, image, desktop, network, logger):
+    """Create a new, powered off, CentOS VM from an OVA
+
+    :Returns: vim.VirtualMachine
+
+    :param vcenter: The vCenter object
+    :type vcenter: vlab_inf_common.vmware.vcenter.vCenter
+
+    :param folder_name: The name of the folder to deploy the VM into (usually the username)
+    :type folder_name: String
+
+    :param machine_name: The name of the new VM
+    :type machine_name: String
+
+    :param image: The image/version of CentOS to create
+    :type image: String
+
+    :param desktop: Deploy the VM with a GUI
+    :type desktop: Boolean
+
+    :param network: The network to connect the new VM to
+    :type network: vim.Network
+
+    :param logger: An object for logging messages
+    :type logger: logging.LoggerAdapter
+    """
+    error = "Invalid version of CentOS supplied: {}".format(image)
+    image_info = images.lookup(image, desktop)
+    if image_info is None:
+        raise ValueError(error)
+    logger.info(os.path.basename(image_info['path']))
+    try:
+        with metrics.phase('import_ova', 'open'):
+            ova = ova_cache.open_ova(image_info['path'])
+    except FileNotFoundError:
+        # deleted since the catalog last looked
+        images.CATALOG.invalidate()
+        raise ValueError(error)
+    try:
+        network_map = vim.OvfManager.NetworkMapping()
+        network_map.name = ova.networks[0]
+        network_map.network = network
+        the_vm = _import_ova(vcenter, ova, [network_map], folder_name, machine_name, image, logger)
+    finally:
+        ova.close()
+    return the_vm
+
+
+def _import_ova(vcenter, ova, network_map, folder_name, machine_name, image, logger):
+    """Like ``virtual_machine.deploy_from_ova``, but imports onto the datastore &
+    host picked by the placement policy, instead of random ones
+
+    :Returns: vim.VirtualMachine
+
+    :Raises: ValueError, RuntimeError, admission.Busy
+
+    :param vcenter: The vCenter object
+    :type vcenter: vlab_inf_common.vmware.vcenter.vCenter
+
+    :param ova: The OVA to deploy
+    :type ova: vlab_centos_api.lib.worker.ova_cache.CachedOva
+
+    :param network_map: The mapping of networks defined in the OVA with what's available in vCenter
+    :type network_map: List
+
+    :param folder_name: The name of the folder to deploy the VM into (usually the username)
+    :type folder_name: String
+
+    :param machine_name: The name of the new VM
+    :type machine_name: String
+
+    :param image: The image/version of CentOS being deployed
+    :type image: String
+
+    :param logger: An object for logging messages
+    :type logger: logging.LoggerAdapter
+    """
+    warm_pool.check_machine_name(machine_name)
+    folder = lookup_index.folder(vcenter, folder_name)
+    resource_pool = vcenter.resource_pools[const.INF_VCENTER_RESORUCE_POOL]
+    spec_params = vim.OvfManager.CreateImportSpecParams(entityName=machine_name,
+                                                        diskProvisioning='thin',
+                                                        networkMapping=network_map)
+    with contextlib.ExitStack() as stack:
+        with metrics.phase('import_ova', 'placement'):
+            # Every worker process ranks the datastores alike; take the best one with free slots
+            candidates = placement.candidates(vcenter, resource_pool, image, ova.size, logger)
+            target = stack.enter_context(admission.first_free(candidates))
+        stack.enter_context(placement.deploying(target, ova.size))
+        with metrics.phase('import_ova', 'import_spec'):
+            spec = vcenter.ovf_manager.CreateImportSpec(ovfDescriptor=ova.ovf,
+                                                        resourcePool=resource_pool,
+                                                        datastore=target.datastore,
+                                                        cisp=spec_params)
+            lease = virtual_machine._get_lease(resource_pool, spec.importSpec, folder, target.host)
+        logger.debug('Uploading OVA')
+        with metrics.phase('import_ova', 'upload'):
+            ova.deploy(spec, lease, target.host_name)
+    logger.debug('OVA deployed successfully')
+    the_vm = vcenter.content.searchIndex.FindChild(folder, machine_name)
+    if the_vm is None:
+        raise RuntimeError('Unable to find newly created VM by name {}'.format(machine_name))
+    return the_vm
+
+
+def build_template(image, desktop, logger):
+    """Import an OVA once as the template that new VMs are cloned from.
+
+    :Returns: Dictionary
+
+    :Raises: ValueError
+
+    :param image: The image/version of CentOS
+    :type image: String
+
+    :param desktop: Build the template for the variant with a GUI
+    :type desktop: Boolean
+
+    :param logger: An object for logging messages
+    :type logger: logging.LoggerAdapter
+    """
+    mode = const.VLAB_CENTOS_DEPLOY_MODE
+    if mode not in ('linked', 'instant'):
+        error = 'Templates are only used when VLAB_CENTOS_DEPLOY_MODE is "linked" or "instant", not "{}"'.format(mode)
+        raise ValueError(error)
+    name = templates.template_name(image, desktop)
+    with session_pool.session() as vcenter:
+        if templates.find_template(vcenter, image, desktop) is not None:
+            return {'template': name, 'created': False}
+        templates.template_folder(vcenter, create=True)
+        try:
+            the_network = lookup_index.network(vcenter, const.VLAB_CENTOS_TEMPLATE_NETWORK)
+        except KeyError:
+            raise ValueError('No such network named {}'.format(const.VLAB_CENTOS_TEMPLATE_NETWORK))
+        logger.info('Building template {}'.format(name))
+        the_vm = _deploy_from_image(vcenter, const.VLAB_CENTOS_TEMPLATE_DIR, name,
+                                    image, desktop, the_network, logger)
+        templates.finalize_template(the_vm, mode)
+    return {'template': name, 'created': True}
+
+
+def refill_warm_pool(logger):
+    """Deploy VMs into the warm pool until every image has the configured number
+    of VMs ready to be claimed.
+
+    Only one refill runs at a time, across every worker; otherwise concurrent
+    refills would each count the same shortfall, and deploy it twice over. A
+    refill that finds another one running skips, because that one will do the work.
+
+    :Returns: Dictionary
+
+    :param logger: An object for logging messages
+    :type logger: logging.LoggerAdapter
+    """
+    start = time.time()
+    try:
+        with admission.exclusive('warm-pool-refill', 'A refill of the warm pool is already running'):
+            deployed = _refill(logger)
+    except (admission.Locked, admission.Unreachable) as doh:
+        logger.info('Skipping refill: {}'.format(doh))
+        return warm_pool.status()
+    elapsed = time.time() - start
+    warm_pool.STATS['refills'] += 1
+    warm_pool.STATS['refill_seconds'] += elapsed
+    warm_pool.STATS['deployed'] += deployed
+    logger.info('Deployed {} warm VMs in {:.3f} seconds'.format(deployed, elapsed))
+    return warm_pool.status()
+
+
+def _refill(logger):
+    """Count the VMs in the warm pool, and deploy the shortfall. Caller must
+    hold the refill lock.
+
+    :Returns: Integer, how many VMs were deployed
+
+    :param logger: An object for logging messages
+    :type logger: logging.LoggerAdapter
+    """
+    deployed = 0
+    with session_pool.session() as vcenter:
+        folder = warm_pool.holding_folder(vcenter)
+        try:
+            the_network = lookup_index.network(vcenter, const.VLAB_CENTOS_WARM_POOL_NETWORK)
+        except KeyError:
+            raise ValueError('No such network named {}'.format(const.VLAB_CENTOS_WARM_POOL_NETWORK))
+        counts = warm_pool.census(vcenter, folder)
+        for (image, desktop), depth in warm_pool.DEPTHS.items():
+            entry = counts[(image, desktop)]
+            warm_pool.reap(entry, logger)
+            have = len(entry['ready']) + len(entry['pending'])
+            ready = len(entry['ready'])
+            for _ in range(depth - have):
+                machine_name = warm_pool.make_name(image, desktop)
+                logger.info('Deploying warm VM {}'.format(machine_name))
+                try:
+                    the_vm = _deploy_from_image(vcenter, const.VLAB_CENTOS_WARM_POOL_DIR, machine_name,
+                                                image, desktop, the_network, logger)
+                except admission.Busy as doh:
+                    # User deploys come first; the next refill picks up the slack
+                    logger.info('Postponing warm VM {}: {}'.format(machine_name, doh))
+                    break
+                virtual_machine.set_meta(the_vm, warm_pool.warm_meta(image, desktop))
+                deployed += 1
+                ready += 1
+            warm_pool.DEPTH[(image, desktop)] = ready
+    return deployed
+
 
 def list_images():
     """Obtain a list of available versions of CentOS that can be created
 
     :Returns: List
     """
-    images = os.listdir(const.VLAB_CENTOS_IMAGES_DIR)
-    images = list(set([convert_name(x, to_version=True) for x in images]))
-    return images
+    return images.versions()
 
 
 def convert_name(name, to_version=False, desktop=False):
@@ -163,6 +651,7 @@ def convert_name(name, to_version=False, desktop=False):
         return 'CentOS-{}.ova'.format(name)
 
 
+@invalidates_inventory
 def update_network(username, machine_name, new_network):
     """Implements the VM network update
 
@@ -175,23 +664,22 @@ def update_network(username, machine_name, new_network):
     :param new_network: The name of the new network to connect the VM to
     :type new_network: String
     """
-    with vCenter(host=const.INF_VCENTER_SERVER, user=const.INF_VCENTER_USER, \
-                 password=const.INF_VCENTER_PASSWORD) as vcenter:
-        folder = vcenter.get_by_name(name=username, vimtype=vim.Folder)
-        for entity in folder.childEntity:
-            if entity.name == machine_name:
-                info = virtual_machine.get_info(vcenter, entity, username)
-                if info['meta']['component'] == 'CentOS':
-                    the_vm = entity
-                    break
-        else:
+    phases = metrics.Phases('update_network')
+    with session_pool.session() as vcenter:
+        phases.done('session')
+        folder = lookup_index.folder(vcenter, username)
+        found = inventory.find_vm(vcenter, folder, machine_name, component='CentOS')
+        if found is None:
             error = 'No VM named {} found'.format(machine_name)
             raise ValueError(error)
+        the_vm, _ = found
 
         try:
-            network = vcenter.networks[new_network]
+            network = lookup_index.network(vcenter, new_network)
         except KeyError:
             error = 'No VM named {} found'.format(machine_name)
             raise ValueError(error)
         else:
+            phases.done('lookup')
             virtual_machine.change_network(the_vm, network)
+            phases.done('reconfigure')
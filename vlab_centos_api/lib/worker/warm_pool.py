@@ -0,0 +1,315 @@
+# -*- coding: UTF-8 -*-
+"""
+A pool of pre-deployed, powered off CentOS VMs.
+
+Deploying from an OVA streams the whole image to a datastore, and takes minutes.
+Instead, a handful of VMs per image are deployed ahead of time into a holding
+folder. Creating a CentOS instance then only has to claim one of those VMs,
+rename it, and move it into the user's folder.
+
+The number of VMs to keep warm is set via ``VLAB_CENTOS_WARM_POOL``, a comma
+separated list of ``<image>:<depth>`` pairs. Append ``-desktop`` to the image
+for the GUI variant, i.e. ``7:2,7-desktop:1``.
+
+Warm VMs are named ``centos-warm-<image>-<cli|gui>-<token>``, and their meta
+data component is ``CentOS-warm``. Claiming a VM swaps that component to
+``CentOS-claimed`` with a reconfigure that's guarded by the VM's config
+``changeVersion``, so two workers can never claim the same VM.
+"""
+import re
+import time
+import uuid
+import collections
+
+import ujson
+from pyVmomi import vmodl
+from vlab_inf_common.vmware import vim, virtual_machine, consume_task
+
+from vlab_centos_api.lib import const
+from vlab_centos_api.lib.worker import inventory, lookup_index
+
+
+WARM_PREFIX = 'centos-warm'
+WARM_COMPONENT = 'CentOS-warm'
+CLAIMED_COMPONENT = 'CentOS-claimed'
+# A claimed VM that's still in the holding folder after this many seconds was
+# abandoned by a worker that died part way through a create.
+CLAIM_TIMEOUT = 3600
+HOSTNAME_REGEX = r'^(([a-zA-Z0-9]|[a-zA-Z0-9][a-zA-Z0-9\-]*[a-zA-Z0-9])\.)*([A-Za-z0-9]|[A-Za-z0-9][A-Za-z0-9\-]*[A-Za-z0-9])$'
+
+STATS = collections.Counter(claims=0, claim_misses=0, claim_seconds=0, refills=0,
+                            refill_seconds=0, deployed=0, reaped=0, assign_failures=0)
+DEPTH = {}
+
+
+def parse_depths(spec):
+    """Convert the ``VLAB_CENTOS_WARM_POOL`` setting into a mapping of
+    (image, desktop) -> number of VMs to keep warm.
+
+    :Returns: Dictionary
+
+    :Raises: ValueError
+
+    :param spec: The setting, i.e. "7:2,7-desktop:1"
+    :type spec: String
+    """
+    depths = {}
+    for item in [x.strip() for x in spec.split(',') if x.strip()]:
+        try:
+            image, depth = item.rsplit(':', 1)
+            depth = int(depth)
+        except ValueError:
+            raise ValueError('Invalid warm pool setting: {}'.format(item))
+        desktop = image.endswith('-desktop')
+        if desktop:
+            image = image[:-len('-desktop')]
+        depths[(image, desktop)] = depth
+    return depths
+
+
+DEPTHS = parse_depths(const.VLAB_CENTOS_WARM_POOL)
+
+
+def make_name(image, desktop):
+    """Create a unique name for a new warm VM
+
+    :Returns: String
+
+    :param image: The image/version of CentOS
+    :type image: String
+
+    :param desktop: True if the VM has a GUI
+    :type desktop: Boolean
+    """
+    kind = 'gui' if desktop else 'cli'
+    return '{}-{}-{}-{}'.format(WARM_PREFIX, image, kind, uuid.uuid4().hex[:8])
+
+
+def parse_name(name):
+    """Extract the (image, desktop) variant from the name of a warm VM
+
+    :Returns: Tuple, or None if the name isn't a warm VM name
+
+    :param name: The name of a VM in the holding folder
+    :type name: String
+    """
+    try:
+        front, kind, _ = name.rsplit('-', 2)
+    except ValueError:
+        return None
+    prefix = '{}-'.format(WARM_PREFIX)
+    if not front.startswith(prefix) or kind not in ('cli', 'gui'):
+        return None
+    return front[len(prefix):], kind == 'gui'
+
+
+def warm_meta(image, desktop):
+    """The meta data stored on a warm VM that's ready to be claimed
+
+    :Returns: Dictionary
+    """
+    return {'component': WARM_COMPONENT,
+            'created': time.time(),
+            'version': image,
+            'desktop': desktop,
+            'configured': False,
+            'generation': 1,
+           }
+
+
+def holding_folder(vcenter):
+    """Find (or create) the folder that warm VMs live in
+
+    :Returns: vim.Folder
+
+    :param vcenter: The vCenter object
+    :type vcenter: vlab_inf_common.vmware.vcenter.vCenter
+    """
+    try:
+        return lookup_index.folder(vcenter, const.VLAB_CENTOS_WARM_POOL_DIR)
+    except ValueError:
+        path = '{}/{}'.format(const.INF_VCENTER_TOP_LVL_DIR.rstrip('/'), const.VLAB_CENTOS_WARM_POOL_DIR)
+        vcenter.create_vm_folder(path)
+        lookup_index.invalidate()
+        return lookup_index.folder(vcenter, const.VLAB_CENTOS_WARM_POOL_DIR)
+
+
+def census(vcenter, folder):
+    """Sort the VMs in the holding folder by variant and readiness.
+
+    The returned dictionary maps (image, desktop) to a dictionary with the keys
+    ``ready`` (claimable VMs), ``pending`` (VMs still being deployed), and
+    ``claimed`` (VMs a worker is turning into a user's VM).
+
+    :Returns: Dictionary
+
+    :param vcenter: The vCenter object
+    :type vcenter: vlab_inf_common.vmware.vcenter.vCenter
+
+    :param folder: The holding folder
+    :type folder: vim.Folder
+    """
+    counts = collections.defaultdict(lambda: {'ready': [], 'pending': [], 'claimed': []})
+    vms, _ = inventory.retrieve(vcenter, folder)
+    for ref, props in vms.items():
+        variant = parse_name(props['name'])
+        if variant is None:
+            continue
+        component = props['meta']['component']
+        if component == WARM_COMPONENT and props['state'] == 'poweredOff':
+            counts[variant]['ready'].append((ref, props))
+        elif component == CLAIMED_COMPONENT:
+            counts[variant]['claimed'].append((ref, props))
+        else:
+            counts[variant]['pending'].append((ref, props))
+    return counts
+
+
+def claim(vcenter, image, desktop, logger):
+    """Take ownership of a warm VM of the requested image.
+
+    :Returns: vim.VirtualMachine, or None if no warm VM is available
+
+    :param vcenter: The vCenter object
+    :type vcenter: vlab_inf_common.vmware.vcenter.vCenter
+
+    :param image: The image/version of CentOS
+    :type image: String
+
+    :param desktop: True if the VM should have a GUI
+    :type desktop: Boolean
+
+    :param logger: An object for logging messages
+    :type logger: logging.LoggerAdapter
+    """
+    if not DEPTHS.get((image, desktop), 0):
+        return None
+    start = time.time()
+    try:
+        folder = lookup_index.folder(vcenter, const.VLAB_CENTOS_WARM_POOL_DIR)
+    except ValueError:
+        logger.info('No warm pool folder found')
+        STATS['claim_misses'] += 1
+        return None
+    ready = census(vcenter, folder)[(image, desktop)]['ready']
+    DEPTH[(image, desktop)] = len(ready)
+    for the_vm, props in ready:
+        meta = dict(props['meta'])
+        meta['component'] = CLAIMED_COMPONENT
+        meta['claimed'] = time.time()
+        spec = vim.vm.ConfigSpec(annotation=ujson.dumps(meta), changeVersion=props['change_version'])
+        try:
+            consume_task(the_vm.ReconfigVM_Task(spec))
+        except (RuntimeError, vim.fault.ConcurrentAccess):
+            # Another worker claimed it first
+            continue
+        elapsed = time.time() - start
+        DEPTH[(image, desktop)] = len(ready) - 1
+        STATS['claims'] += 1
+        STATS['claim_seconds'] += elapsed
+        logger.info('Claimed warm VM {} in {:.3f} seconds'.format(props['name'], elapsed))
+        return the_vm
+    STATS['claim_misses'] += 1
+    logger.info('No warm VMs available for CentOS {} (desktop={})'.format(image, desktop))
+    return None
+
+
+def assign(vcenter, the_vm, folder, machine_name, logger):
+    """Turn a claimed warm VM into a user's VM. If that fails, the warm VM is destroyed.
+
+    The VM is still on the warm pool network; the caller must connect it to
+    one of the user's networks. The caller must also check the machine name
+    and find the user's folder before claiming the VM, so a mistake by the
+    user never costs a warm VM.
+
+    When vCenter refuses to rename or move the VM (i.e. DuplicateName or
+    InvalidState), the caller should make the user's VM some other way.
+
+    :Returns: Boolean, True if the warm VM is now the user's VM
+
+    :param vcenter: The vCenter object
+    :type vcenter: vlab_inf_common.vmware.vcenter.vCenter
+
+    :param the_vm: The claimed warm VM
+    :type the_vm: vim.VirtualMachine
+
+    :param folder: The folder of the user who will own the VM
+    :type folder: vim.Folder
+
+    :param machine_name: The name the user gave the VM
+    :type machine_name: String
+
+    :param logger: An object for logging messages
+    :type logger: logging.LoggerAdapter
+    """
+    try:
+        consume_task(the_vm.Rename_Task(machine_name))
+        consume_task(folder.MoveIntoFolder_Task([the_vm]))
+    except (RuntimeError, vmodl.MethodFault) as doh:
+        logger.error('Failed to assign warm VM as {}; destroying it: {}'.format(machine_name, doh))
+        _destroy(the_vm, logger)
+        STATS['assign_failures'] += 1
+        return False
+    return True
+
+
+def _destroy(the_vm, logger):
+    """Delete a warm VM that couldn't be assigned, so it's not left in the holding folder
+
+    :Returns: None
+    """
+    try:
+        consume_task(the_vm.Destroy_Task())
+    except Exception as doh:
+        logger.error('Unable to destroy warm VM: {}'.format(doh))
+
+
+def check_machine_name(machine_name):
+    """Enforce the same naming rules as ``virtual_machine.deploy_from_ova`` for
+    VMs that are not deployed from an OVA.
+
+    :Returns: None
+
+    :Raises: ValueError
+
+    :param machine_name: The name the user gave the VM
+    :type machine_name: String
+    """
+    if not re.match(HOSTNAME_REGEX, machine_name):
+        error = 'Invalid machine name. Names can only contain characters a-z, A-Z, 0-9, periods (".") and dashes ("-"). Supplied: {}'.format(machine_name)
+        raise ValueError(error)
+
+
+def reap(census_entry, logger):
+    """Destroy claimed VMs that were abandoned in the holding folder
+
+    :Returns: Integer (the number of VMs destroyed)
+
+    :param census_entry: One variant's output from ``census``
+    :type census_entry: Dictionary
+
+    :param logger: An object for logging messages
+    :type logger: logging.LoggerAdapter
+    """
+    reaped = 0
+    for the_vm, props in census_entry['claimed']:
+        if time.time() - props['meta'].get('claimed', 0) > CLAIM_TIMEOUT:
+            logger.info('Destroying abandoned warm VM {}'.format(props['name']))
+            try:
+                virtual_machine.power(the_vm, state='off')
+                consume_task(the_vm.Destroy_Task())
+            except RuntimeError as doh:
+                logger.error('Unable to destroy abandoned warm VM {}: {}'.format(props['name'], doh))
+            else:
+                reaped += 1
+    STATS['reaped'] += reaped
+    return reaped
+
+
+def status():
+    """Report the depth of the warm pool and how well it's working
+
+    :Returns: Dictionary
+    """
+    depth = {'{}{}'.format(image, '-desktop' if desktop else ''): count for (image, desktop), count in DEPTH.items()}
+    return {'depth': depth, 'stats': dict(STATS)}